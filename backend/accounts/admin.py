@@ -7,7 +7,7 @@ from .models import User
 class CustomUserAdmin(UserAdmin):
     list_display = ('email', 'name', 'is_active', 'date_joined')
     list_filter = ('is_active', 'is_staff', 'date_joined')
-    search_fields = ('email', 'name')
+    search_fields = ('email', 'full_name')
     ordering = ('email',)
     
     fieldsets = (
@@ -0,0 +1,184 @@
+"""
+JWT authentication that resolves users without a query on every request.
+
+SimpleJWT's ``JWTAuthentication`` loads ``request.user`` with a ``SELECT`` on
+``users`` per request. ``CachedJWTAuthentication`` looks users up in two
+layers instead:
+
+1. a bounded, per-process LRU whose entries expire after
+   ``AUTH_USER_CACHE_LOCAL_TIMEOUT`` seconds
+2. the shared Django cache (Redis in deployments), for
+   ``AUTH_USER_CACHE_TIMEOUT`` seconds
+
+and only queries the database when both miss. Only ``AUTH_USER_FIELDS``
+are cached, never the password hash or permissions; each request gets a
+new ``User`` built from them, whose other fields load on first use.
+Saving or deleting a user
+clears both layers in the process that made the change and the shared
+cache everywhere (see ``accounts.signals``); other processes may serve their
+local copy until it expires, so the local timeout bounds that staleness.
+
+With ``AUTH_CLAIMS_USER_READS`` enabled, safe-method requests to the view
+actions listed in a view's ``claims_user_actions`` get a ``TokenClaimsUser``
+built from the token's ``user_id``, ``email`` and ``name`` claims and never
+touch the database. Deactivated and deleted users are still refused through
+a revocation marker in the shared cache.
+"""
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.db import DEFAULT_DB_ALIAS
+from django.utils.functional import cached_property
+from rest_framework.permissions import SAFE_METHODS
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.exceptions import AuthenticationFailed, InvalidToken
+from rest_framework_simplejwt.models import TokenUser
+from rest_framework_simplejwt.settings import api_settings
+
+# What authentication and the views read from request.user
+AUTH_USER_FIELDS = ('id', 'email', 'full_name', 'is_active', 'is_staff')
+
+
+def user_cache_key(user_id):
+    return f'auth:user-fields:{user_id}'
+
+
+def revoked_cache_key(user_id):
+    return f'auth:revoked:{user_id}'
+
+
+class LocalUserCache:
+    """Thread-safe LRU of users' cached fields with a per-entry time to live"""
+    
+    def __init__(self, max_size, timeout):
+        self.max_size = max_size
+        self.timeout = timeout
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+    
+    def get(self, user_id):
+        with self.lock:
+            entry = self.entries.get(user_id)
+            if entry is None:
+                return None
+            values, expires_at = entry
+            if expires_at <= time.monotonic():
+                del self.entries[user_id]
+                return None
+            self.entries.move_to_end(user_id)
+            return values
+    
+    def set(self, user_id, values):
+        if self.max_size <= 0 or self.timeout <= 0:
+            return
+        with self.lock:
+            self.entries[user_id] = (values, time.monotonic() + self.timeout)
+            self.entries.move_to_end(user_id)
+            while len(self.entries) > self.max_size:
+                self.entries.popitem(last=False)
+    
+    def delete(self, user_id):
+        with self.lock:
+            self.entries.pop(user_id, None)
+    
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+
+local_user_cache = LocalUserCache(
+    settings.AUTH_USER_CACHE_LOCAL_SIZE,
+    settings.AUTH_USER_CACHE_LOCAL_TIMEOUT
+)
+
+
+def get_cached_user(user_id):
+    """
+    Return the user with ``user_id``, built from ``AUTH_USER_FIELDS`` in the caches or the database.
+    
+    Returns ``None`` for unknown ids. The other fields are deferred, so they
+    are read when first used and ``save()`` only writes the loaded ones.
+    """
+    User = get_user_model()
+    values = local_user_cache.get(user_id)
+    if values is None:
+        values = cache.get(user_cache_key(user_id))
+        if values is None:
+            values = User.objects.filter(id=user_id).values(*AUTH_USER_FIELDS).first()
+            if values is None:
+                return None
+            cache.set(user_cache_key(user_id), values, settings.AUTH_USER_CACHE_TIMEOUT)
+        local_user_cache.set(user_id, values)
+    # from_db takes the loaded values in the model's field order
+    names = [field.attname for field in User._meta.concrete_fields if field.attname in values]
+    return User.from_db(DEFAULT_DB_ALIAS, names, [values[name] for name in names])
+
+
+def invalidate_user(user_id):
+    """Drop a user from the local and shared caches"""
+    local_user_cache.delete(user_id)
+    cache.delete(user_cache_key(user_id))
+
+
+def set_user_revoked(user_id, revoked):
+    """Mark a user's outstanding tokens as unusable (or usable again)"""
+    if revoked:
+        lifetime = api_settings.ACCESS_TOKEN_LIFETIME.total_seconds()
+        cache.set(revoked_cache_key(user_id), True, int(lifetime))
+    else:
+        cache.delete(revoked_cache_key(user_id))
+
+
+class TokenClaimsUser(TokenUser):
+    """Stateless user built from the claims ``CustomTokenObtainPairSerializer`` adds"""
+    
+    @cached_property
+    def full_name(self):
+        return self.token.get('name', '')
+    
+    @cached_property
+    def email(self):
+        return self.token.get('email', '')
+    
+    @property
+    def name(self):
+        return self.full_name
+
+
+class CachedJWTAuthentication(JWTAuthentication):
+    """``JWTAuthentication`` with cached user lookups and an optional claims-only mode"""
+    
+    def authenticate(self, request):
+        self.request = request
+        return super().authenticate(request)
+    
+    def uses_claims_user(self):
+        request = getattr(self, 'request', None)
+        if not settings.AUTH_CLAIMS_USER_READS or request is None:
+            return False
+        if request.method not in SAFE_METHODS:
+            return False
+        view = getattr(request, 'parser_context', {}).get('view')
+        return getattr(view, 'action', None) in getattr(view, 'claims_user_actions', ())
+    
+    def get_user(self, validated_token):
+        try:
+            user_id = validated_token[api_settings.USER_ID_CLAIM]
+        except KeyError:
+            raise InvalidToken('Token contained no recognizable user identification')
+        
+        if self.uses_claims_user():
+            if cache.get(revoked_cache_key(user_id)):
+                raise AuthenticationFailed('User is inactive', code='user_inactive')
+            return TokenClaimsUser(validated_token)
+        
+        user = get_cached_user(user_id)
+        if user is None:
+            raise AuthenticationFailed('User not found', code='user_not_found')
+        if not user.is_active:
+            raise AuthenticationFailed('User is inactive', code='user_inactive')
+        return user
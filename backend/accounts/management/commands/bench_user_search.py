@@ -0,0 +1,106 @@
+import random
+import statistics
+import time
+
+from django.contrib.auth.hashers import make_password
+from django.core.management.base import BaseCommand
+from django.db import connection
+
+from accounts.models import User
+from accounts.search import search_users
+
+FIRST_NAMES = [
+    'James', 'Mary', 'Robert', 'Patricia', 'John', 'Jennifer', 'Michael', 'Linda', 'David', 'Elizabeth',
+    'William', 'Barbara', 'Richard', 'Susan', 'Joseph', 'Jessica', 'Thomas', 'Sarah', 'Charles', 'Karen',
+    'Aarav', 'Priya', 'Wei', 'Mei', 'Hiroshi', 'Yuki', 'Mohammed', 'Fatima', 'Olga', 'Ivan',
+    'Lucas', 'Sofia', 'Mateo', 'Valentina', 'Noah', 'Emma', 'Liam', 'Olivia', 'Kwame', 'Amara',
+]
+LAST_NAMES = [
+    'Smith', 'Johnson', 'Williams', 'Brown', 'Jones', 'Garcia', 'Miller', 'Davis', 'Rodriguez', 'Martinez',
+    'Hernandez', 'Lopez', 'Gonzalez', 'Wilson', 'Anderson', 'Thomas', 'Taylor', 'Moore', 'Jackson', 'Martin',
+    'Sharma', 'Patel', 'Wang', 'Li', 'Tanaka', 'Suzuki', 'Hassan', 'Khan', 'Petrov', 'Ivanova',
+    'Silva', 'Santos', 'Rossi', 'Ferrari', 'Muller', 'Schmidt', 'Dubois', 'Laurent', 'Mensah', 'Okafor',
+]
+
+# (label, query) pairs covering each matching path
+QUERIES = [
+    ('full-name prefix', 'Jennifer Gar'),
+    ('first-name prefix', 'Valen'),
+    ('last-name word prefix', 'Okaf'),
+    ('email prefix', 'kwame.mensah'),
+    ('typo', 'Jenifer Rodriguz'),
+    ('short prefix', 'Li'),
+    ('no match', 'Zzyzx Qwerty'),
+]
+
+
+def percentile(values, fraction):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(fraction * len(values)))]
+
+
+class Command(BaseCommand):
+    help = (
+        'Benchmark user search. Tops the users table up to --users synthetic '
+        'accounts, then times the first and second result page for queries '
+        'covering prefix, word-prefix, email and typo-tolerant matching.'
+    )
+    
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=100_000,
+                            help='Users the table should hold before timing')
+        parser.add_argument('--runs', type=int, default=50,
+                            help='Timed runs per query')
+        parser.add_argument('--limit', type=int, default=20,
+                            help='Results per page')
+        parser.add_argument('--batch-size', type=int, default=10_000)
+        parser.add_argument('--seed', type=int, default=7)
+    
+    def handle(self, *args, **options):
+        self.populate(options['users'], options['batch_size'], options['seed'])
+        self.stdout.write(f'Users: {User.objects.count():,} ({connection.vendor})')
+        
+        for label, query in QUERIES:
+            first_page = []
+            second_page = []
+            for _ in range(options['runs']):
+                started = time.perf_counter()
+                users, cursor = search_users(query, limit=options['limit'])
+                first_page.append((time.perf_counter() - started) * 1000)
+                if cursor:
+                    started = time.perf_counter()
+                    search_users(query, limit=options['limit'], cursor=cursor)
+                    second_page.append((time.perf_counter() - started) * 1000)
+            line = (
+                f'{label:<22} {query!r:<20} p50 {statistics.median(first_page):7.2f} ms  '
+                f'p95 {percentile(first_page, 0.95):7.2f} ms'
+            )
+            if second_page:
+                line += f'  page 2 p50 {statistics.median(second_page):7.2f} ms'
+            top = users[0].full_name if users else '-'
+            self.stdout.write(f'{line}  top: {top}')
+    
+    def populate(self, target, batch_size, seed):
+        """Bulk-insert synthetic users until the table holds ``target`` rows"""
+        existing = User.objects.count()
+        if existing >= target:
+            return
+        rng = random.Random(seed)
+        password = make_password(None)
+        created = 0
+        started = time.perf_counter()
+        for start in range(existing, target, batch_size):
+            batch = []
+            for number in range(start, min(start + batch_size, target)):
+                first, last = rng.choice(FIRST_NAMES), rng.choice(LAST_NAMES)
+                batch.append(User(
+                    email=f'{first.lower()}.{last.lower()}.{number}@example.test',
+                    full_name=f'{first} {last}',
+                    password=password
+                ))
+            User.objects.bulk_create(batch)
+            created += len(batch)
+        if connection.vendor == 'postgresql':
+            with connection.cursor() as cursor:
+                cursor.execute('ANALYZE users')
+        self.stdout.write(f'Created {created:,} users in {time.perf_counter() - started:.1f}s')
@@ -0,0 +1,41 @@
+from django.contrib.postgres.operations import TrigramExtension
+from django.db import migrations
+
+# Prefix matches are range scans in name/email order on the btree indexes;
+# word-prefix and typo-tolerant matches use the trigram GIN indexes
+SEARCH_INDEXES = {
+    'users_full_name_prefix_idx': '((lower(full_name) COLLATE "C"), id)',
+    'users_email_prefix_idx': '((lower(email) COLLATE "C"), id)',
+    'users_full_name_trgm_idx': 'USING gin (full_name gin_trgm_ops)',
+    'users_email_trgm_idx': 'USING gin (email gin_trgm_ops)',
+}
+
+
+def create_search_indexes(apps, schema_editor):
+    """Indexes for user search; other databases use the in-process index"""
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    for name, definition in SEARCH_INDEXES.items():
+        schema_editor.execute(f'CREATE INDEX CONCURRENTLY IF NOT EXISTS {name} ON users {definition}')
+
+
+def drop_search_indexes(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    for name in SEARCH_INDEXES:
+        schema_editor.execute(f'DROP INDEX CONCURRENTLY IF EXISTS {name}')
+
+
+class Migration(migrations.Migration):
+    # Build the indexes without blocking writes to the users table
+    atomic = False
+    
+    dependencies = [
+        ('accounts', '0001_initial'),
+    ]
+    
+    operations = [
+        # No-op on databases other than PostgreSQL
+        TrigramExtension(),
+        migrations.RunPython(create_search_indexes, drop_search_indexes),
+    ]
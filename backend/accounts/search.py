@@ -0,0 +1,296 @@
+"""
+Ranked fuzzy search over users' full names and emails.
+
+Matches are ranked in tiers, best first:
+
+1. the full name starts with the term, in name order
+2. the email starts with the term, in email order
+3. a later word of the name starts with the term ("smi" finds "John Smith"),
+   in name order
+4. typo-tolerant matches: trigram word similarity to the name or email clears
+   ``SIMILARITY_THRESHOLD`` ("jenifer" finds "Jennifer"), most similar first
+
+On PostgreSQL tiers 1 and 2 are range scans in index order on btree indexes,
+so a broad prefix costs the same as a narrow one; tiers 3 and 4 are served by
+pg_trgm GIN indexes (see migration 0002). Later tiers are only queried when
+the earlier ones cannot fill the page. Other databases (SQLite test runs)
+use ``InMemoryUserIndex``, a per-process index with the same tiers.
+
+Pages are cut with an opaque keyset cursor holding (tier, sort key, id).
+"""
+import base64
+import bisect
+import json
+import threading
+from collections import defaultdict
+
+from django.db import connection
+from django.db.models import Count, Max
+from rest_framework.exceptions import ValidationError
+
+from .models import User
+
+NAME_PREFIX, EMAIL_PREFIX, WORD_PREFIX, FUZZY = range(4)
+TIER_COUNT = 4
+# Mirrors the pg_trgm.word_similarity_threshold default
+SIMILARITY_THRESHOLD = 0.6
+# Shorter terms share too few trigrams for similarity to mean anything
+MIN_FUZZY_LENGTH = 3
+
+
+def encode_cursor(tier, key, user_id):
+    raw = json.dumps([tier, key, user_id])
+    return base64.urlsafe_b64encode(raw.encode()).decode()
+
+
+def decode_cursor(cursor):
+    """Return the (tier, (key, id)) position encoded in a cursor"""
+    try:
+        tier, key, user_id = json.loads(base64.urlsafe_b64decode(cursor.encode()).decode())
+        if type(tier) is not int or tier not in range(TIER_COUNT) or type(user_id) is not int:
+            raise ValueError
+        # Fuzzy matches sort by similarity, the other tiers by a name or email
+        if tier == FUZZY and type(key) not in (int, float) or tier != FUZZY and type(key) is not str:
+            raise ValueError
+    except (ValueError, TypeError, UnicodeError):
+        raise ValidationError({'cursor': 'Invalid cursor'})
+    return tier, (key, user_id)
+
+
+def search_users(query, exclude_user_id=None, limit=20, cursor=None):
+    """Return ``(users, next_cursor)`` for one page of matches, best first"""
+    term = ' '.join(query.lower().split())
+    if not term:
+        raise ValidationError({'q': 'A search term is required'})
+    tier, after = decode_cursor(cursor) if cursor else (NAME_PREFIX, None)
+    
+    if connection.vendor == 'postgresql':
+        backend = PostgresUserSearch(term, exclude_user_id)
+    else:
+        backend = fallback_index.searcher(term, exclude_user_id)
+    
+    results = []
+    while tier < TIER_COUNT and len(results) <= limit:
+        if tier != FUZZY or len(term) >= MIN_FUZZY_LENGTH:
+            rows = backend.fetch(tier, after, limit + 1 - len(results))
+            results.extend((tier, key, user) for key, user in rows)
+        tier += 1
+        after = None
+    
+    next_cursor = None
+    if len(results) > limit:
+        results = results[:limit]
+        last_tier, key, user = results[-1]
+        next_cursor = encode_cursor(last_tier, key, user.id)
+    return [user for _, _, user in results], next_cursor
+
+
+def escape_like(value):
+    return value.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+
+
+class PostgresUserSearch:
+    """One SQL query per tier, each excluding the rows of the tiers before it"""
+    
+    # tier: (sort key, match condition, descending)
+    TIERS = {
+        NAME_PREFIX: (
+            'lower(full_name) COLLATE "C"',
+            'lower(full_name) COLLATE "C" LIKE %(prefix)s',
+            False,
+        ),
+        EMAIL_PREFIX: (
+            'lower(email) COLLATE "C"',
+            'lower(email) COLLATE "C" LIKE %(prefix)s AND lower(full_name) NOT LIKE %(prefix)s',
+            False,
+        ),
+        WORD_PREFIX: (
+            'lower(full_name) COLLATE "C"',
+            'full_name ILIKE %(word_prefix)s '
+            'AND lower(full_name) NOT LIKE %(prefix)s AND lower(email) NOT LIKE %(prefix)s',
+            False,
+        ),
+        FUZZY: (
+            'GREATEST(word_similarity(%(term)s, full_name), word_similarity(%(term)s, email))::float8',
+            '(%(term)s <%% full_name OR %(term)s <%% email) '
+            'AND lower(full_name) NOT LIKE %(prefix)s AND lower(email) NOT LIKE %(prefix)s '
+            'AND full_name NOT ILIKE %(word_prefix)s',
+            True,
+        ),
+    }
+    
+    def __init__(self, term, exclude_user_id):
+        prefix = escape_like(term) + '%'
+        self.params = {
+            'term': term,
+            'prefix': prefix,
+            'word_prefix': '% ' + prefix,
+            'exclude_user_id': exclude_user_id or 0,
+        }
+    
+    def fetch(self, tier, after, limit):
+        key, match, descending = self.TIERS[tier]
+        params = dict(self.params, limit=limit)
+        keyset = ''
+        if after is not None:
+            params['after_key'], params['after_id'] = after
+            if descending:
+                keyset = (
+                    'WHERE search_key < %(after_key)s '
+                    'OR (search_key = %(after_key)s AND id > %(after_id)s)'
+                )
+            else:
+                keyset = 'WHERE (search_key, id) > (%(after_key)s, %(after_id)s)'
+        
+        sql = f"""
+            SELECT * FROM (
+                SELECT users.*, {key} AS search_key
+                FROM users
+                WHERE is_active AND id <> %(exclude_user_id)s AND {match}
+            ) matches
+            {keyset}
+            ORDER BY search_key {'DESC' if descending else 'ASC'}, id
+            LIMIT %(limit)s
+        """
+        return [(user.search_key, user) for user in User.objects.raw(sql, params)]
+
+
+def trigrams(text):
+    """pg_trgm style trigrams: lowercased words padded with two spaces in front and one behind"""
+    grams = set()
+    for word in ''.join(c if c.isalnum() else ' ' for c in text.lower()).split():
+        padded = f'  {word} '
+        grams.update(padded[i:i + 3] for i in range(len(padded) - 2))
+    return grams
+
+
+def prefix_range(entries, prefix, after=None):
+    """Yield sorted ``(text, id)`` entries starting with ``prefix``, after a position"""
+    position = bisect.bisect_right(entries, tuple(after)) if after else bisect.bisect_left(entries, (prefix,))
+    while position < len(entries) and entries[position][0].startswith(prefix):
+        yield entries[position]
+        position += 1
+
+
+class InMemoryUserIndex:
+    """
+    Per-process search index over active users, used when PostgreSQL is not.
+    
+    The index is rebuilt whenever the users table changes, which is detected
+    with one aggregate query per search. That is cheap at test-run sizes; on
+    PostgreSQL the database indexes are used instead.
+    """
+    
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.fingerprint = None
+    
+    def build(self):
+        users = {}
+        names = []
+        emails = []
+        words = []
+        postings = defaultdict(set)
+        for user_id, full_name, email in User.objects.filter(is_active=True).values_list(
+            'id', 'full_name', 'email'
+        ):
+            full_name, email = full_name.lower(), email.lower()
+            users[user_id] = (full_name, email)
+            names.append((full_name, user_id))
+            emails.append((email, user_id))
+            words.extend((word, user_id) for word in full_name.split()[1:])
+            for gram in trigrams(full_name) | trigrams(email):
+                postings[gram].add(user_id)
+        self.users = users
+        self.names = sorted(names)
+        self.emails = sorted(emails)
+        self.words = sorted(words)
+        self.postings = postings
+    
+    def searcher(self, term, exclude_user_id):
+        fingerprint = tuple(User.objects.aggregate(count=Count('id'), latest=Max('updated_at')).values())
+        with self.lock:
+            if fingerprint != self.fingerprint:
+                self.build()
+                self.fingerprint = fingerprint
+            return InMemoryUserSearch(self, term, exclude_user_id)
+
+
+class InMemoryUserSearch:
+    """The ``PostgresUserSearch`` tiers evaluated against an ``InMemoryUserIndex``"""
+    
+    def __init__(self, index, term, exclude_user_id):
+        self.index = index
+        self.term = term
+        self.exclude_user_id = exclude_user_id
+    
+    def tier_of(self, user_id):
+        full_name, email = self.index.users[user_id]
+        if full_name.startswith(self.term):
+            return NAME_PREFIX
+        if email.startswith(self.term):
+            return EMAIL_PREFIX
+        if f' {self.term}' in full_name:
+            return WORD_PREFIX
+        return FUZZY
+    
+    def similarity(self, term_grams, user_id):
+        """Share of the term's trigrams found in the name or email (a bound on word_similarity)"""
+        full_name, email = self.index.users[user_id]
+        return max(
+            len(term_grams & trigrams(full_name)) / len(term_grams),
+            len(term_grams & trigrams(email)) / len(term_grams)
+        )
+    
+    def candidates(self, tier):
+        """Unordered ``(key, id)`` pairs for the word-prefix and fuzzy tiers"""
+        if tier == WORD_PREFIX:
+            first_word = self.term.split()[0]
+            user_ids = {user_id for _, user_id in prefix_range(self.index.words, first_word)}
+            return [
+                (self.index.users[user_id][0], user_id)
+                for user_id in user_ids if self.tier_of(user_id) == WORD_PREFIX
+            ]
+        
+        term_grams = trigrams(self.term)
+        if not term_grams:
+            return []
+        shared = defaultdict(int)
+        for gram in term_grams:
+            for user_id in self.index.postings.get(gram, ()):
+                shared[user_id] += 1
+        pairs = []
+        for user_id, count in shared.items():
+            if count >= SIMILARITY_THRESHOLD * len(term_grams) and self.tier_of(user_id) == FUZZY:
+                pairs.append((self.similarity(term_grams, user_id), user_id))
+        return [pair for pair in pairs if pair[0] >= SIMILARITY_THRESHOLD]
+    
+    def fetch(self, tier, after, limit):
+        if tier in (NAME_PREFIX, EMAIL_PREFIX):
+            entries = self.index.names if tier == NAME_PREFIX else self.index.emails
+            ordered = (
+                (key, user_id) for key, user_id in prefix_range(entries, self.term, after)
+                if self.tier_of(user_id) == tier
+            )
+        elif tier == FUZZY:
+            ordered = sorted(self.candidates(tier), key=lambda pair: (-pair[0], pair[1]))
+            if after is not None:
+                ordered = [pair for pair in ordered if (-pair[0], pair[1]) > (-after[0], after[1])]
+        else:
+            ordered = sorted(self.candidates(tier))
+            if after is not None:
+                ordered = [pair for pair in ordered if pair > tuple(after)]
+        
+        page = []
+        for key, user_id in ordered:
+            if user_id == self.exclude_user_id:
+                continue
+            page.append((key, user_id))
+            if len(page) == limit:
+                break
+        
+        users = User.objects.in_bulk([user_id for _, user_id in page])
+        return [(key, users[user_id]) for key, user_id in page if user_id in users]
+
+
+fallback_index = InMemoryUserIndex()
@@ -56,6 +56,18 @@ class UserSerializer(serializers.ModelSerializer):
         read_only_fields = ('id', 'email')
 
 
+# Columns of ``UserSerializer``, for list endpoints that skip model instances
+USER_ROW_FIELDS = ('id', 'email', 'full_name', 'profile_picture')
+
+
+def format_user_rows(rows):
+    """``UserSerializer(many=True).data`` for ``values_list(*USER_ROW_FIELDS)`` rows"""
+    return [
+        {'id': user_id, 'email': email, 'full_name': full_name, 'profile_picture': profile_picture}
+        for user_id, email, full_name, profile_picture in rows
+    ]
+
+
 class UserDetailSerializer(serializers.ModelSerializer):
     class Meta:
         model = User
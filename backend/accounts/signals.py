@@ -0,0 +1,52 @@
+from django.contrib.auth import get_user_model
+from django.db import transaction
+from django.conf import settings
+from django.db.models.signals import post_delete, post_save, pre_delete
+from django.dispatch import receiver
+
+from social_messenger import etags
+
+from .authentication import invalidate_user, set_user_revoked
+from .tasks import bump_profile_dependents, profile_dependents
+
+User = get_user_model()
+
+# Fields other users see; saving only other fields (e.g. last_login) keeps ETags valid
+PUBLIC_FIELDS = frozenset({'email', 'full_name', 'profile_picture'})
+
+
+@receiver(post_save, sender=User, dispatch_uid='accounts.invalidate_cached_user_on_save')
+def invalidate_cached_user_on_save(sender, instance, **kwargs):
+    """Drop the cached user now and again on commit, so a concurrent miss cannot re-cache the old row"""
+    invalidate_user(instance.id)
+    transaction.on_commit(lambda: invalidate_user(instance.id))
+    set_user_revoked(instance.id, not instance.is_active)
+
+
+@receiver(post_delete, sender=User, dispatch_uid='accounts.invalidate_cached_user_on_delete')
+def invalidate_cached_user_on_delete(sender, instance, **kwargs):
+    invalidate_user(instance.id)
+    transaction.on_commit(lambda: invalidate_user(instance.id))
+    set_user_revoked(instance.id, True)
+
+
+@receiver(post_save, sender=User, dispatch_uid='accounts.bump_profile_versions_on_save')
+def bump_profile_versions_on_save(sender, instance, created, update_fields=None, **kwargs):
+    """Invalidate ETags showing the user; the fan-out to friends and peers runs on a worker"""
+    if created or not settings.ETAGS_ENABLED:
+        return
+    if update_fields is not None and not PUBLIC_FIELDS.intersection(update_fields):
+        return
+    etags.bump('profile', (instance.id,))
+    transaction.on_commit(lambda: bump_profile_dependents.delay(instance.id))
+
+
+@receiver(pre_delete, sender=User, dispatch_uid='accounts.bump_profile_versions_on_delete')
+def bump_profile_versions_on_delete(sender, instance, **kwargs):
+    """Collect dependents before the cascade removes the rows that link them"""
+    if not settings.ETAGS_ENABLED:
+        return
+    friend_ids, peer_ids = profile_dependents(instance.id)
+    etags.bump('profile', (instance.id,))
+    etags.bump('friends', friend_ids)
+    etags.bump('messages', peer_ids)
@@ -0,0 +1,32 @@
+from celery import shared_task
+
+from social_messenger import etags
+
+
+def profile_dependents(user_id):
+    """
+    ``(friends, peers)``: users whose friend list or inbox shows ``user_id``'s profile.
+    
+    Friend lists show friends and the senders of pending requests; inboxes
+    and chat lists show conversation peers.
+    """
+    from friends.models import FriendRequest, Friendship
+    from messaging.models import Conversation
+    
+    friend_ids = set(Friendship.objects.filter(user_low_id=user_id).values_list('user_high_id', flat=True))
+    friend_ids.update(Friendship.objects.filter(user_high_id=user_id).values_list('user_low_id', flat=True))
+    friend_ids.update(FriendRequest.objects.filter(
+        sender_id=user_id,
+        status=FriendRequest.RequestStatus.PENDING
+    ).values_list('receiver_id', flat=True))
+    peer_ids = set(Conversation.objects.filter(user_low_id=user_id).values_list('user_high_id', flat=True))
+    peer_ids.update(Conversation.objects.filter(user_high_id=user_id).values_list('user_low_id', flat=True))
+    return friend_ids, peer_ids
+
+
+@shared_task
+def bump_profile_dependents(user_id):
+    """Invalidate the ETags of every friend list and inbox that shows the user"""
+    friend_ids, peer_ids = profile_dependents(user_id)
+    etags.bump_now('friends', friend_ids)
+    etags.bump_now('messages', peer_ids)
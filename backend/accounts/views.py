@@ -1,19 +1,22 @@
 from rest_framework import status, generics, viewsets, permissions
 from rest_framework.decorators import api_view, permission_classes, action
 from rest_framework.permissions import AllowAny, IsAuthenticated
+from rest_framework.exceptions import ValidationError
 from rest_framework.response import Response
-from rest_framework_simplejwt.tokens import RefreshToken
 from rest_framework_simplejwt.views import TokenObtainPairView
 from django.contrib.auth import get_user_model
 from django.db.models import Q
 from django_filters.rest_framework import DjangoFilterBackend
 from rest_framework.filters import SearchFilter, OrderingFilter
+from social_messenger.etags import conditional_get
 from .serializers import (
     UserRegistrationSerializer, 
     UserLoginSerializer, 
     UserSerializer,
     UserDetailSerializer,
-    CustomTokenObtainPairSerializer
+    CustomTokenObtainPairSerializer,
+    USER_ROW_FIELDS,
+    format_user_rows
 )
 
 User = get_user_model()
@@ -22,6 +25,8 @@ User = get_user_model()
 class CustomTokenObtainPairView(TokenObtainPairView):
     """Custom JWT token view that includes user data"""
     serializer_class = CustomTokenObtainPairSerializer
+    # Separate rate limit per address (see social_messenger.throttling)
+    throttle_scope = 'login'
 
 
 class UserRegistrationView(generics.CreateAPIView):
@@ -35,8 +40,8 @@ class UserRegistrationView(generics.CreateAPIView):
         serializer.is_valid(raise_exception=True)
         user = serializer.save()
         
-        # Generate JWT tokens
-        refresh = RefreshToken.for_user(user)
+        # Generate JWT tokens with the same claims as login
+        refresh = CustomTokenObtainPairSerializer.get_token(user)
         access_token = refresh.access_token
         
         return Response({
@@ -53,9 +58,13 @@ class UserViewSet(viewsets.ReadOnlyModelViewSet):
     serializer_class = UserSerializer
     permission_classes = [IsAuthenticated]
     filter_backends = [DjangoFilterBackend, SearchFilter, OrderingFilter]
-    search_fields = ['name', 'email']
-    ordering_fields = ['name', 'email', 'date_joined']
-    ordering = ['name']
+    search_fields = ['full_name', 'email']
+    ordering_fields = ['full_name', 'email', 'date_joined']
+    ordering = ['full_name']
+    # Read-only actions that only need the user id (see AUTH_CLAIMS_USER_READS)
+    claims_user_actions = ('list', 'retrieve', 'all_users', 'profile', 'suggestions', 'search')
+    # Separate rate limits (see social_messenger.throttling)
+    throttle_scopes = {'search': 'search'}
     
     def get_queryset(self):
         """Filter users based on the action"""
@@ -63,38 +72,65 @@ class UserViewSet(viewsets.ReadOnlyModelViewSet):
         
         if self.action == 'list':
             # Get users excluding current user and friends
-            from friends.models import FriendRequest
-            friend_requests = FriendRequest.objects.filter(
-                Q(sender=current_user) | Q(receiver=current_user),
-                status='accepted'
-            )
-            
-            friend_ids = []
-            for fr in friend_requests:
-                if fr.sender == current_user:
-                    friend_ids.append(fr.receiver.id)
-                else:
-                    friend_ids.append(fr.sender.id)
-            
-            return User.objects.exclude(
-                Q(id=current_user.id) | Q(id__in=friend_ids)
+            from friends.models import Friendship
+            return User.objects.exclude(id=current_user.id).exclude(
+                Friendship.objects.friends_q(current_user.id)
             )
         
         return User.objects.exclude(id=current_user.id)
     
+    def list(self, request, *args, **kwargs):
+        """Users who are not friends yet, read as plain rows"""
+        queryset = self.filter_queryset(self.get_queryset()).values_list(*USER_ROW_FIELDS)
+        page = self.paginate_queryset(queryset)
+        if page is not None:
+            return self.get_paginated_response(format_user_rows(page))
+        return Response(format_user_rows(queryset))
+    
     @action(detail=False, methods=['get'], url_path='all')
     def all_users(self, request):
         """Get all users except current user"""
         current_user = request.user
-        users = User.objects.exclude(id=current_user.id)
-        serializer = self.get_serializer(users, many=True)
-        return Response(serializer.data)
+        users = User.objects.exclude(id=current_user.id).values_list(*USER_ROW_FIELDS)
+        return Response(format_user_rows(users))
     
     @action(detail=True, methods=['get'])
+    @conditional_get(lambda request, pk: [('profile', int(pk))])
     def profile(self, request, pk=None):
         """Get detailed user profile"""
         user = self.get_object()
         serializer = UserDetailSerializer(user)
         return Response(serializer.data)
+    
+    @action(detail=False, methods=['get'])
+    def suggestions(self, request):
+        """Get people the current user may know, ranked by mutual friends"""
+        from friends.suggestions import get_suggestions
+        results = []
+        for user, mutual_count in get_suggestions(request.user.id):
+            data = UserSerializer(user, context={'request': request}).data
+            data['mutualFriends'] = mutual_count
+            results.append(data)
+        return Response(results)
+    
+    @action(detail=False, methods=['get'])
+    def search(self, request):
+        """Ranked, typo-tolerant search over names and emails with cursor pagination"""
+        from .search import search_users
+        try:
+            limit = max(1, min(int(request.query_params.get('limit', 20)), 50))
+        except ValueError:
+            raise ValidationError({'limit': 'A valid integer is required'})
+        users, next_cursor = search_users(
+            request.query_params.get('q', ''),
+            exclude_user_id=request.user.id,
+            limit=limit,
+            cursor=request.query_params.get('cursor')
+        )
+        return Response({
+            'results': UserSerializer(users, many=True, context={'request': request}).data,
+            'nextCursor': next_cursor,
+            'hasMore': next_cursor is not None,
+        })
 
 
@@ -0,0 +1,163 @@
+import os
+import shutil
+import socket
+import statistics
+import threading
+import time
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from django.test import override_settings
+from django.views.static import serve
+from rest_framework.test import APIRequestFactory, force_authenticate
+
+from social_messenger.media import serve_media
+
+User = get_user_model()
+
+BENCH_DIR = 'benchmarks'
+# name -> (file size, bytes requested with Range or None, requests per run)
+CASES = {
+    'thumbnail': (32 * 1024, None, 500),
+    'video': (64 * 1024 * 1024, None, 5),
+    'video seek': (64 * 1024 * 1024, 1024 * 1024, 100),
+}
+
+
+class Sink:
+    """The client end of a socket pair, read and discarded by a thread"""
+    
+    def __init__(self):
+        self.server, self.client = socket.socketpair()
+        self.received = 0
+        self.thread = threading.Thread(target=self.drain, daemon=True)
+        self.thread.start()
+    
+    def drain(self):
+        buffer = bytearray(1024 * 1024)
+        while received := self.client.recv_into(buffer):
+            self.received += received
+    
+    def wait_for(self, total):
+        while self.received < total:
+            time.sleep(0)
+    
+    def close(self):
+        self.server.close()
+        self.thread.join()
+        self.client.close()
+
+
+def write_body(response, sock):
+    """Send the body through Python, as runserver and ASGI servers do"""
+    sent = 0
+    for chunk in response:
+        sock.sendall(chunk)
+        sent += len(chunk)
+    response.close()
+    return sent
+
+
+def sendfile_body(response, sock):
+    """Send the body as gunicorn's ``wsgi.file_wrapper`` does: ``os.sendfile`` up to Content-Length"""
+    fd = response.file_to_stream.fileno()
+    offset = os.lseek(fd, 0, os.SEEK_CUR)
+    remaining = length = int(response['Content-Length'])
+    while remaining:
+        sent = os.sendfile(sock.fileno(), fd, offset, remaining)
+        offset += sent
+        remaining -= sent
+    response.close()
+    return length
+
+
+def handoff_only(response, sock):
+    """Nothing to send: the proxy reads the file named in ``X-Accel-Redirect``"""
+    response.close()
+    return 0
+
+
+class Command(BaseCommand):
+    help = (
+        'Benchmark media throughput: the development static view against '
+        'serve_media streaming through Python (ASGI), with os.sendfile (the '
+        'path gunicorn takes through wsgi.file_wrapper) and handing off to '
+        'nginx with X-Accel-Redirect (Django work only). Bodies are written '
+        'to a local socket that a thread drains; headers and authentication '
+        'are left out. Writes temporary files under MEDIA_ROOT/benchmarks.'
+    )
+    
+    def add_arguments(self, parser):
+        parser.add_argument('--runs', type=int, default=5,
+                            help='Timed runs per case and path')
+    
+    def handle(self, *args, **options):
+        user = User.objects.first()
+        if user is None:
+            raise CommandError('No users found; run generate_dataset first')
+        directory = os.path.join(settings.MEDIA_ROOT, BENCH_DIR)
+        os.makedirs(directory, exist_ok=True)
+        factory = APIRequestFactory()
+        
+        def media_request(path, range_header):
+            request = factory.get(f'{settings.MEDIA_URL}{path}', **range_header)
+            force_authenticate(request, user)
+            return request
+        
+        paths = {
+            'static': (
+                lambda path, range_header: serve(factory.get('/', **range_header), path, settings.MEDIA_ROOT),
+                write_body, '',
+            ),
+            'media stream': (lambda path, range_header: serve_media(media_request(path, range_header), path=path),
+                             write_body, ''),
+            'media sendfile': (lambda path, range_header: serve_media(media_request(path, range_header), path=path),
+                               sendfile_body, ''),
+            'media x-accel': (lambda path, range_header: serve_media(media_request(path, range_header), path=path),
+                              handoff_only, 'x-accel-redirect'),
+        }
+        
+        self.stdout.write(f"Media serving benchmark (median of {options['runs']} runs)")
+        try:
+            for label, (size, range_size, requests) in CASES.items():
+                path = f'{BENCH_DIR}/{size}.bin'
+                fullpath = os.path.join(settings.MEDIA_ROOT, path)
+                if not os.path.exists(fullpath):
+                    with open(fullpath, 'wb') as file:
+                        file.write(os.urandom(size))
+                range_header = {'HTTP_RANGE': f'bytes={size // 2}-{size // 2 + range_size - 1}'} if range_size else {}
+                wanted = range_size or size
+                described = f'{wanted // 1024:,} KiB of a {size // 1024:,} KiB file' if range_size else f'{size // 1024:,} KiB'
+                self.stdout.write(f'{label} ({described}, {requests} requests)')
+                for name, (view, send, mode) in paths.items():
+                    with override_settings(MEDIA_SENDFILE=mode):
+                        timings, sent = self.bench(lambda: view(path, range_header), send, requests, options['runs'])
+                    per_request = statistics.median(timings) / requests
+                    line = f'  {name:<15} {1 / per_request:>9,.0f} req/s'
+                    if sent:
+                        line += f'  {sent / per_request / 1024 ** 2:>9,.0f} MiB/s'
+                        if sent != wanted:
+                            line += f'  (sent {sent // 1024:,} KiB per request)'
+                    self.stdout.write(line)
+        finally:
+            shutil.rmtree(directory, ignore_errors=True)
+    
+    def bench(self, view, send, requests, runs):
+        sink = Sink()
+        timings = []
+        try:
+            for _ in range(runs):
+                expected = sink.received
+                started = time.perf_counter()
+                for _ in range(requests):
+                    response = view()
+                    if response.status_code not in (200, 206):
+                        raise CommandError(f'Unexpected status {response.status_code}')
+                    sent = send(response, sink.server)
+                    expected += sent
+                sink.wait_for(expected)
+                timings.append(time.perf_counter() - started)
+        finally:
+            sink.close()
+        return timings, sent
@@ -0,0 +1,112 @@
+import random
+import statistics
+import time
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DEFAULT_DB_ALIAS, connections
+from django.test import Client, override_settings
+from rest_framework_simplejwt.tokens import RefreshToken
+
+from social_messenger import replicas
+
+User = get_user_model()
+
+
+class QueryCounter:
+    """Counts the queries run on one database"""
+    
+    def __init__(self):
+        self.queries = 0
+    
+    def __call__(self, execute, sql, params, many, context):
+        self.queries += 1
+        return execute(sql, params, many, context)
+
+
+class Command(BaseCommand):
+    help = (
+        'Benchmark read-replica routing on the heavy read endpoints (user '
+        'chats, chat history, friend lists, the user list). Random users '
+        'from the dataset send --requests GET requests; --pinned of them '
+        'count as having just written, so they read from the primary. '
+        'Counts the queries each database served and times the requests, '
+        'then repeats them with routing off. Needs DB_REPLICAS, e.g. a copy '
+        'of the SQLite database; leaves nothing behind.'
+    )
+    
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=1000,
+                            help='GET requests per run')
+        parser.add_argument('--users', type=int, default=100,
+                            help='Users sending them')
+        parser.add_argument('--pinned', type=float, default=0.2,
+                            help='Share of users who just wrote')
+    
+    def handle(self, *args, **options):
+        if not settings.DATABASE_REPLICAS:
+            raise CommandError('No replicas configured; set DB_REPLICAS')
+        users = list(User.objects.order_by('id')[:options['users']])
+        if len(users) < 2:
+            raise CommandError('Need at least 2 users; run generate_dataset first')
+        rng = random.Random(0)
+        pinned = rng.sample(users, int(len(users) * options['pinned']))
+        headers = {
+            user.id: {'HTTP_AUTHORIZATION': f'Bearer {RefreshToken.for_user(user).access_token}'}
+            for user in users
+        }
+        paths = []
+        for _ in range(options['requests']):
+            user, peer = rng.sample(users, 2)
+            path = rng.choice((
+                f'/api/v1/messages/messages/chats/{user.id}/',
+                f'/api/v1/messages/messages/{user.id}/{peer.id}/',
+                f'/api/v1/friends/friend-requests/friends/{user.id}/',
+                '/api/v1/users/users/',
+            ))
+            paths.append((user.id, path))
+        
+        replicas.health.get()
+        lags = ', '.join(f'{alias} {lag:.1f} s' if lag is not None else f'{alias} down'
+                         for alias, lag in replicas.health.lags.items())
+        self.stdout.write(
+            f"Replica routing benchmark ({connections[DEFAULT_DB_ALIAS].vendor}, {len(paths):,} GET requests "
+            f"by {len(users)} users, {len(pinned)} of them pinned; lag: {lags})"
+        )
+        client = Client(HTTP_HOST='localhost')
+        try:
+            cache.set_many({replicas.pin_key(user.id): 1 for user in pinned}, 3600)
+            # Warm up connections and caches, so both runs find them alike
+            self.run(client, paths, headers)
+            for label, aliases in (('routed', settings.DATABASE_REPLICAS), ('primary only', [])):
+                with override_settings(DATABASE_REPLICAS=aliases, ETAGS_ENABLED=False):
+                    timings, counts = self.run(client, paths, headers)
+                total = sum(counts.values())
+                shares = '  '.join(f'{alias} {count / total:.0%}' for alias, count in counts.items())
+                self.stdout.write(
+                    f'  {label:<13} p50 {statistics.median(timings) * 1000:6.2f} ms  '
+                    f'{total:,} queries: {shares}'
+                )
+        finally:
+            cache.delete_many([replicas.pin_key(user.id) for user in pinned])
+    
+    def run(self, client, paths, headers):
+        counters = {alias: QueryCounter() for alias in [DEFAULT_DB_ALIAS, *settings.DATABASE_REPLICAS]}
+        timings = []
+        for user_id, path in paths:
+            with self.counting(counters):
+                started = time.perf_counter()
+                response = client.get(path, **headers[user_id])
+                timings.append(time.perf_counter() - started)
+            if response.status_code != 200:
+                raise CommandError(f'{path} answered {response.status_code}')
+        return timings, {alias: counter.queries for alias, counter in counters.items()}
+    
+    def counting(self, counters):
+        from contextlib import ExitStack
+        stack = ExitStack()
+        for alias, counter in counters.items():
+            stack.enter_context(connections[alias].execute_wrapper(counter))
+        return stack
@@ -0,0 +1,167 @@
+import statistics
+import time
+from types import SimpleNamespace
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.db.models import Count, Q
+from rest_framework.renderers import JSONRenderer
+
+from accounts.serializers import USER_ROW_FIELDS, UserSerializer, format_user_rows
+from friends.models import FriendRequest
+from friends.serializers import FRIEND_REQUEST_ROW_FIELDS, FriendRequestSerializer, format_friend_request_rows
+from messaging.models import Message
+from messaging.pagination import ConversationCursorPagination
+from messaging.serializers import (
+    MessageListSerializer,
+    format_chat_rows,
+    format_message,
+    format_message_rows,
+    message_rows,
+    user_summaries
+)
+from social_messenger.renderers import FastJSONRenderer
+
+User = get_user_model()
+
+PHASES = ('fetch', 'format', 'render')
+
+
+class Command(BaseCommand):
+    help = (
+        'Microbenchmark the serialization of the hot list endpoints: rows per '
+        'second to fetch, format and render each response the previous way '
+        '(model instances, DRF serializers, JSONRenderer) and the current way '
+        '(values_list rows formatted as dicts, FastJSONRenderer). Both outputs '
+        'are checked to be byte-identical first. Read-only; run it on a '
+        'generate_dataset database.'
+    )
+    
+    def add_arguments(self, parser):
+        parser.add_argument('--runs', type=int, default=20,
+                            help='Timed runs per case and path')
+        parser.add_argument('--page-size', type=int, default=ConversationCursorPagination.max_limit,
+                            help='Messages per conversation history page')
+    
+    def handle(self, *args, **options):
+        user_id = (
+            Message.objects.values('sender_id').annotate(count=Count('id'))
+            .order_by('-count').values_list('sender_id', flat=True).first()
+        )
+        if user_id is None:
+            raise CommandError('No messages found; run generate_dataset first')
+        peer_id = (
+            Message.objects.filter(sender_id=user_id).values('recipient_id').annotate(count=Count('id'))
+            .order_by('-count').values_list('recipient_id', flat=True).first()
+        )
+        requests_user_id = (
+            FriendRequest.objects.values('receiver_id').annotate(count=Count('id'))
+            .order_by('-count').values_list('receiver_id', flat=True).first()
+        ) or user_id
+        
+        self.stdout.write(f"Serialization benchmark ({connection.vendor}, median of {options['runs']} runs)")
+        self.bench('chat list', *self.chat_list(user_id), options['runs'])
+        self.bench('history page', *self.history_page(user_id, peer_id, options['page_size']), options['runs'])
+        self.bench('friend requests', *self.friend_requests(requests_user_id), options['runs'])
+        self.bench('user list', *self.user_list(user_id), options['runs'])
+    
+    def chat_list(self, user_id):
+        queryset = Message.objects.filter(Q(sender_id=user_id) | Q(recipient_id=user_id)).order_by('created_at', 'id')
+        
+        def fetch_rows():
+            rows = list(message_rows(queryset))
+            return rows, user_summaries({row.sender_id for row in rows} | {row.recipient_id for row in rows})
+        
+        old = (
+            lambda: list(queryset.select_related('sender', 'recipient')),
+            lambda messages: {'messages': MessageListSerializer(messages, many=True).data},
+        )
+        new = (
+            fetch_rows,
+            lambda fetched: {'messages': format_chat_rows(*fetched)},
+        )
+        return old, new
+    
+    def history_page(self, user_id, peer_id, page_size):
+        request = SimpleNamespace(query_params={'limit': str(page_size)})
+        
+        def fetch(queryset):
+            paginator = ConversationCursorPagination(request)
+            return paginator, paginator.paginate(user_id, peer_id, queryset)
+        
+        def fetch_rows():
+            paginator, messages = fetch(message_rows(Message.objects.all()))
+            return paginator, messages, user_summaries((user_id, peer_id))
+        
+        old = (
+            lambda: fetch(Message.objects.select_related('sender')),
+            lambda fetched: fetched[0].get_page_data([format_message(message) for message in fetched[1]]),
+        )
+        new = (
+            fetch_rows,
+            lambda fetched: fetched[0].get_page_data(format_message_rows(fetched[1], fetched[2])),
+        )
+        return old, new
+    
+    def friend_requests(self, user_id):
+        queryset = FriendRequest.objects.filter(Q(sender_id=user_id) | Q(receiver_id=user_id))
+        old = (
+            lambda: list(queryset.select_related('sender', 'receiver')),
+            lambda requests: FriendRequestSerializer(requests, many=True).data,
+        )
+        new = (
+            lambda: list(queryset.values_list(*FRIEND_REQUEST_ROW_FIELDS)),
+            format_friend_request_rows,
+        )
+        return old, new
+    
+    def user_list(self, user_id):
+        queryset = User.objects.exclude(id=user_id)
+        old = (
+            lambda: list(queryset.all()),
+            lambda users: UserSerializer(users, many=True).data,
+        )
+        new = (
+            lambda: list(queryset.values_list(*USER_ROW_FIELDS)),
+            format_user_rows,
+        )
+        return old, new
+    
+    def bench(self, label, old, new, runs):
+        paths = {
+            'DRF': (*old, JSONRenderer()),
+            'rows': (*new, FastJSONRenderer()),
+        }
+        outputs = {}
+        timings = {}
+        for name, (fetch, format_data, renderer) in paths.items():
+            phases = {phase: [] for phase in PHASES}
+            for _ in range(runs):
+                started = time.perf_counter()
+                fetched = fetch()
+                formatted_at = time.perf_counter()
+                data = format_data(fetched)
+                rendered_at = time.perf_counter()
+                outputs[name] = renderer.render(data)
+                finished = time.perf_counter()
+                phases['fetch'].append(formatted_at - started)
+                phases['format'].append(rendered_at - formatted_at)
+                phases['render'].append(finished - rendered_at)
+            timings[name] = {phase: statistics.median(values) for phase, values in phases.items()}
+        
+        if outputs['DRF'] != outputs['rows']:
+            raise CommandError(f'{label}: the two paths rendered different responses')
+        rows = self.count_rows(data)
+        self.stdout.write(f'{label} ({rows} rows, {len(outputs["rows"]) / 1024:.0f} KiB)')
+        for name, phases in timings.items():
+            total = sum(phases.values())
+            breakdown = '  '.join(f'{phase} {phases[phase] * 1000:7.2f} ms' for phase in PHASES)
+            self.stdout.write(f'  {name:<5} {rows / total:>10,.0f} rows/s  {breakdown}')
+        speedup = sum(timings['DRF'].values()) / sum(timings['rows'].values())
+        self.stdout.write(f'  {speedup:.1f}x faster')
+    
+    def count_rows(self, data):
+        if isinstance(data, dict):
+            data = data['messages']
+        return len(data)
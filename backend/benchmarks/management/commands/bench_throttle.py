@@ -0,0 +1,125 @@
+import time
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.cache import caches
+from django.core.management.base import BaseCommand
+from django.test import override_settings
+from rest_framework import throttling
+from rest_framework.exceptions import Throttled
+from rest_framework.test import APIRequestFactory, force_authenticate
+from rest_framework.views import APIView
+
+from social_messenger import throttling as buckets
+
+User = get_user_model()
+
+# A synthetic user id, far above real ones, so real buckets are untouched
+USER_ID = 10 ** 12
+
+
+class Probe(APIView):
+    throttle_scope = 'search'
+
+
+class Command(BaseCommand):
+    help = (
+        "Benchmark request throttling: the time check_throttles adds to a "
+        "request with DRF's AnonRateThrottle/UserRateThrottle (a timestamp "
+        "list per key in the default cache) against the token buckets of "
+        "social_messenger.throttling, with and without a scoped bucket. One "
+        "user sends --requests requests at a rate that never refuses them; "
+        "the first and last thousand are timed separately, since DRF's lists "
+        "grow with the rate. Then compares the Retry-After each gives once a "
+        "5/minute limit is reached. Uses the default cache (Redis when "
+        "REDIS_URL is set) and deletes its keys afterwards."
+    )
+    
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=10000,
+                            help='Requests per throttle setup')
+    
+    def handle(self, *args, **options):
+        user = User(id=USER_ID, email='bench@example.com')
+        factory = APIRequestFactory()
+        self.stdout.write(
+            f"Throttle benchmark ({caches['default'].__class__.__name__}, {options['requests']:,} requests by one user)"
+        )
+        rate = f"{options['requests'] * 2}/hour"
+        setups = {
+            'DRF anon+user': (drf_throttles(rate), False),
+            'bucket anon+user': ([buckets.AnonThrottle, buckets.UserThrottle], False),
+            'bucket +scope': ([buckets.AnonThrottle, buckets.UserThrottle, buckets.ScopedThrottle], True),
+        }
+        try:
+            with override_settings(REST_FRAMEWORK=self.rates(rate)):
+                for label, (classes, scoped) in setups.items():
+                    timings = self.bench(factory, user, classes, scoped, options['requests'])
+                    first, last = timings[:1000], timings[-1000:]
+                    self.stdout.write(
+                        f'  {label:<17} {sum(first) / len(first) * 1e6:8.1f} us/request for the first 1,000  '
+                        f'{sum(last) / len(last) * 1e6:8.1f} us for the last 1,000'
+                    )
+                    self.cleanup()
+            with override_settings(REST_FRAMEWORK=self.rates('5/minute')):
+                for label, classes in (('DRF', drf_throttles('5/minute')), ('bucket', [buckets.UserThrottle])):
+                    allowed, wait = self.retry_after(factory, user, classes)
+                    self.stdout.write(
+                        f'  5/minute, 6 requests at once: {label:<7} allows {allowed}, then Retry-After {wait} s'
+                    )
+                    self.cleanup()
+        finally:
+            self.cleanup()
+    
+    def rates(self, rate):
+        rest_framework = dict(settings.REST_FRAMEWORK)
+        rest_framework['DEFAULT_THROTTLE_RATES'] = {'anon': rate, 'user': rate, 'search': rate}
+        return rest_framework
+    
+    def throttle(self, factory, user, classes, scoped):
+        """Run check_throttles for one request; returns (seconds taken, Retry-After or None)"""
+        request = factory.get('/bench/')
+        force_authenticate(request, user)
+        view = Probe()
+        view.throttle_classes = classes
+        if not scoped:
+            view.throttle_scope = None
+        view.request = view.initialize_request(request)
+        view.format_kwarg = None
+        started = time.perf_counter()
+        try:
+            view.check_throttles(view.request)
+        except Throttled as exc:
+            return time.perf_counter() - started, exc.wait
+        return time.perf_counter() - started, None
+    
+    def bench(self, factory, user, classes, scoped, requests):
+        timings = []
+        for _ in range(requests):
+            elapsed, wait = self.throttle(factory, user, classes, scoped)
+            if wait is not None:
+                raise RuntimeError('Benchmark request was throttled')
+            timings.append(elapsed)
+        return timings
+    
+    def retry_after(self, factory, user, classes):
+        allowed = 0
+        for _ in range(6):
+            _, wait = self.throttle(factory, user, classes, False)
+            if wait is not None:
+                return allowed, wait
+            allowed += 1
+        return allowed, None
+    
+    def cleanup(self):
+        keys = [f'throttle_{scope}_{USER_ID}' for scope in ('anon', 'user', 'search')]
+        caches['default'].delete_many(keys)
+        buckets.local_buckets.clear()
+
+
+def drf_throttles(rate):
+    """DRF's throttles at ``rate``; their rates are read once, at import"""
+    return [
+        type('AnonRateThrottle', (throttling.AnonRateThrottle,), {'rate': rate}),
+        type('UserRateThrottle', (throttling.UserRateThrottle,), {'rate': rate}),
+    ]
@@ -0,0 +1,251 @@
+import io
+import random
+import time
+from collections import defaultdict
+from datetime import datetime, timedelta
+
+from django.contrib.auth import get_user_model
+from django.contrib.auth.hashers import make_password
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.db.models import Sum
+from django.utils import timezone
+
+from accounts.management.commands.bench_user_search import FIRST_NAMES, LAST_NAMES
+from friends.management.commands.bench_suggestions import preferential_attachment_graph
+from friends.models import FriendRequest, Friendship
+from messaging.models import Conversation, Message, UnreadCounter
+
+User = get_user_model()
+
+WORDS = (
+    'the be to of and a in that have it for not on with he as you do at this but his by from they we '
+    'say her she or an will my one all would there their what so up out if about who get which go me '
+    'when make can like time no just him know take people into year your good some could them see '
+    'other than then now look only come its over think also back after use two how our work first '
+    'well way even new want because any these give day most us hey thanks tomorrow tonight lunch '
+    'dinner meeting call later sure okay great sounds weekend photo link project deadline coffee '
+    'movie game train flight home office birthday party music book class exam trip beach running'
+).split()
+# Zipf-like word frequencies, so full-text search sees common and rare terms
+WORD_WEIGHTS = [1 / (rank + 1) for rank in range(len(WORDS))]
+
+
+class Command(BaseCommand):
+    help = (
+        'Generate a synthetic dataset for benchmarks: users, a power-law '
+        'friendship graph stored as accepted friend requests, and message '
+        'histories concentrated on a few very active conversations. Rows are '
+        'bulk-inserted (COPY on PostgreSQL), then the derived friendship, '
+        'conversation and unread-counter tables are rebuilt. Adds to whatever '
+        'the database already holds; use a scratch database.'
+    )
+    
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=10_000,
+                            help='Users to create')
+        parser.add_argument('--friends-per-user', type=int, default=5,
+                            help='Friendships each new user forms (the mean degree is twice this)')
+        parser.add_argument('--pending-requests', type=float, default=0.1,
+                            help='Pending friend requests per user')
+        parser.add_argument('--messages', type=int, default=100_000,
+                            help='Messages to create')
+        parser.add_argument('--days', type=int, default=365,
+                            help='Days of history the messages are spread over')
+        parser.add_argument('--unread', type=float, default=0.02,
+                            help='Share of the most recent messages left unread')
+        parser.add_argument('--batch-size', type=int, default=50_000,
+                            help='Rows per insert batch')
+        parser.add_argument('--seed', type=int, default=7)
+    
+    def handle(self, *args, **options):
+        if options['users'] <= options['friends_per_user']:
+            raise CommandError('--users must be larger than --friends-per-user')
+        self.rng = random.Random(options['seed'])
+        self.batch_size = options['batch_size']
+        started = time.perf_counter()
+        
+        user_ids = self.timed('users', self.create_users, options['users'])
+        edges = self.timed(
+            'friendships', self.create_friendships,
+            user_ids, options['friends_per_user'], options['pending_requests'], options['seed']
+        )
+        self.timed(
+            'messages', self.create_messages,
+            edges, options['messages'], options['days'], options['unread']
+        )
+        self.timed('conversation summaries', self.rebuild_derived)
+        if connection.vendor == 'postgresql':
+            with connection.cursor() as cursor:
+                cursor.execute('ANALYZE')
+        
+        self.stdout.write(self.style.SUCCESS(
+            f'Generated {len(user_ids):,} users, {len(edges):,} friendships and '
+            f"{options['messages']:,} messages in {time.perf_counter() - started:.1f}s "
+            f'({connection.vendor})'
+        ))
+    
+    def timed(self, label, function, *args):
+        started = time.perf_counter()
+        result = function(*args)
+        self.stdout.write(f'{label}: {time.perf_counter() - started:.1f}s')
+        return result
+    
+    def insert_rows(self, model, columns, rows):
+        """
+        Insert tuples into a model's table in batches, bypassing the ORM.
+        
+        PostgreSQL gets one COPY per batch; other databases get an
+        ``executemany`` per batch. Values must not contain tabs, newlines or
+        backslashes (none of the generated ones do).
+        """
+        table = connection.ops.quote_name(model._meta.db_table)
+        column_list = ', '.join(connection.ops.quote_name(column) for column in columns)
+        batch = []
+        
+        def flush():
+            if not batch:
+                return
+            with transaction.atomic(), connection.cursor() as cursor:
+                if connection.vendor == 'postgresql':
+                    buffer = io.StringIO()
+                    for row in batch:
+                        buffer.write('\t'.join(r'\N' if value is None else str(value) for value in row))
+                        buffer.write('\n')
+                    buffer.seek(0)
+                    cursor.copy_expert(f'COPY {table} ({column_list}) FROM STDIN', buffer)
+                else:
+                    # Store datetimes the way the ORM does, so its lookups compare them correctly
+                    adapt = connection.ops.adapt_datetimefield_value
+                    placeholders = ', '.join(['%s'] * len(columns))
+                    cursor.executemany(
+                        f'INSERT INTO {table} ({column_list}) VALUES ({placeholders})',
+                        [
+                            [adapt(value) if isinstance(value, datetime) else value for value in row]
+                            for row in batch
+                        ]
+                    )
+            batch.clear()
+        
+        for row in rows:
+            batch.append(row)
+            if len(batch) >= self.batch_size:
+                flush()
+        flush()
+    
+    def create_users(self, count):
+        last_id = User.objects.order_by('-id').values_list('id', flat=True).first() or 0
+        offset = User.objects.count()
+        password = make_password(None)
+        for start in range(0, count, self.batch_size):
+            batch = []
+            for number in range(start, min(start + self.batch_size, count)):
+                first, last = self.rng.choice(FIRST_NAMES), self.rng.choice(LAST_NAMES)
+                batch.append(User(
+                    email=f'{first.lower()}.{last.lower()}.{offset + number}@example.test',
+                    full_name=f'{first} {last}',
+                    password=password
+                ))
+            User.objects.bulk_create(batch)
+        return list(User.objects.filter(id__gt=last_id).order_by('id').values_list('id', flat=True))
+    
+    def create_friendships(self, user_ids, friends_per_user, pending_requests, seed):
+        """Accepted requests and Friendship edges for a preferential-attachment graph"""
+        graph = preferential_attachment_graph(len(user_ids), friends_per_user, seed)
+        edges = []
+        for node in range(len(user_ids)):
+            for friend in graph.friends(node):
+                if friend > node:
+                    edges.append((user_ids[node], user_ids[friend]))
+        
+        now = timezone.now()
+        accepted = FriendRequest.RequestStatus.ACCEPTED
+        pending = FriendRequest.RequestStatus.PENDING
+        requests = [
+            (low, high, accepted, now, now) if self.rng.random() < 0.5 else (high, low, accepted, now, now)
+            for low, high in edges
+        ]
+        edge_set = set(edges)
+        for _ in range(int(len(user_ids) * pending_requests)):
+            sender_id, receiver_id = self.rng.sample(user_ids, 2)
+            if (min(sender_id, receiver_id), max(sender_id, receiver_id)) not in edge_set:
+                edge_set.add((min(sender_id, receiver_id), max(sender_id, receiver_id)))
+                requests.append((sender_id, receiver_id, pending, now, now))
+        
+        self.insert_rows(
+            FriendRequest,
+            ('sender_id', 'receiver_id', 'status', 'created_at', 'updated_at'),
+            requests
+        )
+        self.insert_rows(
+            Friendship,
+            ('user_low_id', 'user_high_id', 'created_at'),
+            ((low, high, now) for low, high in edges)
+        )
+        return edges
+    
+    def create_messages(self, edges, count, days, unread_share):
+        """
+        Messages between friends, oldest first so ids follow time.
+        
+        Each conversation gets a Pareto-distributed activity weight, so a few
+        conversations hold most of the history, as in real messengers.
+        """
+        if not edges:
+            return
+        weights = [self.rng.paretovariate(1.2) for _ in edges]
+        total = 0.0
+        cumulative = []
+        for weight in weights:
+            total += weight
+            cumulative.append(total)
+        
+        end = timezone.now()
+        step = timedelta(days=days) / max(count, 1)
+        unread_from = int(count * (1 - unread_share))
+        
+        def rows():
+            created_at = end - step * count
+            for start in range(0, count, self.batch_size):
+                size = min(self.batch_size, count - start)
+                pairs = self.rng.choices(edges, cum_weights=cumulative, k=size)
+                for index, (user_a, user_b) in enumerate(pairs, start):
+                    sender_id, recipient_id = (user_a, user_b) if self.rng.random() < 0.5 else (user_b, user_a)
+                    created_at += step
+                    timestamp = created_at
+                    content = ' '.join(self.rng.choices(WORDS, WORD_WEIGHTS, k=self.rng.randint(2, 24)))
+                    is_read = index < unread_from
+                    read_at = created_at + timedelta(minutes=5) if is_read else None
+                    yield (
+                        sender_id, recipient_id, Message.MessageType.TEXT, content,
+                        is_read, read_at, timestamp, timestamp
+                    )
+        
+        self.insert_rows(
+            Message,
+            (
+                'sender_id', 'recipient_id', 'message_type', 'content',
+                'is_read', 'read_at', 'created_at', 'updated_at'
+            ),
+            rows()
+        )
+    
+    def rebuild_derived(self):
+        """Rebuild conversation summaries, then every user's unread total from them"""
+        call_command('backfill_conversations', stdout=io.StringIO())
+        
+        totals = defaultdict(int)
+        for field in ('low', 'high'):
+            for user_id, total in Conversation.objects.values_list(f'user_{field}_id').annotate(
+                total=Sum(f'unread_count_{field}')
+            ).filter(total__gt=0):
+                totals[user_id] += total
+        rows = [UnreadCounter(user_id=user_id, total=total) for user_id, total in totals.items()]
+        UnreadCounter.objects.bulk_create(
+            rows,
+            batch_size=self.batch_size,
+            update_conflicts=True,
+            unique_fields=['user'],
+            update_fields=['total', 'updated_at']
+        )
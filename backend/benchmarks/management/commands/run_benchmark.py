@@ -0,0 +1,245 @@
+import base64
+import http.client
+import json
+import platform
+import random
+import statistics
+import subprocess
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+from urllib.parse import urlsplit
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+
+from accounts.serializers import CustomTokenObtainPairSerializer
+from friends.models import Friendship
+from messaging import partitions
+from messaging.models import Conversation, Message
+
+User = get_user_model()
+
+SEARCH_PREFIXES = ('jen', 'mar', 'moh', 'li', 'sof', 'smi', 'pat', 'oka')
+SEARCH_WORDS = ('lunch', 'meeting', 'coffee', 'weekend', 'project deadline', 'birthday party')
+# How far back history_older pages start
+HISTORY_DEPTH_DAYS = 365
+
+
+def older_cursor(rng):
+    """``before`` cursor at a random point of the last year, as a client scrolling back would send"""
+    position = datetime.now(timezone.utc) - timedelta(seconds=rng.uniform(0, HISTORY_DEPTH_DAYS * 86400))
+    return base64.urlsafe_b64encode(f'{position.isoformat()}|{2 ** 62}'.encode()).decode()
+
+
+def build_request(endpoint, user_id, peer_id, rng):
+    """``(method, path, body)`` for one call to an endpoint on behalf of ``user_id``"""
+    if endpoint == 'inbox':
+        return 'GET', '/api/v1/messages/messages/inbox/', None
+    if endpoint == 'history':
+        return 'GET', f'/api/v1/messages/messages/{user_id}/{peer_id}/?limit=50', None
+    if endpoint == 'history_older':
+        return 'GET', f'/api/v1/messages/messages/{user_id}/{peer_id}/?limit=50&before={older_cursor(rng)}', None
+    if endpoint == 'unread':
+        return 'GET', '/api/v1/messages/messages/unread/', None
+    if endpoint == 'sync':
+        return 'GET', '/api/v1/messages/messages/sync/', None
+    if endpoint == 'friends':
+        return 'GET', f'/api/v1/friends/friend-requests/friends/{user_id}/', None
+    if endpoint == 'suggestions':
+        return 'GET', '/api/v1/users/users/suggestions/', None
+    if endpoint == 'user_search':
+        return 'GET', f'/api/v1/users/users/search/?q={rng.choice(SEARCH_PREFIXES)}', None
+    if endpoint == 'message_search':
+        query = rng.choice(SEARCH_WORDS).replace(' ', '+')
+        return 'GET', f'/api/v1/messages/messages/search/?q={query}', None
+    if endpoint == 'send_message':
+        body = {'recipient': peer_id, 'message_type': 'text', 'message': 'benchmark message'}
+        return 'POST', '/api/v1/messages/messages/', json.dumps(body)
+    raise CommandError(f'Unknown endpoint: {endpoint}')
+
+
+ENDPOINTS = (
+    'inbox', 'history', 'history_older', 'unread', 'sync', 'friends',
+    'suggestions', 'user_search', 'message_search', 'send_message',
+)
+
+
+def percentile(values, fraction):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(fraction * len(values)))]
+
+
+class Command(BaseCommand):
+    help = (
+        'Drive the hot API endpoints of a running server at fixed concurrency '
+        'levels and write p50/p95/p99 latency and throughput to a JSON report. '
+        'Each worker thread keeps one HTTP connection open and acts as a user '
+        'picked from the most recently active conversations. Pass --compare '
+        'with an earlier report to print the change per endpoint. The server '
+        'must use this database, with throttling off (THROTTLE_ENABLED=False).'
+    )
+    
+    def add_arguments(self, parser):
+        parser.add_argument('--url', default='http://127.0.0.1:8000',
+                            help='Base URL of the running server')
+        parser.add_argument('--endpoints', default=','.join(ENDPOINTS),
+                            help='Comma-separated endpoints to drive')
+        parser.add_argument('--concurrency', default='1,8,32',
+                            help='Comma-separated numbers of concurrent clients')
+        parser.add_argument('--duration', type=float, default=10.0,
+                            help='Seconds measured per endpoint and concurrency level')
+        parser.add_argument('--warmup', type=float, default=2.0,
+                            help='Seconds of unmeasured requests before each measurement')
+        parser.add_argument('--users', type=int, default=200,
+                            help='Distinct users the clients act as')
+        parser.add_argument('--output', default='benchmark-report.json',
+                            help='Where to write the JSON report')
+        parser.add_argument('--compare', help='Earlier report to compare against')
+        parser.add_argument('--seed', type=int, default=7)
+    
+    def handle(self, *args, **options):
+        url = urlsplit(options['url'])
+        if url.scheme != 'http':
+            raise CommandError('Only plain http:// URLs are supported')
+        endpoints = [endpoint.strip() for endpoint in options['endpoints'].split(',') if endpoint.strip()]
+        unknown = set(endpoints) - set(ENDPOINTS)
+        if unknown:
+            raise CommandError(f"Unknown endpoint(s): {', '.join(sorted(unknown))}")
+        levels = [int(level) for level in options['concurrency'].split(',')]
+        actors = self.pick_actors(options['users'])
+        
+        results = []
+        for endpoint in endpoints:
+            for concurrency in levels:
+                result = self.run_level(url, endpoint, concurrency, actors, options)
+                results.append(result)
+                self.stdout.write(
+                    f"{endpoint:<15} c={concurrency:<4} {result['throughput']:8.1f} req/s  "
+                    f"p50 {result['p50']:7.2f} ms  p95 {result['p95']:7.2f} ms  "
+                    f"p99 {result['p99']:7.2f} ms  errors {result['errors']}"
+                )
+        
+        report = {'meta': self.describe(options), 'results': results}
+        with open(options['output'], 'w') as output:
+            json.dump(report, output, indent=2)
+        self.stdout.write(self.style.SUCCESS(f"Report written to {options['output']}"))
+        
+        if options['compare']:
+            with open(options['compare']) as baseline:
+                self.compare(json.load(baseline), report)
+    
+    def pick_actors(self, count):
+        """``(user_id, peer_id, token)`` for users of the most recently active conversations"""
+        pairs = []
+        seen = set()
+        for user_low_id, user_high_id in Conversation.objects.order_by('-last_message_at').values_list(
+            'user_low_id', 'user_high_id'
+        )[:count * 4]:
+            for user_id, peer_id in ((user_low_id, user_high_id), (user_high_id, user_low_id)):
+                if user_id not in seen and len(pairs) < count:
+                    seen.add(user_id)
+                    pairs.append((user_id, peer_id))
+        if not pairs:
+            raise CommandError('No conversations found; run generate_dataset first')
+        
+        users = User.objects.in_bulk([user_id for user_id, _ in pairs])
+        return [
+            (user_id, peer_id, str(CustomTokenObtainPairSerializer.get_token(users[user_id]).access_token))
+            for user_id, peer_id in pairs
+        ]
+    
+    def run_level(self, url, endpoint, concurrency, actors, options):
+        """Closed loop: each client sends its next request as soon as the last one returns"""
+        latencies = [[] for _ in range(concurrency)]
+        errors = [0] * concurrency
+        measure_from = time.perf_counter() + options['warmup']
+        stop_at = measure_from + options['duration']
+        
+        def client(index):
+            rng = random.Random(options['seed'] + index)
+            user_id, peer_id, token = actors[index % len(actors)]
+            headers = {'Authorization': f'Bearer {token}', 'Content-Type': 'application/json'}
+            conn = http.client.HTTPConnection(url.hostname, url.port or 80, timeout=30)
+            while True:
+                started = time.perf_counter()
+                if started >= stop_at:
+                    break
+                method, path, body = build_request(endpoint, user_id, peer_id, rng)
+                try:
+                    conn.request(method, url.path.rstrip('/') + path, body=body, headers=headers)
+                    response = conn.getresponse()
+                    response.read()
+                    failed = response.status >= 400
+                except (OSError, http.client.HTTPException):
+                    conn.close()
+                    conn = http.client.HTTPConnection(url.hostname, url.port or 80, timeout=30)
+                    failed = True
+                finished = time.perf_counter()
+                if started >= measure_from:
+                    latencies[index].append((finished - started) * 1000)
+                    errors[index] += failed
+            conn.close()
+        
+        threads = [threading.Thread(target=client, args=(index,)) for index in range(concurrency)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        
+        samples = [latency for client_latencies in latencies for latency in client_latencies]
+        if not samples:
+            raise CommandError(f'No {endpoint} request completed within the measured window')
+        return {
+            'endpoint': endpoint,
+            'concurrency': concurrency,
+            'requests': len(samples),
+            'errors': sum(errors),
+            'throughput': len(samples) / options['duration'],
+            'mean': statistics.mean(samples),
+            'p50': percentile(samples, 0.50),
+            'p95': percentile(samples, 0.95),
+            'p99': percentile(samples, 0.99),
+            'max': max(samples),
+        }
+    
+    def describe(self, options):
+        try:
+            commit = subprocess.run(
+                ['git', 'rev-parse', '--short', 'HEAD'],
+                capture_output=True, text=True, check=True
+            ).stdout.strip()
+        except (OSError, subprocess.CalledProcessError):
+            commit = None
+        return {
+            'timestamp': datetime.now(timezone.utc).isoformat(),
+            'commit': commit,
+            'url': options['url'],
+            'database': connection.vendor,
+            'partitioned': partitions.is_partitioned(),
+            'dataset': {
+                'users': User.objects.count(),
+                'friendships': Friendship.objects.count(),
+                'messages': Message.objects.count(),
+            },
+            'duration': options['duration'],
+            'python': platform.python_version(),
+            'machine': platform.machine(),
+        }
+    
+    def compare(self, baseline, report):
+        before = {(result['endpoint'], result['concurrency']): result for result in baseline['results']}
+        self.stdout.write(
+            f"\nCompared with {baseline['meta'].get('commit') or 'baseline'} "
+            f"({baseline['meta']['timestamp']}):"
+        )
+        for result in report['results']:
+            previous = before.get((result['endpoint'], result['concurrency']))
+            if previous is None:
+                continue
+            changes = '  '.join(
+                f'{key} {(result[key] - previous[key]) / previous[key]:+7.1%}' if previous[key] else f'{key}     n/a'
+                for key in ('throughput', 'p50', 'p95', 'p99')
+            )
+            self.stdout.write(f"{result['endpoint']:<15} c={result['concurrency']:<4} {changes}")
@@ -6,5 +6,5 @@ from .models import FriendRequest
 class FriendRequestAdmin(admin.ModelAdmin):
     list_display = ('sender', 'receiver', 'status', 'created_at')
     list_filter = ('status', 'created_at')
-    search_fields = ('sender__name', 'sender__email', 'receiver__name', 'receiver__email')
+    search_fields = ('sender__full_name', 'sender__email', 'receiver__full_name', 'receiver__email')
     readonly_fields = ('created_at', 'updated_at')
@@ -0,0 +1,161 @@
+import random
+import statistics
+import time
+from array import array
+
+from django.core.management.base import BaseCommand
+
+from friends.suggestions import MAX_FANOUT, POOL_SIZE, rank_candidates, sample_friends
+
+
+class Graph:
+    """Undirected graph in compressed sparse row form (two flat int arrays)"""
+    
+    def __init__(self, user_count, sources, targets):
+        degrees = array('I', bytes(4 * (user_count + 1)))
+        for node in sources:
+            degrees[node] += 1
+        for node in targets:
+            degrees[node] += 1
+        
+        offsets = array('Q', bytes(8 * (user_count + 1)))
+        total = 0
+        for node in range(user_count):
+            offsets[node] = total
+            total += degrees[node]
+        offsets[user_count] = total
+        
+        neighbours = array('I', bytes(4 * total))
+        cursor = array('Q', offsets)
+        for source, target in zip(sources, targets):
+            neighbours[cursor[source]] = target
+            cursor[source] += 1
+            neighbours[cursor[target]] = source
+            cursor[target] += 1
+        
+        self.user_count = user_count
+        self.offsets = offsets
+        self.neighbours = neighbours
+    
+    def friends(self, node):
+        return self.neighbours[self.offsets[node]:self.offsets[node + 1]]
+    
+    def degree(self, node):
+        return self.offsets[node + 1] - self.offsets[node]
+
+
+def preferential_attachment_graph(user_count, edges_per_user, seed):
+    """
+    Barabási–Albert graph: each new user befriends ``edges_per_user`` existing
+    users chosen proportionally to their degree, which yields the heavy-tailed
+    friend counts (a few very popular users) seen in real social graphs.
+    """
+    rng = random.Random(seed)
+    sources = array('I')
+    targets = array('I')
+    # Every edge endpoint, so a uniform pick from it is a degree-weighted pick
+    endpoints = array('I', range(edges_per_user))
+    
+    for node in range(edges_per_user, user_count):
+        chosen = set()
+        while len(chosen) < edges_per_user:
+            chosen.add(endpoints[int(rng.random() * len(endpoints))])
+        for target in chosen:
+            sources.append(node)
+            targets.append(target)
+            endpoints.append(target)
+            endpoints.append(node)
+    return Graph(user_count, sources, targets)
+
+
+def percentile(values, fraction):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(fraction * len(values)))]
+
+
+class Command(BaseCommand):
+    help = (
+        'Benchmark the friends-of-friends ranking on a synthetic graph. Builds a '
+        'preferential-attachment graph in memory, then times top-K computation '
+        'for sampled users, the incremental work done when a friendship changes, '
+        'and extrapolates the cost of a full rebuild.'
+    )
+    
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=1_000_000,
+                            help='Users in the synthetic graph')
+        parser.add_argument('--edges-per-user', type=int, default=10,
+                            help='Friendships each new user creates')
+        parser.add_argument('--sample', type=int, default=2000,
+                            help='Users timed for the top-K computation')
+        parser.add_argument('--changes', type=int, default=200,
+                            help='Friendship changes timed for incremental updates')
+        parser.add_argument('--seed', type=int, default=42)
+    
+    def handle(self, *args, **options):
+        rng = random.Random(options['seed'])
+        
+        started = time.perf_counter()
+        graph = preferential_attachment_graph(options['users'], options['edges_per_user'], options['seed'])
+        build_seconds = time.perf_counter() - started
+        degrees = [graph.degree(node) for node in range(graph.user_count)]
+        self.stdout.write(
+            f'Graph: {graph.user_count:,} users, {len(graph.neighbours) // 2:,} friendships, '
+            f'max degree {max(degrees):,}, built in {build_seconds:.1f}s'
+        )
+        
+        def top_k(node):
+            friend_ids = graph.friends(node)
+            scanned = sample_friends(node, friend_ids)
+            return rank_candidates(
+                node,
+                friend_ids,
+                (candidate for friend in scanned for candidate in graph.friends(friend)),
+                POOL_SIZE
+            )
+        
+        # Per-user top-K for a uniform sample and for the most connected users
+        sample = rng.sample(range(graph.user_count), min(options['sample'], graph.user_count))
+        timings = []
+        for node in sample:
+            started = time.perf_counter()
+            top_k(node)
+            timings.append(time.perf_counter() - started)
+        self.report('Top-K (uniform sample)', timings)
+        
+        hubs = sorted(range(graph.user_count), key=degrees.__getitem__, reverse=True)[:20]
+        hub_timings = []
+        for node in hubs:
+            started = time.perf_counter()
+            top_k(node)
+            hub_timings.append(time.perf_counter() - started)
+        self.report(f'Top-K (20 largest hubs, fan-out capped at {MAX_FANOUT})', hub_timings)
+        
+        # A friendship change: recompute both users, recount one candidate per friend
+        change_timings = []
+        for _ in range(options['changes']):
+            user_id, other_user_id = rng.sample(range(graph.user_count), 2)
+            started = time.perf_counter()
+            top_k(user_id)
+            top_k(other_user_id)
+            for changed_id, candidate_id in ((user_id, other_user_id), (other_user_id, user_id)):
+                candidate_friends = set(graph.friends(candidate_id))
+                for friend in sample_friends(changed_id, graph.friends(changed_id)):
+                    len(candidate_friends.intersection(graph.friends(friend)))
+            change_timings.append(time.perf_counter() - started)
+        self.report('Incremental update per friendship change', change_timings)
+        
+        rebuild_seconds = statistics.mean(timings) * graph.user_count
+        self.stdout.write(self.style.SUCCESS(
+            f'Estimated full rebuild: {rebuild_seconds / 60:.1f} min on one worker process '
+            f'(ranking only, excluding database reads and writes)'
+        ))
+    
+    def report(self, label, timings):
+        milliseconds = [value * 1000 for value in timings]
+        self.stdout.write(
+            f'{label}: p50 {percentile(milliseconds, 0.5):.2f} ms, '
+            f'p95 {percentile(milliseconds, 0.95):.2f} ms, '
+            f'p99 {percentile(milliseconds, 0.99):.2f} ms, '
+            f'max {max(milliseconds):.2f} ms'
+        )
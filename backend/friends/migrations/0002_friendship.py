@@ -0,0 +1,68 @@
+# Generated by Django 4.2.7 on 2026-10-18 13:29
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def backfill_friendships(apps, schema_editor):
+    """Create one canonical edge per pair with an accepted request in either direction"""
+    FriendRequest = apps.get_model('friends', 'FriendRequest')
+    Friendship = apps.get_model('friends', 'Friendship')
+    
+    batch_size = 5000
+    last_id = 0
+    while True:
+        rows = list(
+            FriendRequest.objects.filter(id__gt=last_id, status='accepted')
+            .order_by('id')
+            .values_list('id', 'sender_id', 'receiver_id')[:batch_size]
+        )
+        if not rows:
+            break
+        last_id = rows[-1][0]
+        
+        pairs = {
+            tuple(sorted((sender_id, receiver_id)))
+            for _, sender_id, receiver_id in rows
+            if sender_id != receiver_id
+        }
+        Friendship.objects.bulk_create(
+            [Friendship(user_low_id=low, user_high_id=high) for low, high in pairs],
+            ignore_conflicts=True
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('friends', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Friendship',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('created_at', models.DateTimeField(auto_now_add=True, verbose_name='Created At')),
+                ('user_high', models.ForeignKey(help_text='Friend with the higher user id', on_delete=django.db.models.deletion.CASCADE, related_name='+', to=settings.AUTH_USER_MODEL, verbose_name='User (higher id)')),
+                ('user_low', models.ForeignKey(help_text='Friend with the lower user id', on_delete=django.db.models.deletion.CASCADE, related_name='+', to=settings.AUTH_USER_MODEL, verbose_name='User (lower id)')),
+            ],
+            options={
+                'verbose_name': 'Friendship',
+                'verbose_name_plural': 'Friendships',
+                'db_table': 'friendships',
+                'indexes': [models.Index(fields=['user_high', 'user_low'], name='friendships_user_hi_47fb51_idx')],
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='friendship',
+            constraint=models.CheckConstraint(check=models.Q(('user_low__lt', models.F('user_high'))), name='friendships_canonical_order'),
+        ),
+        migrations.AlterUniqueTogether(
+            name='friendship',
+            unique_together={('user_low', 'user_high')},
+        ),
+        migrations.RunPython(backfill_friendships, migrations.RunPython.noop),
+    ]
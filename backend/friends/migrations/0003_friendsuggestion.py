@@ -0,0 +1,29 @@
+# Generated by Django 4.2.7 on 2026-10-18 13:32
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('friends', '0002_friendship'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='FriendSuggestion',
+            fields=[
+                ('user', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='friend_suggestion', serialize=False, to=settings.AUTH_USER_MODEL, verbose_name='User')),
+                ('candidates', models.JSONField(default=list, help_text='Top-K [user_id, mutual_friend_count] pairs, best first', verbose_name='Candidates')),
+                ('computed_at', models.DateTimeField(auto_now=True, verbose_name='Computed At')),
+            ],
+            options={
+                'verbose_name': 'Friend Suggestion',
+                'verbose_name_plural': 'Friend Suggestions',
+                'db_table': 'friend_suggestions',
+            },
+        ),
+    ]
@@ -1,10 +1,54 @@
-from django.db import models
+from django.db import models, transaction
+from django.db.models import Exists, OuterRef, Q
 from django.contrib.auth import get_user_model
 from django.core.exceptions import ValidationError
 
 User = get_user_model()
 
 
+class FriendRequestQuerySet(models.QuerySet):
+    """
+    Bulk writes that keep ``Friendship`` in sync like ``FriendRequest.save``/``delete``.
+    
+    ``update``, ``delete`` and ``bulk_create`` bypass the model methods (the
+    admin's "delete selected" action is a queryset ``delete``, and
+    ``bulk_update`` goes through ``update``), so they re-derive the edge of
+    every pair they touched, before and after the write.
+    """
+    
+    def delete(self):
+        with transaction.atomic():
+            pairs = set(self.values_list('sender_id', 'receiver_id'))
+            result = super().delete()
+            self.resync(pairs)
+        return result
+    
+    def update(self, **kwargs):
+        with transaction.atomic():
+            rows = list(self.values_list('pk', 'sender_id', 'receiver_id'))
+            result = super().update(**kwargs)
+            pairs = {(sender_id, receiver_id) for _, sender_id, receiver_id in rows}
+            if kwargs.keys() & {'sender', 'sender_id', 'receiver', 'receiver_id'}:
+                pairs.update(self.model.objects.filter(pk__in=[row[0] for row in rows])
+                             .values_list('sender_id', 'receiver_id'))
+            self.resync(pairs)
+        return result
+    
+    def bulk_create(self, objs, *args, **kwargs):
+        with transaction.atomic():
+            created = super().bulk_create(objs, *args, **kwargs)
+            self.resync({(obj.sender_id, obj.receiver_id) for obj in created})
+        return created
+    
+    @staticmethod
+    def resync(pairs):
+        """Re-derive the edge of each (sender id, receiver id) pair and invalidate both users' friend lists"""
+        from social_messenger import etags
+        for sender_id, receiver_id in {tuple(sorted(pair)) for pair in pairs}:
+            Friendship.objects.sync_pair(sender_id, receiver_id)
+        etags.bump('friends', {user_id for pair in pairs for user_id in pair})
+
+
 class FriendRequest(models.Model):
     """Model representing a friend request between users"""
     
@@ -50,6 +94,8 @@ class FriendRequest(models.Model):
         verbose_name='Updated At'
     )
     
+    objects = FriendRequestQuerySet.as_manager()
+    
     class Meta:
         db_table = 'friend_requests'
         verbose_name = 'Friend Request'
@@ -71,4 +117,134 @@ class FriendRequest(models.Model):
     
     def save(self, *args, **kwargs):
         self.clean()
-        super().save(*args, **kwargs)
+        with transaction.atomic():
+            super().save(*args, **kwargs)
+            FriendRequestQuerySet.resync([(self.sender_id, self.receiver_id)])
+    
+    def delete(self, *args, **kwargs):
+        with transaction.atomic():
+            result = super().delete(*args, **kwargs)
+            FriendRequestQuerySet.resync([(self.sender_id, self.receiver_id)])
+        return result
+
+
+class FriendshipManager(models.Manager):
+    """Set-based friend lookups over the canonical Friendship edges"""
+    
+    def between(self, user_id, other_user_id):
+        user_low_id, user_high_id = sorted((user_id, other_user_id))
+        return self.filter(user_low_id=user_low_id, user_high_id=user_high_id)
+    
+    def are_friends(self, user_id, other_user_id):
+        return self.between(user_id, other_user_id).exists()
+    
+    def friends_q(self, user_id, field='pk'):
+        """
+        Q matching rows whose ``field`` is a friend of the user.
+        
+        Each branch is an EXISTS probe on a unique index, so ``filter()`` with it
+        is a semi-join and ``exclude()`` an anti-join, both in a single query.
+        """
+        return Q(Exists(self.filter(user_low_id=user_id, user_high_id=OuterRef(field)))) | Q(
+            Exists(self.filter(user_high_id=user_id, user_low_id=OuterRef(field)))
+        )
+    
+    def sync_pair(self, user_id, other_user_id):
+        """Create or remove the edge so it matches the pair's accepted friend requests"""
+        if user_id == other_user_id:
+            return
+        accepted = FriendRequest.objects.filter(
+            Q(sender_id=user_id, receiver_id=other_user_id) |
+            Q(sender_id=other_user_id, receiver_id=user_id),
+            status=FriendRequest.RequestStatus.ACCEPTED
+        ).exists()
+        user_low_id, user_high_id = sorted((user_id, other_user_id))
+        if accepted:
+            _, changed = self.get_or_create(user_low_id=user_low_id, user_high_id=user_high_id)
+        else:
+            changed = self.between(user_id, other_user_id).delete()[0] > 0
+        if changed:
+            from .tasks import refresh_suggestions_for_pair
+            transaction.on_commit(lambda: refresh_suggestions_for_pair.delay(user_low_id, user_high_id))
+
+
+class Friendship(models.Model):
+    """
+    Canonical friendship edge with one row per pair of friends.
+    
+    Derived from accepted ``FriendRequest`` rows in either direction and kept
+    in sync by ``FriendRequest.save``/``delete`` and the bulk writes of
+    ``FriendRequestQuerySet``. The pair is stored with the
+    lower user id first, so every friend check is a single unique-index lookup.
+    """
+    user_low = models.ForeignKey(
+        'accounts.User',
+        on_delete=models.CASCADE,
+        related_name='+',
+        verbose_name='User (lower id)',
+        help_text='Friend with the lower user id'
+    )
+    user_high = models.ForeignKey(
+        'accounts.User',
+        on_delete=models.CASCADE,
+        related_name='+',
+        verbose_name='User (higher id)',
+        help_text='Friend with the higher user id'
+    )
+    created_at = models.DateTimeField(
+        auto_now_add=True,
+        verbose_name='Created At'
+    )
+    
+    objects = FriendshipManager()
+    
+    class Meta:
+        db_table = 'friendships'
+        verbose_name = 'Friendship'
+        verbose_name_plural = 'Friendships'
+        unique_together = ['user_low', 'user_high']
+        indexes = [
+            models.Index(fields=['user_high', 'user_low']),
+        ]
+        constraints = [
+            models.CheckConstraint(
+                check=models.Q(user_low__lt=models.F('user_high')),
+                name='friendships_canonical_order'
+            ),
+        ]
+    
+    def __str__(self):
+        return f"Friendship {self.user_low_id} <-> {self.user_high_id}"
+
+
+class FriendSuggestion(models.Model):
+    """
+    Precomputed friends-of-friends suggestions for one user.
+    
+    ``candidates`` is a bounded list of ``[user_id, mutual_friend_count]``
+    pairs, best first, so serving suggestions is a single primary-key read.
+    """
+    user = models.OneToOneField(
+        'accounts.User',
+        on_delete=models.CASCADE,
+        primary_key=True,
+        related_name='friend_suggestion',
+        verbose_name='User'
+    )
+    candidates = models.JSONField(
+        default=list,
+        verbose_name='Candidates',
+        help_text='Top-K [user_id, mutual_friend_count] pairs, best first'
+    )
+    computed_at = models.DateTimeField(
+        auto_now=True,
+        verbose_name='Computed At'
+    )
+    
+    class Meta:
+        db_table = 'friend_suggestions'
+        verbose_name = 'Friend Suggestion'
+        verbose_name_plural = 'Friend Suggestions'
+    
+    def __str__(self):
+        return f"{len(self.candidates)} suggestion(s) for user {self.user_id}"
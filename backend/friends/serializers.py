@@ -1,6 +1,8 @@
 from rest_framework import serializers
 from django.contrib.auth import get_user_model
-from .models import FriendRequest
+from notifications.pipeline import notify_on_commit
+from social_messenger.renderers import format_datetime
+from .models import FriendRequest, Friendship
 
 User = get_user_model()
 
@@ -21,6 +23,33 @@ class FriendRequestSerializer(serializers.ModelSerializer):
         read_only_fields = ('id', 'created_at', 'updated_at')
 
 
+# Columns of ``FriendRequestSerializer``, with both users joined in
+FRIEND_REQUEST_ROW_FIELDS = (
+    'id', 'status', 'created_at', 'updated_at',
+    'sender_id', 'sender__full_name', 'sender__email', 'sender__profile_picture',
+    'receiver_id', 'receiver__full_name', 'receiver__email', 'receiver__profile_picture',
+)
+
+
+def format_friend_request_rows(rows):
+    """``FriendRequestSerializer(many=True).data`` for ``values_list(*FRIEND_REQUEST_ROW_FIELDS)`` rows"""
+    return [
+        {
+            'id': request_id,
+            'sender': {'id': sender_id, 'name': sender_name, 'email': sender_email, 'image': sender_image},
+            'receiver': {'id': receiver_id, 'name': receiver_name, 'email': receiver_email, 'image': receiver_image},
+            'status': status,
+            'created_at': format_datetime(created_at),
+            'updated_at': format_datetime(updated_at),
+        }
+        for (
+            request_id, status, created_at, updated_at,
+            sender_id, sender_name, sender_email, sender_image,
+            receiver_id, receiver_name, receiver_email, receiver_image,
+        ) in rows
+    ]
+
+
 class FriendRequestCreateSerializer(serializers.ModelSerializer):
     class Meta:
         model = FriendRequest
@@ -30,6 +59,9 @@ class FriendRequestCreateSerializer(serializers.ModelSerializer):
         sender = self.context['request'].user
         receiver = validated_data['receiver']
         
+        if Friendship.objects.are_friends(sender.id, receiver.id):
+            raise serializers.ValidationError('You are already friends')
+        
         # Check if request already exists
         existing_request = FriendRequest.objects.filter(
             sender=sender, 
@@ -42,7 +74,9 @@ class FriendRequestCreateSerializer(serializers.ModelSerializer):
             elif existing_request.status == 'accepted':
                 raise serializers.ValidationError('You are already friends')
         
-        return FriendRequest.objects.create(sender=sender, **validated_data)
+        friend_request = FriendRequest.objects.create(sender=sender, **validated_data)
+        notify_on_commit(receiver.id)
+        return friend_request
 
 
 class FriendRequestActionSerializer(serializers.Serializer):
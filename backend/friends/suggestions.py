@@ -0,0 +1,199 @@
+"""
+Friends-of-friends suggestions ranked by mutual-friend count.
+
+Each user's best candidates are precomputed into a bounded ``FriendSuggestion``
+row. A friendship change refreshes the two users involved and adjusts the one
+affected candidate in the rows of their friends; a periodic full rebuild
+(``friends.tasks.rebuild_all_suggestions``) corrects whatever the bounded
+lists could not track incrementally.
+"""
+import heapq
+import random
+from collections import Counter
+
+from django.db import transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from .models import FriendSuggestion, Friendship
+
+# Suggestions served per request
+SUGGESTION_LIMIT = 20
+# Candidates stored per user; the slack absorbs removals between rebuilds
+POOL_SIZE = 50
+# Friends scanned per user; larger friend lists are sampled
+MAX_FANOUT = 500
+# Ids per IN (...) clause when reading friend lists in bulk
+QUERY_CHUNK_SIZE = 1000
+
+
+def rank_candidates(user_id, friend_ids, friends_of_friends, limit=POOL_SIZE):
+    """
+    Rank non-friends by how many of the user's friends they are connected to.
+    
+    ``friends_of_friends`` yields one id per edge leaving the scanned friends,
+    so the same ranking runs over database rows and in-memory graphs.
+    Returns up to ``limit`` ``[candidate_id, mutual_count]`` pairs, best first.
+    """
+    excluded = set(friend_ids)
+    excluded.add(user_id)
+    counts = Counter(candidate for candidate in friends_of_friends if candidate not in excluded)
+    best = heapq.nsmallest(limit, counts.items(), key=lambda item: (-item[1], item[0]))
+    return [[candidate, count] for candidate, count in best]
+
+
+def sample_friends(user_id, friend_ids):
+    """Cap the fan-out for very well connected users with a stable sample"""
+    friend_ids = sorted(friend_ids)
+    if len(friend_ids) <= MAX_FANOUT:
+        return friend_ids
+    return random.Random(user_id).sample(friend_ids, MAX_FANOUT)
+
+
+def get_friend_ids(user_id):
+    return set(
+        Friendship.objects.filter(user_low_id=user_id).values_list('user_high_id', flat=True)
+    ) | set(
+        Friendship.objects.filter(user_high_id=user_id).values_list('user_low_id', flat=True)
+    )
+
+
+def iter_friends_of(user_ids):
+    """Yield the friend ids of every user in ``user_ids``, one per edge"""
+    user_ids = list(user_ids)
+    for start in range(0, len(user_ids), QUERY_CHUNK_SIZE):
+        chunk = user_ids[start:start + QUERY_CHUNK_SIZE]
+        yield from Friendship.objects.filter(user_low_id__in=chunk).values_list(
+            'user_high_id', flat=True
+        ).iterator()
+        yield from Friendship.objects.filter(user_high_id__in=chunk).values_list(
+            'user_low_id', flat=True
+        ).iterator()
+
+
+def compute_suggestions(user_id):
+    friend_ids = get_friend_ids(user_id)
+    return rank_candidates(
+        user_id,
+        friend_ids,
+        iter_friends_of(sample_friends(user_id, friend_ids))
+    )
+
+
+def refresh_user(user_id):
+    """Recompute and store one user's suggestions"""
+    candidates = compute_suggestions(user_id)
+    FriendSuggestion.objects.update_or_create(user_id=user_id, defaults={'candidates': candidates})
+    return candidates
+
+
+def iter_friend_edges(user_ids):
+    """Yield ``(user_id, friend_id)`` for every friend of the users in ``user_ids``, one query per chunk"""
+    user_ids = list(user_ids)
+    for start in range(0, len(user_ids), QUERY_CHUNK_SIZE):
+        chunk = set(user_ids[start:start + QUERY_CHUNK_SIZE])
+        edges = Friendship.objects.filter(Q(user_low_id__in=chunk) | Q(user_high_id__in=chunk)).values_list(
+            'user_low_id', 'user_high_id'
+        )
+        for user_low_id, user_high_id in edges.iterator():
+            if user_low_id in chunk:
+                yield user_low_id, user_high_id
+            if user_high_id in chunk:
+                yield user_high_id, user_low_id
+
+
+def patch_candidate(candidates, candidate_id, mutual_count):
+    """``candidates`` with one candidate's mutual count set, kept sorted and bounded"""
+    candidates = [entry for entry in candidates if entry[0] != candidate_id]
+    if mutual_count > 0:
+        candidates.append([candidate_id, mutual_count])
+        candidates.sort(key=lambda entry: (-entry[1], entry[0]))
+        candidates = candidates[:POOL_SIZE]
+    return candidates
+
+
+def apply_friendship_change(user_id, other_user_id):
+    """
+    Refresh suggestions after the two users became friends or stopped being friends.
+    
+    Both users are recomputed. For each (sampled) friend of one side, only
+    the other side's mutual count can have changed, so that single entry is
+    recounted and patched into their stored list; friends without a stored
+    list get a full one on first use. The friend lists of both users and
+    then of all their sampled friends are each read in one pass, and the
+    stored lists are locked, updated and written in bulk, so the number of
+    queries does not grow with the number of friends.
+    """
+    pair = (user_id, other_user_id)
+    friend_ids = {user_id: set(), other_user_id: set()}
+    for owner_id, friend_id in iter_friend_edges(pair):
+        friend_ids[owner_id].add(friend_id)
+    sampled = {owner_id: set(sample_friends(owner_id, friend_ids[owner_id])) for owner_id in pair}
+    
+    # Friends of the sampled friends: the edges both rankings count, and
+    # each friend's link to and mutual friends with the other side
+    friends_of = {owner_id: [] for owner_id in pair}
+    mutual_counts = {owner_id: Counter() for owner_id in pair}
+    linked = {owner_id: set() for owner_id in pair}
+    for friend_id, friend_of_friend_id in iter_friend_edges(sampled[user_id] | sampled[other_user_id]):
+        for changed_id, candidate_id in (pair, pair[::-1]):
+            if friend_id not in sampled[changed_id]:
+                continue
+            friends_of[changed_id].append(friend_of_friend_id)
+            if friend_of_friend_id == candidate_id:
+                linked[changed_id].add(friend_id)
+            elif friend_of_friend_id in friend_ids[candidate_id]:
+                mutual_counts[changed_id][friend_id] += 1
+    
+    now = timezone.now()
+    with transaction.atomic():
+        stored = FriendSuggestion.objects.select_for_update().in_bulk(
+            {*pair, *sampled[user_id], *sampled[other_user_id]}
+        )
+        changed = {}
+        for changed_id, candidate_id in (pair, pair[::-1]):
+            for friend_id in sampled[changed_id] - {candidate_id}:
+                suggestion = changed.get(friend_id, stored.get(friend_id))
+                if suggestion is None:
+                    continue
+                mutual_count = 0 if friend_id in linked[changed_id] else mutual_counts[changed_id][friend_id]
+                candidates = patch_candidate(suggestion.candidates, candidate_id, mutual_count)
+                if candidates != suggestion.candidates:
+                    suggestion.candidates = candidates
+                    suggestion.computed_at = now
+                    changed[friend_id] = suggestion
+        FriendSuggestion.objects.bulk_update(changed.values(), ['candidates', 'computed_at'])
+        FriendSuggestion.objects.bulk_create(
+            [
+                FriendSuggestion(
+                    user_id=owner_id,
+                    candidates=rank_candidates(owner_id, friend_ids[owner_id], friends_of[owner_id]),
+                    computed_at=now
+                )
+                for owner_id in pair
+            ],
+            update_conflicts=True,
+            unique_fields=['user'],
+            update_fields=['candidates', 'computed_at']
+        )
+
+
+def get_suggestions(user_id, limit=SUGGESTION_LIMIT):
+    """
+    Return ``(user, mutual_count)`` pairs for the suggestion endpoint.
+    
+    Reads the stored list (computing it on first use) and drops candidates
+    who became friends since it was built.
+    """
+    from django.contrib.auth import get_user_model
+    User = get_user_model()
+    
+    suggestion = FriendSuggestion.objects.filter(user_id=user_id).first()
+    candidates = suggestion.candidates if suggestion else refresh_user(user_id)
+    
+    counts = dict((candidate_id, count) for candidate_id, count in candidates)
+    users = User.objects.filter(id__in=list(counts)).exclude(id=user_id).exclude(
+        Friendship.objects.friends_q(user_id)
+    )
+    ranked = sorted(users, key=lambda user: (-counts[user.id], user.id))
+    return [(user, counts[user.id]) for user in ranked[:limit]]
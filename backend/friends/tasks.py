@@ -0,0 +1,39 @@
+from celery import shared_task
+from django.contrib.auth import get_user_model
+
+from . import suggestions
+from .models import FriendSuggestion
+
+User = get_user_model()
+
+
+@shared_task
+def refresh_suggestions_for_pair(user_id, other_user_id):
+    """Incrementally update suggestions after a friendship was created or removed"""
+    suggestions.apply_friendship_change(user_id, other_user_id)
+
+
+@shared_task
+def rebuild_all_suggestions(chunk_size=1000):
+    """Recompute every user's suggestions, writing one chunk of users at a time"""
+    last_id = 0
+    rebuilt = 0
+    while True:
+        user_ids = list(
+            User.objects.filter(id__gt=last_id).order_by('id').values_list('id', flat=True)[:chunk_size]
+        )
+        if not user_ids:
+            break
+        rows = [
+            FriendSuggestion(user_id=user_id, candidates=suggestions.compute_suggestions(user_id))
+            for user_id in user_ids
+        ]
+        FriendSuggestion.objects.bulk_create(
+            rows,
+            update_conflicts=True,
+            unique_fields=['user'],
+            update_fields=['candidates', 'computed_at']
+        )
+        rebuilt += len(rows)
+        last_id = user_ids[-1]
+    return rebuilt
@@ -4,11 +4,15 @@ from rest_framework.permissions import IsAuthenticated
 from rest_framework.response import Response
 from django.contrib.auth import get_user_model
 from django.db.models import Q
+from social_messenger.etags import conditional_get
 from .models import FriendRequest
+from .suggestions import get_friend_ids
 from .serializers import (
+    FRIEND_REQUEST_ROW_FIELDS,
     FriendRequestSerializer,
     FriendRequestCreateSerializer,
-    FriendRequestActionSerializer
+    FriendRequestActionSerializer,
+    format_friend_request_rows
 )
 
 User = get_user_model()
@@ -18,6 +22,10 @@ class FriendRequestViewSet(viewsets.ModelViewSet):
     """ViewSet for friend request operations"""
     serializer_class = FriendRequestSerializer
     permission_classes = [IsAuthenticated]
+    # Read-only actions that only need the user id (see AUTH_CLAIMS_USER_READS)
+    claims_user_actions = ('friends_list', 'presence')
+    # Separate rate limits (see social_messenger.throttling)
+    throttle_scopes = {'create': 'friend_request'}
     
     def get_queryset(self):
         """Filter friend requests based on current user"""
@@ -26,6 +34,14 @@ class FriendRequestViewSet(viewsets.ModelViewSet):
             Q(sender=current_user) | Q(receiver=current_user)
         ).select_related('sender', 'receiver')
     
+    def list(self, request, *args, **kwargs):
+        """The current user's sent and received requests, read as plain rows"""
+        queryset = self.filter_queryset(self.get_queryset()).values_list(*FRIEND_REQUEST_ROW_FIELDS)
+        page = self.paginate_queryset(queryset)
+        if page is not None:
+            return self.get_paginated_response(format_friend_request_rows(page))
+        return Response(format_friend_request_rows(queryset))
+    
     def create(self, request, *args, **kwargs):
         """Send a friend request"""
         serializer = FriendRequestCreateSerializer(
@@ -48,48 +64,39 @@ class FriendRequestViewSet(viewsets.ModelViewSet):
             )
     
     @action(detail=False, methods=['get'], url_path='friends/(?P<user_id>[^/.]+)')
+    @conditional_get(lambda request, user_id: [('friends', int(user_id))])
     def friends_list(self, request, user_id=None):
         """Get friends and pending requests for a user"""
         try:
             user = User.objects.get(id=user_id)
             
-            # Get accepted friend requests
-            sent_requests = FriendRequest.objects.filter(
-                sender=user,
-                status='accepted'
-            ).select_related('receiver')
-            
-            received_requests = FriendRequest.objects.filter(
-                receiver=user,
-                status='accepted'
-            ).select_related('sender')
+            from accounts.serializers import USER_ROW_FIELDS, format_user_rows
             
-            # Combine friends
-            friends = []
-            for request in sent_requests:
-                friends.append(request.receiver)
-            for request in received_requests:
-                friends.append(request.sender)
+            # Friends the user sent the request to, then those who sent it, each newest
+            # first and in request order among equal timestamps, as the lists always were
+            accepted = FriendRequest.objects.filter(status='accepted').order_by('-created_at', 'id')
+            friends = [
+                *accepted.filter(sender=user).values_list(*(f'receiver__{field}' for field in USER_ROW_FIELDS)),
+                *accepted.filter(receiver=user).values_list(*(f'sender__{field}' for field in USER_ROW_FIELDS)),
+            ]
             
             # Get pending requests
             pending_requests = FriendRequest.objects.filter(
                 receiver=user,
                 status='pending'
-            ).select_related('sender')
-            
-            from accounts.serializers import UserSerializer
+            ).values_list('id', 'sender_id', 'sender__full_name', 'sender__email', 'sender__profile_picture')
             
             return Response({
-                'friends': UserSerializer(friends, many=True).data,
+                'friends': format_user_rows(friends),
                 'pendingRequests': [
                     {
-                        'requestId': req.id,
-                        'senderId': req.sender.id,
-                        'name': req.sender.name,
-                        'email': req.sender.email,
-                        'image': req.sender.image
+                        'requestId': request_id,
+                        'senderId': sender_id,
+                        'name': name,
+                        'email': email,
+                        'image': image
                     }
-                    for req in pending_requests
+                    for request_id, sender_id, name, email, image in pending_requests
                 ]
             })
         except User.DoesNotExist:
@@ -98,6 +105,14 @@ class FriendRequestViewSet(viewsets.ModelViewSet):
                 status=status.HTTP_404_NOT_FOUND
             )
     
+    @action(detail=False, methods=['get'], url_path='presence')
+    def presence(self, request):
+        """Online state, last seen and typing of the current user's friends"""
+        from messaging import presence
+        
+        friend_ids = sorted(get_friend_ids(request.user.id))
+        return Response({'presence': presence.get_presence(friend_ids, request.user.id)})
+    
     @action(detail=False, methods=['post'], url_path='accept')
     def accept_friend_request(self, request):
         """Accept a friend request"""
@@ -1,5 +1,10 @@
 from django.contrib import admin
-from .models import Message
+from django.contrib.auth import get_user_model
+from django.db import connection
+from .models import ArchiveChunk, AttachmentBlob, AttachmentUpload, Conversation, GroupConversation, GroupMember, GroupMessage, Message
+from .search import SEARCH_CONFIG
+
+User = get_user_model()
 
 
 @admin.register(Message)
@@ -9,3 +14,80 @@ class MessageAdmin(admin.ModelAdmin):
     search_fields = ('sender__full_name', 'recipient__full_name', 'content')
     readonly_fields = ('created_at', 'updated_at')
     ordering = ('-created_at',)
+    
+    def get_search_results(self, request, queryset, search_term):
+        """
+        Avoid a LIKE scan over every message on PostgreSQL.
+        
+        Content is matched through the full-text index and names through the
+        users table, so each branch is an index lookup on messages.
+        """
+        if not search_term or connection.vendor != 'postgresql':
+            return super().get_search_results(request, queryset, search_term)
+        users = User.objects.filter(full_name__icontains=search_term).values('id')
+        matches = Message.objects.filter(sender__in=users).values('id').order_by().union(
+            Message.objects.filter(recipient__in=users).values('id').order_by(),
+            Message.objects.extra(
+                where=[f"search_vector @@ websearch_to_tsquery('{SEARCH_CONFIG}', %s)"],
+                params=[search_term]
+            ).values('id').order_by()
+        )
+        return queryset.filter(id__in=matches), False
+
+
+@admin.register(Conversation)
+class ConversationAdmin(admin.ModelAdmin):
+    list_display = ('user_low', 'user_high', 'last_message_at', 'unread_count_low', 'unread_count_high')
+    raw_id_fields = ('user_low', 'user_high')
+    readonly_fields = ('updated_at',)
+    ordering = ('-last_message_at',)
+
+
+@admin.register(ArchiveChunk)
+class ArchiveChunkAdmin(admin.ModelAdmin):
+    list_display = ('user_low', 'user_high', 'first_created_at', 'last_created_at', 'message_count', 'stored_size')
+    raw_id_fields = ('user_low', 'user_high')
+    readonly_fields = [field.name for field in ArchiveChunk._meta.fields]
+    ordering = ('-id',)
+
+
+@admin.register(AttachmentBlob)
+class AttachmentBlobAdmin(admin.ModelAdmin):
+    list_display = ('sha256', 'size', 'status', 'ref_count', 'created_at')
+    list_filter = ('status',)
+    search_fields = ('sha256',)
+    readonly_fields = ('sha256', 'ref_count', 'created_at', 'updated_at')
+    ordering = ('-created_at',)
+
+
+@admin.register(AttachmentUpload)
+class AttachmentUploadAdmin(admin.ModelAdmin):
+    list_display = ('filename', 'owner', 'size', 'received', 'status', 'message_id', 'created_at')
+    list_filter = ('status',)
+    raw_id_fields = ('owner', 'blob')
+    readonly_fields = ('created_at', 'updated_at')
+    ordering = ('-created_at',)
+
+
+@admin.register(GroupConversation)
+class GroupConversationAdmin(admin.ModelAdmin):
+    list_display = ('name', 'member_count', 'last_seq', 'last_message_at')
+    search_fields = ('name',)
+    raw_id_fields = ('created_by',)
+    readonly_fields = ('last_seq', 'member_count', 'created_at', 'updated_at')
+    ordering = ('-last_message_at',)
+
+
+@admin.register(GroupMessage)
+class GroupMessageAdmin(admin.ModelAdmin):
+    list_display = ('group', 'seq', 'sender', 'message_type', 'created_at')
+    raw_id_fields = ('group', 'sender')
+    readonly_fields = ('seq', 'created_at')
+    ordering = ('-id',)
+
+
+@admin.register(GroupMember)
+class GroupMemberAdmin(admin.ModelAdmin):
+    list_display = ('group', 'user', 'role', 'last_read_seq', 'joined_at')
+    list_filter = ('role',)
+    raw_id_fields = ('group', 'user')
@@ -0,0 +1,239 @@
+"""
+Cold storage for old one-to-one messages.
+
+Messages older than ``MESSAGE_ARCHIVE_AFTER_DAYS`` are moved, one
+conversation at a time, out of the ``messages`` table into gzip-compressed
+JSON chunks of ``MESSAGE_ARCHIVE_CHUNK_SIZE`` messages in the
+``message_archive`` storage (a local directory, or an S3-compatible bucket).
+Each chunk gets an ``ArchiveChunk`` row with its first and last
+(created_at, id) positions; that small index is all a history page needs
+to find the chunks behind a cursor.
+
+Archived messages are always the oldest part of a conversation, so paging
+backwards reads hot rows until they run out and then continues into the
+chunks, newest first, decompressing only the ones the page reaches. Unread
+messages are never archived, and neither is anything newer than them, so
+read state and unread counters only ever concern hot rows.
+
+Archived messages are read-only: they no longer appear in search or sync,
+and deleting them is not supported.
+"""
+import gzip
+import heapq
+import json
+from functools import lru_cache
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.files.base import ContentFile
+from django.core.files.storage import storages
+from django.db import transaction
+from django.db.models import Q
+from django.utils.dateparse import parse_datetime
+
+from social_messenger import etags
+
+from .models import ArchiveChunk, Conversation, Message
+
+User = get_user_model()
+
+FIELDS = (
+    'id', 'sender_id', 'recipient_id', 'message_type', 'content', 'attachment_url',
+    'is_read', 'read_at', 'created_at', 'updated_at',
+)
+DATETIME_FIELDS = ('read_at', 'created_at', 'updated_at')
+
+
+def get_storage():
+    return storages['message_archive']
+
+
+def encode_chunk(rows):
+    """``(raw_size, compressed bytes)`` for message rows given as dicts of ``FIELDS``"""
+    raw = json.dumps(
+        {'fields': FIELDS, 'rows': [[row[field] for field in FIELDS] for row in rows]},
+        # Full isoformat: cursors compare exact microseconds
+        default=lambda value: value.isoformat(),
+        separators=(',', ':')
+    ).encode()
+    return len(raw), gzip.compress(raw)
+
+
+@lru_cache(maxsize=64)
+def load_chunk(storage_key):
+    """Decompressed rows of a chunk, oldest first; chunks never change, so they are cached per process"""
+    with get_storage().open(storage_key, 'rb') as chunk_file:
+        data = json.loads(gzip.decompress(chunk_file.read()))
+    rows = []
+    for values in data['rows']:
+        row = dict(zip(data['fields'], values))
+        for field in DATETIME_FIELDS:
+            if row[field] is not None:
+                row[field] = parse_datetime(row[field])
+        rows.append(row)
+    return tuple(rows)
+
+
+def archive_conversation(user_id, other_user_id, cutoff, chunk_size=None):
+    """
+    Move the conversation's messages created before ``cutoff`` into chunks.
+    
+    Each chunk is written, indexed and its rows deleted in one transaction
+    that holds locks on those rows, so a message deleted meanwhile is
+    never archived. Returns the new ``ArchiveChunk`` rows.
+    """
+    chunk_size = chunk_size or settings.MESSAGE_ARCHIVE_CHUNK_SIZE
+    user_low_id, user_high_id = Conversation.canonical_pair(user_id, other_user_id)
+    directions = ((user_low_id, user_high_id), (user_high_id, user_low_id))
+    
+    oldest_unread = min(
+        (
+            created_at for created_at in (
+                Message.objects.filter(sender_id=sender_id, recipient_id=recipient_id, is_read=False)
+                .order_by('created_at').values_list('created_at', flat=True).first()
+                for sender_id, recipient_id in directions
+            )
+            if created_at is not None
+        ),
+        default=None
+    )
+    if oldest_unread is not None:
+        cutoff = min(cutoff, oldest_unread)
+    
+    chunks = []
+    while True:
+        with transaction.atomic():
+            branches = [
+                Message.objects.select_for_update()
+                .filter(sender_id=sender_id, recipient_id=recipient_id, created_at__lt=cutoff)
+                .order_by('created_at', 'id').values(*FIELDS)[:chunk_size]
+                for sender_id, recipient_id in directions
+            ]
+            rows = list(heapq.merge(*branches, key=lambda row: (row['created_at'], row['id'])))[:chunk_size]
+            if not rows:
+                break
+            chunks.append(write_chunk(user_low_id, user_high_id, rows))
+    return chunks
+
+
+def write_chunk(user_low_id, user_high_id, rows):
+    """Store ``rows`` as one chunk and delete them from ``messages``; call inside a transaction"""
+    first, last = rows[0], rows[-1]
+    raw_size, data = encode_chunk(rows)
+    storage = get_storage()
+    storage_key = storage.save(f"{user_low_id}-{user_high_id}/{first['id']}-{last['id']}.json.gz", ContentFile(data))
+    try:
+        chunk = ArchiveChunk.objects.create(
+            user_low_id=user_low_id,
+            user_high_id=user_high_id,
+            first_message_id=first['id'],
+            first_created_at=first['created_at'],
+            last_message_id=last['id'],
+            last_created_at=last['created_at'],
+            message_count=len(rows),
+            raw_size=raw_size,
+            stored_size=len(data),
+            storage_key=storage_key
+        )
+        deleted = Message.objects.filter(
+            id__in=[row['id'] for row in rows],
+            created_at__range=(first['created_at'], last['created_at'])
+        ).delete()[0]
+        if deleted != len(rows):
+            raise RuntimeError(f'Archived {len(rows)} messages but deleted {deleted}; rolling back')
+        # The legacy full chat list only shows hot messages
+        etags.bump('messages', (user_low_id, user_high_id))
+    except Exception:
+        storage.delete(storage_key)
+        raise
+    return chunk
+
+
+def archive_cold_messages(cutoff, chunk_size=None, batch_size=1000):
+    """
+    Archive every conversation's messages created before ``cutoff``.
+    
+    Conversations are walked in id order, ``batch_size`` at a time, and
+    only those whose oldest hot message is before ``cutoff`` are touched.
+    Returns ``(conversations, chunks)`` with the numbers archived.
+    """
+    conversations_archived = 0
+    chunks_written = 0
+    last_id = 0
+    while True:
+        pairs = list(
+            Conversation.objects.filter(id__gt=last_id).order_by('id')
+            .values_list('id', 'user_low_id', 'user_high_id')[:batch_size]
+        )
+        if not pairs:
+            break
+        last_id = pairs[-1][0]
+        for _, user_low_id, user_high_id in pairs:
+            has_cold = Message.objects.filter(
+                Q(sender_id=user_low_id, recipient_id=user_high_id) |
+                Q(sender_id=user_high_id, recipient_id=user_low_id),
+                created_at__lt=cutoff
+            ).exists()
+            if not has_cold:
+                continue
+            chunks = archive_conversation(user_low_id, user_high_id, cutoff, chunk_size)
+            conversations_archived += bool(chunks)
+            chunks_written += len(chunks)
+    return conversations_archived, chunks_written
+
+
+def build_messages(rows, user_a, user_b):
+    """Unsaved ``Message`` instances for archived rows, with their senders attached"""
+    users = User.objects.in_bulk({user_a, user_b}) if rows else {}
+    messages = []
+    for row in rows:
+        message = Message(**row)
+        message.sender = users.get(row['sender_id'])
+        messages.append(message)
+    return messages
+
+
+def chunks_for(user_a, user_b):
+    user_low_id, user_high_id = Conversation.canonical_pair(user_a, user_b)
+    return ArchiveChunk.objects.filter(user_low_id=user_low_id, user_high_id=user_high_id)
+
+
+def read_before(user_a, user_b, position, count):
+    """
+    Up to ``count`` archived messages older than ``position``, newest first.
+    
+    ``position`` is a (created_at, id) pair, or ``None`` for the newest
+    archived messages.
+    """
+    chunks = chunks_for(user_a, user_b)
+    if position is not None:
+        created_at, message_id = position
+        chunks = chunks.filter(
+            Q(first_created_at__lt=created_at) |
+            Q(first_created_at=created_at, first_message_id__lt=message_id)
+        )
+    rows = []
+    for chunk in chunks.order_by('-first_created_at', '-first_message_id').iterator(chunk_size=2):
+        for row in reversed(load_chunk(chunk.storage_key)):
+            if position is None or (row['created_at'], row['id']) < position:
+                rows.append(row)
+                if len(rows) == count:
+                    return build_messages(rows, user_a, user_b)
+    return build_messages(rows, user_a, user_b)
+
+
+def read_after(user_a, user_b, position, count):
+    """Up to ``count`` archived messages newer than the (created_at, id) ``position``, oldest first"""
+    created_at, message_id = position
+    chunks = chunks_for(user_a, user_b).filter(
+        Q(last_created_at__gt=created_at) |
+        Q(last_created_at=created_at, last_message_id__gt=message_id)
+    )
+    rows = []
+    for chunk in chunks.order_by('first_created_at', 'first_message_id').iterator(chunk_size=2):
+        for row in load_chunk(chunk.storage_key):
+            if (row['created_at'], row['id']) > position:
+                rows.append(row)
+                if len(rows) == count:
+                    return build_messages(rows, user_a, user_b)
+    return build_messages(rows, user_a, user_b)
@@ -0,0 +1,304 @@
+"""
+Content-addressed storage of message attachments.
+
+Finished uploads are hashed with SHA-256 and each distinct content is
+stored once, as an ``AttachmentBlob``: a plain file under
+``blobs/<hash>``, an image as renditions under ``variants/<hash>/<name>``.
+Uploading bytes that are already stored, or declaring the hash of a file
+the sender can already see, reuses the blob and its renditions without
+storing or processing anything again.
+
+``AttachmentBlob.ref_count`` counts the messages using a blob. It goes up
+when an upload with a blob is attached to a message and down when the
+message is deleted through ``delete_messages``; archived messages keep
+their references. Blobs that no message or pending upload uses are removed
+by ``collect_garbage``, which runs in Celery in batches.
+
+A message refers to its attachment by the file's path under ``MEDIA_URL``
+(``message_path``), never by a storage URL: a private bucket's URLs are
+signed, expire and outgrow the column. ``message_url`` turns the path
+into a URL each time the message is read.
+"""
+import hashlib
+import io
+import logging
+import os
+import re
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.files import File
+from django.core.files.base import ContentFile
+from django.core.files.storage import storages
+from django.db import IntegrityError, transaction
+from django.db.models import Count, Exists, F, OuterRef, Q
+from django.utils import timezone
+from PIL import Image, ImageOps, UnidentifiedImageError
+
+from social_messenger.media import ATTACHMENTS_PREFIX
+
+from .models import AttachmentBlob, AttachmentUpload, Message
+
+logger = logging.getLogger(__name__)
+
+# Longest side of each stored rendition of an image, largest first
+IMAGE_VARIANTS = (('full', 2048), ('preview', 1024), ('thumbnail', 256))
+# Pillow format -> (saved format, extension); anything else is stored as a plain file
+IMAGE_FORMATS = {
+    'JPEG': ('JPEG', 'jpg'),
+    'PNG': ('PNG', 'png'),
+    'WEBP': ('WEBP', 'webp'),
+    'GIF': ('PNG', 'png'),
+}
+# Storage keys carry the blob's digest; uploads stored before blobs existed
+# kept their ``<upload id>/<name>`` keys
+BLOB_KEY = re.compile(r'(?:blobs|variants)/[0-9a-f]{2}/(?P<sha256>[0-9a-f]{64})[./]')
+UPLOAD_KEY = re.compile(r'(?P<upload_id>[0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{12})/')
+# A blob still processing after this long is taken over by the next upload of it
+PROCESSING_TIMEOUT = timedelta(minutes=10)
+
+
+def get_storage():
+    return storages['attachments']
+
+
+def message_path(key):
+    """What a message stores as ``attachment_url`` for the attachment file ``key``"""
+    return f'{settings.MEDIA_URL}{ATTACHMENTS_PREFIX}{key}'
+
+
+def message_url(attachment_url):
+    """The URL to show for a message's ``attachment_url``; links given by clients are kept"""
+    prefix = f'{settings.MEDIA_URL}{ATTACHMENTS_PREFIX}'
+    if attachment_url and attachment_url.startswith(prefix):
+        return get_storage().url(attachment_url[len(prefix):])
+    return attachment_url
+
+
+def file_digest(path):
+    with open(path, 'rb') as staged:
+        return hashlib.file_digest(staged, 'sha256').hexdigest()
+
+
+def blob_key(sha256, filename):
+    extension = os.path.splitext(filename)[1].lower()
+    return f'blobs/{sha256[:2]}/{sha256}{extension}'
+
+
+def variant_key(sha256, name, extension):
+    return f'variants/{sha256[:2]}/{sha256}/{name}.{extension}'
+
+
+def save(key, content):
+    """Store ``content`` under exactly ``key``, replacing a file left there by an interrupted run"""
+    storage = get_storage()
+    if storage.exists(key):
+        storage.delete(key)
+    return storage.save(key, content)
+
+
+def claim_blob(upload_id, sha256, size):
+    """
+    Point an upload at the blob for ``sha256``, creating it if needed.
+    
+    Returns the blob and whether the caller must store it: true for a new
+    blob, and for one whose earlier processing failed or stalled. An upload
+    of a blob another task is still storing is finished by that task. The
+    upload row stays locked meanwhile, so the reference is counted exactly
+    once whether the message or the blob comes first. ``None`` if the
+    upload has been deleted.
+    """
+    with transaction.atomic():
+        upload = AttachmentUpload.objects.select_for_update().filter(id=upload_id).first()
+        if upload is None:
+            return None, False
+        blob = AttachmentBlob.objects.select_for_update().filter(sha256=sha256).first()
+        claimed = blob is None
+        if claimed:
+            try:
+                with transaction.atomic():
+                    blob = AttachmentBlob.objects.create(sha256=sha256, size=size)
+            except IntegrityError:
+                # Created by a concurrent upload of the same bytes
+                blob = AttachmentBlob.objects.select_for_update().get(sha256=sha256)
+                claimed = False
+        if blob.status == AttachmentBlob.Status.FAILED or (
+            blob.status == AttachmentBlob.Status.PROCESSING and not claimed and
+            blob.updated_at < timezone.now() - PROCESSING_TIMEOUT
+        ):
+            blob.status = AttachmentBlob.Status.PROCESSING
+            blob.save(update_fields=['status', 'updated_at'])
+            claimed = True
+        
+        upload.blob = blob
+        upload.save(update_fields=['blob', 'updated_at'])
+        if upload.message_id is not None:
+            add_reference(blob.id)
+    return blob, claimed
+
+
+def find_visible_blob(user, sha256, size):
+    """The ready blob for ``sha256`` if ``user`` already has access to it (see ``can_access``)"""
+    blob = AttachmentBlob.objects.filter(sha256=sha256, size=size, status=AttachmentBlob.Status.READY).first()
+    if blob is None or not can_access(user, blob):
+        return None
+    return blob
+
+
+def can_access(user, blob):
+    """
+    Whether ``user`` may read a blob.
+    
+    That is, it is the content of one of their own uploads, or an
+    attachment of a message they sent or received. Knowing a digest alone
+    does not give access to someone else's file.
+    """
+    message_ids = AttachmentUpload.objects.filter(blob=blob, message_id__isnull=False).values('message_id')
+    return (
+        AttachmentUpload.objects.filter(blob=blob, owner=user).exists() or
+        Message.objects.filter(Q(sender=user) | Q(recipient=user), id__in=message_ids).exists()
+    )
+
+
+def blob_for_key(key):
+    """The blob a file in the attachments storage belongs to, if any"""
+    match = BLOB_KEY.match(key)
+    if match:
+        return AttachmentBlob.objects.filter(sha256=match['sha256']).first()
+    match = UPLOAD_KEY.match(key)
+    if match:
+        return AttachmentBlob.objects.filter(uploads__id=match['upload_id']).first()
+    return None
+
+
+def store_blob(blob, path, filename):
+    """Store a claimed blob's content from the staging file ``path`` and mark it ready"""
+    variants = store_image(blob.sha256, path)
+    if variants:
+        storage_key = variants['full']['key']
+    else:
+        with open(path, 'rb') as staged:
+            storage_key = save(blob_key(blob.sha256, filename), File(staged))
+    AttachmentBlob.objects.filter(id=blob.id).update(
+        status=AttachmentBlob.Status.READY,
+        storage_key=storage_key,
+        variants=variants or {},
+        updated_at=timezone.now()
+    )
+
+
+def store_image(sha256, path):
+    """
+    Save the renditions of an image; ``None`` if it is not a still image.
+    
+    Only pixels are copied into the stored files. EXIF orientation is
+    applied first, since it is dropped with the rest of the metadata.
+    """
+    try:
+        image = Image.open(path)
+    except UnidentifiedImageError:
+        return None
+    with image:
+        if image.format not in IMAGE_FORMATS or getattr(image, 'is_animated', False):
+            return None
+        save_format, extension = IMAGE_FORMATS[image.format]
+        # Let the JPEG decoder scale down while decoding
+        image.draft(image.mode, (IMAGE_VARIANTS[0][1],) * 2)
+        image = ImageOps.exif_transpose(image)
+    
+    if save_format == 'JPEG':
+        image = image.convert('RGB')
+    elif image.mode not in ('RGB', 'RGBA', 'L', 'LA'):
+        image = image.convert('RGBA')
+    
+    variants = {}
+    for name, longest_side in IMAGE_VARIANTS:
+        image.thumbnail((longest_side, longest_side), Image.LANCZOS)
+        # A fresh image carries no metadata from the original
+        rendition = Image.new(image.mode, image.size)
+        rendition.paste(image)
+        buffer = io.BytesIO()
+        rendition.save(buffer, save_format, quality=85, optimize=True)
+        key = save(variant_key(sha256, name, extension), ContentFile(buffer.getvalue()))
+        variants[name] = {'key': key, 'width': rendition.width, 'height': rendition.height}
+    return variants
+
+
+def fail_blob(blob_id):
+    """Mark a blob that could not be stored, and the uploads waiting for it, as failed"""
+    now = timezone.now()
+    with transaction.atomic():
+        AttachmentBlob.objects.filter(id=blob_id).update(status=AttachmentBlob.Status.FAILED, updated_at=now)
+        AttachmentUpload.objects.filter(blob_id=blob_id, status=AttachmentUpload.Status.PROCESSING).update(
+            status=AttachmentUpload.Status.FAILED,
+            updated_at=now
+        )
+
+
+def add_reference(blob_id):
+    AttachmentBlob.objects.filter(id=blob_id).update(ref_count=F('ref_count') + 1, updated_at=timezone.now())
+
+
+def release_messages(message_ids):
+    """
+    Drop the attachment references of deleted messages; call inside their transaction.
+    
+    Their uploads are deleted, and garbage collection is queued if any
+    blob is left unreferenced.
+    """
+    from .tasks import collect_attachment_garbage
+    
+    uploads = AttachmentUpload.objects.filter(message_id__in=message_ids)
+    references = uploads.exclude(blob=None).values('blob_id').annotate(count=Count('id')).order_by()
+    now = timezone.now()
+    for reference in references:
+        AttachmentBlob.objects.filter(id=reference['blob_id']).update(
+            ref_count=F('ref_count') - reference['count'],
+            updated_at=now
+        )
+    uploads.delete()
+    if references:
+        transaction.on_commit(collect_attachment_garbage.delay)
+
+
+def collect_garbage(batch_size):
+    """
+    Delete blobs that no message or pending upload uses, ``batch_size`` at a time.
+    
+    Each batch is locked and deleted in its own transaction, skipping rows
+    another transaction holds (such as an upload of the same bytes
+    claiming the blob), and its files are removed once it commits. Returns
+    the number of blobs deleted.
+    """
+    stalled = timezone.now() - PROCESSING_TIMEOUT
+    unreferenced = AttachmentBlob.objects.filter(ref_count__lte=0).exclude(
+        status=AttachmentBlob.Status.PROCESSING,
+        updated_at__gte=stalled
+    ).exclude(
+        Exists(AttachmentUpload.objects.filter(blob=OuterRef('pk')))
+    ).order_by('id')
+    
+    deleted = 0
+    while True:
+        with transaction.atomic():
+            blobs = list(unreferenced.select_for_update(skip_locked=True)[:batch_size])
+            if not blobs:
+                break
+            # Re-checked now that they are locked: an upload may have claimed one meanwhile
+            ids = set(unreferenced.filter(id__in=[blob.id for blob in blobs]).values_list('id', flat=True))
+            AttachmentBlob.objects.filter(id__in=ids).delete()
+            keys = set().union(*(blob.storage_keys for blob in blobs if blob.id in ids))
+            transaction.on_commit(lambda keys=keys: delete_files(keys))
+        deleted += len(ids)
+        if len(blobs) < batch_size:
+            break
+    return deleted
+
+
+def delete_files(keys):
+    storage = get_storage()
+    for key in keys:
+        try:
+            storage.delete(key)
+        except Exception:
+            logger.exception('Could not delete attachment file %s', key)
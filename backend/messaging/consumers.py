@@ -0,0 +1,135 @@
+import time
+
+from channels.db import database_sync_to_async
+from channels.generic.websocket import AsyncJsonWebsocketConsumer
+from django.conf import settings
+from friends.models import Friendship
+from . import presence, receipts
+from .models import Conversation, GroupMember
+from .realtime import chat_group_name, user_group_name
+
+# How long a socket trusts its answer to whether a peer may be sent typing
+# indicators, and how many such answers it keeps
+PEER_CHECK_TTL = 60
+PEER_CHECK_SIZE = 256
+
+
+class MessageConsumer(AsyncJsonWebsocketConsumer):
+    """
+    Per-user push channel.
+    
+    Every socket of an authenticated user joins that user's group, so events
+    published with ``realtime.publish_to_users`` reach all of their devices.
+    It also joins the channel of each group conversation the user belongs to,
+    so a group message is published once rather than once per member.
+    
+    Pings count as presence heartbeats, and typing indicators are relayed
+    to the group or to a peer who is a friend or already shares a
+    conversation with the user (see ``messaging.presence``). Delivery and read
+    receipts are buffered like those sent to the REST API (see
+    ``messaging.receipts``).
+    """
+    
+    async def connect(self):
+        user = self.scope.get('user')
+        if user is None or not user.is_authenticated:
+            await self.close(code=4401)
+            return
+        
+        self.user_id = user.id
+        self.group_name = user_group_name(user.id)
+        self.chat_groups = set()
+        self.peer_checks = {}
+        await self.channel_layer.group_add(self.group_name, self.channel_name)
+        for group_id in await self.get_group_ids(user.id):
+            await self.join_chat(group_id)
+        await self.accept()
+        await presence.aheartbeat(user.id)
+    
+    async def disconnect(self, code):
+        if hasattr(self, 'group_name'):
+            await self.channel_layer.group_discard(self.group_name, self.channel_name)
+            for group_id in list(self.chat_groups):
+                await self.leave_chat(group_id)
+    
+    @database_sync_to_async
+    def get_group_ids(self, user_id):
+        return list(GroupMember.objects.filter(user_id=user_id).values_list('group_id', flat=True))
+    
+    @database_sync_to_async
+    def is_contact(self, peer_id):
+        """Whether the peer is a friend of the user or already shares a conversation with them"""
+        if Friendship.objects.are_friends(self.user_id, peer_id):
+            return True
+        user_low_id, user_high_id = Conversation.canonical_pair(self.user_id, peer_id)
+        return Conversation.objects.filter(user_low_id=user_low_id, user_high_id=user_high_id).exists()
+    
+    async def may_reach(self, peer_id):
+        """``is_contact``, remembered for ``PEER_CHECK_TTL`` seconds so a typing burst costs one lookup"""
+        now = time.monotonic()
+        checked = self.peer_checks.get(peer_id)
+        if checked is None or now - checked[1] > PEER_CHECK_TTL:
+            if len(self.peer_checks) >= PEER_CHECK_SIZE:
+                self.peer_checks.clear()
+            checked = self.peer_checks[peer_id] = (await self.is_contact(peer_id), now)
+        return checked[0]
+    
+    async def join_chat(self, group_id):
+        self.chat_groups.add(group_id)
+        await self.channel_layer.group_add(chat_group_name(group_id), self.channel_name)
+    
+    async def leave_chat(self, group_id):
+        self.chat_groups.discard(group_id)
+        await self.channel_layer.group_discard(chat_group_name(group_id), self.channel_name)
+    
+    async def receive_json(self, content, **kwargs):
+        """Answer keep-alive pings, relay typing and take receipts; all other traffic goes through the REST API"""
+        if content.get('type') == 'ping':
+            await presence.aheartbeat(self.user_id)
+            await self.send_json({'type': 'pong'})
+        elif content.get('type') == 'typing':
+            await presence.aheartbeat(self.user_id)
+            await self.typing(content.get('userId'), content.get('groupId'), content.get('active', True) is not False)
+        elif content.get('type') == 'receipt':
+            await self.receipt(content.get('userId'), content.get('deliveredUpTo', 0), content.get('readUpTo', 0))
+    
+    async def typing(self, peer_id, group_id, active):
+        """
+        Tell a peer, or the members of one of the user's groups, that the user started or stopped typing.
+        
+        Reports that change nothing are dropped (``presence.typing_changed``),
+        as are reports to peers who are neither friends nor conversation
+        partners; a typing peer's indicator is also kept for clients that
+        poll presence.
+        """
+        payload = {'type': 'typing', 'userId': self.user_id, 'active': active, 'expiresIn': settings.TYPING_TTL}
+        if type(group_id) is int and group_id in self.chat_groups:
+            if presence.typing_changed(self.user_id, ('group', group_id), active):
+                await self.channel_layer.group_send(
+                    chat_group_name(group_id),
+                    {'type': 'push', 'payload': {**payload, 'groupId': group_id}}
+                )
+        elif type(peer_id) is int and peer_id != self.user_id and await self.may_reach(peer_id):
+            if presence.typing_changed(self.user_id, peer_id, active):
+                await presence.aset_typing(self.user_id, peer_id, active)
+                await self.channel_layer.group_send(user_group_name(peer_id), {'type': 'push', 'payload': payload})
+    
+    async def receipt(self, peer_id, delivered, read):
+        """Acknowledge messages from a peer; buffered, unless receipts are written at once"""
+        if not all(type(value) is int and value >= 0 for value in (peer_id, delivered, read)):
+            return
+        if settings.RECEIPT_FLUSH_WINDOW <= 0:
+            await database_sync_to_async(receipts.accept)(self.user_id, [(peer_id, delivered, read)])
+        else:
+            receipts.accept(self.user_id, [(peer_id, delivered, read)])
+    
+    async def push(self, event):
+        """Forward an event published to this user's group or to one of their group conversations"""
+        await self.send_json(event['payload'])
+    
+    async def chat_subscription(self, event):
+        """Follow membership changes published with ``realtime.publish_subscription``"""
+        if event['subscribe']:
+            await self.join_chat(event['group_id'])
+        else:
+            await self.leave_chat(event['group_id'])
@@ -0,0 +1,211 @@
+"""
+Maintenance of the ``Conversation`` inbox summaries.
+
+Each helper must run inside the transaction that changes the messages, so
+the summary row always agrees with the ``messages`` table. Summary rows are
+locked with ``SELECT ... FOR UPDATE`` while they are changed, which keeps
+concurrent sends to the same conversation from losing updates. Counters are
+always touched in the same order (conversation, then the user's total) so
+concurrent writers cannot deadlock.
+"""
+from collections import defaultdict
+
+from django.db import connection
+from django.db.models import Count, F
+from django.db.models.functions import Greatest
+
+from social_messenger import etags
+
+from .models import Conversation, Message, UnreadCounter
+
+
+def record_message(message):
+    """Make ``message`` the latest in its conversation and count it as unread"""
+    user_low_id, user_high_id = Conversation.canonical_pair(message.sender_id, message.recipient_id)
+    conversation, _ = Conversation.objects.select_for_update().get_or_create(
+        user_low_id=user_low_id,
+        user_high_id=user_high_id
+    )
+    
+    # A send that commits late must not replace a newer last message
+    if conversation.last_message_at is None or (
+        (message.created_at, message.id) > (conversation.last_message_at, conversation.last_message_id)
+    ):
+        conversation.last_message_id = message.id
+        conversation.last_sender_id = message.sender_id
+        conversation.last_message_at = message.created_at
+        conversation.preview = Conversation.make_preview(message.content, message.message_type)
+    if message.sender_id != message.recipient_id:
+        field = Conversation.unread_field(message.recipient_id, message.sender_id)
+        setattr(conversation, field, getattr(conversation, field) + 1)
+    conversation.save()
+    if message.sender_id != message.recipient_id:
+        adjust_unread_total(message.recipient_id, 1)
+    etags.bump('messages', (message.sender_id, message.recipient_id))
+    return conversation
+
+
+def record_read(reader_id, sender_id, count, **receipts):
+    """
+    Subtract ``count`` newly read messages from the reader's unread counter.
+    
+    ``receipts`` are the reader's delivery and read marks (see
+    ``messaging.receipts``), set in the same UPDATE.
+    """
+    if (count <= 0 and not receipts) or reader_id == sender_id:
+        return
+    user_low_id, user_high_id = Conversation.canonical_pair(reader_id, sender_id)
+    updates = dict(receipts)
+    if count > 0:
+        field = Conversation.unread_field(reader_id, sender_id)
+        updates[field] = Greatest(F(field) - count, 0)
+    Conversation.objects.filter(
+        user_low_id=user_low_id,
+        user_high_id=user_high_id
+    ).update(**updates)
+    if count > 0:
+        adjust_unread_total(reader_id, -count)
+    etags.bump('messages', (reader_id, sender_id))
+
+
+def release_range(start, end):
+    """
+    Forget the messages created in ``[start, end)`` before their partition is detached.
+    
+    Their unread counts come off the counters, conversations whose last
+    message is among them fall back to the newest older one (or are
+    removed), their message and read events leave the sync log, and their
+    attachment references are dropped, as if they had been deleted. Call
+    inside the transaction that detaches them.
+    """
+    from . import attachments
+    from .models import SyncEvent
+    
+    messages = Message.objects.filter(created_at__gte=start, created_at__lt=end)
+    unread = messages.filter(is_read=False).values('sender_id', 'recipient_id').annotate(
+        count=Count('id')
+    ).order_by()
+    for row in unread:
+        record_read(row['recipient_id'], row['sender_id'], row['count'])
+    
+    for conversation in Conversation.objects.select_for_update().filter(
+        last_message_at__gte=start,
+        last_message_at__lt=end
+    ):
+        latest = latest_message(conversation.user_low_id, conversation.user_high_id, before=start)
+        if latest is None:
+            conversation.delete()
+        else:
+            conversation.last_message_id = latest.id
+            conversation.last_sender_id = latest.sender_id
+            conversation.last_message_at = latest.created_at
+            conversation.preview = Conversation.make_preview(latest.content, latest.message_type)
+            conversation.save()
+        etags.bump('messages', (conversation.user_low_id, conversation.user_high_id))
+    
+    SyncEvent.objects.filter(
+        event_type__in=(SyncEvent.EventType.MESSAGE, SyncEvent.EventType.READ),
+        message_id__in=messages.values('id')
+    ).delete()
+    attachments.release_messages(messages.values('id'))
+
+
+def record_deleted(rows):
+    """
+    Update summaries after messages were deleted.
+    
+    ``rows`` are dicts with ``id``, ``sender_id``, ``recipient_id`` and
+    ``is_read`` captured before the delete. Unread counters drop by the
+    number of deleted unread messages; when the latest message went away the
+    summary falls back to the newest remaining one, and the row is removed
+    once the conversation is empty.
+    """
+    by_pair = defaultdict(list)
+    for row in rows:
+        by_pair[Conversation.canonical_pair(row['sender_id'], row['recipient_id'])].append(row)
+    
+    for (user_low_id, user_high_id), pair_rows in by_pair.items():
+        conversation = Conversation.objects.select_for_update().filter(
+            user_low_id=user_low_id,
+            user_high_id=user_high_id
+        ).first()
+        if conversation is None:
+            continue
+        
+        unread_by_recipient = defaultdict(int)
+        for row in pair_rows:
+            if not row['is_read'] and row['sender_id'] != row['recipient_id']:
+                field = Conversation.unread_field(row['recipient_id'], row['sender_id'])
+                setattr(conversation, field, max(getattr(conversation, field) - 1, 0))
+                unread_by_recipient[row['recipient_id']] += 1
+        
+        if conversation.last_message_id in {row['id'] for row in pair_rows}:
+            latest = latest_message(user_low_id, user_high_id)
+            if latest is None:
+                conversation.delete()
+                conversation = None
+            else:
+                conversation.last_message_id = latest.id
+                conversation.last_sender_id = latest.sender_id
+                conversation.last_message_at = latest.created_at
+                conversation.preview = Conversation.make_preview(latest.content, latest.message_type)
+        if conversation is not None:
+            conversation.save()
+        
+        for recipient_id, count in unread_by_recipient.items():
+            adjust_unread_total(recipient_id, -count)
+        etags.bump('messages', (user_low_id, user_high_id))
+
+
+def adjust_unread_total(user_id, delta):
+    """Atomically add ``delta`` to a user's total unread counter (floored at zero)"""
+    updated = UnreadCounter.objects.filter(user_id=user_id).update(total=Greatest(F('total') + delta, 0))
+    if not updated:
+        UnreadCounter.objects.get_or_create(user_id=user_id)
+        UnreadCounter.objects.filter(user_id=user_id).update(total=Greatest(F('total') + delta, 0))
+
+
+def mark_conversation_read(reader_id, sender_id, up_to_message_id, **receipts):
+    """
+    Mark every message ``sender_id`` sent to ``reader_id`` up to a message id as read.
+    
+    The messages are flipped with a single ``UPDATE ... RETURNING`` served
+    by the (recipient, is_read) index. Only the rows it actually changed are
+    counted and get read events, so racing reads of the same range are
+    recorded once. ``receipts`` are passed on to ``record_read``. Returns
+    the number of messages marked.
+    """
+    from django.utils import timezone
+    from .sync import record_messages_read
+    
+    read_at = timezone.now()
+    quote = connection.ops.quote_name
+    with connection.cursor() as cursor:
+        cursor.execute(f"""
+            UPDATE {quote(Message._meta.db_table)}
+            SET is_read = %s, read_at = %s
+            WHERE recipient_id = %s AND sender_id = %s AND is_read = %s AND id <= %s
+            RETURNING id
+        """, [True, connection.ops.adapt_datetimefield_value(read_at), reader_id, sender_id, False, up_to_message_id])
+        marked_ids = [row[0] for row in cursor.fetchall()]
+    
+    if marked_ids:
+        record_messages_read(
+            [Message(id=message_id, sender_id=sender_id, recipient_id=reader_id) for message_id in marked_ids],
+            read_at
+        )
+    record_read(reader_id, sender_id, len(marked_ids), **receipts)
+    return len(marked_ids)
+
+
+def latest_message(user_id, other_user_id, before=None):
+    """Newest message between two users (created before ``before``, if given), read from each direction's index"""
+    messages = Message.objects.filter(created_at__lt=before) if before else Message.objects.all()
+    candidates = [
+        messages.filter(sender_id=sender_id, recipient_id=recipient_id).order_by('-created_at', '-id').first()
+        for sender_id, recipient_id in {(user_id, other_user_id), (other_user_id, user_id)}
+    ]
+    candidates = [message for message in candidates if message is not None]
+    if not candidates:
+        return None
+    return max(candidates, key=lambda message: (message.created_at, message.id))
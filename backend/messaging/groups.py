@@ -0,0 +1,138 @@
+"""
+Group conversations whose cost per message does not grow with the group.
+
+A group message is stored once in ``group_messages`` and numbered with the
+group's next sequence number. Sending locks the ``GroupConversation`` row,
+bumps ``last_seq`` and the inbox summary, inserts the message and advances
+the sender's read cursor: three writes whatever the member count. Nothing is
+written per recipient; each ``GroupMember`` holds a ``last_read_seq`` cursor,
+so a member's unread count is ``last_seq - last_read_seq`` and marking a
+group read is a single-row update.
+
+Delivery is one channel-layer ``group_send`` to the group's channel
+(``chat.{id}``), which every connected socket of every member joins (see
+``MessageConsumer``), so the application also publishes once per message.
+Clients that were offline catch up from the history endpoint with
+``after=<last seq they saw>``.
+
+Like ``conversations``, the write helpers must run inside a transaction.
+"""
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F
+from django.db.models.functions import Greatest
+from django.utils import timezone
+from rest_framework.exceptions import NotFound, PermissionDenied, ValidationError
+
+from .models import Conversation, GroupConversation, GroupMember, GroupMessage
+from .realtime import publish_subscription, publish_to_chat
+
+
+def get_membership(group_id, user_id):
+    """The user's membership of a group, or ``PermissionDenied`` for non-members"""
+    membership = GroupMember.objects.select_related('group').filter(group_id=group_id, user_id=user_id).first()
+    if membership is None:
+        raise PermissionDenied('You are not a member of this group')
+    return membership
+
+
+def create_group(creator, name, member_ids):
+    """Create a group with ``creator`` as its admin and ``member_ids`` as members"""
+    member_ids = set(member_ids) - {creator.id}
+    check_group_size(len(member_ids) + 1)
+    group = GroupConversation.objects.create(name=name, created_by=creator, last_message_at=timezone.now())
+    GroupMember.objects.create(group=group, user=creator, role=GroupMember.Role.ADMIN)
+    add_members(group, member_ids)
+    return group
+
+
+def check_group_size(count):
+    if count > settings.GROUP_MAX_MEMBERS:
+        raise ValidationError({'member_ids': f'A group can have at most {settings.GROUP_MAX_MEMBERS} members'})
+
+
+def add_members(group, user_ids):
+    """
+    Add users to a group, ignoring those already in it; returns the ids added.
+    
+    New members start with their cursor at the latest message, so joining a
+    busy group does not come with a backlog of unread messages.
+    """
+    group = GroupConversation.objects.select_for_update().get(id=group.id)
+    existing = set(GroupMember.objects.filter(group=group, user_id__in=user_ids).values_list('user_id', flat=True))
+    added = sorted(set(user_ids) - existing)
+    if not added:
+        return []
+    check_group_size(group.member_count + len(added))
+    
+    GroupMember.objects.bulk_create(
+        [GroupMember(group=group, user_id=user_id, last_read_seq=group.last_seq) for user_id in added],
+        batch_size=1000
+    )
+    group.member_count = GroupMember.objects.filter(group=group).count()
+    group.save(update_fields=['member_count', 'updated_at'])
+    transaction.on_commit(lambda: publish_subscription(added, group.id, subscribe=True))
+    return added
+
+
+def remove_member(group, user_id):
+    """Remove a user from a group; returns whether they were a member"""
+    group = GroupConversation.objects.select_for_update().get(id=group.id)
+    deleted = GroupMember.objects.filter(group=group, user_id=user_id).delete()[0]
+    if not deleted:
+        return False
+    group.member_count = GroupMember.objects.filter(group=group).count()
+    group.save(update_fields=['member_count', 'updated_at'])
+    transaction.on_commit(lambda: publish_subscription([user_id], group.id, subscribe=False))
+    return True
+
+
+def send_group_message(group_id, sender, message_type, content=None, attachment_url=None):
+    """
+    Append a message to a group and return it.
+    
+    The group row lock serialises sends to the same group, which is what
+    makes sequence numbers gapless and lets history be paged by ``seq``.
+    """
+    group = GroupConversation.objects.select_for_update().filter(id=group_id).first()
+    if group is None:
+        raise NotFound('Group not found')
+    seq = group.last_seq + 1
+    # Advancing the sender's cursor doubles as the membership check
+    if not GroupMember.objects.filter(group=group, user_id=sender.id).update(last_read_seq=seq):
+        raise PermissionDenied('You are not a member of this group')
+    
+    message = GroupMessage.objects.create(
+        group=group,
+        seq=seq,
+        sender=sender,
+        message_type=message_type,
+        content=content,
+        attachment_url=attachment_url
+    )
+    group.last_seq = seq
+    group.last_sender_id = sender.id
+    group.last_message_at = message.created_at
+    group.preview = Conversation.make_preview(content, message_type)
+    group.save(update_fields=['last_seq', 'last_sender_id', 'last_message_at', 'preview', 'updated_at'])
+    transaction.on_commit(lambda: publish_group_message(message))
+    return message
+
+
+def mark_group_read(membership, seq):
+    """
+    Move a member's read cursor forward to ``seq`` (capped at the latest message).
+    
+    The cursor never moves backwards, so reads reported out of order by
+    different devices are harmless. Returns the member's unread count.
+    """
+    seq = min(seq, membership.group.last_seq)
+    GroupMember.objects.filter(id=membership.id).update(last_read_seq=Greatest(F('last_read_seq'), seq))
+    membership.last_read_seq = max(membership.last_read_seq, seq)
+    return membership.unread_count
+
+
+def publish_group_message(message):
+    """Deliver a committed group message to every connected member with one publish"""
+    from .serializers import format_group_message
+    publish_to_chat(message.group_id, {'type': 'group.message.created', 'message': format_group_message(message)})
@@ -0,0 +1,123 @@
+import random
+import statistics
+import time
+from datetime import timedelta
+from types import SimpleNamespace
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.db.models import Count, Sum
+from django.utils import timezone
+
+from messaging import archive
+from messaging.models import ArchiveChunk, Message
+from messaging.pagination import ConversationCursorPagination, encode_cursor
+from messaging.serializers import format_message
+
+
+def percentile(values, fraction):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(fraction * len(values)))]
+
+
+class Command(BaseCommand):
+    help = (
+        'Move messages older than a number of days into compressed archive '
+        'chunks, one conversation at a time, then report the storage saved '
+        'and time history pages that are served from the archive (cold: '
+        'chunk downloaded and decompressed; warm: chunk already cached) '
+        'against pages of hot rows. The beat task archive_cold_messages does '
+        'the archiving daily when MESSAGE_ARCHIVE_AFTER_DAYS is set.'
+    )
+    
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, default=settings.MESSAGE_ARCHIVE_AFTER_DAYS,
+                            help='Archive messages older than this many days')
+        parser.add_argument('--chunk-size', type=int, default=settings.MESSAGE_ARCHIVE_CHUNK_SIZE,
+                            help='Messages per archive chunk')
+        parser.add_argument('--pages', type=int, default=50,
+                            help='History pages timed per kind afterwards (0 skips timing)')
+        parser.add_argument('--seed', type=int, default=7)
+    
+    def handle(self, *args, **options):
+        if options['days'] <= 0:
+            raise CommandError('Pass --days or set MESSAGE_ARCHIVE_AFTER_DAYS')
+        cutoff = timezone.now() - timedelta(days=options['days'])
+        
+        hot_before = Message.objects.count()
+        size_before = self.table_size()
+        started = time.perf_counter()
+        conversations, chunks = archive.archive_cold_messages(cutoff, options['chunk_size'])
+        elapsed = time.perf_counter() - started
+        hot_after = Message.objects.count()
+        size_after = self.table_size()
+        
+        self.stdout.write(
+            f'Archived {hot_before - hot_after} messages from {conversations} conversations '
+            f'into {chunks} chunks in {elapsed:.1f} s; {hot_after} messages stay hot'
+        )
+        totals = ArchiveChunk.objects.aggregate(
+            chunks=Count('id'),
+            messages=Sum('message_count'),
+            raw=Sum('raw_size'),
+            stored=Sum('stored_size')
+        )
+        if totals['chunks']:
+            self.stdout.write(
+                f"Archive: {totals['chunks']} chunks, {totals['messages']} messages, "
+                f"{totals['raw'] / 2 ** 20:.1f} MiB of JSON stored as {totals['stored'] / 2 ** 20:.1f} MiB "
+                f"({totals['raw'] / max(totals['stored'], 1):.1f}x)"
+            )
+        if size_before is not None:
+            # Deleted rows are only reclaimed by VACUUM (or detaching old partitions)
+            self.stdout.write(
+                f'messages table with indexes: {size_before / 2 ** 20:.1f} MiB before, '
+                f'{size_after / 2 ** 20:.1f} MiB after'
+            )
+        
+        if options['pages'] > 0 and totals['chunks']:
+            self.time_pages(options['pages'], random.Random(options['seed']))
+        self.stdout.write(self.style.SUCCESS('Archiving finished'))
+    
+    def table_size(self):
+        if connection.vendor != 'postgresql':
+            return None
+        with connection.cursor() as cursor:
+            cursor.execute("""
+                SELECT coalesce(sum(pg_total_relation_size(inhrelid)), 0) + pg_total_relation_size('messages')
+                FROM pg_inherits WHERE inhparent = 'messages'::regclass
+            """)
+            return cursor.fetchone()[0]
+    
+    def time_pages(self, count, rng):
+        """Time the page just before a random chunk's end, cold and warm, and the latest page of its conversation"""
+        chunk_ids = list(ArchiveChunk.objects.values_list('id', flat=True)[:10000])
+        chunks = ArchiveChunk.objects.in_bulk(rng.sample(chunk_ids, min(count, len(chunk_ids))))
+        timings = {'hot': [], 'cold': [], 'warm': []}
+        for chunk in chunks.values():
+            position = SimpleNamespace(created_at=chunk.last_created_at, id=chunk.last_message_id + 1)
+            archived_request = SimpleNamespace(query_params={'before': encode_cursor(position)})
+            for label, request in (
+                ('hot', SimpleNamespace(query_params={})),
+                ('cold', archived_request),
+                ('warm', archived_request),
+            ):
+                if label == 'cold':
+                    archive.load_chunk.cache_clear()
+                started = time.perf_counter()
+                paginator = ConversationCursorPagination(request)
+                messages = paginator.paginate(
+                    chunk.user_low_id,
+                    chunk.user_high_id,
+                    Message.objects.select_related('sender')
+                )
+                paginator.get_page_data([format_message(message) for message in messages])
+                timings[label].append(time.perf_counter() - started)
+        
+        for label, values in timings.items():
+            values = [value * 1000 for value in values]
+            self.stdout.write(
+                f'{label:<5} history page  p50 {statistics.median(values):8.2f} ms  '
+                f'p95 {percentile(values, 0.95):8.2f} ms'
+            )
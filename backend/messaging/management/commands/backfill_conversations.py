@@ -0,0 +1,95 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from messaging.models import Conversation, Message
+
+
+class Command(BaseCommand):
+    help = (
+        'Rebuild Conversation inbox summaries from the messages table, with '
+        'read and delivery marks at the latest message each user has read. '
+        'Messages are read in id-ordered chunks and summaries are upserted in '
+        'batches, so the command is safe to re-run.'
+    )
+    
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=10000,
+                            help='Messages read per query')
+        parser.add_argument('--batch-size', type=int, default=1000,
+                            help='Conversation rows written per statement')
+    
+    def handle(self, *args, **options):
+        chunk_size = options['chunk_size']
+        summaries = {}
+        last_id = 0
+        scanned = 0
+        
+        while True:
+            chunk = list(
+                Message.objects.filter(id__gt=last_id).order_by('id').values_list(
+                    'id', 'sender_id', 'recipient_id', 'created_at',
+                    'content', 'message_type', 'is_read'
+                )[:chunk_size]
+            )
+            if not chunk:
+                break
+            
+            for message_id, sender_id, recipient_id, created_at, content, message_type, is_read in chunk:
+                pair = Conversation.canonical_pair(sender_id, recipient_id)
+                summary = summaries.get(pair)
+                if summary is None:
+                    summary = summaries[pair] = {
+                        'last': None,
+                        'unread_count_low': 0,
+                        'unread_count_high': 0,
+                        'last_read_id_low': 0,
+                        'last_read_id_high': 0,
+                    }
+                
+                if summary['last'] is None or (created_at, message_id) > summary['last'][:2]:
+                    summary['last'] = (created_at, message_id, sender_id, content, message_type)
+                if not is_read and sender_id != recipient_id:
+                    summary[Conversation.unread_field(recipient_id, sender_id)] += 1
+                elif is_read:
+                    read_field = Conversation.receipt_fields(recipient_id, sender_id)[1]
+                    summary[read_field] = max(summary[read_field], message_id)
+            
+            last_id = chunk[-1][0]
+            scanned += len(chunk)
+            self.stdout.write(f'Scanned {scanned} messages, {len(summaries)} conversations')
+        
+        rows = []
+        for (user_low_id, user_high_id), summary in summaries.items():
+            created_at, message_id, sender_id, content, message_type = summary['last']
+            rows.append(Conversation(
+                user_low_id=user_low_id,
+                user_high_id=user_high_id,
+                last_message_id=message_id,
+                last_sender_id=sender_id,
+                last_message_at=created_at,
+                preview=Conversation.make_preview(content, message_type),
+                unread_count_low=summary['unread_count_low'],
+                unread_count_high=summary['unread_count_high'],
+                last_delivered_id_low=summary['last_read_id_low'],
+                last_delivered_id_high=summary['last_read_id_high'],
+                last_read_id_low=summary['last_read_id_low'],
+                last_read_id_high=summary['last_read_id_high'],
+            ))
+        
+        batch_size = options['batch_size']
+        for start in range(0, len(rows), batch_size):
+            with transaction.atomic():
+                Conversation.objects.bulk_create(
+                    rows[start:start + batch_size],
+                    update_conflicts=True,
+                    unique_fields=['user_low', 'user_high'],
+                    update_fields=[
+                        'last_message_id', 'last_sender_id', 'last_message_at', 'preview',
+                        'unread_count_low', 'unread_count_high', 'last_delivered_id_low',
+                        'last_delivered_id_high', 'last_read_id_low', 'last_read_id_high', 'updated_at',
+                    ]
+                )
+        
+        self.stdout.write(self.style.SUCCESS(
+            f'Backfilled {len(rows)} conversations from {scanned} messages'
+        ))
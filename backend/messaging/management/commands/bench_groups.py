@@ -0,0 +1,116 @@
+import statistics
+import time
+from types import SimpleNamespace
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+
+from messaging import groups
+from messaging.models import GroupConversation, GroupMessage, Message
+from messaging.pagination import GroupInboxCursorPagination, GroupMessagePagination
+from messaging.serializers import format_group, format_group_message
+
+User = get_user_model()
+
+
+def percentile(values, fraction):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(fraction * len(values)))]
+
+
+class Rollback(Exception):
+    pass
+
+
+class Command(BaseCommand):
+    help = (
+        'Benchmark group conversations as they grow. For each group size a '
+        'group is created from existing users, then sending a message, a '
+        "member's group inbox, the latest history page and marking the group "
+        'read are timed. For comparison, a naive fan-out that writes one '
+        'message row per member is timed too (and rolled back). The groups '
+        'are deleted afterwards. Needs at least as many users as the largest group.'
+    )
+    
+    def add_arguments(self, parser):
+        parser.add_argument('--sizes', default='10,100,1000,5000',
+                            help='Comma-separated group sizes')
+        parser.add_argument('--runs', type=int, default=50,
+                            help='Timed runs per operation and size')
+        parser.add_argument('--history', type=int, default=1000,
+                            help='Messages sent to each group before timing')
+    
+    def handle(self, *args, **options):
+        sizes = [int(size) for size in options['sizes'].split(',')]
+        user_ids = list(User.objects.order_by('id').values_list('id', flat=True)[:max(sizes)])
+        if len(user_ids) < max(sizes):
+            raise CommandError(f'Need {max(sizes)} users, found {len(user_ids)}; run generate_dataset first')
+        users = User.objects.in_bulk(user_ids[:2])
+        sender, reader_id = users[user_ids[0]], user_ids[1]
+        self.stdout.write(f"Group benchmark ({connection.vendor}, {options['runs']} runs per operation)")
+        
+        created = []
+        try:
+            for size in sizes:
+                with transaction.atomic():
+                    group = groups.create_group(sender, f'Benchmark {size}', user_ids[1:size])
+                created.append(group.id)
+                for number in range(options['history']):
+                    with transaction.atomic():
+                        groups.send_group_message(group.id, sender, Message.MessageType.TEXT, f'history {number}')
+                self.bench_size(size, group, sender, reader_id, user_ids[:size], options['runs'])
+        finally:
+            GroupConversation.objects.filter(id__in=created).delete()
+    
+    def bench_size(self, size, group, sender, reader_id, member_ids, runs):
+        timings = {
+            'send': [],
+            'inbox': [],
+            'history': [],
+            'mark read': [],
+            'naive send': [],
+        }
+        request = SimpleNamespace(query_params={})
+        for number in range(runs):
+            started = time.perf_counter()
+            with transaction.atomic():
+                message = groups.send_group_message(group.id, sender, Message.MessageType.TEXT, f'timed {number}')
+            timings['send'].append(time.perf_counter() - started)
+            
+            started = time.perf_counter()
+            paginator = GroupInboxCursorPagination(request)
+            [format_group(membership) for membership in paginator.paginate(reader_id)]
+            timings['inbox'].append(time.perf_counter() - started)
+            
+            started = time.perf_counter()
+            paginator = GroupMessagePagination(request)
+            history = paginator.paginate(group.id, GroupMessage.objects.select_related('sender'))
+            [format_group_message(row) for row in history]
+            timings['history'].append(time.perf_counter() - started)
+            
+            started = time.perf_counter()
+            groups.mark_group_read(groups.get_membership(group.id, reader_id), message.seq)
+            timings['mark read'].append(time.perf_counter() - started)
+            
+            started = time.perf_counter()
+            try:
+                with transaction.atomic():
+                    Message.objects.bulk_create(
+                        [
+                            Message(sender=sender, recipient_id=member_id, content=f'timed {number}')
+                            for member_id in member_ids[1:]
+                        ],
+                        batch_size=1000
+                    )
+                    raise Rollback
+            except Rollback:
+                pass
+            timings['naive send'].append(time.perf_counter() - started)
+        
+        for label, values in timings.items():
+            values = [value * 1000 for value in values]
+            self.stdout.write(
+                f'members {size:>6}  {label:<11} p50 {statistics.median(values):8.2f} ms  '
+                f'p95 {percentile(values, 0.95):8.2f} ms'
+            )
@@ -0,0 +1,101 @@
+import random
+import statistics
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.test import override_settings
+
+from messaging import presence
+
+# Synthetic user ids, far above real ones, so real presence is untouched
+FIRST_USER_ID = 10 ** 12
+
+
+class Command(BaseCommand):
+    help = (
+        'Benchmark presence heartbeats on this node. Simulates users whose '
+        'devices each send a heartbeat every --ping-interval seconds for '
+        '--minutes of simulated time, as fast as one process can take them, '
+        'with and without coalescing; then times reading the presence of '
+        'a friend list and counts the typing pushes for fast typists. Uses '
+        'the presence cache (Redis when REDIS_URL is set) and deletes its keys '
+        'afterwards.'
+    )
+    
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=10000,
+                            help='Online users')
+        parser.add_argument('--devices', type=int, default=2,
+                            help='Connected devices per user')
+        parser.add_argument('--ping-interval', type=float, default=10,
+                            help='Seconds between heartbeats of one device')
+        parser.add_argument('--minutes', type=float, default=5,
+                            help='Simulated minutes of heartbeats')
+        parser.add_argument('--friends', type=int, default=500,
+                            help='Friend list size for the presence read')
+    
+    def handle(self, *args, **options):
+        user_ids = range(FIRST_USER_ID, FIRST_USER_ID + options['users'])
+        cache = presence.get_cache()
+        self.stdout.write(
+            f"Presence benchmark ({cache.__class__.__name__}, {options['users']:,} users x "
+            f"{options['devices']} devices, a heartbeat every {options['ping_interval']:g} s, "
+            f"{options['minutes']:g} simulated minutes)"
+        )
+        try:
+            for label, interval in (('uncoalesced', 0), ('coalesced', settings.PRESENCE_WRITE_INTERVAL)):
+                presence.heartbeats.clear()
+                with override_settings(PRESENCE_WRITE_INTERVAL=interval):
+                    heartbeats, writes, elapsed = self.heartbeats(user_ids, options)
+                self.stdout.write(
+                    f'  {label:<12} {heartbeats / elapsed:>10,.0f} heartbeats/s  '
+                    f'{writes:>9,} cache writes ({writes / heartbeats:.1%})  '
+                    f'{writes / (options["minutes"] * 60):>8,.0f} writes/s of simulated time'
+                )
+            self.read_friends(user_ids[:options['friends']])
+            self.typing(user_ids[:1000])
+        finally:
+            presence.heartbeats.clear()
+            presence.typing_updates.clear()
+            cache.delete_many([presence.presence_key(user_id) for user_id in user_ids])
+    
+    def heartbeats(self, user_ids, options):
+        """Replay every device's heartbeats in time order, each device starting at a random offset"""
+        rng = random.Random(0)
+        interval = options['ping_interval']
+        devices = [(rng.uniform(0, interval), user_id) for user_id in user_ids for _ in range(options['devices'])]
+        devices.sort()
+        rounds = int(options['minutes'] * 60 / interval)
+        start = time.time()
+        heartbeats = writes = 0
+        started = time.perf_counter()
+        for number in range(rounds):
+            for offset, user_id in devices:
+                writes += presence.heartbeat(user_id, now=start + number * interval + offset)
+                heartbeats += 1
+        return heartbeats, writes, time.perf_counter() - started
+    
+    def read_friends(self, friend_ids):
+        timings = []
+        for _ in range(50):
+            started = time.perf_counter()
+            entries = presence.get_presence(friend_ids, FIRST_USER_ID - 1)
+            timings.append(time.perf_counter() - started)
+        online = sum(entry['online'] for entry in entries)
+        self.stdout.write(
+            f'  friend list  {len(friend_ids)} friends ({online} online) read in '
+            f'{statistics.median(timings) * 1000:.2f} ms, one get_many'
+        )
+    
+    def typing(self, user_ids):
+        """Typists reporting 5 keystrokes a second for 30 seconds, then stopping"""
+        reports = pushes = 0
+        start = time.time()
+        for user_id in user_ids:
+            for keystroke in range(150):
+                pushes += presence.typing_changed(user_id, user_id + 1, True, now=start + keystroke / 5)
+                reports += 1
+            pushes += presence.typing_changed(user_id, user_id + 1, False)
+            reports += 1
+        self.stdout.write(f'  typing       {reports:,} reports passed on as {pushes:,} pushes')
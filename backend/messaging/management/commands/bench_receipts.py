@@ -0,0 +1,169 @@
+import random
+import time
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+
+from messaging import conversations, receipts
+from messaging.models import Message
+
+User = get_user_model()
+
+WRITE_STATEMENTS = ('INSERT', 'UPDATE', 'DELETE')
+
+
+class Rollback(Exception):
+    pass
+
+
+class WriteCounter:
+    """Counts the write statements run while ``enabled``"""
+    
+    def __init__(self):
+        self.enabled = False
+        self.writes = 0
+    
+    def __call__(self, execute, sql, params, many, context):
+        if self.enabled and sql.lstrip().upper().startswith(WRITE_STATEMENTS):
+            self.writes += 1
+        return execute(sql, params, many, context)
+
+
+class Command(BaseCommand):
+    help = (
+        'Benchmark receipt writes under a simulated chat workload. Pairs of '
+        'existing users exchange bursts of messages for --minutes of simulated '
+        'time. Every recipient device sends a delivery receipt for each '
+        'message it gets; the recipient reads each message a few seconds '
+        'later when the chat is open (--active), and otherwise scrolls through '
+        'the burst later, sending a read receipt per message. The receipts are '
+        'replayed as per-message is_read updates (the old behaviour), written '
+        'through one by one, and coalesced over each --windows value, counting '
+        'the write statements of each. Everything runs in a transaction that '
+        'is rolled back.'
+    )
+    
+    def add_arguments(self, parser):
+        parser.add_argument('--conversations', type=int, default=100,
+                            help='Conversations, each between two users')
+        parser.add_argument('--devices', type=int, default=2,
+                            help='Connected devices per recipient')
+        parser.add_argument('--burst-interval', type=float, default=60,
+                            help='Average seconds between bursts of messages in one conversation')
+        parser.add_argument('--burst-size', type=int, default=5,
+                            help='Most messages in a burst, a few seconds apart')
+        parser.add_argument('--active', type=float, default=0.5,
+                            help='Share of bursts read as they arrive')
+        parser.add_argument('--minutes', type=float, default=5,
+                            help='Simulated minutes of chat')
+        parser.add_argument('--windows', default='1,2,5',
+                            help='Comma-separated flush windows in seconds')
+    
+    def handle(self, *args, **options):
+        user_ids = list(User.objects.order_by('id').values_list('id', flat=True)[:2 * options['conversations']])
+        if len(user_ids) < 2 * options['conversations']:
+            raise CommandError(f"Need {2 * options['conversations']} users, found {len(user_ids)}; "
+                               'run generate_dataset first')
+        pairs = list(zip(user_ids[::2], user_ids[1::2]))
+        seconds = options['minutes'] * 60
+        windows = [float(window) for window in options['windows'].split(',')]
+        self.stdout.write(
+            f"Receipt benchmark ({connection.vendor}, {len(pairs)} conversations, "
+            f"{options['devices']} devices per recipient, a burst of up to {options['burst_size']} messages "
+            f"every {options['burst_interval']:g} s per conversation, {options['minutes']:g} simulated minutes)"
+        )
+        
+        modes = [('per message', None), ('write-through', 0)] + [(f'window {window:g} s', window) for window in windows]
+        baseline = None
+        for label, window in modes:
+            counter = WriteCounter()
+            try:
+                with transaction.atomic(), connection.execute_wrapper(counter):
+                    events = self.chat(pairs, seconds, options)
+                    counter.enabled = True
+                    started = time.perf_counter()
+                    transactions = self.replay(events, window)
+                    elapsed = time.perf_counter() - started
+                    raise Rollback
+            except Rollback:
+                pass
+            if window == 0:
+                baseline = counter.writes
+            line = (
+                f'  {label:<14} {len(events):>7,} receipts  {transactions:>7,} transactions  '
+                f'{counter.writes:>7,} writes  {counter.writes / seconds:>8,.1f} writes/s  '
+                f'{elapsed:6.2f} s to apply'
+            )
+            if baseline and window:
+                line += f'  ({counter.writes / baseline:.1%} of write-through)'
+            self.stdout.write(line)
+    
+    def chat(self, pairs, seconds, options):
+        """
+        Send the simulated messages and return the receipts for them.
+        
+        Receipts are ``(time, reader id, sender id, delivered up to, read up
+        to)`` in time order, one per message and kind (and device, for
+        deliveries), as a client acknowledging each message separately
+        would send them.
+        """
+        rng = random.Random(0)
+        bursts = []
+        for pair in pairs:
+            at = rng.uniform(0, options['burst_interval'])
+            while at < seconds:
+                bursts.append((at, *rng.sample(pair, 2)))
+                at += rng.expovariate(1 / options['burst_interval'])
+        bursts.sort()
+        
+        sent = []
+        for at, sender_id, recipient_id in bursts:
+            active = rng.random() < options['active']
+            opened_at = at + rng.uniform(30, 300)
+            for number in range(rng.randint(1, options['burst_size'])):
+                sent.append((at, sender_id, recipient_id, at + rng.uniform(1, 3) if active else opened_at + 0.3 * number))
+                at += rng.uniform(1, 5)
+        sent.sort()
+        
+        events = []
+        for at, sender_id, recipient_id, read_at in sent:
+            message = Message.objects.create(sender_id=sender_id, recipient_id=recipient_id, content='benchmark')
+            conversations.record_message(message)
+            for _ in range(options['devices']):
+                events.append((at + rng.uniform(0.05, 0.5), recipient_id, sender_id, message.id, 0))
+            events.append((read_at, recipient_id, sender_id, 0, message.id))
+        events.sort()
+        return events
+    
+    def replay(self, events, window):
+        """Apply receipts as the given mode would; returns the transactions written"""
+        if window is None:
+            # Before receipts: clients marked each message read, and delivery went unrecorded
+            messages = Message.objects.in_bulk([read for _, _, _, _, read in events if read])
+            for _, _, _, _, read in events:
+                if read:
+                    messages[read].is_read = False
+                    messages[read].mark_as_read()
+            return sum(1 for event in events if event[4])
+        if window == 0:
+            for _, reader_id, sender_id, delivered, read in events:
+                receipts.persist(reader_id, sender_id, delivered, read)
+            return len(events)
+        
+        buffer = receipts.ReceiptBuffer()
+        transactions = 0
+        opened_at = None
+        for at, reader_id, sender_id, delivered, read in events:
+            if opened_at is not None and at - opened_at >= window:
+                transactions += self.flush(buffer)
+                opened_at = None
+            if buffer.add(reader_id, sender_id, delivered, read):
+                opened_at = at
+        return transactions + self.flush(buffer)
+    
+    def flush(self, buffer):
+        pending = buffer.drain()
+        for (reader_id, sender_id), (delivered, read) in pending.items():
+            receipts.persist(reader_id, sender_id, delivered, read)
+        return len(pending)
@@ -0,0 +1,144 @@
+import asyncio
+import base64
+import os
+import time
+from urllib.parse import urlsplit
+
+from django.core.management.base import BaseCommand, CommandError
+
+
+def read_rss_kb(pid):
+    """Resident set size of a process in kB (Linux only)"""
+    try:
+        with open(f'/proc/{pid}/status') as status:
+            for line in status:
+                if line.startswith('VmRSS:'):
+                    return int(line.split()[1])
+    except OSError:
+        return None
+    return None
+
+
+class Command(BaseCommand):
+    help = (
+        'Open many idle WebSocket connections against a running ASGI server '
+        'and report how many one worker process can hold'
+    )
+    
+    def add_arguments(self, parser):
+        parser.add_argument('--url', default='ws://127.0.0.1:8000/ws/messages/',
+                            help='WebSocket endpoint to connect to')
+        parser.add_argument('--token', required=True,
+                            help='JWT access token used for every connection')
+        parser.add_argument('--connections', type=int, default=1000,
+                            help='Number of idle connections to open')
+        parser.add_argument('--ramp', type=int, default=100,
+                            help='Maximum number of handshakes in flight at once')
+        parser.add_argument('--hold', type=float, default=10.0,
+                            help='Seconds to keep the connections open once established')
+        parser.add_argument('--pid', type=int,
+                            help='Server worker PID, used to report memory per connection')
+    
+    def handle(self, *args, **options):
+        url = urlsplit(options['url'])
+        if url.scheme != 'ws':
+            raise CommandError('Only plain ws:// URLs are supported')
+        
+        report = asyncio.run(self.run(url, options))
+        
+        self.stdout.write(f"established:     {report['established']}/{options['connections']}")
+        self.stdout.write(f"failed:          {report['failed']}")
+        self.stdout.write(f"handshake time:  {report['elapsed']:.2f}s")
+        if report['alive'] is not None:
+            self.stdout.write(f"alive after {options['hold']:.0f}s: {report['alive']}")
+        if report['rss_before'] and report['rss_after'] and report['established']:
+            per_connection = (report['rss_after'] - report['rss_before']) / report['established']
+            self.stdout.write(
+                f"server RSS:      {report['rss_before'] / 1024:.1f} MB -> "
+                f"{report['rss_after'] / 1024:.1f} MB ({per_connection:.1f} kB/connection)"
+            )
+    
+    async def run(self, url, options):
+        semaphore = asyncio.Semaphore(options['ramp'])
+        rss_before = read_rss_kb(options['pid']) if options['pid'] else None
+        
+        async def open_one():
+            async with semaphore:
+                try:
+                    reader, writer = await self.handshake(url, options['token'])
+                except (OSError, asyncio.TimeoutError, ValueError):
+                    return None
+                # Start answering pings at once so early sockets survive a slow ramp-up
+                return writer, asyncio.create_task(self.keepalive(reader, writer))
+        
+        started = time.perf_counter()
+        results = await asyncio.gather(*[open_one() for _ in range(options['connections'])])
+        elapsed = time.perf_counter() - started
+        
+        connections = [conn for conn in results if conn is not None]
+        await asyncio.sleep(options['hold'])
+        
+        rss_after = read_rss_kb(options['pid']) if options['pid'] else None
+        alive = sum(1 for writer, keepalive in connections if not keepalive.done())
+        
+        for writer, keepalive in connections:
+            keepalive.cancel()
+            writer.close()
+        
+        return {
+            'established': len(connections),
+            'failed': len(results) - len(connections),
+            'elapsed': elapsed,
+            'alive': alive,
+            'rss_before': rss_before,
+            'rss_after': rss_after,
+        }
+    
+    async def keepalive(self, reader, writer):
+        """Behave like an idle client: answer server pings until the socket closes"""
+        try:
+            while True:
+                head = await reader.readexactly(2)
+                opcode = head[0] & 0x0F
+                length = head[1] & 0x7F
+                if length == 126:
+                    length = int.from_bytes(await reader.readexactly(2), 'big')
+                elif length == 127:
+                    length = int.from_bytes(await reader.readexactly(8), 'big')
+                payload = await reader.readexactly(length)
+                
+                if opcode == 0x8:
+                    return
+                if opcode == 0x9:
+                    # Client frames must be masked; control payloads are <= 125 bytes
+                    mask = os.urandom(4)
+                    masked = bytes(byte ^ mask[i % 4] for i, byte in enumerate(payload))
+                    writer.write(bytes([0x8A, 0x80 | len(payload)]) + mask + masked)
+                    await writer.drain()
+        except (OSError, asyncio.IncompleteReadError):
+            return
+    
+    async def handshake(self, url, token):
+        """Perform a bare WebSocket upgrade and return the open stream pair"""
+        reader, writer = await asyncio.wait_for(
+            asyncio.open_connection(url.hostname, url.port or 80), timeout=10
+        )
+        key = base64.b64encode(os.urandom(16)).decode()
+        path = url.path or '/'
+        writer.write((
+            f'GET {path}?token={token} HTTP/1.1\r\n'
+            f'Host: {url.netloc}\r\n'
+            'Upgrade: websocket\r\n'
+            'Connection: Upgrade\r\n'
+            f'Sec-WebSocket-Key: {key}\r\n'
+            'Sec-WebSocket-Version: 13\r\n'
+            '\r\n'
+        ).encode())
+        await writer.drain()
+        
+        status_line = await asyncio.wait_for(reader.readline(), timeout=10)
+        if b' 101 ' not in status_line:
+            writer.close()
+            raise ValueError(status_line)
+        await asyncio.wait_for(reader.readuntil(b'\r\n\r\n'), timeout=10)
+        return reader, writer
@@ -0,0 +1,47 @@
+from datetime import datetime, timezone
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from messaging import partitions
+
+
+class Command(BaseCommand):
+    help = (
+        'Create monthly partitions of the messages table ahead of time and '
+        'detach the ones older than the retention period, then list the '
+        'partitions. The beat task manage_message_partitions does the same '
+        'daily with the settings defaults. PostgreSQL only.'
+    )
+    
+    def add_arguments(self, parser):
+        parser.add_argument('--ahead', type=int, default=settings.MESSAGE_PARTITIONS_AHEAD,
+                            help='Months of partitions to create beyond the current one')
+        parser.add_argument('--since',
+                            help='Also create partitions for past months from YYYY-MM, moving '
+                                 'their rows out of the default partition')
+        parser.add_argument('--retain-months', type=int, default=settings.MESSAGE_RETENTION_MONTHS,
+                            help='Detach partitions entirely older than this many months (0 keeps all)')
+        parser.add_argument('--drop', action='store_true',
+                            help='Drop detached partitions instead of keeping them as tables')
+    
+    def handle(self, *args, **options):
+        if not partitions.is_partitioned():
+            raise CommandError('The messages table is not partitioned (PostgreSQL only, see migration 0007)')
+        since = None
+        if options['since']:
+            try:
+                since = datetime.strptime(options['since'], '%Y-%m').replace(tzinfo=timezone.utc)
+            except ValueError:
+                raise CommandError('--since must look like 2024-01')
+        
+        for name in partitions.ensure_partitions(options['ahead'], since=since):
+            self.stdout.write(f'Created {name}')
+        for name in partitions.detach_partitions(options['retain_months'], drop=options['drop']):
+            self.stdout.write(f"{'Dropped' if options['drop'] else 'Detached'} {name}")
+        
+        for name, lower, upper in partitions.list_partitions():
+            lower = lower.date().isoformat() if lower else '-'
+            upper = upper.date().isoformat() if upper else '-'
+            self.stdout.write(f'{name:<20} {lower:>10} .. {upper}')
+        self.stdout.write(self.style.SUCCESS('Partitions are up to date'))
@@ -0,0 +1,125 @@
+from collections import defaultdict
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Count, Sum
+
+from messaging.models import Conversation, Message, UnreadCounter
+
+
+class Command(BaseCommand):
+    help = (
+        'Compare the maintained unread counters with the messages table and '
+        'repair any drift. Users are checked in id-ordered chunks; each repair '
+        'recounts under a row lock so it is safe while the site is live.'
+    )
+    
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=1000,
+                            help='Users checked per pass')
+        parser.add_argument('--dry-run', action='store_true',
+                            help='Report drift without repairing it')
+    
+    def handle(self, *args, **options):
+        from django.contrib.auth import get_user_model
+        User = get_user_model()
+        
+        chunk_size = options['chunk_size']
+        dry_run = options['dry_run']
+        last_id = 0
+        conversation_fixes = 0
+        total_fixes = 0
+        
+        while True:
+            user_ids = list(
+                User.objects.filter(id__gt=last_id).order_by('id').values_list('id', flat=True)[:chunk_size]
+            )
+            if not user_ids:
+                break
+            last_id = user_ids[-1]
+            
+            conversation_fixes += self.check_conversations(user_ids, dry_run)
+            total_fixes += self.check_totals(user_ids, dry_run)
+        
+        verb = 'Found' if dry_run else 'Repaired'
+        self.stdout.write(self.style.SUCCESS(
+            f'{verb} {conversation_fixes} conversation counter(s) and {total_fixes} total counter(s)'
+        ))
+    
+    def check_conversations(self, user_ids, dry_run):
+        """Compare per-conversation counters of these recipients with real unread rows"""
+        actual = defaultdict(int)
+        unread = (
+            Message.objects.filter(recipient_id__in=user_ids, is_read=False)
+            .values('recipient_id', 'sender_id')
+            .annotate(count=Count('id'))
+        )
+        for row in unread:
+            if row['recipient_id'] != row['sender_id']:
+                actual[(row['recipient_id'], row['sender_id'])] = row['count']
+        
+        stored = {}
+        for conversation in Conversation.objects.filter(user_low_id__in=user_ids):
+            stored[(conversation.user_low_id, conversation.user_high_id)] = conversation.unread_count_low
+        for conversation in Conversation.objects.filter(user_high_id__in=user_ids):
+            stored[(conversation.user_high_id, conversation.user_low_id)] = conversation.unread_count_high
+        
+        fixes = 0
+        for reader_id, sender_id in set(actual) | set(stored):
+            if actual.get((reader_id, sender_id), 0) == stored.get((reader_id, sender_id), 0):
+                continue
+            fixes += 1
+            self.stdout.write(
+                f'Conversation {reader_id}<-{sender_id}: stored '
+                f'{stored.get((reader_id, sender_id), 0)}, actual {actual.get((reader_id, sender_id), 0)}'
+            )
+            if not dry_run:
+                self.repair_conversation(reader_id, sender_id)
+        return fixes
+    
+    def repair_conversation(self, reader_id, sender_id):
+        user_low_id, user_high_id = Conversation.canonical_pair(reader_id, sender_id)
+        field = Conversation.unread_field(reader_id, sender_id)
+        with transaction.atomic():
+            conversation = Conversation.objects.select_for_update().filter(
+                user_low_id=user_low_id,
+                user_high_id=user_high_id
+            ).first()
+            if conversation is None:
+                # Summary missing entirely; rebuild it with backfill_conversations
+                return
+            count = Message.objects.filter(recipient_id=reader_id, sender_id=sender_id, is_read=False).count()
+            setattr(conversation, field, count)
+            conversation.save(update_fields=[field, 'updated_at'])
+    
+    def check_totals(self, user_ids, dry_run):
+        """Compare each user's total with the sum of their conversation counters"""
+        sums = defaultdict(int)
+        for row in Conversation.objects.filter(user_low_id__in=user_ids).values('user_low_id').annotate(
+            total=Sum('unread_count_low')
+        ):
+            sums[row['user_low_id']] += row['total']
+        for row in Conversation.objects.filter(user_high_id__in=user_ids).values('user_high_id').annotate(
+            total=Sum('unread_count_high')
+        ):
+            sums[row['user_high_id']] += row['total']
+        
+        stored = dict(UnreadCounter.objects.filter(user_id__in=user_ids).values_list('user_id', 'total'))
+        
+        fixes = 0
+        for user_id in user_ids:
+            if sums.get(user_id, 0) == stored.get(user_id, 0):
+                continue
+            fixes += 1
+            self.stdout.write(f'User {user_id} total: stored {stored.get(user_id, 0)}, actual {sums.get(user_id, 0)}')
+            if not dry_run:
+                self.repair_total(user_id)
+        return fixes
+    
+    def repair_total(self, user_id):
+        with transaction.atomic():
+            counter, _ = UnreadCounter.objects.select_for_update().get_or_create(user_id=user_id)
+            low = Conversation.objects.filter(user_low_id=user_id).aggregate(total=Sum('unread_count_low'))
+            high = Conversation.objects.filter(user_high_id=user_id).aggregate(total=Sum('unread_count_high'))
+            counter.total = (low['total'] or 0) + (high['total'] or 0)
+            counter.save(update_fields=['total', 'updated_at'])
@@ -0,0 +1,47 @@
+from urllib.parse import parse_qs
+
+from channels.db import database_sync_to_async
+from django.contrib.auth.models import AnonymousUser
+from rest_framework_simplejwt.exceptions import InvalidToken, AuthenticationFailed
+
+from accounts.authentication import CachedJWTAuthentication
+
+
+class JWTAuthMiddleware:
+    """
+    Authenticate WebSocket connections with SimpleJWT access tokens.
+    
+    The token is read from the ``token`` query parameter (browsers and
+    React Native cannot always set headers on a WebSocket handshake) or
+    from a ``Authorization: Bearer <token>`` header.
+    """
+    
+    def __init__(self, inner):
+        self.inner = inner
+        self.authentication = CachedJWTAuthentication()
+    
+    async def __call__(self, scope, receive, send):
+        scope = dict(scope)
+        scope['user'] = await self.get_user(self.get_raw_token(scope))
+        return await self.inner(scope, receive, send)
+    
+    def get_raw_token(self, scope):
+        """Extract the raw token from the query string or headers"""
+        query = parse_qs(scope.get('query_string', b'').decode())
+        if query.get('token'):
+            return query['token'][0].encode()
+        
+        for name, value in scope.get('headers', []):
+            if name == b'authorization':
+                return self.authentication.get_raw_token(value)
+        return None
+    
+    @database_sync_to_async
+    def get_user(self, raw_token):
+        if raw_token is None:
+            return AnonymousUser()
+        try:
+            validated_token = self.authentication.get_validated_token(raw_token)
+            return self.authentication.get_user(validated_token)
+        except (InvalidToken, AuthenticationFailed):
+            return AnonymousUser()
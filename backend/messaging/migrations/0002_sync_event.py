@@ -0,0 +1,34 @@
+# Generated by Django 4.2.7 on 2026-10-18 13:25
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('messaging', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SyncEvent',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('event_type', models.CharField(choices=[('message', 'New Message'), ('read', 'Read Receipt'), ('delete', 'Message Deleted')], help_text='Kind of change', max_length=10, verbose_name='Event Type')),
+                ('message_id', models.BigIntegerField(help_text='Affected message; kept after deletion so it can act as a tombstone', verbose_name='Message ID')),
+                ('read_at', models.DateTimeField(blank=True, help_text='When the message was read (read receipts only)', null=True, verbose_name='Read At')),
+                ('created_at', models.DateTimeField(auto_now_add=True, verbose_name='Created At')),
+                ('user', models.ForeignKey(help_text='User whose clients should receive this change', on_delete=django.db.models.deletion.CASCADE, related_name='sync_events', to=settings.AUTH_USER_MODEL, verbose_name='User')),
+            ],
+            options={
+                'verbose_name': 'Sync Event',
+                'verbose_name_plural': 'Sync Events',
+                'db_table': 'sync_events',
+                'ordering': ['id'],
+                'indexes': [models.Index(fields=['user', 'id'], name='sync_events_user_id_4d5c3a_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,39 @@
+# Generated by Django 4.2.7 on 2026-10-18 13:27
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('messaging', '0002_sync_event'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Conversation',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('last_message_id', models.BigIntegerField(blank=True, help_text='Most recent message in the conversation', null=True, verbose_name='Last Message ID')),
+                ('last_sender_id', models.BigIntegerField(blank=True, help_text='Sender of the most recent message', null=True, verbose_name='Last Sender ID')),
+                ('last_message_at', models.DateTimeField(blank=True, help_text='When the most recent message was sent', null=True, verbose_name='Last Activity')),
+                ('preview', models.CharField(blank=True, default='', help_text='Start of the most recent message', max_length=100, verbose_name='Preview')),
+                ('unread_count_low', models.PositiveIntegerField(default=0, help_text='Messages not yet read by user_low', verbose_name='Unread Count (lower id)')),
+                ('unread_count_high', models.PositiveIntegerField(default=0, help_text='Messages not yet read by user_high', verbose_name='Unread Count (higher id)')),
+                ('updated_at', models.DateTimeField(auto_now=True, verbose_name='Updated At')),
+                ('user_high', models.ForeignKey(help_text='Participant with the higher user id', on_delete=django.db.models.deletion.CASCADE, related_name='+', to=settings.AUTH_USER_MODEL, verbose_name='User (higher id)')),
+                ('user_low', models.ForeignKey(help_text='Participant with the lower user id', on_delete=django.db.models.deletion.CASCADE, related_name='+', to=settings.AUTH_USER_MODEL, verbose_name='User (lower id)')),
+            ],
+            options={
+                'verbose_name': 'Conversation',
+                'verbose_name_plural': 'Conversations',
+                'db_table': 'conversations',
+                'ordering': ['-last_message_at', '-id'],
+                'indexes': [models.Index(fields=['user_low', '-last_message_at', '-id'], name='conversatio_user_lo_aee30d_idx'), models.Index(fields=['user_high', '-last_message_at', '-id'], name='conversatio_user_hi_246882_idx')],
+                'unique_together': {('user_low', 'user_high')},
+            },
+        ),
+    ]
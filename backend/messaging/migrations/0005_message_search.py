@@ -0,0 +1,72 @@
+from django.contrib.postgres.operations import BtreeGinExtension
+from django.db import migrations
+
+BATCH_SIZE = 10000
+
+
+def create_search_vector(apps, schema_editor):
+    """
+    Add the trigger-maintained messages.search_vector column and its indexes.
+    
+    Adding a nullable column is instant; existing rows are then filled in id
+    batches that each commit on their own, and the indexes are built
+    concurrently, so the table stays writable throughout. Other databases
+    use the unindexed fallback in messaging.search.
+    """
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    schema_editor.execute('ALTER TABLE messages ADD COLUMN IF NOT EXISTS search_vector tsvector')
+    schema_editor.execute("""
+        CREATE OR REPLACE FUNCTION messages_search_vector_update() RETURNS trigger AS $$
+        BEGIN
+            NEW.search_vector := to_tsvector('english', coalesce(NEW.content, ''));
+            RETURN NEW;
+        END
+        $$ LANGUAGE plpgsql
+    """)
+    schema_editor.execute("""
+        CREATE OR REPLACE TRIGGER messages_search_vector_trigger
+        BEFORE INSERT OR UPDATE OF content ON messages
+        FOR EACH ROW EXECUTE FUNCTION messages_search_vector_update()
+    """)
+    
+    with schema_editor.connection.cursor() as cursor:
+        cursor.execute('SELECT coalesce(max(id), 0) FROM messages')
+        max_id = cursor.fetchone()[0]
+        for start in range(0, max_id, BATCH_SIZE):
+            cursor.execute(
+                "UPDATE messages SET search_vector = to_tsvector('english', coalesce(content, '')) "
+                "WHERE id > %s AND id <= %s AND search_vector IS NULL",
+                [start, start + BATCH_SIZE]
+            )
+    
+    for column in ('sender_id', 'recipient_id'):
+        schema_editor.execute(
+            f'CREATE INDEX CONCURRENTLY IF NOT EXISTS messages_{column}_search_idx '
+            f'ON messages USING gin ({column}, search_vector)'
+        )
+
+
+def drop_search_vector(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    for column in ('sender_id', 'recipient_id'):
+        schema_editor.execute(f'DROP INDEX CONCURRENTLY IF EXISTS messages_{column}_search_idx')
+    schema_editor.execute('DROP TRIGGER IF EXISTS messages_search_vector_trigger ON messages')
+    schema_editor.execute('DROP FUNCTION IF EXISTS messages_search_vector_update()')
+    schema_editor.execute('ALTER TABLE messages DROP COLUMN IF EXISTS search_vector')
+
+
+class Migration(migrations.Migration):
+    # Backfill batches and concurrent index builds must run outside a transaction
+    atomic = False
+    
+    dependencies = [
+        ('messaging', '0004_unread_counters'),
+    ]
+    
+    operations = [
+        # Lets the GIN indexes lead with the integer user columns; no-op elsewhere
+        BtreeGinExtension(),
+        migrations.RunPython(create_search_vector, drop_search_vector),
+    ]
@@ -0,0 +1,73 @@
+# Generated by Django 4.2.7 on 2026-10-18 14:27
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('messaging', '0005_message_search'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='GroupConversation',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(help_text='Display name of the group', max_length=100, verbose_name='Name')),
+                ('last_seq', models.PositiveBigIntegerField(default=0, help_text='Sequence number of the most recent message', verbose_name='Last Sequence')),
+                ('last_sender_id', models.BigIntegerField(blank=True, help_text='Sender of the most recent message', null=True, verbose_name='Last Sender ID')),
+                ('last_message_at', models.DateTimeField(blank=True, help_text='When the most recent message was sent, or the group was created', null=True, verbose_name='Last Activity')),
+                ('preview', models.CharField(blank=True, default='', help_text='Start of the most recent message', max_length=100, verbose_name='Preview')),
+                ('member_count', models.PositiveIntegerField(default=0, verbose_name='Member Count')),
+                ('created_at', models.DateTimeField(auto_now_add=True, verbose_name='Created At')),
+                ('updated_at', models.DateTimeField(auto_now=True, verbose_name='Updated At')),
+                ('created_by', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='created_groups', to=settings.AUTH_USER_MODEL, verbose_name='Created By')),
+            ],
+            options={
+                'verbose_name': 'Group Conversation',
+                'verbose_name_plural': 'Group Conversations',
+                'db_table': 'group_conversations',
+            },
+        ),
+        migrations.CreateModel(
+            name='GroupMessage',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('seq', models.PositiveBigIntegerField(help_text='Position of the message in the group, starting at 1', verbose_name='Sequence')),
+                ('message_type', models.CharField(choices=[('text', 'Text Message'), ('image', 'Image Message'), ('file', 'File Attachment'), ('system', 'System Message')], default='text', max_length=10, verbose_name='Message Type')),
+                ('content', models.TextField(blank=True, null=True, verbose_name='Message Content')),
+                ('attachment_url', models.URLField(blank=True, null=True, verbose_name='Attachment URL')),
+                ('created_at', models.DateTimeField(auto_now_add=True, verbose_name='Created At')),
+                ('group', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='messages', to='messaging.groupconversation', verbose_name='Group')),
+                ('sender', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='sent_group_messages', to=settings.AUTH_USER_MODEL, verbose_name='Sender')),
+            ],
+            options={
+                'verbose_name': 'Group Message',
+                'verbose_name_plural': 'Group Messages',
+                'db_table': 'group_messages',
+                'unique_together': {('group', 'seq')},
+            },
+        ),
+        migrations.CreateModel(
+            name='GroupMember',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('role', models.CharField(choices=[('admin', 'Admin'), ('member', 'Member')], default='member', help_text='Admins can add members', max_length=10, verbose_name='Role')),
+                ('last_read_seq', models.PositiveBigIntegerField(default=0, help_text='Every message up to this sequence number has been read', verbose_name='Last Read Sequence')),
+                ('joined_at', models.DateTimeField(auto_now_add=True, verbose_name='Joined At')),
+                ('group', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='members', to='messaging.groupconversation', verbose_name='Group')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='group_memberships', to=settings.AUTH_USER_MODEL, verbose_name='User')),
+            ],
+            options={
+                'verbose_name': 'Group Member',
+                'verbose_name_plural': 'Group Members',
+                'db_table': 'group_members',
+                'indexes': [models.Index(fields=['user', 'group'], name='group_membe_user_id_db54e1_idx')],
+                'unique_together': {('group', 'user')},
+            },
+        ),
+    ]
@@ -0,0 +1,186 @@
+import re
+from datetime import datetime, timedelta, timezone
+
+from django.conf import settings
+from django.db import migrations, transaction
+from django.db.migrations.exceptions import IrreversibleError
+
+# Frozen copies of messaging.partitions: a migration must not change when
+# the runtime module does, and everything here runs on schema_editor.connection
+PARENT_TABLE = 'messages'
+DEFAULT_PARTITION = 'messages_default'
+LEGACY_PARTITION = 'messages_legacy'
+
+
+def month_start(value):
+    value = value.astimezone(timezone.utc)
+    return datetime(value.year, value.month, 1, tzinfo=timezone.utc)
+
+
+def add_months(value, months):
+    month = value.month - 1 + months
+    return value.replace(year=value.year + month // 12, month=month % 12 + 1)
+
+
+def is_partitioned(connection):
+    if connection.vendor != 'postgresql':
+        return False
+    with connection.cursor() as cursor:
+        cursor.execute('SELECT relkind FROM pg_class WHERE oid = to_regclass(%s)', [PARENT_TABLE])
+        row = cursor.fetchone()
+    return row is not None and row[0] == 'p'
+
+
+def create_partition(connection, start):
+    """Create the partition for the month beginning at ``start``, moving in its rows from the default partition"""
+    name = f'{PARENT_TABLE}_p{start:%Y%m}'
+    end = add_months(start, 1)
+    with transaction.atomic(using=connection.alias), connection.cursor() as cursor:
+        cursor.execute('SELECT to_regclass(%s) IS NOT NULL', [name])
+        if cursor.fetchone()[0]:
+            return
+        cursor.execute(f'CREATE TABLE {name} (LIKE {PARENT_TABLE} INCLUDING DEFAULTS INCLUDING STORAGE)')
+        cursor.execute(f"""
+            WITH moved AS (
+                DELETE FROM {DEFAULT_PARTITION}
+                WHERE created_at >= %(start)s AND created_at < %(end)s
+                RETURNING *
+            )
+            INSERT INTO {name} SELECT * FROM moved
+        """, {'start': start, 'end': end})
+        cursor.execute(
+            f'ALTER TABLE {PARENT_TABLE} ATTACH PARTITION {name} FOR VALUES FROM (%s) TO (%s)',
+            [start.isoformat(), end.isoformat()]
+        )
+
+
+def partition_messages(apps, schema_editor):
+    """
+    Turn ``messages`` into a table range-partitioned on ``created_at``.
+    
+    Nothing is copied. The existing table first gets, while it stays
+    writable, a unique (id, created_at) index built concurrently and a
+    validated CHECK constraint bounding ``created_at`` below the first
+    monthly partition. A short transaction then renames it to
+    ``messages_legacy``, creates the partitioned ``messages`` with the same
+    columns, indexes, foreign keys and search trigger, and attaches the old
+    table as the partition for everything before that bound; the constraint
+    spares PostgreSQL the scan and the matching indexes are adopted instead
+    of rebuilt. An empty table is simply replaced. Other databases keep the
+    plain table.
+    """
+    connection = schema_editor.connection
+    if connection.vendor != 'postgresql' or is_partitioned(connection):
+        return
+    
+    # Give the legacy table at least a day before its range closes
+    now = datetime.now(timezone.utc)
+    cutoff = add_months(month_start(now), 1)
+    if cutoff - now < timedelta(days=1):
+        cutoff = add_months(cutoff, 1)
+    
+    with connection.cursor() as cursor:
+        cursor.execute(f'SELECT EXISTS (SELECT 1 FROM {PARENT_TABLE})')
+        populated = cursor.fetchone()[0]
+        if populated:
+            cursor.execute(
+                f'CREATE UNIQUE INDEX CONCURRENTLY IF NOT EXISTS messages_legacy_id_created_at '
+                f'ON {PARENT_TABLE} (id, created_at)'
+            )
+            cursor.execute(
+                f'ALTER TABLE {PARENT_TABLE} ADD CONSTRAINT messages_legacy_range '
+                f'CHECK (created_at < %s) NOT VALID',
+                [cutoff.isoformat()]
+            )
+            cursor.execute(f'ALTER TABLE {PARENT_TABLE} VALIDATE CONSTRAINT messages_legacy_range')
+    
+    with transaction.atomic(using=connection.alias), connection.cursor() as cursor:
+        cursor.execute(f'LOCK TABLE {PARENT_TABLE} IN ACCESS EXCLUSIVE MODE')
+        cursor.execute(f'SELECT coalesce(max(id), 0) FROM {PARENT_TABLE}')
+        next_id = cursor.fetchone()[0] + 1
+        cursor.execute("""
+            SELECT index.relname, pg_get_indexdef(index.oid)
+            FROM pg_index
+            JOIN pg_class index ON index.oid = pg_index.indexrelid
+            WHERE pg_index.indrelid = to_regclass(%s)
+                AND NOT pg_index.indisprimary AND index.relname <> 'messages_legacy_id_created_at'
+        """, [PARENT_TABLE])
+        indexes = cursor.fetchall()
+        cursor.execute("""
+            SELECT conname, pg_get_constraintdef(oid)
+            FROM pg_constraint
+            WHERE conrelid = to_regclass(%s) AND contype = 'f'
+        """, [PARENT_TABLE])
+        foreign_keys = cursor.fetchall()
+        
+        # Index names are schema-wide, so the legacy ones make way for the parent's
+        for name, _ in indexes:
+            cursor.execute(f'ALTER INDEX {name} RENAME TO {name[:50]}_legacy')
+        cursor.execute('ALTER INDEX messages_pkey RENAME TO messages_legacy_pkey')
+        cursor.execute(f'ALTER TABLE {PARENT_TABLE} RENAME TO {LEGACY_PARTITION}')
+        cursor.execute(f'ALTER TABLE {LEGACY_PARTITION} ALTER COLUMN id DROP IDENTITY IF EXISTS')
+        # Tables created before identity columns use a serial sequence instead
+        cursor.execute(f'ALTER TABLE {LEGACY_PARTITION} ALTER COLUMN id DROP DEFAULT')
+        cursor.execute('DROP SEQUENCE IF EXISTS messages_id_seq')
+        cursor.execute(f'DROP TRIGGER IF EXISTS messages_search_vector_trigger ON {LEGACY_PARTITION}')
+        
+        cursor.execute(
+            f'CREATE TABLE {PARENT_TABLE} (LIKE {LEGACY_PARTITION} INCLUDING DEFAULTS INCLUDING STORAGE) '
+            f'PARTITION BY RANGE (created_at)'
+        )
+        cursor.execute(f'CREATE SEQUENCE messages_id_seq START {next_id} OWNED BY {PARENT_TABLE}.id')
+        cursor.execute(f"ALTER TABLE {PARENT_TABLE} ALTER COLUMN id SET DEFAULT nextval('messages_id_seq')")
+        cursor.execute(f'ALTER TABLE {PARENT_TABLE} ADD CONSTRAINT messages_pkey PRIMARY KEY (id, created_at)')
+        for _, definition in indexes:
+            cursor.execute(re.sub(rf' ON (\w+\.)?{PARENT_TABLE} ', f' ON {PARENT_TABLE} ', definition))
+        for name, definition in foreign_keys:
+            cursor.execute(f'ALTER TABLE {PARENT_TABLE} ADD CONSTRAINT {name} {definition}')
+        cursor.execute(f"""
+            CREATE TRIGGER messages_search_vector_trigger
+            BEFORE INSERT OR UPDATE OF content ON {PARENT_TABLE}
+            FOR EACH ROW EXECUTE FUNCTION messages_search_vector_update()
+        """)
+        cursor.execute(f'CREATE TABLE {DEFAULT_PARTITION} PARTITION OF {PARENT_TABLE} DEFAULT')
+        
+        if populated:
+            cursor.execute(
+                f'ALTER TABLE {PARENT_TABLE} ATTACH PARTITION {LEGACY_PARTITION} '
+                f'FOR VALUES FROM (MINVALUE) TO (%s)',
+                [cutoff.isoformat()]
+            )
+            cursor.execute(f'ALTER TABLE {LEGACY_PARTITION} DROP CONSTRAINT messages_legacy_range')
+        else:
+            cursor.execute(f'DROP TABLE {LEGACY_PARTITION}')
+    
+    # The legacy partition covers everything before the cutoff
+    month = cutoff if populated else month_start(now)
+    while month <= add_months(month_start(now), settings.MESSAGE_PARTITIONS_AHEAD):
+        create_partition(connection, month)
+        month = add_months(month, 1)
+
+
+def keep_partitions(apps, schema_editor):
+    """
+    Going back only works where nothing was partitioned.
+    
+    This is irreversible on purpose for a partitioned table: turning it
+    back into a plain one would copy every message under an exclusive lock,
+    which needs a planned maintenance window rather than ``migrate``.
+    """
+    if is_partitioned(schema_editor.connection):
+        raise IrreversibleError(
+            f'{PARENT_TABLE} is partitioned; copy it into a plain table by hand before migrating back'
+        )
+
+
+class Migration(migrations.Migration):
+    # The unique index is built concurrently, outside the swap transaction
+    atomic = False
+    
+    dependencies = [
+        ('messaging', '0006_group_conversations'),
+    ]
+    
+    operations = [
+        migrations.RunPython(partition_messages, reverse_code=keep_partitions),
+    ]
@@ -0,0 +1,39 @@
+# Generated by Django 4.2.7 on 2026-10-18 15:02
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('messaging', '0007_partition_messages'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ArchiveChunk',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('first_message_id', models.BigIntegerField(verbose_name='First Message ID')),
+                ('first_created_at', models.DateTimeField(verbose_name='First Message At')),
+                ('last_message_id', models.BigIntegerField(verbose_name='Last Message ID')),
+                ('last_created_at', models.DateTimeField(verbose_name='Last Message At')),
+                ('message_count', models.PositiveIntegerField(verbose_name='Message Count')),
+                ('raw_size', models.PositiveBigIntegerField(help_text='Bytes of the chunk before compression', verbose_name='Raw Size')),
+                ('stored_size', models.PositiveBigIntegerField(help_text='Bytes of the compressed file', verbose_name='Stored Size')),
+                ('storage_key', models.CharField(help_text='Name of the file in the message_archive storage', max_length=255, verbose_name='Storage Key')),
+                ('created_at', models.DateTimeField(auto_now_add=True, verbose_name='Created At')),
+                ('user_high', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to=settings.AUTH_USER_MODEL, verbose_name='User (higher id)')),
+                ('user_low', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to=settings.AUTH_USER_MODEL, verbose_name='User (lower id)')),
+            ],
+            options={
+                'verbose_name': 'Archive Chunk',
+                'verbose_name_plural': 'Archive Chunks',
+                'db_table': 'message_archive_chunks',
+                'indexes': [models.Index(fields=['user_low', 'user_high', 'first_created_at', 'first_message_id'], name='message_arc_user_lo_92fbeb_idx')],
+            },
+        ),
+    ]
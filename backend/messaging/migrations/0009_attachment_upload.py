@@ -0,0 +1,40 @@
+# Generated by Django 4.2.7 on 2026-10-18 15:12
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+import uuid
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('messaging', '0008_archive_chunk'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AttachmentUpload',
+            fields=[
+                ('id', models.UUIDField(default=uuid.uuid4, editable=False, primary_key=True, serialize=False)),
+                ('filename', models.CharField(max_length=255, verbose_name='File Name')),
+                ('content_type', models.CharField(help_text='Type declared by the client; images are recognised from their content', max_length=100, verbose_name='Content Type')),
+                ('size', models.PositiveBigIntegerField(help_text='Total bytes declared when the upload was created', verbose_name='Size')),
+                ('received', models.PositiveBigIntegerField(default=0, help_text='Bytes stored so far; the offset the next chunk must start at', verbose_name='Received')),
+                ('status', models.CharField(choices=[('uploading', 'Uploading'), ('processing', 'Processing'), ('ready', 'Ready'), ('failed', 'Failed')], default='uploading', max_length=10, verbose_name='Status')),
+                ('storage_key', models.CharField(blank=True, help_text='Name of the finished file in the attachments storage', max_length=255, verbose_name='Storage Key')),
+                ('variants', models.JSONField(blank=True, default=dict, help_text='Resized images by name: storage key, width and height', verbose_name='Variants')),
+                ('message_id', models.BigIntegerField(blank=True, help_text='Message waiting for this attachment', null=True, verbose_name='Message ID')),
+                ('created_at', models.DateTimeField(auto_now_add=True, verbose_name='Created At')),
+                ('updated_at', models.DateTimeField(auto_now=True, verbose_name='Updated At')),
+                ('owner', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='attachment_uploads', to=settings.AUTH_USER_MODEL, verbose_name='Owner')),
+            ],
+            options={
+                'verbose_name': 'Attachment Upload',
+                'verbose_name_plural': 'Attachment Uploads',
+                'db_table': 'attachment_uploads',
+                'indexes': [models.Index(fields=['status', 'updated_at'], name='attachment__status_56ec0c_idx')],
+            },
+        ),
+    ]
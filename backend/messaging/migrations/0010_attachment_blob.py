@@ -0,0 +1,94 @@
+# Generated by Django 4.2.7 on 2026-10-18 15:18
+
+from django.db import migrations, models
+import django.db.models.deletion
+import hashlib
+
+from django.core.files.storage import storages
+
+
+def move_stored_files_to_blobs(apps, schema_editor):
+    """
+    Give each finished upload a blob holding its already stored files.
+    
+    The original bytes are gone, so the blob is keyed by the digest of the
+    stored file; later uploads of the same original are stored anew.
+    """
+    AttachmentBlob = apps.get_model('messaging', 'AttachmentBlob')
+    AttachmentUpload = apps.get_model('messaging', 'AttachmentUpload')
+    storage = storages['attachments']
+    for upload in AttachmentUpload.objects.filter(status='ready').exclude(storage_key=''):
+        try:
+            with storage.open(upload.storage_key) as stored:
+                sha256 = hashlib.file_digest(stored, 'sha256').hexdigest()
+        except FileNotFoundError:
+            upload.status = 'failed'
+            upload.save(update_fields=['status'])
+            continue
+        blob, created = AttachmentBlob.objects.get_or_create(sha256=sha256, defaults={
+            'size': upload.size,
+            'status': 'ready',
+            'storage_key': upload.storage_key,
+            'variants': upload.variants,
+        })
+        if upload.message_id is not None:
+            blob.ref_count += 1
+            blob.save(update_fields=['ref_count'])
+        upload.blob = blob
+        upload.save(update_fields=['blob'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('messaging', '0009_attachment_upload'),
+    ]
+    
+    operations = [
+        migrations.CreateModel(
+            name='AttachmentBlob',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('sha256', models.CharField(help_text='Hex digest of the uploaded bytes', max_length=64, unique=True, verbose_name='SHA-256')),
+                ('size', models.PositiveBigIntegerField(verbose_name='Size')),
+                ('status', models.CharField(choices=[('processing', 'Processing'), ('ready', 'Ready'), ('failed', 'Failed')], default='processing', max_length=10, verbose_name='Status')),
+                ('storage_key', models.CharField(blank=True, help_text='Name of the stored file (the full rendition of an image) in the attachments storage', max_length=255, verbose_name='Storage Key')),
+                ('variants', models.JSONField(blank=True, default=dict, help_text='Resized images by name: storage key, width and height', verbose_name='Variants')),
+                ('ref_count', models.IntegerField(default=0, help_text='Messages using this blob', verbose_name='Reference Count')),
+                ('created_at', models.DateTimeField(auto_now_add=True, verbose_name='Created At')),
+                ('updated_at', models.DateTimeField(auto_now=True, verbose_name='Updated At')),
+            ],
+            options={
+                'verbose_name': 'Attachment Blob',
+                'verbose_name_plural': 'Attachment Blobs',
+                'db_table': 'attachment_blobs',
+            },
+        ),
+        migrations.RunPython(move_stored_files_to_blobs, migrations.RunPython.noop),
+        migrations.RemoveField(
+            model_name='attachmentupload',
+            name='storage_key',
+        ),
+        migrations.RemoveField(
+            model_name='attachmentupload',
+            name='variants',
+        ),
+        migrations.AlterField(
+            model_name='attachmentupload',
+            name='message_id',
+            field=models.BigIntegerField(blank=True, help_text='Message using this attachment', null=True, verbose_name='Message ID'),
+        ),
+        migrations.AddIndex(
+            model_name='attachmentupload',
+            index=models.Index(fields=['message_id'], name='attachment__message_3342a0_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='attachmentblob',
+            index=models.Index(fields=['ref_count'], name='attachment__ref_cou_b321e5_idx'),
+        ),
+        migrations.AddField(
+            model_name='attachmentupload',
+            name='blob',
+            field=models.ForeignKey(blank=True, help_text='Stored content, set once the upload is hashed', null=True, on_delete=django.db.models.deletion.PROTECT, related_name='uploads', to='messaging.attachmentblob', verbose_name='Blob'),
+        ),
+    ]
@@ -0,0 +1,43 @@
+# Generated by Django 4.2.7 on 2026-10-18 15:34
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('messaging', '0010_attachment_blob'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='conversation',
+            name='last_delivered_id_high',
+            field=models.BigIntegerField(default=0, help_text='Every message up to this id has reached a device of user_high', verbose_name='Last Delivered ID (higher id)'),
+        ),
+        migrations.AddField(
+            model_name='conversation',
+            name='last_delivered_id_low',
+            field=models.BigIntegerField(default=0, help_text='Every message up to this id has reached a device of user_low', verbose_name='Last Delivered ID (lower id)'),
+        ),
+        migrations.AddField(
+            model_name='conversation',
+            name='last_read_id_high',
+            field=models.BigIntegerField(default=0, help_text='Every message up to this id has been read by user_high', verbose_name='Last Read ID (higher id)'),
+        ),
+        migrations.AddField(
+            model_name='conversation',
+            name='last_read_id_low',
+            field=models.BigIntegerField(default=0, help_text='Every message up to this id has been read by user_low', verbose_name='Last Read ID (lower id)'),
+        ),
+        migrations.AddField(
+            model_name='syncevent',
+            name='peer_id',
+            field=models.BigIntegerField(blank=True, help_text='User who acknowledged the messages (delivery receipts only)', null=True, verbose_name='Peer ID'),
+        ),
+        migrations.AlterField(
+            model_name='syncevent',
+            name='event_type',
+            field=models.CharField(choices=[('message', 'New Message'), ('read', 'Read Receipt'), ('delivered', 'Delivery Receipt'), ('delete', 'Message Deleted')], help_text='Kind of change', max_length=10, verbose_name='Event Type'),
+        ),
+    ]
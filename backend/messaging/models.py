@@ -1,3 +1,5 @@
+import uuid
+
 from django.db import models
 from django.contrib.auth import get_user_model
 
@@ -88,7 +90,9 @@ class Message(models.Model):
     @property
     def image_url(self):
         """Backward compatibility property"""
-        return self.attachment_url if self.message_type == self.MessageType.IMAGE else None
+        from .attachments import message_url
+        
+        return message_url(self.attachment_url) if self.message_type == self.MessageType.IMAGE else None
     
     @property
     def timestamp(self):
@@ -98,7 +102,643 @@ class Message(models.Model):
     def mark_as_read(self):
         """Mark message as read"""
         if not self.is_read:
-            self.is_read = True
+            from django.db import transaction
             from django.utils import timezone
-            self.read_at = timezone.now()
-            self.save(update_fields=['is_read', 'read_at'])
+            from . import conversations
+            from .sync import record_messages_read
+            read_at = timezone.now()
+            with transaction.atomic():
+                # Conditional update so concurrent reads are only counted once;
+                # created_at lets a partitioned table skip every other month
+                updated = Message.objects.filter(
+                    pk=self.pk,
+                    created_at=self.created_at,
+                    is_read=False
+                ).update(
+                    is_read=True,
+                    read_at=read_at
+                )
+                self.is_read = True
+                if updated:
+                    self.read_at = read_at
+                    record_messages_read([self], read_at)
+                    conversations.record_read(self.recipient_id, self.sender_id, 1)
+
+
+class Conversation(models.Model):
+    """
+    Inbox summary with one row per pair of users.
+    
+    The pair is stored in canonical order (``user_low`` has the lower id) so
+    each conversation has exactly one row. It is kept up to date in the same
+    transaction as every message create, read and delete. Each participant's
+    delivery and read receipts are high-water marks: message ids up to which
+    everything has reached one of their devices, or been read (see
+    ``messaging.receipts``).
+    """
+    PREVIEW_LENGTH = 100
+    
+    user_low = models.ForeignKey(
+        'accounts.User',
+        on_delete=models.CASCADE,
+        related_name='+',
+        verbose_name='User (lower id)',
+        help_text='Participant with the lower user id'
+    )
+    user_high = models.ForeignKey(
+        'accounts.User',
+        on_delete=models.CASCADE,
+        related_name='+',
+        verbose_name='User (higher id)',
+        help_text='Participant with the higher user id'
+    )
+    last_message_id = models.BigIntegerField(
+        blank=True,
+        null=True,
+        verbose_name='Last Message ID',
+        help_text='Most recent message in the conversation'
+    )
+    last_sender_id = models.BigIntegerField(
+        blank=True,
+        null=True,
+        verbose_name='Last Sender ID',
+        help_text='Sender of the most recent message'
+    )
+    last_message_at = models.DateTimeField(
+        blank=True,
+        null=True,
+        verbose_name='Last Activity',
+        help_text='When the most recent message was sent'
+    )
+    preview = models.CharField(
+        max_length=PREVIEW_LENGTH,
+        blank=True,
+        default='',
+        verbose_name='Preview',
+        help_text='Start of the most recent message'
+    )
+    unread_count_low = models.PositiveIntegerField(
+        default=0,
+        verbose_name='Unread Count (lower id)',
+        help_text='Messages not yet read by user_low'
+    )
+    unread_count_high = models.PositiveIntegerField(
+        default=0,
+        verbose_name='Unread Count (higher id)',
+        help_text='Messages not yet read by user_high'
+    )
+    last_delivered_id_low = models.BigIntegerField(
+        default=0,
+        verbose_name='Last Delivered ID (lower id)',
+        help_text='Every message up to this id has reached a device of user_low'
+    )
+    last_delivered_id_high = models.BigIntegerField(
+        default=0,
+        verbose_name='Last Delivered ID (higher id)',
+        help_text='Every message up to this id has reached a device of user_high'
+    )
+    last_read_id_low = models.BigIntegerField(
+        default=0,
+        verbose_name='Last Read ID (lower id)',
+        help_text='Every message up to this id has been read by user_low'
+    )
+    last_read_id_high = models.BigIntegerField(
+        default=0,
+        verbose_name='Last Read ID (higher id)',
+        help_text='Every message up to this id has been read by user_high'
+    )
+    updated_at = models.DateTimeField(
+        auto_now=True,
+        verbose_name='Updated At'
+    )
+    
+    class Meta:
+        db_table = 'conversations'
+        verbose_name = 'Conversation'
+        verbose_name_plural = 'Conversations'
+        unique_together = ['user_low', 'user_high']
+        ordering = ['-last_message_at', '-id']
+        indexes = [
+            models.Index(fields=['user_low', '-last_message_at', '-id']),
+            models.Index(fields=['user_high', '-last_message_at', '-id']),
+            models.Index(
+                fields=['user_low'],
+                condition=models.Q(unread_count_low__gt=0),
+                name='conversations_unread_low_idx'
+            ),
+            models.Index(
+                fields=['user_high'],
+                condition=models.Q(unread_count_high__gt=0),
+                name='conversations_unread_high_idx'
+            ),
+        ]
+    
+    def __str__(self):
+        return f"Conversation {self.user_low_id} <-> {self.user_high_id}"
+    
+    @staticmethod
+    def canonical_pair(user_id, other_user_id):
+        """Return the (user_low_id, user_high_id) key for two users"""
+        return (user_id, other_user_id) if user_id <= other_user_id else (other_user_id, user_id)
+    
+    @staticmethod
+    def unread_field(user_id, other_user_id):
+        """Name of the unread counter belonging to ``user_id``"""
+        return 'unread_count_low' if user_id <= other_user_id else 'unread_count_high'
+    
+    @staticmethod
+    def receipt_fields(user_id, other_user_id):
+        """Names of the delivered and read high-water marks belonging to ``user_id``"""
+        if user_id <= other_user_id:
+            return 'last_delivered_id_low', 'last_read_id_low'
+        return 'last_delivered_id_high', 'last_read_id_high'
+    
+    @classmethod
+    def make_preview(cls, content, message_type):
+        if content:
+            return content[:cls.PREVIEW_LENGTH]
+        return f"[{Message.MessageType(message_type).label}]"
+    
+    def peer_id(self, user_id):
+        return self.user_high_id if user_id == self.user_low_id else self.user_low_id
+    
+    def unread_count(self, user_id):
+        return self.unread_count_low if user_id == self.user_low_id else self.unread_count_high
+    
+    def receipts(self, user_id):
+        """``(last delivered id, last read id)`` acknowledged by ``user_id``"""
+        delivered_field, read_field = self.receipt_fields(user_id, self.peer_id(user_id))
+        return getattr(self, delivered_field), getattr(self, read_field)
+
+
+class UnreadCounter(models.Model):
+    """Total unread messages per user, so badge reads never run ``COUNT(*)``"""
+    user = models.OneToOneField(
+        'accounts.User',
+        on_delete=models.CASCADE,
+        primary_key=True,
+        related_name='unread_counter',
+        verbose_name='User'
+    )
+    total = models.PositiveIntegerField(
+        default=0,
+        verbose_name='Total Unread',
+        help_text='Sum of the user\'s per-conversation unread counters'
+    )
+    updated_at = models.DateTimeField(
+        auto_now=True,
+        verbose_name='Updated At'
+    )
+    
+    class Meta:
+        db_table = 'unread_counters'
+        verbose_name = 'Unread Counter'
+        verbose_name_plural = 'Unread Counters'
+    
+    def __str__(self):
+        return f"{self.total} unread for user {self.user_id}"
+
+
+class ArchiveChunk(models.Model):
+    """
+    One compressed file of archived messages from a single conversation.
+    
+    Rows hold the chunk's first and last (created_at, id) positions, so a
+    history page finds the chunks it needs with an index lookup and only
+    downloads and decompresses those (see ``messaging.archive``).
+    """
+    user_low = models.ForeignKey(
+        'accounts.User',
+        on_delete=models.CASCADE,
+        related_name='+',
+        verbose_name='User (lower id)'
+    )
+    user_high = models.ForeignKey(
+        'accounts.User',
+        on_delete=models.CASCADE,
+        related_name='+',
+        verbose_name='User (higher id)'
+    )
+    first_message_id = models.BigIntegerField(verbose_name='First Message ID')
+    first_created_at = models.DateTimeField(verbose_name='First Message At')
+    last_message_id = models.BigIntegerField(verbose_name='Last Message ID')
+    last_created_at = models.DateTimeField(verbose_name='Last Message At')
+    message_count = models.PositiveIntegerField(verbose_name='Message Count')
+    raw_size = models.PositiveBigIntegerField(
+        verbose_name='Raw Size',
+        help_text='Bytes of the chunk before compression'
+    )
+    stored_size = models.PositiveBigIntegerField(
+        verbose_name='Stored Size',
+        help_text='Bytes of the compressed file'
+    )
+    storage_key = models.CharField(
+        max_length=255,
+        verbose_name='Storage Key',
+        help_text='Name of the file in the message_archive storage'
+    )
+    created_at = models.DateTimeField(
+        auto_now_add=True,
+        verbose_name='Created At'
+    )
+    
+    class Meta:
+        db_table = 'message_archive_chunks'
+        verbose_name = 'Archive Chunk'
+        verbose_name_plural = 'Archive Chunks'
+        indexes = [
+            models.Index(fields=['user_low', 'user_high', 'first_created_at', 'first_message_id']),
+        ]
+    
+    def __str__(self):
+        return f"{self.message_count} messages {self.user_low_id} <-> {self.user_high_id} in {self.storage_key}"
+
+
+class SyncEvent(models.Model):
+    """Per-user change log backing incremental (delta) sync"""
+    
+    class EventType(models.TextChoices):
+        MESSAGE = 'message', 'New Message'
+        READ = 'read', 'Read Receipt'
+        DELIVERED = 'delivered', 'Delivery Receipt'
+        DELETE = 'delete', 'Message Deleted'
+    
+    user = models.ForeignKey(
+        'accounts.User',
+        on_delete=models.CASCADE,
+        related_name='sync_events',
+        verbose_name='User',
+        help_text='User whose clients should receive this change'
+    )
+    event_type = models.CharField(
+        max_length=10,
+        choices=EventType.choices,
+        verbose_name='Event Type',
+        help_text='Kind of change'
+    )
+    message_id = models.BigIntegerField(
+        verbose_name='Message ID',
+        help_text='Affected message; kept after deletion so it can act as a tombstone'
+    )
+    read_at = models.DateTimeField(
+        blank=True,
+        null=True,
+        verbose_name='Read At',
+        help_text='When the message was read (read receipts only)'
+    )
+    peer_id = models.BigIntegerField(
+        blank=True,
+        null=True,
+        verbose_name='Peer ID',
+        help_text='User who acknowledged the messages (delivery receipts only)'
+    )
+    created_at = models.DateTimeField(
+        auto_now_add=True,
+        verbose_name='Created At'
+    )
+    
+    class Meta:
+        db_table = 'sync_events'
+        verbose_name = 'Sync Event'
+        verbose_name_plural = 'Sync Events'
+        ordering = ['id']
+        indexes = [
+            models.Index(fields=['user', 'id']),
+        ]
+    
+    def __str__(self):
+        return f"{self.get_event_type_display()} #{self.message_id} for user {self.user_id}"
+
+
+class GroupConversation(models.Model):
+    """
+    Group chat whose messages are stored once, however many members it has.
+    
+    Messages are numbered by a per-group sequence (``last_seq`` is the latest)
+    and each member keeps a read cursor into it, so a send writes the message,
+    this row and the sender's cursor, and a member's unread count is
+    ``last_seq - last_read_seq`` rather than one row per member.
+    """
+    name = models.CharField(
+        max_length=100,
+        verbose_name='Name',
+        help_text='Display name of the group'
+    )
+    created_by = models.ForeignKey(
+        'accounts.User',
+        on_delete=models.SET_NULL,
+        blank=True,
+        null=True,
+        related_name='created_groups',
+        verbose_name='Created By'
+    )
+    last_seq = models.PositiveBigIntegerField(
+        default=0,
+        verbose_name='Last Sequence',
+        help_text='Sequence number of the most recent message'
+    )
+    last_sender_id = models.BigIntegerField(
+        blank=True,
+        null=True,
+        verbose_name='Last Sender ID',
+        help_text='Sender of the most recent message'
+    )
+    last_message_at = models.DateTimeField(
+        blank=True,
+        null=True,
+        verbose_name='Last Activity',
+        help_text='When the most recent message was sent, or the group was created'
+    )
+    preview = models.CharField(
+        max_length=Conversation.PREVIEW_LENGTH,
+        blank=True,
+        default='',
+        verbose_name='Preview',
+        help_text='Start of the most recent message'
+    )
+    member_count = models.PositiveIntegerField(
+        default=0,
+        verbose_name='Member Count'
+    )
+    created_at = models.DateTimeField(
+        auto_now_add=True,
+        verbose_name='Created At'
+    )
+    updated_at = models.DateTimeField(
+        auto_now=True,
+        verbose_name='Updated At'
+    )
+    
+    class Meta:
+        db_table = 'group_conversations'
+        verbose_name = 'Group Conversation'
+        verbose_name_plural = 'Group Conversations'
+    
+    def __str__(self):
+        return f"{self.name} ({self.member_count} members)"
+
+
+class GroupMember(models.Model):
+    """Membership of a user in a group, with their read cursor"""
+    
+    class Role(models.TextChoices):
+        ADMIN = 'admin', 'Admin'
+        MEMBER = 'member', 'Member'
+    
+    group = models.ForeignKey(
+        GroupConversation,
+        on_delete=models.CASCADE,
+        related_name='members',
+        verbose_name='Group'
+    )
+    user = models.ForeignKey(
+        'accounts.User',
+        on_delete=models.CASCADE,
+        related_name='group_memberships',
+        verbose_name='User'
+    )
+    role = models.CharField(
+        max_length=10,
+        choices=Role.choices,
+        default=Role.MEMBER,
+        verbose_name='Role',
+        help_text='Admins can add members'
+    )
+    last_read_seq = models.PositiveBigIntegerField(
+        default=0,
+        verbose_name='Last Read Sequence',
+        help_text='Every message up to this sequence number has been read'
+    )
+    joined_at = models.DateTimeField(
+        auto_now_add=True,
+        verbose_name='Joined At'
+    )
+    
+    class Meta:
+        db_table = 'group_members'
+        verbose_name = 'Group Member'
+        verbose_name_plural = 'Group Members'
+        unique_together = ['group', 'user']
+        indexes = [
+            models.Index(fields=['user', 'group']),
+        ]
+    
+    def __str__(self):
+        return f"User {self.user_id} in group {self.group_id}"
+    
+    @property
+    def unread_count(self):
+        return max(self.group.last_seq - self.last_read_seq, 0)
+
+
+class GroupMessage(models.Model):
+    """A message sent to a group, stored once and numbered within the group"""
+    group = models.ForeignKey(
+        GroupConversation,
+        on_delete=models.CASCADE,
+        related_name='messages',
+        verbose_name='Group'
+    )
+    seq = models.PositiveBigIntegerField(
+        verbose_name='Sequence',
+        help_text='Position of the message in the group, starting at 1'
+    )
+    sender = models.ForeignKey(
+        'accounts.User',
+        on_delete=models.CASCADE,
+        related_name='sent_group_messages',
+        verbose_name='Sender'
+    )
+    message_type = models.CharField(
+        max_length=10,
+        choices=Message.MessageType.choices,
+        default=Message.MessageType.TEXT,
+        verbose_name='Message Type'
+    )
+    content = models.TextField(
+        blank=True,
+        null=True,
+        verbose_name='Message Content'
+    )
+    attachment_url = models.URLField(
+        blank=True,
+        null=True,
+        verbose_name='Attachment URL'
+    )
+    created_at = models.DateTimeField(
+        auto_now_add=True,
+        verbose_name='Created At'
+    )
+    
+    class Meta:
+        db_table = 'group_messages'
+        verbose_name = 'Group Message'
+        verbose_name_plural = 'Group Messages'
+        unique_together = ['group', 'seq']
+    
+    def __str__(self):
+        return f"Group {self.group_id} #{self.seq} from {self.sender_id}"
+
+
+class AttachmentBlob(models.Model):
+    """
+    One stored copy of attachment content, shared by every upload of it.
+    
+    Blobs are found by the SHA-256 of the uploaded bytes; the file and the
+    image renditions are stored under keys derived from it (see
+    ``messaging.attachments``). ``ref_count`` is the number of messages
+    using the blob; a blob no message or pending upload uses is deleted by
+    the garbage collection task.
+    """
+    
+    class Status(models.TextChoices):
+        PROCESSING = 'processing', 'Processing'
+        READY = 'ready', 'Ready'
+        FAILED = 'failed', 'Failed'
+    
+    sha256 = models.CharField(
+        max_length=64,
+        unique=True,
+        verbose_name='SHA-256',
+        help_text='Hex digest of the uploaded bytes'
+    )
+    size = models.PositiveBigIntegerField(
+        verbose_name='Size'
+    )
+    status = models.CharField(
+        max_length=10,
+        choices=Status.choices,
+        default=Status.PROCESSING,
+        verbose_name='Status'
+    )
+    storage_key = models.CharField(
+        max_length=255,
+        blank=True,
+        verbose_name='Storage Key',
+        help_text='Name of the stored file (the full rendition of an image) in the attachments storage'
+    )
+    variants = models.JSONField(
+        default=dict,
+        blank=True,
+        verbose_name='Variants',
+        help_text='Resized images by name: storage key, width and height'
+    )
+    ref_count = models.IntegerField(
+        default=0,
+        verbose_name='Reference Count',
+        help_text='Messages using this blob'
+    )
+    created_at = models.DateTimeField(
+        auto_now_add=True,
+        verbose_name='Created At'
+    )
+    updated_at = models.DateTimeField(
+        auto_now=True,
+        verbose_name='Updated At'
+    )
+    
+    class Meta:
+        db_table = 'attachment_blobs'
+        verbose_name = 'Attachment Blob'
+        verbose_name_plural = 'Attachment Blobs'
+        indexes = [
+            models.Index(fields=['ref_count']),
+        ]
+    
+    def __str__(self):
+        return f"{self.sha256[:12]} ({self.get_status_display()}, {self.ref_count} references)"
+    
+    @property
+    def storage_keys(self):
+        """Every file stored for this blob"""
+        return {self.storage_key, *(variant['key'] for variant in self.variants.values())} - {''}
+
+
+class AttachmentUpload(models.Model):
+    """
+    A resumable upload of a message attachment.
+    
+    The file is received in chunks into a staging file and, once complete,
+    hashed by a Celery task that points the upload at the ``AttachmentBlob``
+    with the same content, storing and processing it only if it is new (see
+    ``messaging.uploads``). A message sent with the upload gets its
+    ``attachment_url`` as soon as the upload is ready, and holds a reference
+    to the blob until it is deleted.
+    """
+    
+    class Status(models.TextChoices):
+        UPLOADING = 'uploading', 'Uploading'
+        PROCESSING = 'processing', 'Processing'
+        READY = 'ready', 'Ready'
+        FAILED = 'failed', 'Failed'
+    
+    id = models.UUIDField(
+        primary_key=True,
+        default=uuid.uuid4,
+        editable=False
+    )
+    owner = models.ForeignKey(
+        'accounts.User',
+        on_delete=models.CASCADE,
+        related_name='attachment_uploads',
+        verbose_name='Owner'
+    )
+    filename = models.CharField(
+        max_length=255,
+        verbose_name='File Name'
+    )
+    content_type = models.CharField(
+        max_length=100,
+        verbose_name='Content Type',
+        help_text='Type declared by the client; images are recognised from their content'
+    )
+    size = models.PositiveBigIntegerField(
+        verbose_name='Size',
+        help_text='Total bytes declared when the upload was created'
+    )
+    received = models.PositiveBigIntegerField(
+        default=0,
+        verbose_name='Received',
+        help_text='Bytes stored so far; the offset the next chunk must start at'
+    )
+    status = models.CharField(
+        max_length=10,
+        choices=Status.choices,
+        default=Status.UPLOADING,
+        verbose_name='Status'
+    )
+    blob = models.ForeignKey(
+        AttachmentBlob,
+        on_delete=models.PROTECT,
+        blank=True,
+        null=True,
+        related_name='uploads',
+        verbose_name='Blob',
+        help_text='Stored content, set once the upload is hashed'
+    )
+    message_id = models.BigIntegerField(
+        blank=True,
+        null=True,
+        verbose_name='Message ID',
+        help_text='Message using this attachment'
+    )
+    created_at = models.DateTimeField(
+        auto_now_add=True,
+        verbose_name='Created At'
+    )
+    updated_at = models.DateTimeField(
+        auto_now=True,
+        verbose_name='Updated At'
+    )
+    
+    class Meta:
+        db_table = 'attachment_uploads'
+        verbose_name = 'Attachment Upload'
+        verbose_name_plural = 'Attachment Uploads'
+        indexes = [
+            models.Index(fields=['status', 'updated_at']),
+            models.Index(fields=['message_id']),
+        ]
+    
+    def __str__(self):
+        return f"{self.filename} ({self.get_status_display()}) from user {self.owner_id}"
@@ -0,0 +1,278 @@
+import base64
+import heapq
+
+from django.db.models import Q
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+from rest_framework.exceptions import ValidationError
+
+from . import archive
+from .models import Conversation, GroupMember, GroupMessage, Message
+
+
+def encode_cursor(instance, field='created_at'):
+    """Opaque cursor for a row position in (timestamp, id) order"""
+    raw = f'{getattr(instance, field).isoformat()}|{instance.id}'
+    return base64.urlsafe_b64encode(raw.encode()).decode()
+
+
+def decode_cursor(cursor):
+    """Return the (created_at, id) position encoded in a cursor"""
+    try:
+        created_at, message_id = base64.urlsafe_b64decode(cursor.encode()).decode().split('|')
+        position = (parse_datetime(created_at), int(message_id))
+    except (ValueError, UnicodeError):
+        raise ValidationError({'cursor': 'Invalid cursor'})
+    # Cursors are always issued with an offset; a naive one cannot be ordered against rows
+    if position[0] is None or timezone.is_naive(position[0]):
+        raise ValidationError({'cursor': 'Invalid cursor'})
+    return position
+
+
+class ConversationCursorPagination:
+    """
+    Keyset pagination for the messages exchanged between two users.
+    
+    Pages are ordered by (created_at, id). Each direction of the conversation
+    is read separately so both queries are range scans on the
+    (sender, recipient, created_at) index limited to ``limit + 1`` rows; the two
+    branches are then merged in Python. The cost of a page therefore does not
+    depend on how long the conversation is.
+    
+    Archived history (see ``messaging.archive``) is older than every hot row,
+    so pages going back continue into archive chunks once the hot rows run
+    out, and pages going forward from an archived cursor start there.
+    """
+    default_limit = 50
+    max_limit = 200
+    
+    def __init__(self, request):
+        self.before = request.query_params.get('before')
+        self.after = request.query_params.get('after')
+        if self.before and self.after:
+            raise ValidationError({'cursor': 'Use either before or after, not both'})
+        self.limit = self.get_limit(request.query_params.get('limit'))
+    
+    def get_limit(self, value):
+        if value is None:
+            return self.default_limit
+        try:
+            limit = int(value)
+        except ValueError:
+            raise ValidationError({'limit': 'A valid integer is required'})
+        return max(1, min(limit, self.max_limit))
+    
+    def paginate(self, user_a, user_b, queryset=None):
+        """Return one page of the conversation, oldest message first"""
+        queryset = queryset if queryset is not None else Message.objects.all()
+        
+        position = None
+        if self.after:
+            created_at, message_id = position = decode_cursor(self.after)
+            keyset = Q(created_at__gte=created_at) & ~Q(created_at=created_at, id__lte=message_id)
+            ordering = ('created_at', 'id')
+        else:
+            keyset = Q()
+            if self.before:
+                created_at, message_id = position = decode_cursor(self.before)
+                keyset = Q(created_at__lte=created_at) & ~Q(created_at=created_at, id__gte=message_id)
+            ordering = ('-created_at', '-id')
+        
+        branches = [
+            queryset.filter(keyset, sender_id=sender_id, recipient_id=recipient_id)
+            .order_by(*ordering)[:self.limit + 1]
+            for sender_id, recipient_id in ((user_a, user_b), (user_b, user_a))
+        ]
+        rows = heapq.merge(
+            *branches,
+            key=lambda message: (message.created_at, message.id),
+            reverse=not self.after
+        )
+        messages = [message for _, message in zip(range(self.limit + 1), rows)]
+        
+        if self.after:
+            messages = (archive.read_after(user_a, user_b, position, self.limit + 1) + messages)[:self.limit + 1]
+        elif len(messages) <= self.limit:
+            if messages:
+                position = (messages[-1].created_at, messages[-1].id)
+            messages += archive.read_before(user_a, user_b, position, self.limit + 1 - len(messages))
+        
+        has_more = len(messages) > self.limit
+        messages = messages[:self.limit]
+        if not self.after:
+            messages.reverse()
+        
+        self.messages = messages
+        if self.after:
+            self.has_older = True
+            self.has_newer = has_more
+        else:
+            self.has_older = has_more
+            self.has_newer = bool(self.before)
+        return messages
+    
+    def get_page_data(self, results):
+        """Wrap formatted results with the cursors needed to load adjacent pages"""
+        messages = self.messages
+        older_cursor = encode_cursor(messages[0]) if messages and self.has_older else None
+        if messages:
+            newer_cursor = encode_cursor(messages[-1])
+        else:
+            newer_cursor = self.after
+        
+        return {
+            'messages': results,
+            'olderCursor': older_cursor,
+            'newerCursor': newer_cursor,
+            'hasOlder': bool(older_cursor),
+            'hasNewer': self.has_newer,
+        }
+
+
+class InboxCursorPagination(ConversationCursorPagination):
+    """
+    Keyset pagination for a user's conversations, most recently active first.
+    
+    A user appears on either side of a ``Conversation`` row, so each side is
+    read from its (user, -last_message_at, -id) index and the branches merged.
+    Only ``before`` is supported: newer activity is picked up from the first page.
+    """
+    default_limit = 20
+    max_limit = 100
+    
+    def __init__(self, request):
+        self.before = request.query_params.get('before')
+        self.after = None
+        self.limit = self.get_limit(request.query_params.get('limit'))
+    
+    def paginate(self, user_id, queryset=None):
+        """Return one page of conversations, most recent first"""
+        queryset = queryset if queryset is not None else Conversation.objects.all()
+        
+        keyset = Q(last_message_at__isnull=False)
+        if self.before:
+            last_message_at, conversation_id = decode_cursor(self.before)
+            keyset &= Q(last_message_at__lte=last_message_at) & ~Q(
+                last_message_at=last_message_at,
+                id__gte=conversation_id
+            )
+        
+        branches = [
+            queryset.filter(keyset, user_low_id=user_id).order_by('-last_message_at', '-id')[:self.limit + 1],
+            queryset.filter(keyset, user_high_id=user_id).exclude(user_low_id=user_id)
+            .order_by('-last_message_at', '-id')[:self.limit + 1],
+        ]
+        rows = heapq.merge(
+            *branches,
+            key=lambda conversation: (conversation.last_message_at, conversation.id),
+            reverse=True
+        )
+        conversations = [conversation for _, conversation in zip(range(self.limit + 1), rows)]
+        
+        self.has_more = len(conversations) > self.limit
+        self.conversations = conversations[:self.limit]
+        return self.conversations
+    
+    def get_page_data(self, results):
+        next_cursor = None
+        if self.has_more:
+            next_cursor = encode_cursor(self.conversations[-1], field='last_message_at')
+        return {
+            'conversations': results,
+            'nextCursor': next_cursor,
+            'hasMore': self.has_more,
+        }
+
+
+class GroupMessagePagination(ConversationCursorPagination):
+    """
+    Pagination for a group's history by sequence number.
+    
+    ``before``/``after`` are plain ``seq`` values, so a client that was
+    offline asks for ``after=<last seq it has>``. Every page is a range scan
+    on the (group, seq) unique index.
+    """
+    
+    def __init__(self, request):
+        super().__init__(request)
+        self.before = self.get_seq('before', self.before)
+        self.after = self.get_seq('after', self.after)
+    
+    def get_seq(self, name, value):
+        if value is None:
+            return None
+        try:
+            return int(value)
+        except ValueError:
+            raise ValidationError({name: 'A valid sequence number is required'})
+    
+    def paginate(self, group_id, queryset=None):
+        """Return one page of the group's messages, oldest first"""
+        queryset = queryset if queryset is not None else GroupMessage.objects.all()
+        queryset = queryset.filter(group_id=group_id)
+        
+        if self.after is not None:
+            messages = list(queryset.filter(seq__gt=self.after).order_by('seq')[:self.limit + 1])
+        else:
+            if self.before is not None:
+                queryset = queryset.filter(seq__lt=self.before)
+            messages = list(queryset.order_by('-seq')[:self.limit + 1])
+        
+        has_more = len(messages) > self.limit
+        messages = messages[:self.limit]
+        if self.after is None:
+            messages.reverse()
+            self.has_older, self.has_newer = has_more, self.before is not None
+        else:
+            self.has_older, self.has_newer = True, has_more
+        self.messages = messages
+        return messages
+    
+    def get_page_data(self, results):
+        messages = self.messages
+        older_cursor = messages[0].seq if messages and self.has_older and messages[0].seq > 1 else None
+        newer_cursor = messages[-1].seq if messages else self.after
+        return {
+            'messages': results,
+            'olderCursor': older_cursor,
+            'newerCursor': newer_cursor,
+            'hasOlder': older_cursor is not None,
+            'hasNewer': self.has_newer,
+        }
+
+
+class GroupInboxCursorPagination(InboxCursorPagination):
+    """
+    Keyset pagination for the groups a user belongs to, most recently active first.
+    
+    Reads the user's memberships from the (user, group) index and joins their
+    groups, so a page costs the number of groups the user is in, not the size
+    of those groups.
+    """
+    
+    def paginate(self, user_id, queryset=None):
+        queryset = queryset if queryset is not None else GroupMember.objects.select_related('group')
+        keyset = Q()
+        if self.before:
+            last_message_at, group_id = decode_cursor(self.before)
+            keyset = Q(group__last_message_at__lte=last_message_at) & ~Q(
+                group__last_message_at=last_message_at,
+                group_id__gte=group_id
+            )
+        memberships = list(
+            queryset.filter(keyset, user_id=user_id)
+            .order_by('-group__last_message_at', '-group_id')[:self.limit + 1]
+        )
+        self.has_more = len(memberships) > self.limit
+        self.conversations = memberships[:self.limit]
+        return self.conversations
+    
+    def get_page_data(self, results):
+        next_cursor = None
+        if self.has_more:
+            next_cursor = encode_cursor(self.conversations[-1].group, field='last_message_at')
+        return {
+            'groups': results,
+            'nextCursor': next_cursor,
+            'hasMore': self.has_more,
+        }
@@ -0,0 +1,182 @@
+"""
+Monthly range partitions of the ``messages`` table on PostgreSQL.
+
+Migration 0007 turns ``messages`` into a table partitioned by ``created_at``
+with one partition per calendar month (``messages_pYYYYMM``) and a
+``messages_default`` partition that catches rows no monthly partition
+covers. Rows that existed before the migration stay where they are: the
+old table is attached as ``messages_legacy`` covering everything before the
+first monthly partition, so converting a populated table copies nothing.
+
+Each partition carries its own copy of every index, so inserts only touch
+the indexes of the current month and vacuum works on one month at a time.
+Queries that bound ``created_at`` (history pages with a cursor) skip the
+partitions outside the range, and ``ORDER BY created_at DESC LIMIT n``
+scans partitions newest first and stops once it has enough rows.
+
+The primary key is ``(id, created_at)`` because PostgreSQL requires the
+partition key in unique constraints. Ids still come from a single
+sequence, so they remain unique in practice, and the ORM keeps using
+``id`` alone. Writes that target known rows also filter on their
+``created_at`` so they only touch the partitions holding them.
+
+``ensure_partitions`` creates partitions ahead of time and
+``detach_partitions`` removes months older than the retention period; both
+run from the ``manage_partitions`` command and a daily beat task. Every
+function here is a no-op on other databases.
+"""
+import logging
+import re
+from datetime import datetime, timezone
+
+from django.db import connection, transaction
+
+logger = logging.getLogger(__name__)
+
+PARENT_TABLE = 'messages'
+DEFAULT_PARTITION = 'messages_default'
+LEGACY_PARTITION = 'messages_legacy'
+BOUND_PATTERN = re.compile(r"FROM \((MINVALUE|'[^']+')\) TO \((MAXVALUE|'[^']+')\)")
+
+
+def month_start(value):
+    """First instant of the UTC month containing ``value``"""
+    value = value.astimezone(timezone.utc)
+    return datetime(value.year, value.month, 1, tzinfo=timezone.utc)
+
+
+def add_months(value, months):
+    month = value.month - 1 + months
+    return value.replace(year=value.year + month // 12, month=month % 12 + 1)
+
+
+def partition_name(start):
+    return f'{PARENT_TABLE}_p{start:%Y%m}'
+
+
+def is_partitioned():
+    if connection.vendor != 'postgresql':
+        return False
+    with connection.cursor() as cursor:
+        cursor.execute('SELECT relkind FROM pg_class WHERE oid = to_regclass(%s)', [PARENT_TABLE])
+        row = cursor.fetchone()
+    return row is not None and row[0] == 'p'
+
+
+def parse_bound(value):
+    if value in ('MINVALUE', 'MAXVALUE'):
+        return None
+    return datetime.fromisoformat(value.strip("'")).astimezone(timezone.utc)
+
+
+def list_partitions():
+    """``(name, lower, upper)`` of every range partition, oldest first; open bounds are ``None``"""
+    if not is_partitioned():
+        return []
+    with connection.cursor() as cursor:
+        cursor.execute("""
+            SELECT child.relname, pg_get_expr(child.relpartbound, child.oid)
+            FROM pg_inherits
+            JOIN pg_class child ON child.oid = pg_inherits.inhrelid
+            WHERE pg_inherits.inhparent = to_regclass(%s)
+        """, [PARENT_TABLE])
+        rows = cursor.fetchall()
+    
+    partitions = []
+    for name, bound in rows:
+        match = BOUND_PATTERN.search(bound)
+        if match:
+            partitions.append((name, parse_bound(match.group(1)), parse_bound(match.group(2))))
+    return sorted(partitions, key=lambda partition: partition[1] or datetime.min.replace(tzinfo=timezone.utc))
+
+
+def create_partition(start):
+    """
+    Create the partition for the month beginning at ``start``; returns whether it was created.
+    
+    Rows for that month that already landed in the default partition are
+    moved into the new one in the same transaction, because PostgreSQL
+    refuses to attach a range the default partition has rows for.
+    """
+    name = partition_name(start)
+    end = add_months(start, 1)
+    quote = connection.ops.quote_name
+    with transaction.atomic(), connection.cursor() as cursor:
+        cursor.execute('SELECT to_regclass(%s) IS NOT NULL', [name])
+        if cursor.fetchone()[0]:
+            return False
+        cursor.execute(f'CREATE TABLE {quote(name)} (LIKE {PARENT_TABLE} INCLUDING DEFAULTS INCLUDING STORAGE)')
+        cursor.execute(f"""
+            WITH moved AS (
+                DELETE FROM {DEFAULT_PARTITION}
+                WHERE created_at >= %(start)s AND created_at < %(end)s
+                RETURNING *
+            )
+            INSERT INTO {quote(name)} SELECT * FROM moved
+        """, {'start': start, 'end': end})
+        if cursor.rowcount:
+            logger.warning('Moved %s rows from %s into %s', cursor.rowcount, DEFAULT_PARTITION, name)
+        cursor.execute(
+            f'ALTER TABLE {PARENT_TABLE} ATTACH PARTITION {quote(name)} FOR VALUES FROM (%s) TO (%s)',
+            [start.isoformat(), end.isoformat()]
+        )
+    return True
+
+
+def ensure_partitions(ahead, since=None):
+    """
+    Make sure a partition exists for every month from ``since`` (default:
+    the current month) to ``ahead`` months from now; returns the names created.
+    
+    Months that overlap an existing partition, such as the legacy one, are
+    skipped.
+    """
+    if not is_partitioned():
+        return []
+    now = month_start(datetime.now(timezone.utc))
+    partitions = list_partitions()
+    
+    def covered(start, end):
+        return any(
+            (lower is None or lower < end) and (upper is None or upper > start)
+            for _, lower, upper in partitions
+        )
+    
+    created = []
+    month = month_start(since) if since else now
+    while month <= add_months(now, ahead):
+        if not covered(month, add_months(month, 1)) and create_partition(month):
+            created.append(partition_name(month))
+        month = add_months(month, 1)
+    return created
+
+
+def detach_partitions(retain_months, drop=False):
+    """
+    Detach (or drop) monthly partitions whose months all lie before the retention window.
+    
+    In the same transaction, summaries, unread counters, the sync log and
+    attachment references forget the partition's messages (see
+    ``conversations.release_range``). The legacy partition is never
+    detached: it holds everything from before partitioning, however recent.
+    Detached partitions become ordinary tables that can be archived and
+    dropped later. Returns the names removed from ``messages``.
+    """
+    from .conversations import release_range
+    
+    if not is_partitioned() or retain_months <= 0:
+        return []
+    cutoff = add_months(month_start(datetime.now(timezone.utc)), -retain_months)
+    removed = []
+    for name, lower, upper in list_partitions():
+        if lower is None or upper is None or upper > cutoff:
+            continue
+        with transaction.atomic(), connection.cursor() as cursor:
+            # Detaching briefly locks the parent; give up rather than queue behind long queries
+            cursor.execute("SET LOCAL lock_timeout = '5s'")
+            release_range(lower, upper)
+            cursor.execute(f'ALTER TABLE {PARENT_TABLE} DETACH PARTITION {connection.ops.quote_name(name)}')
+            if drop:
+                cursor.execute(f'DROP TABLE {connection.ops.quote_name(name)}')
+        removed.append(name)
+    return removed
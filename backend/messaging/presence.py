@@ -0,0 +1,149 @@
+"""
+Ephemeral presence: who is online, when they were last seen, who is typing.
+
+Nothing here touches the database. State lives in the ``presence`` cache
+(Redis when ``REDIS_URL`` is set; otherwise a per-process LocMemCache,
+which only suits a single node and tests) and expires by itself:
+
+- ``presence:<user id>`` holds the time of the user's last heartbeat. The
+  user is online while it is less than ``PRESENCE_TTL`` seconds old; the
+  key expires after ``PRESENCE_LAST_SEEN_TTL``, forgetting "last seen".
+- ``typing:<user id>:<peer id>`` exists while the user is typing to the
+  peer and expires after ``TYPING_TTL``, so an indicator the client never
+  cleared goes away on its own.
+
+Heartbeats are the WebSocket ``ping`` and the REST heartbeat, sent every
+few seconds by each device. A process writes a user's key at most once
+every ``PRESENCE_WRITE_INTERVAL`` seconds and drops the heartbeats in
+between, so the cache sees about one write per online user per interval
+whatever the number of devices. Typing is coalesced the same way: a
+client may report every keystroke, but peers are only told when typing
+starts, stops, or needs refreshing before it expires.
+
+``get_presence`` reads any number of users, with whether each is typing
+to the requester, in one ``get_many`` (a single MGET on Redis).
+"""
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime, timezone
+
+from django.conf import settings
+from django.core.cache import caches
+
+from social_messenger.renderers import format_datetime
+
+# Users (or typing pairs) whose last write each process remembers
+COALESCE_SIZE = 100000
+
+
+class WriteCoalescer:
+    """Thread-safe, bounded record of when each key was last written"""
+    
+    def __init__(self, max_size):
+        self.max_size = max_size
+        self.written = OrderedDict()
+        self.lock = threading.Lock()
+    
+    def claim(self, key, now, interval):
+        """Whether ``key`` is due for a write at ``now``; if so, it counts as written"""
+        with self.lock:
+            last = self.written.get(key)
+            if last is not None and now - last < interval:
+                return False
+            self.written[key] = now
+            self.written.move_to_end(key)
+            while len(self.written) > self.max_size:
+                self.written.popitem(last=False)
+            return True
+    
+    def forget(self, key):
+        with self.lock:
+            self.written.pop(key, None)
+    
+    def clear(self):
+        with self.lock:
+            self.written.clear()
+
+
+heartbeats = WriteCoalescer(COALESCE_SIZE)
+typing_updates = WriteCoalescer(COALESCE_SIZE)
+
+
+def get_cache():
+    return caches['presence']
+
+
+def presence_key(user_id):
+    return f'presence:{user_id}'
+
+
+def typing_key(user_id, peer_id):
+    return f'typing:{user_id}:{peer_id}'
+
+
+def heartbeat(user_id, now=None):
+    """Record that a user is online; returns whether the cache was written"""
+    now = time.time() if now is None else now
+    if not heartbeats.claim(user_id, now, settings.PRESENCE_WRITE_INTERVAL):
+        return False
+    get_cache().set(presence_key(user_id), int(now), settings.PRESENCE_LAST_SEEN_TTL)
+    return True
+
+
+async def aheartbeat(user_id):
+    """``heartbeat`` for consumers: coalesced heartbeats never leave the event loop"""
+    now = time.time()
+    if not heartbeats.claim(user_id, now, settings.PRESENCE_WRITE_INTERVAL):
+        return False
+    await get_cache().aset(presence_key(user_id), int(now), settings.PRESENCE_LAST_SEEN_TTL)
+    return True
+
+
+def typing_changed(user_id, target, active, now=None):
+    """
+    Whether a typing report must be passed on to ``target``.
+    
+    A start is passed on once, then again only when the last one is half
+    way to expiring; a stop always is. ``target`` is a peer id or a group
+    key, anything hashable that identifies the conversation.
+    """
+    key = (user_id, target)
+    if not active:
+        typing_updates.forget(key)
+        return True
+    now = time.time() if now is None else now
+    return typing_updates.claim(key, now, settings.TYPING_TTL / 2)
+
+
+async def aset_typing(user_id, peer_id, active):
+    """Store whether ``user_id`` is typing to ``peer_id``, for peers that poll"""
+    if active:
+        await get_cache().aset(typing_key(user_id, peer_id), 1, settings.TYPING_TTL)
+    else:
+        await get_cache().adelete(typing_key(user_id, peer_id))
+
+
+def get_presence(user_ids, viewer_id, now=None):
+    """
+    Presence of each of ``user_ids`` as ``viewer_id`` sees it, in one cache read.
+    
+    Entries give ``online``, ``lastSeen`` (``None`` once forgotten) and
+    whether the user is ``typing`` to the viewer.
+    """
+    now = time.time() if now is None else now
+    user_ids = list(user_ids)
+    keys = [presence_key(user_id) for user_id in user_ids]
+    keys += [typing_key(user_id, viewer_id) for user_id in user_ids]
+    values = get_cache().get_many(keys)
+    
+    presence = []
+    for user_id in user_ids:
+        seen = values.get(presence_key(user_id))
+        presence.append({
+            'userId': user_id,
+            'online': seen is not None and now - seen < settings.PRESENCE_TTL,
+            'lastSeen': format_datetime(datetime.fromtimestamp(seen, timezone.utc)) if seen is not None else None,
+            'typing': typing_key(user_id, viewer_id) in values,
+        })
+    return presence
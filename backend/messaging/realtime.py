@@ -0,0 +1,83 @@
+import logging
+
+from asgiref.sync import async_to_sync
+from channels.layers import get_channel_layer
+
+logger = logging.getLogger(__name__)
+
+
+def user_group_name(user_id):
+    """Channel layer group holding every socket of a user"""
+    return f'user.{user_id}'
+
+
+def publish_to_users(user_ids, payload):
+    """
+    Push a JSON payload to every connected socket of the given users.
+    
+    Delivery is best effort: a push failure is logged and never propagates
+    to the request that triggered it. Call this from ``transaction.on_commit``
+    so clients never see rows that were rolled back.
+    """
+    channel_layer = get_channel_layer()
+    if channel_layer is None:
+        return
+    
+    for user_id in set(user_ids):
+        try:
+            async_to_sync(channel_layer.group_send)(
+                user_group_name(user_id),
+                {'type': 'push', 'payload': payload}
+            )
+        except Exception:
+            logger.exception('Failed to push %s to user %s', payload.get('type'), user_id)
+
+
+def publish_message_created(message):
+    """Deliver a newly committed message to its sender and recipient"""
+    from .serializers import format_message
+    publish_to_users(
+        [message.sender_id, message.recipient_id],
+        {'type': 'message.created', 'message': format_message(message)}
+    )
+
+
+def chat_group_name(group_id):
+    """Channel layer group holding every connected socket of a group's members"""
+    return f'chat.{group_id}'
+
+
+def publish_to_chat(group_id, payload):
+    """
+    Push a JSON payload to every connected member of a group conversation.
+    
+    This is a single ``group_send`` however large the group is; the channel
+    layer fans it out to the sockets that joined ``chat.{group_id}``.
+    """
+    channel_layer = get_channel_layer()
+    if channel_layer is None:
+        return
+    
+    try:
+        async_to_sync(channel_layer.group_send)(
+            chat_group_name(group_id),
+            {'type': 'push', 'payload': payload}
+        )
+    except Exception:
+        logger.exception('Failed to push %s to group %s', payload.get('type'), group_id)
+
+
+def publish_subscription(user_ids, group_id, subscribe):
+    """Tell the users' open sockets to join (or leave) a group's channel"""
+    channel_layer = get_channel_layer()
+    if channel_layer is None:
+        return
+    
+    for user_id in set(user_ids):
+        try:
+            async_to_sync(channel_layer.group_send)(
+                user_group_name(user_id),
+                {'type': 'chat.subscription', 'group_id': group_id, 'subscribe': subscribe}
+            )
+        except Exception:
+            logger.exception('Failed to update group %s subscription of user %s', group_id, user_id)
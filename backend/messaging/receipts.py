@@ -0,0 +1,166 @@
+"""
+Delivery and read receipts as per-conversation high-water marks.
+
+A client acknowledges a conversation with two message ids: everything the
+peer sent up to ``delivered_up_to`` has reached the device, everything up
+to ``read_up_to`` has been read. Marks only move forward, so receipts are
+merged by taking the largest, may be repeated, and may arrive in any order;
+a client reports the newest ids it has, not one receipt per message.
+
+Receipts are buffered in memory for ``RECEIPT_FLUSH_WINDOW`` seconds,
+merged by (reader, sender), and written by a timer thread (``flush``).
+Each conversation that moved costs one transaction (``persist``): the marks
+on its ``Conversation`` row, the messages flipped to read with the unread
+counters, the sync log, and once it commits a ``receipt`` push to the
+sender and to the reader's other devices. A client scrolling through fifty
+messages of a conversation thus costs one write per window instead of
+fifty. Receipts buffered by a process that dies before flushing are lost;
+clients resend their marks when they reconnect. With a window of 0 every
+receipt is written at once.
+"""
+import atexit
+import logging
+import threading
+
+from django.conf import settings
+from django.db import connection, transaction
+
+from . import conversations
+from .models import Conversation
+from .realtime import publish_to_users
+from .sync import record_delivered
+
+logger = logging.getLogger(__name__)
+
+
+class ReceiptBuffer:
+    """Thread-safe receipts waiting to be written, merged by (reader, sender)"""
+    
+    def __init__(self):
+        self.pending = {}
+        self.lock = threading.Lock()
+    
+    def __len__(self):
+        return len(self.pending)
+    
+    def add(self, reader_id, sender_id, delivered, read):
+        """Merge a receipt; returns whether it opened a new window"""
+        key = (reader_id, sender_id)
+        with self.lock:
+            opened = not self.pending
+            pending_delivered, pending_read = self.pending.get(key, (0, 0))
+            # Reading a message implies it was delivered
+            self.pending[key] = (max(pending_delivered, delivered, read), max(pending_read, read))
+            return opened
+    
+    def drain(self):
+        """Take every pending receipt, as ``{(reader id, sender id): (delivered, read)}``"""
+        with self.lock:
+            pending, self.pending = self.pending, {}
+            return pending
+
+
+pending = ReceiptBuffer()
+timer_lock = threading.Lock()
+flush_timer = None
+
+
+def accept(reader_id, receipts):
+    """
+    Take a batch of ``(sender id, delivered up to, read up to)`` receipts from ``reader_id``.
+    
+    Nothing is written before the window closes, so this is safe to call
+    from the event loop. Receipts for the reader's own id are ignored.
+    """
+    receipts = [receipt for receipt in receipts if receipt[0] != reader_id]
+    window = settings.RECEIPT_FLUSH_WINDOW
+    if window <= 0:
+        for sender_id, delivered, read in receipts:
+            persist(reader_id, sender_id, delivered, read)
+        return
+    
+    for sender_id, delivered, read in receipts:
+        if pending.add(reader_id, sender_id, delivered, read):
+            schedule_flush(window)
+
+
+def schedule_flush(window):
+    global flush_timer
+    with timer_lock:
+        if flush_timer is None:
+            flush_timer = threading.Timer(window, flush_in_background)
+            flush_timer.daemon = True
+            flush_timer.start()
+
+
+def flush_in_background():
+    global flush_timer
+    with timer_lock:
+        flush_timer = None
+    try:
+        flush()
+    finally:
+        # Timer threads are not requests, so nothing else closes their connection
+        connection.close()
+
+
+def flush():
+    """Write every buffered receipt, one transaction per conversation; returns how many were written"""
+    written = 0
+    for (reader_id, sender_id), (delivered, read) in pending.drain().items():
+        try:
+            persist(reader_id, sender_id, delivered, read)
+            written += 1
+        except Exception:
+            logger.exception('Could not write receipts of user %s for user %s', reader_id, sender_id)
+    return written
+
+
+atexit.register(flush)
+
+
+def persist(reader_id, sender_id, delivered, read):
+    """
+    Move ``reader_id``'s marks in the conversation with ``sender_id`` forward.
+    
+    Marks are capped at the conversation's latest message, so messages not
+    sent yet cannot be acknowledged, and never move back. The row lock
+    orders this with sends and other receipts of the conversation. Returns
+    the number of messages newly marked read.
+    """
+    user_low_id, user_high_id = Conversation.canonical_pair(reader_id, sender_id)
+    delivered_field, read_field = Conversation.receipt_fields(reader_id, sender_id)
+    with transaction.atomic():
+        conversation = Conversation.objects.select_for_update().filter(
+            user_low_id=user_low_id,
+            user_high_id=user_high_id
+        ).first()
+        if conversation is None:
+            return 0
+        last_delivered, last_read = conversation.receipts(reader_id)
+        latest = conversation.last_message_id or 0
+        read = max(min(read, latest), last_read)
+        delivered = max(min(delivered, latest), read, last_delivered)
+        if (delivered, read) == (last_delivered, last_read):
+            return 0
+        
+        marks = {delivered_field: delivered, read_field: read}
+        marked = 0
+        if read > last_read:
+            # The marks go into the UPDATE of the unread counter
+            marked = conversations.mark_conversation_read(reader_id, sender_id, read, **marks)
+        else:
+            conversations.record_read(reader_id, sender_id, 0, **marks)
+        # Read receipts already tell the sender those messages were delivered
+        if delivered > max(last_delivered, read):
+            record_delivered(reader_id, sender_id, delivered)
+        
+        payload = {
+            'type': 'receipt',
+            'userId': reader_id,
+            'peerId': sender_id,
+            'deliveredUpTo': delivered,
+            'readUpTo': read,
+        }
+        transaction.on_commit(lambda: publish_to_users([sender_id, reader_id], payload))
+    return marked
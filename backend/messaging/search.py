@@ -0,0 +1,166 @@
+"""
+Full-text search over the messages a user sent or received.
+
+On PostgreSQL ``messages.search_vector`` holds the ``tsvector`` of each
+message's content. It is maintained by a trigger (see migration 0005), so
+the application never writes it, and it is not a model field, so normal
+message reads never load it. Two GIN indexes on (sender_id, search_vector)
+and (recipient_id, search_vector) (btree_gin) make both halves of "messages
+I sent or received that match" a single index probe each.
+
+Other databases fall back to a case-insensitive substring match on every
+word of the query, which is only meant for local development.
+
+Hits are ordered by (rank desc, id desc) and paginated with an opaque keyset
+cursor. Each hit also carries a conversation history cursor pointing at the
+message, so clients can jump to it.
+"""
+import base64
+import html
+import re
+
+from django.db import connection
+from django.db.models import Q
+from rest_framework.exceptions import ValidationError
+
+from .models import Message
+
+# Text search configuration; must match the trigger in migration 0005
+SEARCH_CONFIG = 'english'
+SNIPPET_OPTIONS = 'MaxWords=25, MinWords=10, MaxFragments=2, FragmentDelimiter=" … "'
+# Highlight markers are control characters so the snippet can be HTML-escaped
+# before they are turned into <mark> tags
+HIGHLIGHT_START = '\x02'
+HIGHLIGHT_STOP = '\x03'
+FALLBACK_SNIPPET_LENGTH = 160
+
+
+def encode_cursor(rank, message_id):
+    raw = f'{rank!r}|{message_id}'
+    return base64.urlsafe_b64encode(raw.encode()).decode()
+
+
+def decode_cursor(cursor):
+    """Return the (rank, id) position encoded in a cursor"""
+    try:
+        rank, message_id = base64.urlsafe_b64decode(cursor.encode()).decode().split('|')
+        return float(rank), int(message_id)
+    except (ValueError, UnicodeError):
+        raise ValidationError({'cursor': 'Invalid cursor'})
+
+
+def render_snippet(snippet):
+    """HTML-escape a snippet and wrap the highlighted terms in <mark> tags"""
+    return (
+        html.escape(snippet)
+        .replace(HIGHLIGHT_START, '<mark>')
+        .replace(HIGHLIGHT_STOP, '</mark>')
+    )
+
+
+def search_messages(user_id, query, limit=20, cursor=None):
+    """
+    Return ``(hits, next_cursor)`` for one page of matching messages, best first.
+    
+    Each hit is a ``(message, snippet)`` pair; the message has its sender
+    loaded and carries the ``rank`` it was ordered by.
+    """
+    query = query.strip()
+    if not query:
+        raise ValidationError({'q': 'A search term is required'})
+    position = decode_cursor(cursor) if cursor else None
+    
+    if connection.vendor == 'postgresql':
+        rows = postgres_search(user_id, query, limit + 1, position)
+    else:
+        rows = fallback_search(user_id, query, limit + 1, position)
+    
+    messages = Message.objects.select_related('sender').in_bulk([row[0] for row in rows])
+    hits = []
+    for message_id, rank, snippet in rows:
+        if message_id in messages:
+            message = messages[message_id]
+            message.rank = rank
+            hits.append((message, render_snippet(snippet)))
+    
+    next_cursor = None
+    if len(hits) > limit:
+        hits = hits[:limit]
+        last = hits[-1][0]
+        next_cursor = encode_cursor(last.rank, last.id)
+    return hits, next_cursor
+
+
+def postgres_search(user_id, query, limit, position):
+    """
+    Rank matches first and build snippets only for the page.
+    
+    ``ts_headline`` re-parses the message text, so it runs in the outer query
+    on at most ``limit`` rows rather than on every match.
+    """
+    params = {
+        'config': SEARCH_CONFIG,
+        'query': query,
+        'user_id': user_id,
+        'limit': limit,
+        'options': f'StartSel={HIGHLIGHT_START}, StopSel={HIGHLIGHT_STOP}, {SNIPPET_OPTIONS}',
+    }
+    keyset = ''
+    if position is not None:
+        keyset = 'WHERE rank < %(rank)s OR (rank = %(rank)s AND id < %(message_id)s)'
+        params['rank'], params['message_id'] = position
+    
+    tsquery = 'websearch_to_tsquery(%(config)s::regconfig, %(query)s)'
+    # The user id is cast to bigint because btree_gin only indexes same-type
+    # comparisons; with an int4 literal the planner ignores the user column
+    sql = f"""
+        WITH page AS (
+            SELECT * FROM (
+                SELECT id, ts_rank_cd(search_vector, {tsquery})::float8 AS rank
+                FROM messages
+                WHERE (sender_id = %(user_id)s::bigint AND search_vector @@ {tsquery})
+                    OR (recipient_id = %(user_id)s::bigint AND search_vector @@ {tsquery})
+            ) matches
+            {keyset}
+            ORDER BY rank DESC, id DESC
+            LIMIT %(limit)s
+        )
+        SELECT page.id, page.rank,
+            ts_headline(%(config)s::regconfig, messages.content, {tsquery}, %(options)s)
+        FROM page
+        JOIN messages ON messages.id = page.id
+        ORDER BY page.rank DESC, page.id DESC
+    """
+    with connection.cursor() as cursor:
+        cursor.execute(sql, params)
+        return cursor.fetchall()
+
+
+def fallback_search(user_id, query, limit, position):
+    """Substring match on every word, ranked by the number of occurrences"""
+    terms = [term.lower() for term in re.findall(r'\w+', query)]
+    if not terms:
+        return []
+    matches = Message.objects.filter(Q(sender_id=user_id) | Q(recipient_id=user_id))
+    for term in terms:
+        matches = matches.filter(content__icontains=term)
+    
+    rows = []
+    for message_id, content in matches.values_list('id', 'content'):
+        lowered = content.lower()
+        rank = float(sum(lowered.count(term) for term in terms))
+        if position is None or (-rank, -message_id) > (-position[0], -position[1]):
+            rows.append((message_id, rank, content))
+    rows.sort(key=lambda row: (-row[1], -row[0]))
+    
+    pattern = re.compile('|'.join(re.escape(term) for term in terms), re.IGNORECASE)
+    page = []
+    for message_id, rank, content in rows[:limit]:
+        first = pattern.search(content)
+        start = max(0, first.start() - FALLBACK_SNIPPET_LENGTH // 2) if first else 0
+        snippet = pattern.sub(
+            lambda match: f'{HIGHLIGHT_START}{match.group(0)}{HIGHLIGHT_STOP}',
+            content[start:start + FALLBACK_SNIPPET_LENGTH]
+        )
+        page.append((message_id, rank, snippet))
+    return page
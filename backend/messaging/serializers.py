@@ -1,6 +1,14 @@
 from rest_framework import serializers
+from django.conf import settings
 from django.contrib.auth import get_user_model
-from .models import Message
+from django.db import transaction
+from notifications.pipeline import notify_on_commit
+from social_messenger.renderers import format_datetime
+from .models import AttachmentUpload, GroupMessage, Message
+from . import conversations, uploads
+from .attachments import message_url
+from .realtime import publish_message_created
+from .sync import record_message_created
 
 User = get_user_model()
 
@@ -24,13 +32,40 @@ class MessageSerializer(serializers.ModelSerializer):
 
 
 class MessageCreateSerializer(serializers.ModelSerializer):
+    message = serializers.CharField(source='content', required=False, allow_blank=True)
+    image_url = serializers.URLField(source='attachment_url', required=False)
+    upload_id = serializers.UUIDField(required=False, write_only=True)
+    
     class Meta:
         model = Message
-        fields = ('recipient', 'message_type', 'message', 'image_url')
+        fields = ('recipient', 'message_type', 'message', 'image_url', 'upload_id')
+    
+    def validate_upload_id(self, value):
+        upload = AttachmentUpload.objects.filter(id=value, owner=self.context['request'].user).first()
+        if upload is None:
+            raise serializers.ValidationError('Upload not found')
+        if upload.status == AttachmentUpload.Status.FAILED:
+            raise serializers.ValidationError('The upload could not be processed')
+        if upload.message_id is not None:
+            raise serializers.ValidationError('The upload is already attached to a message')
+        return value
     
     def create(self, validated_data):
         sender = self.context['request'].user
-        return Message.objects.create(sender=sender, **validated_data)
+        upload_id = validated_data.pop('upload_id', None)
+        with transaction.atomic():
+            message = Message.objects.create(sender=sender, **validated_data)
+            if upload_id is not None:
+                try:
+                    uploads.link_message(message, upload_id)
+                except uploads.UploadConflict as exc:
+                    raise serializers.ValidationError({'upload_id': str(exc)})
+            record_message_created(message)
+            conversations.record_message(message)
+            transaction.on_commit(lambda: publish_message_created(message))
+            if message.recipient_id != sender.id:
+                notify_on_commit(message.recipient_id)
+        return message
 
 
 class MessageListSerializer(serializers.ModelSerializer):
@@ -43,3 +78,209 @@ class MessageListSerializer(serializers.ModelSerializer):
             'id', 'sender', 'recipient', 'message_type', 
             'message', 'image_url', 'timestamp'
         )
+
+
+class AttachmentUploadCreateSerializer(serializers.Serializer):
+    filename = serializers.CharField(max_length=255)
+    content_type = serializers.CharField(max_length=100, required=False, default='application/octet-stream')
+    size = serializers.IntegerField(min_value=0)
+    sha256 = serializers.RegexField(r'^[0-9a-fA-F]{64}$', required=False)
+    
+    def validate_sha256(self, value):
+        return value.lower()
+    
+    def validate_size(self, value):
+        if value > settings.ATTACHMENT_MAX_SIZE:
+            raise serializers.ValidationError(f'Attachments are limited to {settings.ATTACHMENT_MAX_SIZE} bytes')
+        return value
+
+
+class MarkConversationReadSerializer(serializers.Serializer):
+    user_id = serializers.IntegerField()
+    up_to_message_id = serializers.IntegerField(min_value=1)
+    
+    def validate_user_id(self, value):
+        if not User.objects.filter(id=value).exists():
+            raise serializers.ValidationError('User not found')
+        return value
+
+
+class ReceiptSerializer(serializers.Serializer):
+    user_id = serializers.IntegerField(min_value=1)
+    delivered_up_to = serializers.IntegerField(min_value=0, default=0)
+    read_up_to = serializers.IntegerField(min_value=0, default=0)
+
+
+class ReceiptBatchSerializer(serializers.Serializer):
+    receipts = serializers.ListField(
+        child=ReceiptSerializer(),
+        allow_empty=False,
+        max_length=settings.RECEIPT_BATCH_SIZE
+    )
+
+
+class GroupCreateSerializer(serializers.Serializer):
+    name = serializers.CharField(max_length=100)
+    member_ids = serializers.ListField(child=serializers.IntegerField(), allow_empty=True, default=list)
+    
+    def validate_member_ids(self, value):
+        value = set(value)
+        found = set(User.objects.filter(id__in=value).values_list('id', flat=True))
+        if found != value:
+            raise serializers.ValidationError(f'Users not found: {sorted(value - found)}')
+        return value
+
+
+class GroupMembersSerializer(GroupCreateSerializer):
+    name = None
+    member_ids = serializers.ListField(child=serializers.IntegerField(), allow_empty=False)
+
+
+class GroupMessageCreateSerializer(serializers.ModelSerializer):
+    message_type = serializers.ChoiceField(choices=Message.MessageType.choices, default=Message.MessageType.TEXT)
+    message = serializers.CharField(source='content', required=False, allow_blank=True)
+    image_url = serializers.URLField(source='attachment_url', required=False)
+    
+    class Meta:
+        model = GroupMessage
+        fields = ('message_type', 'message', 'image_url')
+
+
+class MarkGroupReadSerializer(serializers.Serializer):
+    seq = serializers.IntegerField(min_value=0)
+
+
+def format_message(message):
+    """Conversation representation of a message, shared by the REST and push APIs"""
+    return {
+        'messageId': message.id,
+        'sender': {
+            'id': message.sender.id,
+            'name': message.sender.name,
+            'email': message.sender.email
+        },
+        'recipientId': message.recipient_id,
+        'messageType': message.message_type,
+        'content': message.message,
+        'imageUrl': message.image_url,
+        'timestamp': serializers.DateTimeField().to_representation(message.timestamp),
+    }
+
+
+# Columns the list endpoints read instead of whole ``Message`` rows
+MESSAGE_ROW_FIELDS = ('id', 'sender_id', 'recipient_id', 'message_type', 'content', 'attachment_url', 'created_at')
+
+
+def message_rows(queryset):
+    """``queryset`` as named tuples of ``MESSAGE_ROW_FIELDS``, which also work as pagination positions"""
+    return queryset.values_list(*MESSAGE_ROW_FIELDS, named=True)
+
+
+def user_summaries(user_ids):
+    """``UserSerializer`` representations by id, read in one query"""
+    return {
+        user_id: {'id': user_id, 'name': full_name, 'email': email}
+        for user_id, full_name, email in User.objects.filter(id__in=user_ids).values_list('id', 'full_name', 'email')
+    }
+
+
+def format_message_rows(rows, users):
+    """
+    ``format_message`` for each of ``rows`` without loading models.
+    
+    ``rows`` carry ``MESSAGE_ROW_FIELDS`` as attributes (``message_rows``
+    tuples or ``Message`` instances) and ``users`` comes from
+    ``user_summaries``.
+    """
+    image = Message.MessageType.IMAGE
+    return [
+        {
+            'messageId': row.id,
+            'sender': users[row.sender_id],
+            'recipientId': row.recipient_id,
+            'messageType': row.message_type,
+            'content': row.content,
+            'imageUrl': message_url(row.attachment_url) if row.message_type == image else None,
+            'timestamp': format_datetime(row.created_at),
+        }
+        for row in rows
+    ]
+
+
+def format_chat_rows(rows, users):
+    """``MessageListSerializer(many=True).data`` for ``message_rows`` tuples, without loading models"""
+    image = Message.MessageType.IMAGE
+    return [
+        {
+            'id': row.id,
+            'sender': users[row.sender_id],
+            'recipient': users[row.recipient_id],
+            'message_type': row.message_type,
+            'message': row.content,
+            'image_url': message_url(row.attachment_url) if row.message_type == image else None,
+            # A bare datetime, as the serializer's read-only ``timestamp`` field returns
+            'timestamp': row.created_at,
+        }
+        for row in rows
+    ]
+
+
+def format_conversation(conversation, user_id):
+    """Inbox representation of a conversation as seen by ``user_id``"""
+    peer = conversation.user_high if user_id == conversation.user_low_id else conversation.user_low
+    peer_delivered_up_to, peer_read_up_to = conversation.receipts(peer.id)
+    return {
+        'conversationId': conversation.id,
+        'user': {
+            'id': peer.id,
+            'name': peer.name,
+            'email': peer.email,
+            'image': peer.image
+        },
+        'lastMessage': {
+            'messageId': conversation.last_message_id,
+            'senderId': conversation.last_sender_id,
+            'preview': conversation.preview,
+            'timestamp': serializers.DateTimeField().to_representation(conversation.last_message_at),
+        },
+        'unreadCount': conversation.unread_count(user_id),
+        'peerDeliveredUpTo': peer_delivered_up_to,
+        'peerReadUpTo': peer_read_up_to,
+    }
+
+
+def format_group(membership):
+    """Inbox representation of a group as seen by the member ``membership`` belongs to"""
+    group = membership.group
+    return {
+        'groupId': group.id,
+        'name': group.name,
+        'memberCount': group.member_count,
+        'role': membership.role,
+        'lastMessage': {
+            'seq': group.last_seq,
+            'senderId': group.last_sender_id,
+            'preview': group.preview,
+            'timestamp': serializers.DateTimeField().to_representation(group.last_message_at)
+            if group.last_message_at else None,
+        },
+        'lastReadSeq': membership.last_read_seq,
+        'unreadCount': membership.unread_count,
+    }
+
+
+def format_group_message(message):
+    """Representation of a group message, shared by the REST and push APIs"""
+    return {
+        'groupId': message.group_id,
+        'seq': message.seq,
+        'sender': {
+            'id': message.sender.id,
+            'name': message.sender.name,
+            'email': message.sender.email
+        },
+        'messageType': message.message_type,
+        'content': message.content,
+        'imageUrl': message.attachment_url if message.message_type == Message.MessageType.IMAGE else None,
+        'timestamp': serializers.DateTimeField().to_representation(message.created_at),
+    }
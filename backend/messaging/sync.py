@@ -0,0 +1,152 @@
+"""
+Delta sync: a per-user change log of new messages, read and delivery
+receipts and deletions. Clients keep the id of the last event they have seen (the sync
+token) and only download what changed after it.
+
+The ``record_*`` helpers must be called inside the transaction that makes
+the change, so the log never disagrees with the ``messages`` table.
+"""
+import time
+
+from rest_framework import serializers
+
+from .models import Message, SyncEvent
+
+POLL_INTERVAL = 1.0
+MAX_WAIT = 30
+DEFAULT_LIMIT = 200
+
+
+def record_message_created(message):
+    """Log a new message for both participants"""
+    SyncEvent.objects.bulk_create([
+        SyncEvent(user_id=user_id, event_type=SyncEvent.EventType.MESSAGE, message_id=message.id)
+        for user_id in {message.sender_id, message.recipient_id}
+    ])
+
+
+def record_messages_read(messages, read_at):
+    """Log read receipts for both participants of each message"""
+    SyncEvent.objects.bulk_create([
+        SyncEvent(
+            user_id=user_id,
+            event_type=SyncEvent.EventType.READ,
+            message_id=message.id,
+            read_at=read_at
+        )
+        for message in messages
+        for user_id in {message.sender_id, message.recipient_id}
+    ])
+
+
+def record_delivered(reader_id, sender_id, up_to_message_id):
+    """Log that everything ``sender_id`` sent to ``reader_id`` up to a message id was delivered"""
+    SyncEvent.objects.create(
+        user_id=sender_id,
+        event_type=SyncEvent.EventType.DELIVERED,
+        message_id=up_to_message_id,
+        peer_id=reader_id
+    )
+
+
+def record_messages_deleted(rows):
+    """
+    Log tombstones for deleted messages.
+    
+    ``rows`` are dicts with ``id``, ``sender_id`` and ``recipient_id``
+    captured before the delete, since the messages are gone afterwards.
+    """
+    SyncEvent.objects.bulk_create([
+        SyncEvent(user_id=user_id, event_type=SyncEvent.EventType.DELETE, message_id=row['id'])
+        for row in rows
+        for user_id in {row['sender_id'], row['recipient_id']}
+    ])
+
+
+def parse_sync_token(token):
+    """Sync tokens are opaque to clients; internally they are event ids"""
+    if not token:
+        return 0
+    try:
+        value = int(token)
+    except ValueError:
+        raise serializers.ValidationError({'since': 'Invalid sync token'})
+    if value < 0:
+        raise serializers.ValidationError({'since': 'Invalid sync token'})
+    return value
+
+
+def latest_sync_token(user):
+    last_event = SyncEvent.objects.filter(user_id=user.id).order_by('-id').values_list('id', flat=True).first()
+    return str(last_event or 0)
+
+
+def wait_for_changes(user, since, timeout):
+    """
+    Block until the user has events after ``since`` or ``timeout`` seconds pass.
+    
+    Each check is an indexed ``EXISTS`` on (user, id), so an idle long-poll
+    costs one cheap query per second.
+    """
+    deadline = time.monotonic() + min(timeout, MAX_WAIT)
+    while True:
+        if SyncEvent.objects.filter(user_id=user.id, id__gt=since).exists():
+            return True
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            return False
+        time.sleep(min(POLL_INTERVAL, remaining))
+
+
+def get_changes(user, since, limit=DEFAULT_LIMIT):
+    """
+    Collect the user's changes after ``since``.
+    
+    Returns a dict with new messages (in the conversation-history shape),
+    read receipts, the latest delivery high-water mark per peer and deleted
+    message ids, plus the token to send next time.
+    """
+    from .serializers import format_message
+    
+    events = list(
+        SyncEvent.objects.filter(user_id=user.id, id__gt=since).order_by('id')[:limit + 1]
+    )
+    has_more = len(events) > limit
+    events = events[:limit]
+    
+    deleted_ids = {
+        event.message_id for event in events
+        if event.event_type == SyncEvent.EventType.DELETE
+    }
+    created_ids = [
+        event.message_id for event in events
+        if event.event_type == SyncEvent.EventType.MESSAGE and event.message_id not in deleted_ids
+    ]
+    messages = Message.objects.filter(id__in=created_ids).select_related('sender').order_by('created_at', 'id')
+    
+    reads = {}
+    for event in events:
+        if event.event_type == SyncEvent.EventType.READ and event.message_id not in deleted_ids:
+            reads[event.message_id] = event.read_at
+    deliveries = {}
+    for event in events:
+        if event.event_type == SyncEvent.EventType.DELIVERED:
+            deliveries[event.peer_id] = max(deliveries.get(event.peer_id, 0), event.message_id)
+    
+    return {
+        'messages': [format_message(message) for message in messages],
+        'reads': [
+            {
+                'messageId': message_id,
+                'readAt': serializers.DateTimeField().to_representation(read_at),
+            }
+            for message_id, read_at in reads.items()
+        ],
+        'deliveries': [
+            {'userId': peer_id, 'deliveredUpTo': message_id}
+            for peer_id, message_id in deliveries.items()
+        ],
+        'deletions': sorted(deleted_ids),
+        'syncToken': str(events[-1].id) if events else str(since),
+        'hasMore': has_more,
+    }
@@ -0,0 +1,44 @@
+from datetime import timedelta
+
+from celery import shared_task
+from django.conf import settings
+from django.utils import timezone
+
+from . import archive, attachments, partitions, uploads
+
+
+@shared_task
+def manage_message_partitions():
+    """Create upcoming monthly message partitions and detach those past retention"""
+    created = partitions.ensure_partitions(settings.MESSAGE_PARTITIONS_AHEAD)
+    detached = partitions.detach_partitions(settings.MESSAGE_RETENTION_MONTHS)
+    return {'created': created, 'detached': detached}
+
+
+@shared_task
+def archive_cold_messages():
+    """Move messages older than MESSAGE_ARCHIVE_AFTER_DAYS into the archive store"""
+    if settings.MESSAGE_ARCHIVE_AFTER_DAYS <= 0:
+        return None
+    cutoff = timezone.now() - timedelta(days=settings.MESSAGE_ARCHIVE_AFTER_DAYS)
+    conversations, chunks = archive.archive_cold_messages(cutoff)
+    return {'conversations': conversations, 'chunks': chunks}
+
+
+@shared_task
+def process_attachment_upload(upload_id):
+    """Hash a finished upload, store its content unless already stored, and attach it to its message"""
+    return uploads.process_upload(upload_id)
+
+
+@shared_task
+def expire_attachment_uploads():
+    """Delete abandoned and failed uploads, and finished ones never sent, after ATTACHMENT_UPLOAD_EXPIRY_HOURS"""
+    cutoff = timezone.now() - timedelta(hours=settings.ATTACHMENT_UPLOAD_EXPIRY_HOURS)
+    return {'expired': uploads.expire_uploads(cutoff)}
+
+
+@shared_task
+def collect_attachment_garbage():
+    """Delete attachment blobs no message or pending upload uses, ATTACHMENT_GC_BATCH_SIZE per transaction"""
+    return {'deleted': attachments.collect_garbage(settings.ATTACHMENT_GC_BATCH_SIZE)}
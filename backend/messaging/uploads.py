@@ -0,0 +1,276 @@
+"""
+Resumable, chunked uploads of message attachments.
+
+A client creates an upload with the file's name, type and size, then sends
+the bytes in order as raw ``PATCH`` bodies, each starting at the offset
+the server last reported (``Upload-Offset``). Chunks are copied from the
+request into a staging file under ``ATTACHMENT_UPLOAD_DIR`` in
+``BUFFER_SIZE`` blocks, so a worker never holds a whole file, and an
+interrupted upload resumes from the last byte that was stored. The
+staging directory must be shared by every web process.
+
+Once the last byte arrives, ``process_upload`` runs in Celery. It hashes
+the file and points the upload at the blob holding that content (see
+``messaging.attachments``). Only new content is stored: images are
+re-encoded by Pillow without their metadata (EXIF, GPS position, comments),
+rotated upright and resized into ``IMAGE_VARIANTS``; other files are
+copied unchanged, into the ``attachments`` storage (local media, or an
+S3-compatible bucket). A client that knows the file's SHA-256 can declare
+it when creating the upload and skip sending a file the sender already
+has access to, such as one being forwarded.
+
+A message can be sent with an upload that is still in progress: it gets
+its ``attachment_url`` when processing finishes, and both participants are
+told through the sync log, push and their ETags.
+"""
+import fcntl
+import logging
+import os
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Q
+from django.utils import timezone
+from django.utils.text import get_valid_filename
+
+from social_messenger import etags
+
+from . import attachments
+from .attachments import get_storage
+from .models import AttachmentBlob, AttachmentUpload, Message, SyncEvent
+from .realtime import publish_to_users
+
+logger = logging.getLogger(__name__)
+
+BUFFER_SIZE = 64 * 1024
+
+
+class UploadConflict(Exception):
+    """A chunk that does not start at the stored offset, or an upload no longer accepting data"""
+    
+    def __init__(self, message, offset):
+        super().__init__(message)
+        self.offset = offset
+
+
+def staging_path(upload):
+    return os.path.join(settings.ATTACHMENT_UPLOAD_DIR, f'{upload.id}.part')
+
+
+def create_upload(owner, filename, content_type, size, sha256=None):
+    """
+    Start an upload; one whose declared ``sha256`` the owner can already see is ready at once.
+    """
+    filename = get_valid_filename(os.path.basename(filename)) or 'attachment'
+    blob = attachments.find_visible_blob(owner, sha256, size) if sha256 else None
+    if blob is not None:
+        return AttachmentUpload.objects.create(
+            owner=owner,
+            filename=filename,
+            content_type=content_type,
+            size=size,
+            received=size,
+            status=AttachmentUpload.Status.READY,
+            blob=blob
+        )
+    
+    upload = AttachmentUpload.objects.create(
+        owner=owner,
+        filename=filename,
+        content_type=content_type,
+        size=size
+    )
+    os.makedirs(settings.ATTACHMENT_UPLOAD_DIR, exist_ok=True)
+    open(staging_path(upload), 'wb').close()
+    if size == 0:
+        complete(upload)
+    return upload
+
+
+def append_chunk(upload, offset, stream, length):
+    """
+    Store ``length`` bytes read from ``stream`` at ``offset`` and return the new offset.
+    
+    The staging file is locked while the chunk is written, so parallel
+    requests for one upload cannot interleave. Bytes received before a
+    client disconnects are kept and count towards the offset. The upload
+    is queued for processing once complete.
+    """
+    with open(staging_path(upload), 'r+b') as staged:
+        try:
+            fcntl.flock(staged, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            raise UploadConflict('Another chunk of this upload is being written', offset)
+        # Re-read under the lock: a request that held it may have just moved the offset
+        upload.refresh_from_db(fields=['received', 'status'])
+        if upload.status != AttachmentUpload.Status.UPLOADING:
+            raise UploadConflict('The upload is already complete', upload.received)
+        if offset != upload.received:
+            raise UploadConflict('Chunks must start at the current offset', upload.received)
+        
+        staged.seek(offset)
+        staged.truncate()
+        written = 0
+        try:
+            while written < length:
+                block = stream.read(min(BUFFER_SIZE, length - written))
+                if not block:
+                    break
+                staged.write(block)
+                written += len(block)
+        except OSError:
+            logger.info('Upload %s interrupted after %s bytes of a chunk', upload.id, written)
+        staged.flush()
+        os.fsync(staged.fileno())
+        
+        upload.received = offset + written
+        AttachmentUpload.objects.filter(id=upload.id).update(received=upload.received, updated_at=timezone.now())
+    
+    if upload.received == upload.size:
+        complete(upload)
+    return upload.received
+
+
+def complete(upload):
+    from .tasks import process_attachment_upload
+    
+    with transaction.atomic():
+        AttachmentUpload.objects.filter(id=upload.id).update(
+            status=AttachmentUpload.Status.PROCESSING,
+            updated_at=timezone.now()
+        )
+        upload.status = AttachmentUpload.Status.PROCESSING
+        transaction.on_commit(lambda: process_attachment_upload.delay(str(upload.id)))
+
+
+def process_upload(upload_id):
+    """Point a complete upload at the blob with its content, storing the content if it is new"""
+    upload = AttachmentUpload.objects.filter(id=upload_id, status=AttachmentUpload.Status.PROCESSING).first()
+    if upload is None:
+        return None
+    path = staging_path(upload)
+    blob, claimed = attachments.claim_blob(upload.id, attachments.file_digest(path), upload.size)
+    try:
+        if claimed:
+            attachments.store_blob(blob, path, upload.filename)
+    except Exception:
+        logger.exception('Storing attachment blob %s for upload %s failed', blob.sha256, upload.id)
+        attachments.fail_blob(blob.id)
+        return AttachmentUpload.Status.FAILED
+    finally:
+        os.remove(path)
+    if blob is None:
+        return None
+    
+    finish(blob.id)
+    return AttachmentUpload.objects.filter(id=upload.id).values_list('status', flat=True).first()
+
+
+def finish(blob_id):
+    """
+    Mark the uploads waiting for a ready blob ready, and give their messages the attachment URL.
+    
+    Runs after the blob is stored, and after an upload of content that was
+    already stored is claimed; the blob lock serializes the two.
+    """
+    with transaction.atomic():
+        blob = AttachmentBlob.objects.select_for_update().get(id=blob_id)
+        if blob.status != AttachmentBlob.Status.READY:
+            return
+        waiting = list(AttachmentUpload.objects.select_for_update().filter(
+            blob=blob,
+            status=AttachmentUpload.Status.PROCESSING
+        ))
+        AttachmentUpload.objects.filter(id__in=[upload.id for upload in waiting]).update(
+            status=AttachmentUpload.Status.READY,
+            updated_at=timezone.now()
+        )
+        path = attachments.message_path(blob.storage_key)
+        for upload in waiting:
+            if upload.message_id is not None:
+                attach_to_message(upload.message_id, path)
+
+
+def attach_to_message(message_id, path):
+    """Set a sent message's ``attachment_url`` and let both participants refetch it"""
+    message = Message.objects.filter(id=message_id).select_related('sender').first()
+    if message is None:
+        return
+    message.attachment_url = path
+    message.save(update_fields=['attachment_url', 'updated_at'])
+    participants = {message.sender_id, message.recipient_id}
+    # Clients replace a message they already have when it comes back in a sync
+    SyncEvent.objects.bulk_create([
+        SyncEvent(user_id=user_id, event_type=SyncEvent.EventType.MESSAGE, message_id=message.id)
+        for user_id in participants
+    ])
+    etags.bump('messages', participants)
+    
+    from .serializers import format_message
+    payload = {'type': 'message.updated', 'message': format_message(message)}
+    transaction.on_commit(lambda: publish_to_users(participants, payload))
+
+
+def link_message(message, upload_id):
+    """
+    Attach an upload to a message being sent; call inside its transaction.
+    
+    A ready upload gives the message its URL right away, otherwise the
+    upload remembers the message until ``finish``. The message holds a
+    reference to the upload's blob from whichever comes first, the message
+    or the hashed content; the row lock keeps this from racing with the
+    processing task.
+    """
+    upload = AttachmentUpload.objects.select_for_update().select_related('blob').get(id=upload_id)
+    if upload.message_id is not None or upload.status == AttachmentUpload.Status.FAILED:
+        raise UploadConflict('The upload cannot be attached to another message', upload.received)
+    if upload.status == AttachmentUpload.Status.READY:
+        message.attachment_url = attachments.message_path(upload.blob.storage_key)
+        message.save(update_fields=['attachment_url', 'updated_at'])
+    if upload.blob_id is not None:
+        attachments.add_reference(upload.blob_id)
+    upload.message_id = message.id
+    upload.save(update_fields=['message_id', 'updated_at'])
+
+
+def expire_uploads(older_than):
+    """
+    Delete uploads last touched before ``older_than`` that no message uses.
+    
+    Unfinished and failed uploads lose their staging file. The blobs of
+    finished ones that were never sent are left to garbage collection.
+    """
+    from .tasks import collect_attachment_garbage
+    
+    uploads = list(AttachmentUpload.objects.filter(
+        Q(status__in=(AttachmentUpload.Status.UPLOADING, AttachmentUpload.Status.FAILED)) |
+        Q(status=AttachmentUpload.Status.READY, message_id__isnull=True),
+        updated_at__lt=older_than
+    ))
+    for upload in uploads:
+        if upload.status != AttachmentUpload.Status.READY:
+            try:
+                os.remove(staging_path(upload))
+            except FileNotFoundError:
+                pass
+    AttachmentUpload.objects.filter(id__in=[upload.id for upload in uploads]).delete()
+    if any(upload.blob_id is not None for upload in uploads):
+        transaction.on_commit(collect_attachment_garbage.delay)
+    return len(uploads)
+
+
+def format_upload(upload):
+    storage = get_storage()
+    blob = upload.blob if upload.status == AttachmentUpload.Status.READY else None
+    return {
+        'uploadId': str(upload.id),
+        'filename': upload.filename,
+        'size': upload.size,
+        'offset': upload.received,
+        'status': upload.status,
+        'url': storage.url(blob.storage_key) if blob else None,
+        'variants': {
+            name: {'url': storage.url(variant['key']), 'width': variant['width'], 'height': variant['height']}
+            for name, variant in blob.variants.items()
+        } if blob else {},
+    }
@@ -4,6 +4,9 @@ from . import views
 
 router = DefaultRouter()
 router.register(r'messages', views.MessageViewSet, basename='message')
+router.register(r'groups', views.GroupViewSet, basename='group')
+router.register(r'uploads', views.AttachmentUploadViewSet, basename='upload')
+router.register(r'presence', views.PresenceViewSet, basename='presence')
 
 urlpatterns = [
     path('', include(router.urls)),
@@ -2,12 +2,42 @@ from rest_framework import status, viewsets, permissions
 from rest_framework.decorators import api_view, permission_classes, action
 from rest_framework.permissions import IsAuthenticated
 from rest_framework.response import Response
-from rest_framework.parsers import MultiPartParser, FormParser
+from rest_framework.parsers import JSONParser, MultiPartParser, FormParser
 from rest_framework.views import APIView
+from rest_framework.exceptions import NotFound, ValidationError
+from django.conf import settings
 from django.contrib.auth import get_user_model
+from django.db import transaction
 from django.db.models import Q
-from .models import Message
-from .serializers import MessageSerializer, MessageCreateSerializer, MessageListSerializer
+from social_messenger.etags import conditional_get
+from .models import AttachmentUpload, Conversation, GroupMember, GroupMessage, Message, UnreadCounter
+from . import attachments, conversations, groups, presence, receipts, sync, uploads
+from .pagination import (
+    ConversationCursorPagination,
+    GroupInboxCursorPagination,
+    GroupMessagePagination,
+    InboxCursorPagination,
+    encode_cursor
+)
+from .serializers import (
+    AttachmentUploadCreateSerializer,
+    MessageSerializer,
+    MessageCreateSerializer,
+    MarkConversationReadSerializer,
+    ReceiptBatchSerializer,
+    GroupCreateSerializer,
+    GroupMembersSerializer,
+    GroupMessageCreateSerializer,
+    MarkGroupReadSerializer,
+    format_chat_rows,
+    format_conversation,
+    format_group,
+    format_group_message,
+    format_message,
+    format_message_rows,
+    message_rows,
+    user_summaries
+)
 
 User = get_user_model()
 
@@ -16,14 +46,26 @@ class MessageViewSet(viewsets.ModelViewSet):
     """ViewSet for message operations"""
     serializer_class = MessageSerializer
     permission_classes = [IsAuthenticated]
-    parser_classes = [MultiPartParser, FormParser]
+    parser_classes = [JSONParser, MultiPartParser, FormParser]
+    # Read-only actions that only need the user id (see AUTH_CLAIMS_USER_READS)
+    claims_user_actions = (
+        'messages_between_users',
+        'user_detail',
+        'user_chats',
+        'inbox',
+        'unread_counts',
+        'sync_changes',
+        'search',
+    )
+    # Separate rate limits (see social_messenger.throttling)
+    throttle_scopes = {'create': 'send_message', 'search': 'search'}
     
     def get_queryset(self):
         """Filter messages based on current user"""
         current_user = self.request.user
         return Message.objects.filter(
             Q(sender=current_user) | Q(recipient=current_user)
-        ).select_related('sender', 'recipient').order_by('-timestamp')
+        ).select_related('sender', 'recipient').order_by('-created_at', '-id')
     
     def create(self, request, *args, **kwargs):
         """Create a new message (supports file upload)"""
@@ -39,6 +81,7 @@ class MessageViewSet(viewsets.ModelViewSet):
         }, status=status.HTTP_201_CREATED)
     
     @action(detail=False, methods=['get'], url_path='user/(?P<user_id>[^/.]+)')
+    @conditional_get(lambda request, user_id: [('profile', int(user_id))])
     def user_detail(self, request, user_id=None):
         """Get user details by ID"""
         try:
@@ -52,9 +95,14 @@ class MessageViewSet(viewsets.ModelViewSet):
                 status=status.HTTP_404_NOT_FOUND
             )
     
-    @action(detail=False, methods=['get'], url_path='(?P<sender_id>[^/.]+)/(?P<recipient_id>[^/.]+)')
+    @action(detail=False, methods=['get'], url_path=r'(?P<sender_id>\d+)/(?P<recipient_id>\d+)')
     def messages_between_users(self, request, sender_id=None, recipient_id=None):
-        """Get messages between two users"""
+        """
+        Get messages between two users, one cursor page at a time.
+        
+        Query parameters: ``before``/``after`` (cursor), ``limit`` (page size)
+        and ``legacy=true`` for the old unpaginated list.
+        """
         try:
             # Verify that the current user is one of the participants
             current_user = request.user
@@ -64,28 +112,28 @@ class MessageViewSet(viewsets.ModelViewSet):
                     status=status.HTTP_403_FORBIDDEN
                 )
             
-            messages = Message.objects.filter(
-                Q(sender_id=sender_id, recipient_id=recipient_id) |
-                Q(sender_id=recipient_id, recipient_id=sender_id)
-            ).select_related('sender').order_by('timestamp')
+            if request.query_params.get('legacy') == 'true':
+                messages = message_rows(Message.objects.filter(
+                    Q(sender_id=sender_id, recipient_id=recipient_id) |
+                    Q(sender_id=recipient_id, recipient_id=sender_id)
+                ).order_by('created_at', 'id'))
+                users = user_summaries((int(sender_id), int(recipient_id)))
+                
+                return Response(format_message_rows(messages, users))
+            
+            paginator = ConversationCursorPagination(request)
+            messages = paginator.paginate(
+                int(sender_id),
+                int(recipient_id),
+                message_rows(Message.objects.all())
+            )
             
-            formatted_messages = []
-            for message in messages:
-                formatted_messages.append({
-                    'messageId': message.id,
-                    'sender': {
-                        'id': message.sender.id,
-                        'name': message.sender.name,
-                        'email': message.sender.email
-                    },
-                    'recipientId': message.recipient.id,
-                    'messageType': message.message_type,
-                    'content': message.message,
-                    'imageUrl': message.image_url,
-                    'timestamp': message.timestamp,
-                })
+            users = user_summaries((int(sender_id), int(recipient_id))) if messages else {}
+            formatted_messages = format_message_rows(messages, users)
             
-            return Response(formatted_messages)
+            return Response(paginator.get_page_data(formatted_messages))
+        except ValidationError:
+            raise
         except Exception as e:
             return Response(
                 {'error': 'Internal Server Error'}, 
@@ -106,10 +154,19 @@ class MessageViewSet(viewsets.ModelViewSet):
         try:
             # Only allow users to delete their own messages
             current_user = request.user
-            deleted_count = Message.objects.filter(
-                id__in=message_ids,
-                sender=current_user
-            ).delete()[0]
+            with transaction.atomic():
+                # Capture participants first so both sides get a tombstone
+                rows = list(Message.objects.select_for_update().filter(
+                    id__in=message_ids,
+                    sender=current_user
+                ).values('id', 'sender_id', 'recipient_id', 'is_read', 'created_at'))
+                deleted_count = Message.objects.filter(
+                    id__in=[row['id'] for row in rows],
+                    created_at__in={row['created_at'] for row in rows}
+                ).delete()[0]
+                sync.record_messages_deleted(rows)
+                conversations.record_deleted(rows)
+                attachments.release_messages([row['id'] for row in rows])
             
             return Response({
                 'message': f'{deleted_count} message(s) deleted successfully'
@@ -121,6 +178,7 @@ class MessageViewSet(viewsets.ModelViewSet):
             )
     
     @action(detail=False, methods=['get'], url_path='chats/(?P<user_id>[^/.]+)')
+    @conditional_get(lambda request, user_id: [('messages', int(user_id))])
     def user_chats(self, request, user_id=None):
         """Get all chats for a user"""
         try:
@@ -131,13 +189,368 @@ class MessageViewSet(viewsets.ModelViewSet):
                     status=status.HTTP_403_FORBIDDEN
                 )
             
-            messages = Message.objects.filter(
+            messages = list(message_rows(Message.objects.filter(
                 Q(sender_id=user_id) | Q(recipient_id=user_id)
-            ).select_related('sender', 'recipient').order_by('timestamp')
+            ).order_by('created_at', 'id')))
+            users = user_summaries(
+                {message.sender_id for message in messages} | {message.recipient_id for message in messages}
+            )
             
-            return Response({'messages': MessageListSerializer(messages, many=True).data})
+            return Response({'messages': format_chat_rows(messages, users)})
         except Exception as e:
             return Response(
                 {'error': 'Internal Server Error'}, 
                 status=status.HTTP_500_INTERNAL_SERVER_ERROR
             )
+    
+    @action(detail=False, methods=['get'], url_path='inbox')
+    @conditional_get(lambda request: [('messages', request.user.id)])
+    def inbox(self, request):
+        """Get the current user's conversations, most recently active first"""
+        current_user = request.user
+        paginator = InboxCursorPagination(request)
+        page = paginator.paginate(
+            current_user.id,
+            Conversation.objects.select_related('user_low', 'user_high')
+        )
+        
+        results = [format_conversation(conversation, current_user.id) for conversation in page]
+        return Response(paginator.get_page_data(results))
+    
+    @action(detail=False, methods=['post'], url_path='read')
+    def mark_conversation_read(self, request):
+        """Mark every message from a user up to a message id as read, without waiting for the receipt window"""
+        serializer = MarkConversationReadSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        
+        current_user = request.user
+        sender_id = serializer.validated_data['user_id']
+        
+        marked_count = receipts.persist(current_user.id, sender_id, 0, serializer.validated_data['up_to_message_id'])
+        
+        conversation = Conversation.objects.filter(
+            user_low_id=min(current_user.id, sender_id),
+            user_high_id=max(current_user.id, sender_id)
+        ).first()
+        counter = UnreadCounter.objects.filter(user=current_user).first()
+        
+        return Response({
+            'message': f'{marked_count} message(s) marked as read',
+            'markedCount': marked_count,
+            'unreadCount': conversation.unread_count(current_user.id) if conversation else 0,
+            'totalUnread': counter.total if counter else 0,
+        })
+    
+    @action(detail=False, methods=['post'], url_path='receipts')
+    def send_receipts(self, request):
+        """
+        Acknowledge conversations in a batch: each entry's ``user_id`` is the
+        peer, with every message up to ``delivered_up_to`` received and up to
+        ``read_up_to`` read. Receipts are written within RECEIPT_FLUSH_WINDOW
+        seconds (see ``messaging.receipts``).
+        """
+        serializer = ReceiptBatchSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        batch = serializer.validated_data['receipts']
+        receipts.accept(request.user.id, [
+            (receipt['user_id'], receipt['delivered_up_to'], receipt['read_up_to'])
+            for receipt in batch
+        ])
+        return Response({'accepted': len(batch)}, status=status.HTTP_202_ACCEPTED)
+    
+    @action(detail=False, methods=['get'], url_path='unread')
+    def unread_counts(self, request):
+        """Get unread badge counts per conversation and in total"""
+        current_user = request.user
+        counter = UnreadCounter.objects.filter(user_id=current_user.id).first()
+        
+        unread = list(
+            Conversation.objects.filter(user_low_id=current_user.id, unread_count_low__gt=0)
+            .values_list('id', 'user_high_id', 'unread_count_low')
+        ) + list(
+            Conversation.objects.filter(user_high_id=current_user.id, unread_count_high__gt=0)
+            .values_list('id', 'user_low_id', 'unread_count_high')
+        )
+        
+        return Response({
+            'total': counter.total if counter else 0,
+            'conversations': [
+                {'conversationId': conversation_id, 'userId': user_id, 'unreadCount': count}
+                for conversation_id, user_id, count in unread
+            ],
+        })
+    
+    @action(detail=False, methods=['get'], url_path='sync')
+    def sync_changes(self, request):
+        """
+        Get changes since a sync token: new messages, read and delivery receipts and deletions.
+        
+        Without ``since`` only the current token is returned. With ``wait=N``
+        the request is held open for up to N seconds until something changes.
+        """
+        current_user = request.user
+        
+        if 'since' not in request.query_params:
+            return Response({
+                'messages': [],
+                'reads': [],
+                'deliveries': [],
+                'deletions': [],
+                'syncToken': sync.latest_sync_token(current_user),
+                'hasMore': False,
+            })
+        
+        since = sync.parse_sync_token(request.query_params.get('since'))
+        try:
+            wait = float(request.query_params.get('wait', 0))
+        except ValueError:
+            raise ValidationError({'wait': 'A valid number is required'})
+        
+        if wait > 0:
+            sync.wait_for_changes(current_user, since, wait)
+        
+        return Response(sync.get_changes(current_user, since))
+    
+    @action(detail=False, methods=['get'], url_path='search')
+    def search(self, request):
+        """
+        Full-text search over the current user's messages, best match first.
+        
+        Each hit includes a highlighted snippet and a ``historyCursor`` that
+        can be passed as ``before``/``after`` to the conversation history
+        endpoint to load the messages around it.
+        """
+        from .search import search_messages
+        try:
+            limit = max(1, min(int(request.query_params.get('limit', 20)), 50))
+        except ValueError:
+            raise ValidationError({'limit': 'A valid integer is required'})
+        
+        current_user = request.user
+        hits, next_cursor = search_messages(
+            current_user.id,
+            request.query_params.get('q', ''),
+            limit=limit,
+            cursor=request.query_params.get('cursor')
+        )
+        
+        return Response({
+            'results': [
+                {
+                    'message': format_message(message),
+                    'peerId': message.recipient_id if message.sender_id == current_user.id else message.sender_id,
+                    'snippet': snippet,
+                    'historyCursor': encode_cursor(message),
+                }
+                for message, snippet in hits
+            ],
+            'nextCursor': next_cursor,
+            'hasMore': next_cursor is not None,
+        })
+
+
+class GroupViewSet(viewsets.ViewSet):
+    """
+    Group conversations.
+    
+    Messages are stored once per group and read state is a per-member
+    cursor (see ``messaging.groups``), so sending, reading and the inbox
+    cost the same in a group of five as in a group of five thousand.
+    """
+    permission_classes = [IsAuthenticated]
+    lookup_value_regex = r'\d+'
+    claims_user_actions = ('list', 'retrieve', 'messages', 'members')
+    # Separate rate limits (see social_messenger.throttling)
+    throttle_scopes = {'messages:POST': 'send_message'}
+    
+    def list(self, request):
+        """Get the current user's groups, most recently active first"""
+        paginator = GroupInboxCursorPagination(request)
+        memberships = paginator.paginate(request.user.id)
+        return Response(paginator.get_page_data([format_group(membership) for membership in memberships]))
+    
+    def create(self, request):
+        """Create a group with the current user as its admin"""
+        serializer = GroupCreateSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        with transaction.atomic():
+            group = groups.create_group(
+                request.user,
+                serializer.validated_data['name'],
+                serializer.validated_data['member_ids']
+            )
+        membership = groups.get_membership(group.id, request.user.id)
+        return Response(format_group(membership), status=status.HTTP_201_CREATED)
+    
+    def retrieve(self, request, pk=None):
+        """Get a group as seen by the current user"""
+        return Response(format_group(groups.get_membership(pk, request.user.id)))
+    
+    @action(detail=True, methods=['get', 'post'], url_path='messages')
+    def messages(self, request, pk=None):
+        """
+        GET: one page of the group's history, paged by sequence number with
+        ``before``/``after`` and ``limit``. POST: send a message to the group.
+        """
+        if request.method == 'POST':
+            serializer = GroupMessageCreateSerializer(data=request.data)
+            serializer.is_valid(raise_exception=True)
+            with transaction.atomic():
+                message = groups.send_group_message(pk, request.user, **serializer.validated_data)
+            return Response(format_group_message(message), status=status.HTTP_201_CREATED)
+        
+        groups.get_membership(pk, request.user.id)
+        paginator = GroupMessagePagination(request)
+        messages = paginator.paginate(pk, GroupMessage.objects.select_related('sender'))
+        return Response(paginator.get_page_data([format_group_message(message) for message in messages]))
+    
+    @action(detail=True, methods=['post'], url_path='read')
+    def mark_read(self, request, pk=None):
+        """Move the current user's read cursor up to a sequence number"""
+        serializer = MarkGroupReadSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        membership = groups.get_membership(pk, request.user.id)
+        unread_count = groups.mark_group_read(membership, serializer.validated_data['seq'])
+        return Response({'lastReadSeq': membership.last_read_seq, 'unreadCount': unread_count})
+    
+    @action(detail=True, methods=['get', 'post'], url_path='members')
+    def members(self, request, pk=None):
+        """
+        GET: the group's members in user id order, ``limit`` at a time after
+        the ``after`` user id. POST: add ``member_ids`` (admins only).
+        """
+        membership = groups.get_membership(pk, request.user.id)
+        if request.method == 'POST':
+            if membership.role != GroupMember.Role.ADMIN:
+                return Response(
+                    {'error': 'Only group admins can add members'},
+                    status=status.HTTP_403_FORBIDDEN
+                )
+            serializer = GroupMembersSerializer(data=request.data)
+            serializer.is_valid(raise_exception=True)
+            with transaction.atomic():
+                added = groups.add_members(membership.group, serializer.validated_data['member_ids'])
+            return Response({'added': added})
+        
+        try:
+            limit = max(1, min(int(request.query_params.get('limit', 50)), 200))
+            after = int(request.query_params.get('after', 0))
+        except ValueError:
+            raise ValidationError({'limit': 'A valid integer is required'})
+        rows = list(
+            GroupMember.objects.filter(group_id=pk, user_id__gt=after)
+            .select_related('user').order_by('user_id')[:limit + 1]
+        )
+        return Response({
+            'members': [
+                {'id': row.user.id, 'name': row.user.name, 'email': row.user.email, 'role': row.role}
+                for row in rows[:limit]
+            ],
+            'nextCursor': rows[limit - 1].user_id if len(rows) > limit else None,
+            'hasMore': len(rows) > limit,
+        })
+    
+    @action(detail=True, methods=['post'], url_path=r'members/(?P<user_id>\d+)/remove')
+    def remove_member(self, request, pk=None, user_id=None):
+        """Remove a member (admins only); members remove themselves with ``leave``"""
+        membership = groups.get_membership(pk, request.user.id)
+        if membership.role != GroupMember.Role.ADMIN:
+            return Response(
+                {'error': 'Only group admins can remove members'},
+                status=status.HTTP_403_FORBIDDEN
+            )
+        with transaction.atomic():
+            removed = groups.remove_member(membership.group, int(user_id))
+        if not removed:
+            return Response({'error': 'User is not a member'}, status=status.HTTP_404_NOT_FOUND)
+        return Response({'message': 'Member removed'})
+    
+    @action(detail=True, methods=['post'], url_path='leave')
+    def leave(self, request, pk=None):
+        """Leave a group"""
+        membership = groups.get_membership(pk, request.user.id)
+        with transaction.atomic():
+            groups.remove_member(membership.group, request.user.id)
+        return Response({'message': 'You left the group'})
+
+
+class AttachmentUploadViewSet(viewsets.ViewSet):
+    """
+    Resumable attachment uploads (see ``messaging.uploads``).
+    
+    POST creates an upload from its ``filename``, ``content_type`` and
+    ``size``, plus its ``sha256`` to skip sending content the user already
+    has access to (the upload is then ready at once). PATCH sends the next chunk as the raw request body, with its
+    position in the ``Upload-Offset`` header; a 409 carries the offset to
+    resume from. GET or HEAD reports the offset, the status and, once
+    processed, the URLs. Send the message with ``upload_id`` at any point.
+    """
+    permission_classes = [IsAuthenticated]
+    lookup_value_regex = r'[0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{12}'
+    
+    def get_upload(self, request, pk):
+        try:
+            return AttachmentUpload.objects.select_related('blob').get(id=pk, owner=request.user)
+        except AttachmentUpload.DoesNotExist:
+            raise NotFound('Upload not found')
+    
+    def upload_response(self, upload, status_code=status.HTTP_200_OK):
+        response = Response(uploads.format_upload(upload), status=status_code)
+        response['Upload-Offset'] = str(upload.received)
+        return response
+    
+    def create(self, request):
+        """Start an upload"""
+        serializer = AttachmentUploadCreateSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        upload = uploads.create_upload(request.user, **serializer.validated_data)
+        return self.upload_response(upload, status.HTTP_201_CREATED)
+    
+    def retrieve(self, request, pk=None):
+        """Get the offset to resume from, or the processed attachment"""
+        return self.upload_response(self.get_upload(request, pk))
+    
+    def partial_update(self, request, pk=None):
+        """Append a chunk, streamed from the request body"""
+        upload = self.get_upload(request, pk)
+        try:
+            offset = int(request.headers['Upload-Offset'])
+            length = int(request.headers.get('Content-Length') or 0)
+        except (KeyError, ValueError):
+            return Response(
+                {'error': 'Upload-Offset and Content-Length headers are required'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        if not 0 < length <= settings.ATTACHMENT_CHUNK_SIZE:
+            return Response(
+                {'error': f'Chunks must be between 1 and {settings.ATTACHMENT_CHUNK_SIZE} bytes'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        if offset < 0 or offset + length > upload.size:
+            return Response(
+                {'error': 'The chunk does not fit in the declared size'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        
+        try:
+            uploads.append_chunk(upload, offset, request.stream, length)
+        except uploads.UploadConflict as exc:
+            response = Response({'error': str(exc), 'offset': exc.offset}, status=status.HTTP_409_CONFLICT)
+            response['Upload-Offset'] = str(exc.offset)
+            return response
+        return self.upload_response(upload)
+
+
+class PresenceViewSet(viewsets.ViewSet):
+    """
+    Presence heartbeats for clients without a WebSocket (see ``messaging.presence``).
+    
+    Friends' presence is read from ``friend-requests/presence/``.
+    """
+    permission_classes = [IsAuthenticated]
+    
+    @action(detail=False, methods=['post'])
+    def heartbeat(self, request):
+        """Keep the user online for another PRESENCE_TTL seconds"""
+        presence.heartbeat(request.user.id)
+        return Response(status=status.HTTP_204_NO_CONTENT)
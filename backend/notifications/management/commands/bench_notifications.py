@@ -0,0 +1,182 @@
+import heapq
+import random
+import statistics
+import time
+import uuid
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.test import TestCase, override_settings
+from rest_framework.test import APIRequestFactory, force_authenticate
+
+from messaging.models import Message
+from messaging.views import MessageViewSet
+from notifications import pipeline
+from notifications.providers import NotificationProvider
+from social_messenger.celery_app import app
+
+User = get_user_model()
+
+
+class Rollback(Exception):
+    pass
+
+
+class CountingProvider(NotificationProvider):
+    """Counts provider calls and notifications instead of sending them"""
+    
+    calls = 0
+    notifications = 0
+    
+    def send(self, notifications):
+        CountingProvider.calls += 1
+        CountingProvider.notifications += len(notifications)
+
+
+def private_cache():
+    """Settings for an empty default cache, leaving the real one untouched"""
+    return {'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+                        'LOCATION': f'bench-notifications-{uuid.uuid4()}'}}
+
+
+class Command(BaseCommand):
+    help = (
+        'Benchmark push notifications. First times sending a message through '
+        'the API with notifications disabled and enabled, the latter queueing '
+        'a task on an in-memory broker after commit. Then replays bursts of '
+        'messages to --recipients users over --minutes of simulated time '
+        'through the coalescing pipeline, counting the notifications and '
+        'provider calls against one per message. Uses a private cache and '
+        'rolls back every database change.'
+    )
+    
+    def add_arguments(self, parser):
+        parser.add_argument('--sends', type=int, default=300,
+                            help='Timed sends per mode')
+        parser.add_argument('--recipients', type=int, default=100,
+                            help='Users receiving messages in the simulation')
+        parser.add_argument('--senders', type=int, default=50,
+                            help='Users sending them')
+        parser.add_argument('--burst-interval', type=float, default=120,
+                            help='Average seconds between bursts of messages to one recipient')
+        parser.add_argument('--burst-size', type=int, default=8,
+                            help='Most messages in a burst, a few seconds apart')
+        parser.add_argument('--minutes', type=float, default=60,
+                            help='Simulated minutes of messages')
+        parser.add_argument('--buckets', default='5,15',
+                            help='Comma-separated NOTIFICATION_COALESCE_SECONDS values to simulate')
+    
+    def handle(self, *args, **options):
+        user_ids = list(User.objects.order_by('id').values_list('id', flat=True)[:options['recipients'] + options['senders']])
+        if len(user_ids) < options['recipients'] + options['senders']:
+            raise CommandError(f"Need {options['recipients'] + options['senders']} users, found {len(user_ids)}; "
+                               'run generate_dataset first')
+        provider = f'{__name__}.CountingProvider'
+        with override_settings(CACHES=private_cache(), NOTIFICATION_PROVIDER=provider):
+            self.send_path(user_ids[0], user_ids[1], options['sends'])
+        recipient_ids, sender_ids = user_ids[:options['recipients']], user_ids[options['recipients']:]
+        self.stdout.write(
+            f"Coalescing ({len(recipient_ids)} recipients, a burst of up to {options['burst_size']} messages "
+            f"every {options['burst_interval']:g} s each, {options['minutes']:g} simulated minutes, "
+            f"cap {settings.NOTIFICATION_RATE})"
+        )
+        for seconds in options['buckets'].split(','):
+            with override_settings(CACHES=private_cache(), NOTIFICATION_PROVIDER=provider,
+                                   NOTIFICATION_COALESCE_SECONDS=int(seconds)):
+                self.simulate(recipient_ids, sender_ids, options)
+    
+    def send_path(self, sender_id, recipient_id, sends):
+        sender = User.objects.get(id=sender_id)
+        view = MessageViewSet.as_view({'post': 'create'})
+        factory = APIRequestFactory()
+        timings = {'disabled': [], 'enabled': []}
+        try:
+            # The first send of each mode connects to the broker and is not timed
+            for number in range(sends + 1):
+                for label in timings:
+                    request = factory.post('/api/messages/messages/', {'recipient': recipient_id, 'message': 'benchmark'},
+                                           format='json')
+                    force_authenticate(request, sender)
+                    with override_settings(NOTIFICATIONS_ENABLED=label == 'enabled', CELERY_TASK_ALWAYS_EAGER=False):
+                        try:
+                            with transaction.atomic():
+                                started = time.perf_counter()
+                                # Commit callbacks run as if the request had committed
+                                with TestCase.captureOnCommitCallbacks(execute=True):
+                                    response = view(request)
+                                if number:
+                                    timings[label].append(time.perf_counter() - started)
+                                raise Rollback
+                        except Rollback:
+                            pass
+                    if response.status_code != 201:
+                        raise CommandError(f'Unexpected status {response.status_code}')
+        finally:
+            app.control.purge()
+        
+        self.stdout.write(f'Send path ({connection.vendor}, {sends} messages per mode, in-memory broker)')
+        medians = {}
+        for label, values in timings.items():
+            values.sort()
+            medians[label] = statistics.median(values)
+            self.stdout.write(
+                f'  notifications {label:<9} p50 {medians[label] * 1000:6.2f} ms  '
+                f'p95 {values[int(len(values) * 0.95)] * 1000:6.2f} ms'
+            )
+        self.stdout.write(f"  queueing adds {(medians['enabled'] - medians['disabled']) * 1000:+.3f} ms at the median")
+    
+    def simulate(self, recipient_ids, sender_ids, options):
+        rng = random.Random(0)
+        seconds = options['minutes'] * 60
+        start = time.time()
+        sent = []
+        for recipient_id in recipient_ids:
+            at = rng.uniform(0, options['burst_interval'])
+            while at < seconds:
+                sender_id = rng.choice(sender_ids)
+                for _ in range(rng.randint(1, options['burst_size'])):
+                    sent.append((start + at, sender_id, recipient_id))
+                    at += rng.uniform(1, 5)
+                at += rng.expovariate(1 / options['burst_interval'])
+        sent.sort()
+        
+        CountingProvider.calls = CountingProvider.notifications = 0
+        deferred = 0
+        due = []
+        try:
+            with transaction.atomic():
+                started = time.perf_counter()
+                for at, sender_id, recipient_id in sent:
+                    deferred += self.run_due(due, at)
+                    Message.objects.create(sender_id=sender_id, recipient_id=recipient_id, content='benchmark')
+                    bucket = pipeline.open_burst(recipient_id, now=at)
+                    if bucket is not None:
+                        heapq.heappush(due, bucket)
+                deferred += self.run_due(due, float('inf'))
+                elapsed = time.perf_counter() - started
+                raise Rollback
+        except Rollback:
+            pass
+        
+        self.stdout.write(
+            f'  {settings.NOTIFICATION_COALESCE_SECONDS:>3} s buckets  {len(sent):,} messages -> '
+            f'{CountingProvider.notifications:,} notifications ({CountingProvider.notifications / len(sent):.1%}) '
+            f'in {CountingProvider.calls:,} provider calls; {deferred:,} deferred by the rate cap; '
+            f'{elapsed:.2f} s including the inserts'
+        )
+    
+    def run_due(self, due, until):
+        """Deliver every bucket due by ``until``, as the scheduled tasks would; returns the users deferred"""
+        deferred = 0
+        while due and pipeline.bucket_time(due[0]) <= until:
+            bucket = heapq.heappop(due)
+            user_ids = pipeline.take_bucket(bucket)
+            size = settings.NOTIFICATION_BATCH_SIZE
+            for start in range(0, len(user_ids), size):
+                _, buckets, capped = pipeline.deliver(user_ids[start:start + size], now=pipeline.bucket_time(bucket))
+                deferred += capped
+                for later in buckets:
+                    heapq.heappush(due, later)
+        return deferred
@@ -0,0 +1,286 @@
+"""
+Push notifications for new direct messages and friend requests.
+
+Sending a message or a friend request only queues
+``notifications.tasks.queue_notification`` once its transaction commits
+(``notify_on_commit``); the rest runs in the Celery worker, with its state
+in the default cache (Redis when ``REDIS_URL`` is set):
+
+- The first event for a user opens a burst: the user joins the delivery
+  bucket due one to two ``NOTIFICATION_COALESCE_SECONDS`` later, and
+  further events until the bucket goes out are absorbed.
+- One task per bucket (``deliver_notification_bucket``) takes its users at
+  the bucket's time and sends them in batches of
+  ``NOTIFICATION_BATCH_SIZE``, one provider call per batch.
+- Notifications are built from the database when they go out, so one
+  notification covers the whole burst: the unread messages and pending
+  friend requests that arrived since the user's previous notification. A
+  user who read everything meanwhile gets nothing.
+- ``NOTIFICATION_RATE`` caps the notifications a user gets per period. A
+  capped user moves to the bucket where the period ends and gets a single
+  notification for everything then.
+
+Lost cache state costs at most a repeated or a missed notification, never
+a message. With ``CELERY_TASK_ALWAYS_EAGER`` tasks run at once and
+ignore their ETA, so every event is sent right away.
+"""
+import logging
+import math
+import time
+from datetime import datetime, timedelta, timezone
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Count, Max
+
+from friends.models import FriendRequest
+from messaging.models import Message, UnreadCounter
+
+from .providers import get_provider
+
+logger = logging.getLogger(__name__)
+
+# Events older than this are never notified, e.g. for users without a cursor
+LOOKBACK = timedelta(days=1)
+CURSOR_TIMEOUT = 7 * 24 * 3600
+# Keeps bucket keys a while past their time, for late deliveries
+KEY_MARGIN = 3600
+PREVIEW_LENGTH = 100
+# Senders named in a notification about several conversations
+NAMED_SENDERS = 2
+PERIODS = {'s': 1, 'm': 60, 'h': 3600, 'd': 86400}
+
+
+def scheduled_key(user_id):
+    return f'notify:scheduled:{user_id}'
+
+
+def bucket_key(bucket):
+    return f'notify:bucket:{bucket}'
+
+
+def cursor_key(user_id):
+    return f'notify:cursor:{user_id}'
+
+
+def rate_key(user_id, window):
+    return f'notify:rate:{user_id}:{window}'
+
+
+def notify_on_commit(user_id):
+    """Queue a notification check for ``user_id`` once the current transaction commits"""
+    if not settings.NOTIFICATIONS_ENABLED:
+        return
+    from .tasks import queue_notification
+    
+    def queue():
+        # A broker outage must not fail a send that already committed
+        try:
+            queue_notification.delay(user_id)
+        except Exception:
+            logger.exception('Could not queue a notification for user %s', user_id)
+    
+    transaction.on_commit(queue)
+
+
+def bucket_at(when):
+    """The first bucket due at or after ``when``"""
+    return math.ceil(when / settings.NOTIFICATION_COALESCE_SECONDS)
+
+
+def bucket_time(bucket):
+    return bucket * settings.NOTIFICATION_COALESCE_SECONDS
+
+
+def open_burst(user_id, now=None):
+    """
+    Record an event for ``user_id``.
+    
+    Returns the bucket the user joined when it still needs scheduling
+    (the user is its first), else ``None``; events for a user already
+    waiting in a bucket change nothing.
+    """
+    now = time.time() if now is None else now
+    return add_to_bucket(user_id, now + settings.NOTIFICATION_COALESCE_SECONDS, now)
+
+
+def add_to_bucket(user_id, when, now):
+    bucket = bucket_at(when)
+    timeout = math.ceil(bucket_time(bucket) - now) + KEY_MARGIN
+    if not cache.add(scheduled_key(user_id), bucket, timeout):
+        return None
+    key = bucket_key(bucket)
+    cache.add(key, 0, timeout)
+    slot = cache.incr(key)
+    cache.set(f'{key}:{slot}', user_id, timeout)
+    return bucket if slot == 1 else None
+
+
+def take_bucket(bucket):
+    """The users waiting in ``bucket``, removing them from it"""
+    key = bucket_key(bucket)
+    slots = [f'{key}:{slot}' for slot in range(1, (cache.get(key) or 0) + 1)]
+    user_ids = list(cache.get_many(slots).values())
+    cache.delete_many([key, *slots])
+    return user_ids
+
+
+def parse_rate(rate):
+    """``'<count>/<period>'`` as (count, seconds), periods as in DRF throttle rates"""
+    count, period = rate.split('/')
+    return int(count), PERIODS[period[0]]
+
+
+def reserve(user_id, now):
+    """Count a notification against the user's cap; returns ``None`` if allowed, else when the cap resets"""
+    count, period = parse_rate(settings.NOTIFICATION_RATE)
+    window = int(now // period)
+    key = rate_key(user_id, window)
+    cache.add(key, 0, period + KEY_MARGIN)
+    if cache.incr(key) <= count:
+        return None
+    return (window + 1) * period
+
+
+def summarise(user_id, cursor, since):
+    """
+    What ``user_id`` has not been notified of, or ``None`` if nothing.
+    
+    ``cursor`` is the (message id, friend request id) the previous
+    notification covered; only unread messages and pending requests after
+    it and after ``since`` count.
+    """
+    message_cursor, request_cursor = cursor
+    senders = list(
+        Message.objects.filter(recipient_id=user_id, is_read=False, id__gt=message_cursor, created_at__gte=since)
+        .exclude(sender_id=user_id)
+        .values('sender_id')
+        .annotate(count=Count('id'), last_id=Max('id'))
+        .order_by('-last_id')
+    )
+    requests = list(
+        FriendRequest.objects.filter(
+            receiver_id=user_id,
+            status=FriendRequest.RequestStatus.PENDING,
+            id__gt=request_cursor,
+            created_at__gte=since
+        ).order_by('-id').values_list('id', 'sender_id')
+    )
+    if not senders and not requests:
+        return None
+    
+    preview = None
+    if len(senders) == 1 and senders[0]['count'] == 1:
+        preview = Message.objects.filter(
+            id=senders[0]['last_id'],
+            created_at__gte=since
+        ).values_list('message_type', 'content').first()
+    return {
+        'senders': [(row['sender_id'], row['count']) for row in senders],
+        'preview': preview,
+        'requests': [sender_id for _, sender_id in requests],
+        'cursor': (
+            max([row['last_id'] for row in senders], default=message_cursor),
+            requests[0][0] if requests else request_cursor,
+        ),
+    }
+
+
+def preview_text(preview):
+    message_type, content = preview
+    if message_type == Message.MessageType.IMAGE:
+        return 'Sent a photo'
+    if message_type == Message.MessageType.FILE:
+        return 'Sent a file'
+    content = content or ''
+    return content if len(content) <= PREVIEW_LENGTH else content[:PREVIEW_LENGTH - 1] + '…'
+
+
+def list_names(names, total):
+    if total > len(names):
+        return f"{', '.join(names)} and {total - len(names)} more"
+    return ' and '.join(names)
+
+
+def format_notification(user_id, summary, names, badge):
+    senders, requests = summary['senders'], summary['requests']
+    messages = sum(count for _, count in senders)
+    parts = []
+    if senders:
+        if len(senders) == 1:
+            title = names.get(senders[0][0], 'New message')
+            parts.append(preview_text(summary['preview']) if summary['preview'] else f'{messages} new messages')
+        else:
+            title = 'New messages'
+            named = [names.get(sender_id, 'Someone') for sender_id, _ in senders[:NAMED_SENDERS]]
+            parts.append(f'{messages} new messages from {list_names(named, len(senders))}')
+    if requests:
+        if not senders:
+            title = 'Friend request' if len(requests) == 1 else 'Friend requests'
+        named = [names.get(sender_id, 'Someone') for sender_id in requests[:NAMED_SENDERS]]
+        parts.append(
+            f'{list_names(named, len(requests))} sent you '
+            f"{'a friend request' if len(requests) == 1 else 'friend requests'}"
+        )
+    return {
+        'userId': user_id,
+        'title': title,
+        'body': '; '.join(parts),
+        'badge': badge,
+        'data': {
+            'messages': messages,
+            'senders': [sender_id for sender_id, _ in senders],
+            'friendRequests': requests,
+        },
+    }
+
+
+def deliver(user_ids, now=None):
+    """
+    Build and send the notifications of a batch of users, in one provider call.
+    
+    Returns the notifications sent, the buckets rate-capped users were
+    moved to that need scheduling, and the number of capped users. Raises
+    ``ProviderError`` before any cursor moves, so a retry sends the same.
+    """
+    from messaging.serializers import user_summaries
+    
+    now = time.time() if now is None else now
+    since = datetime.fromtimestamp(now, timezone.utc) - LOOKBACK
+    # New events from here on open a new burst
+    cache.delete_many([scheduled_key(user_id) for user_id in user_ids])
+    cursors = cache.get_many([cursor_key(user_id) for user_id in user_ids])
+    
+    summaries = {}
+    buckets = []
+    deferred = 0
+    for user_id in user_ids:
+        summary = summarise(user_id, cursors.get(cursor_key(user_id), (0, 0)), since)
+        if summary is None:
+            continue
+        reset_at = reserve(user_id, now)
+        if reset_at is not None:
+            deferred += 1
+            bucket = add_to_bucket(user_id, reset_at, now)
+            if bucket is not None:
+                buckets.append(bucket)
+            continue
+        summaries[user_id] = summary
+    if not summaries:
+        return [], buckets, deferred
+    
+    sender_ids = {sender_id for summary in summaries.values() for sender_id, _ in summary['senders']}
+    sender_ids.update(sender_id for summary in summaries.values() for sender_id in summary['requests'])
+    names = {user_id: user['name'] for user_id, user in user_summaries(sender_ids).items()}
+    badges = dict(UnreadCounter.objects.filter(user_id__in=summaries).values_list('user_id', 'total'))
+    notifications = [
+        format_notification(user_id, summary, names, badges.get(user_id, 0))
+        for user_id, summary in summaries.items()
+    ]
+    get_provider().send(notifications)
+    cache.set_many(
+        {cursor_key(user_id): summary['cursor'] for user_id, summary in summaries.items()},
+        CURSOR_TIMEOUT
+    )
+    return notifications, buckets, deferred
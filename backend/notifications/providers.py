@@ -0,0 +1,75 @@
+"""
+Where push notifications go.
+
+``NOTIFICATION_PROVIDER`` names a ``NotificationProvider`` class. Its
+``send`` takes one batch of notifications, each a dict like::
+
+    {"userId": 2, "title": "Jane Doe", "body": "See you tomorrow!",
+     "badge": 3, "data": {"messages": 1, "senders": [5], "friendRequests": []}}
+
+and gets them to the users' devices (APNs, FCM, a push gateway). Failures
+worth retrying raise ``ProviderError``; the batch is then rebuilt and sent
+again later.
+"""
+import functools
+import logging
+import urllib.error
+import urllib.request
+from collections import deque
+
+import orjson
+from django.conf import settings
+from django.utils.module_loading import import_string
+
+logger = logging.getLogger(__name__)
+
+# Notifications the local provider keeps
+OUTBOX_SIZE = 1000
+WEBHOOK_TIMEOUT = 10
+
+
+class ProviderError(Exception):
+    """A batch could not be sent but may be retried"""
+
+
+class NotificationProvider:
+    def send(self, notifications):
+        raise NotImplementedError
+
+
+class LocalProvider(NotificationProvider):
+    """Logs notifications and keeps the latest in ``outbox``; for development and tests"""
+    
+    outbox = deque(maxlen=OUTBOX_SIZE)
+    
+    def send(self, notifications):
+        for notification in notifications:
+            logger.info('Notification for user %s: %s: %s', notification['userId'],
+                        notification['title'], notification['body'])
+        self.outbox.extend(notifications)
+
+
+class WebhookProvider(NotificationProvider):
+    """POSTs each batch as ``{"notifications": [...]}`` to NOTIFICATION_WEBHOOK_URL"""
+    
+    def send(self, notifications):
+        request = urllib.request.Request(
+            settings.NOTIFICATION_WEBHOOK_URL,
+            data=orjson.dumps({'notifications': notifications}),
+            headers={'Content-Type': 'application/json'},
+            method='POST'
+        )
+        try:
+            with urllib.request.urlopen(request, timeout=WEBHOOK_TIMEOUT) as response:
+                response.read()
+        except (urllib.error.URLError, TimeoutError) as exc:
+            raise ProviderError(f'Webhook failed: {exc}') from exc
+
+
+@functools.lru_cache(maxsize=None)
+def load_provider(path):
+    return import_string(path)()
+
+
+def get_provider():
+    return load_provider(settings.NOTIFICATION_PROVIDER)
@@ -0,0 +1,41 @@
+from datetime import datetime, timezone
+
+from celery import shared_task
+from django.conf import settings
+
+from . import pipeline
+from .providers import ProviderError
+
+
+def schedule_bucket(bucket):
+    if bucket is not None:
+        eta = datetime.fromtimestamp(pipeline.bucket_time(bucket), timezone.utc)
+        deliver_notification_bucket.apply_async((bucket,), eta=eta)
+
+
+@shared_task
+def queue_notification(user_id):
+    """Put a user with news in the next delivery bucket, unless they already wait in one"""
+    schedule_bucket(pipeline.open_burst(user_id))
+
+
+@shared_task
+def deliver_notification_bucket(bucket):
+    """Send the notifications of every user in a bucket, NOTIFICATION_BATCH_SIZE per task"""
+    user_ids = pipeline.take_bucket(bucket)
+    size = settings.NOTIFICATION_BATCH_SIZE
+    for start in range(0, len(user_ids), size):
+        deliver_notifications.delay(user_ids[start:start + size])
+    return {'users': len(user_ids)}
+
+
+@shared_task(bind=True, max_retries=3, default_retry_delay=30)
+def deliver_notifications(self, user_ids):
+    """Build and send one batch of notifications; provider failures are retried"""
+    try:
+        notifications, buckets, deferred = pipeline.deliver(user_ids)
+    except ProviderError as exc:
+        raise self.retry(exc=exc)
+    for bucket in buckets:
+        schedule_bucket(bucket)
+    return {'sent': len(notifications), 'deferred': deferred}
@@ -1,5 +1,8 @@
 """
 ASGI config for social_messenger project.
+
+HTTP requests are handled by Django as usual; WebSocket connections are
+routed to the real-time consumers after JWT authentication.
 """
 
 import os
@@ -8,4 +11,14 @@ from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'social_messenger.settings')
 
-application = get_asgi_application()
+# Initialize Django before importing anything that touches the ORM
+django_asgi_app = get_asgi_application()
+
+from channels.routing import ProtocolTypeRouter, URLRouter  # noqa: E402
+from messaging.middleware import JWTAuthMiddleware  # noqa: E402
+from messaging.routing import websocket_urlpatterns  # noqa: E402
+
+application = ProtocolTypeRouter({
+    'http': django_asgi_app,
+    'websocket': JWTAuthMiddleware(URLRouter(websocket_urlpatterns)),
+})
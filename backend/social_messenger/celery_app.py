@@ -0,0 +1,17 @@
+"""
+Celery config for social_messenger project.
+"""
+
+import os
+
+from celery import Celery
+
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'social_messenger.settings')
+
+app = Celery('social_messenger')
+
+# Read CELERY_* settings from Django settings
+app.config_from_object('django.conf:settings', namespace='CELERY')
+
+# Discover tasks.py in every installed app
+app.autodiscover_tasks()
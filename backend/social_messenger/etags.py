@@ -0,0 +1,138 @@
+"""
+Version-based ETags and conditional GET for read endpoints that rarely change.
+
+Every user has a change counter per scope in the shared cache:
+
+- ``profile``: the user's own public fields
+- ``friends``: their friends and the pending requests they received,
+  including those people's profiles
+- ``messages``: their one-to-one messages and inbox, including peers' profiles
+
+Writes bump the affected counters after their transaction commits (see
+``bump``). A view decorated with ``conditional_get`` builds its ETag from
+the counters it depends on and the request URL, so a matching
+``If-None-Match`` is answered with 304 after a single cache read, before
+the view runs any query or serializer.
+
+A missing counter (first use, eviction, cache flush) is started from the
+current time in nanoseconds, which is larger than any value it could have
+had before, so an old ETag can never match again. Counters must live in a
+cache every process shares, so ETags are only enabled by default when
+Redis is configured (``ETAGS_ENABLED``).
+"""
+import functools
+import hashlib
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.utils.cache import patch_vary_headers
+from django.utils.http import parse_etags
+from rest_framework import status
+from rest_framework.response import Response
+
+from .metrics import CONDITIONAL_REQUESTS, current_request_metrics
+
+# Change when a covered response changes shape, so clients refetch after a deploy
+RESPONSE_SCHEMA = '1'
+
+
+def version_key(scope, user_id):
+    return f'etag:{scope}:{user_id}'
+
+
+def get_versions(keys):
+    """Current counter for each ``(scope, user_id)`` in ``keys``, starting missing ones"""
+    cache_keys = [version_key(scope, user_id) for scope, user_id in keys]
+    versions = cache.get_many(cache_keys)
+    missing = [key for key in cache_keys if key not in versions]
+    if missing:
+        for key in missing:
+            cache.add(key, time.time_ns(), settings.ETAG_VERSION_TIMEOUT)
+        versions.update(cache.get_many(missing))
+    return [versions.get(key) for key in cache_keys]
+
+
+def bump_now(scope, user_ids):
+    for user_id in set(user_ids):
+        key = version_key(scope, user_id)
+        try:
+            cache.incr(key)
+        except ValueError:
+            cache.add(key, time.time_ns(), settings.ETAG_VERSION_TIMEOUT)
+
+
+def bump(scope, user_ids):
+    """
+    Invalidate the ``scope`` ETags of ``user_ids`` once the current transaction commits.
+    
+    Bumping earlier would let a concurrent read tag the old data with the
+    new version; bumping after commit at worst tags new data with the old
+    one, which only costs a refetch.
+    """
+    if not settings.ETAGS_ENABLED:
+        return
+    user_ids = list(user_ids)
+    if user_ids:
+        transaction.on_commit(lambda: bump_now(scope, user_ids))
+
+
+def make_etag(request, keys):
+    versions = get_versions(keys)
+    raw = '|'.join([RESPONSE_SCHEMA, request.get_full_path()] + [
+        f'{scope}:{user_id}:{version}' for (scope, user_id), version in zip(keys, versions)
+    ])
+    return f'W/"{hashlib.blake2b(raw.encode(), digest_size=12).hexdigest()}"'
+
+
+def etag_matches(header, etag):
+    """Weak comparison of ``etag`` against an ``If-None-Match`` header"""
+    if not header:
+        return False
+    # "*" is not honoured: it would skip the view's permission checks without knowing any version
+    candidates = parse_etags(header)
+    return etag.removeprefix('W/') in {candidate.removeprefix('W/') for candidate in candidates}
+
+
+def record_result(result):
+    metrics = current_request_metrics.get()
+    if metrics is not None and metrics.endpoint is not None:
+        CONDITIONAL_REQUESTS.inc((metrics.endpoint, result))
+
+
+def conditional_get(dependencies):
+    """
+    Serve a DRF view method with version-based ETags.
+    
+    ``dependencies(request, **kwargs)`` returns the ``(scope, user_id)``
+    counters the response is built from. It may raise ``ValueError`` for a
+    malformed URL argument, in which case the view runs unconditionally.
+    Only 200 responses carry an ETag.
+    """
+    def decorator(method):
+        @functools.wraps(method)
+        def wrapper(view, request, *args, **kwargs):
+            if not settings.ETAGS_ENABLED or request.method not in ('GET', 'HEAD'):
+                return method(view, request, *args, **kwargs)
+            try:
+                keys = list(dependencies(request, **kwargs))
+            except ValueError:
+                return method(view, request, *args, **kwargs)
+            etag = make_etag(request, keys)
+            
+            if etag_matches(request.headers.get('If-None-Match'), etag):
+                record_result('hit')
+                response = Response(status=status.HTTP_304_NOT_MODIFIED)
+            else:
+                record_result('miss' if request.headers.get('If-None-Match') else 'unconditional')
+                response = method(view, request, *args, **kwargs)
+                if response.status_code != status.HTTP_200_OK:
+                    return response
+            
+            response['ETag'] = etag
+            response['Cache-Control'] = 'private, no-cache'
+            patch_vary_headers(response, ('Authorization',))
+            return response
+        return wrapper
+    return decorator
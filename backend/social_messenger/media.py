@@ -0,0 +1,188 @@
+"""
+Production serving of files under ``MEDIA_ROOT``.
+
+``serve_media`` only answers signed-in users. Message attachments
+(``attachments/``) are served to those who may read their blob, its
+uploader and the participants of a message using it (see
+``messaging.attachments``), and are a 404 for everyone else. Other media,
+such as profile pictures, are served to any signed-in user.
+
+How the bytes leave the process depends on ``MEDIA_SENDFILE``:
+
+- ``x-accel-redirect``: an empty response tells nginx to send the file
+  from its internal location ``MEDIA_ACCEL_PREFIX``, an alias of
+  ``MEDIA_ROOT``
+- ``x-sendfile``: the same with the absolute path, for Apache
+  (mod_xsendfile) or lighttpd
+- empty (stand-alone): the open file is the response body. A WSGI server
+  with ``wsgi.file_wrapper`` (gunicorn) hands it to ``os.sendfile``, so no
+  byte is copied through Python; under ASGI it is read in blocks
+
+Conditional requests (``If-None-Match``, ``If-Modified-Since``) are
+answered here. A single byte range gets a 206, checked against
+``If-Range``; several ranges get the whole file. With a proxy handing off
+the file, the proxy serves ranges itself. Attachment keys never change
+content (see ``messaging.attachments``), so attachments are cached as
+``immutable`` for a year, other media for ``MEDIA_CACHE_SECONDS``; always
+``private``, since who may read them depends on the request.
+"""
+import mimetypes
+import re
+from pathlib import Path
+from urllib.parse import quote
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured, SuspiciousFileOperation
+from django.http import FileResponse, Http404, HttpResponse
+from django.utils._os import safe_join
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.utils.http import http_date, parse_http_date_safe, quote_etag
+from rest_framework.decorators import api_view, permission_classes, throttle_classes
+from rest_framework.permissions import IsAuthenticated
+
+ATTACHMENTS_PREFIX = 'attachments/'
+IMMUTABLE_MAX_AGE = 365 * 24 * 3600
+SENDFILE_MODES = ('', 'x-accel-redirect', 'x-sendfile')
+# Types shown inline; anything else is downloaded, so an uploaded page cannot run in our origin
+INLINE_TYPES = ('image/', 'video/', 'audio/')
+SINGLE_RANGE = re.compile(r'bytes=(\d*)-(\d*)')
+
+
+class FileRange:
+    """
+    ``length`` bytes of an open file from ``start``.
+    
+    ``read`` stops at the end of the range. ``fileno`` and the file
+    position let a WSGI server's ``file_wrapper`` send the range with
+    ``os.sendfile``, bounded by the response's ``Content-Length``.
+    """
+    
+    def __init__(self, file, start, length):
+        file.seek(start)
+        self.file = file
+        self.remaining = length
+    
+    def read(self, size=-1):
+        if size < 0 or size > self.remaining:
+            size = self.remaining
+        data = self.file.read(size)
+        self.remaining -= len(data)
+        return data
+    
+    def fileno(self):
+        return self.file.fileno()
+    
+    def close(self):
+        self.file.close()
+
+
+def parse_range(header, size):
+    """
+    ``(first, last)`` byte positions requested by a single-range ``Range`` header.
+    
+    ``None`` means the whole file: no header, a malformed one, or several
+    ranges. A ``first`` past the end of the file cannot be satisfied.
+    """
+    match = SINGLE_RANGE.fullmatch(header or '')
+    if match is None:
+        return None
+    first, last = match.groups()
+    if first:
+        first = int(first)
+        last = min(int(last), size - 1) if last else size - 1
+        return (first, last) if first <= last or first >= size else None
+    if last:
+        # A suffix: the last N bytes
+        return max(size - int(last), 0), size - 1
+    return None
+
+
+def if_range_matches(request, etag, last_modified):
+    """Whether a ``Range`` may be honoured: no ``If-Range``, or one naming the current file"""
+    if_range = request.META.get('HTTP_IF_RANGE')
+    if not if_range:
+        return True
+    if if_range.startswith('"'):
+        return if_range == etag
+    return parse_http_date_safe(if_range) == last_modified
+
+
+def can_read(user, path):
+    if not path.startswith(ATTACHMENTS_PREFIX):
+        return True
+    from messaging import attachments
+    
+    blob = attachments.blob_for_key(path[len(ATTACHMENTS_PREFIX):])
+    return blob is not None and attachments.can_access(user, blob)
+
+
+@api_view(['GET', 'HEAD'])
+@permission_classes([IsAuthenticated])
+@throttle_classes([])
+def serve_media(request, path):
+    """Serve a file under MEDIA_ROOT to a user allowed to read it"""
+    mode = settings.MEDIA_SENDFILE
+    if mode not in SENDFILE_MODES:
+        raise ImproperlyConfigured(f'MEDIA_SENDFILE must be one of {SENDFILE_MODES}')
+    try:
+        fullpath = Path(safe_join(settings.MEDIA_ROOT, path))
+    except SuspiciousFileOperation:
+        raise Http404
+    # Unreadable attachments look missing, so their names reveal nothing
+    if not fullpath.is_file() or not can_read(request.user, path):
+        raise Http404
+    
+    stat = fullpath.stat()
+    size = stat.st_size
+    last_modified = int(stat.st_mtime)
+    etag = quote_etag(f'{stat.st_mtime_ns:x}-{size:x}')
+    headers = HttpResponse()
+    headers['ETag'] = etag
+    headers['Last-Modified'] = http_date(last_modified)
+    if path.startswith(ATTACHMENTS_PREFIX):
+        patch_cache_control(headers, private=True, max_age=IMMUTABLE_MAX_AGE, immutable=True)
+    else:
+        patch_cache_control(headers, private=True, max_age=settings.MEDIA_CACHE_SECONDS)
+    not_modified = get_conditional_response(request, etag=etag, last_modified=last_modified, response=headers)
+    if not_modified is not headers:
+        return not_modified
+    
+    content_type, encoding = mimetypes.guess_type(fullpath.name)
+    content_type = content_type or 'application/octet-stream'
+    status_code = 200
+    first, last = 0, size - 1
+    byte_range = parse_range(request.META.get('HTTP_RANGE'), size) if not mode else None
+    if byte_range and if_range_matches(request, etag, last_modified):
+        first, last = byte_range
+        if first >= size:
+            response = HttpResponse(status=416)
+            response['Content-Range'] = f'bytes */{size}'
+            return response
+        status_code = 206
+    length = last - first + 1
+    
+    if mode == 'x-accel-redirect':
+        response = HttpResponse(content_type=content_type)
+        response['X-Accel-Redirect'] = settings.MEDIA_ACCEL_PREFIX + quote(path)
+    elif mode == 'x-sendfile':
+        response = HttpResponse(content_type=content_type)
+        response['X-Sendfile'] = str(fullpath)
+    elif request.method == 'HEAD':
+        response = HttpResponse(status=status_code, content_type=content_type)
+        response['Content-Length'] = str(length)
+    else:
+        response = FileResponse(FileRange(fullpath.open('rb'), first, length), status=status_code,
+                                content_type=content_type)
+        response['Content-Length'] = str(length)
+    if status_code == 206:
+        response['Content-Range'] = f'bytes {first}-{last}/{size}'
+    
+    for header in ('ETag', 'Last-Modified', 'Cache-Control'):
+        response[header] = headers[header]
+    response['Accept-Ranges'] = 'bytes'
+    if encoding:
+        response['Content-Encoding'] = encoding
+    if not content_type.startswith(INLINE_TYPES):
+        response['Content-Disposition'] = 'attachment'
+    response['Content-Security-Policy'] = 'sandbox'
+    return response
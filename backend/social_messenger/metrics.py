@@ -0,0 +1,247 @@
+"""
+Per-request query count, database time, serialization time, latency and
+response size, recorded per view action and exposed as Prometheus histograms.
+
+``RequestMetricsMiddleware`` wraps every database connection with an
+execute wrapper for the duration of the request, so the numbers do not
+depend on ``DEBUG``. Each process keeps its own registry; the Prometheus
+text served at ``/metrics`` is that process's view, labelled with its pid.
+
+``http_conditional_requests_total`` counts how ETag-enabled endpoints
+(see ``social_messenger.etags``) were answered, so the 304 hit rate is
+``hit / (hit + miss + unconditional)`` per endpoint.
+
+Routes are also checked against a query budget: ``QUERY_BUDGETS`` maps an
+endpoint label (``"MessageViewSet.inbox"``) to its allowance and
+``QUERY_BUDGET_DEFAULT`` covers the rest. Going over logs a warning, or
+raises ``QueryBudgetExceeded`` when ``QUERY_BUDGET_RAISE`` is set (tests).
+"""
+import bisect
+import contextvars
+import logging
+import os
+import threading
+import time
+from contextlib import ExitStack
+
+from django.conf import settings
+from django.db import connections
+from django.http import HttpResponse, HttpResponseForbidden
+
+from .renderers import FastJSONRenderer
+
+logger = logging.getLogger(__name__)
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+QUERY_BUCKETS = (0, 1, 2, 3, 5, 8, 13, 21, 34, 55, 89)
+SIZE_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304)
+
+# The request being measured, so renderers can add to it
+current_request_metrics = contextvars.ContextVar('current_request_metrics', default=None)
+
+
+class QueryBudgetExceeded(Exception):
+    pass
+
+
+class Histogram:
+    """Cumulative Prometheus histogram with one series per label tuple"""
+    
+    def __init__(self, name, documentation, buckets, labelnames):
+        self.name = name
+        self.documentation = documentation
+        self.buckets = tuple(buckets)
+        self.labelnames = labelnames
+        self.series = {}
+        self.lock = threading.Lock()
+    
+    def observe(self, labels, value):
+        with self.lock:
+            series = self.series.get(labels)
+            if series is None:
+                series = self.series[labels] = [[0] * len(self.buckets), 0, 0.0]
+            counts = series[0]
+            for index in range(bisect.bisect_left(self.buckets, value), len(self.buckets)):
+                counts[index] += 1
+            series[1] += 1
+            series[2] += value
+    
+    def expose(self, extra_labels=''):
+        lines = [
+            f'# HELP {self.name} {self.documentation}',
+            f'# TYPE {self.name} histogram',
+        ]
+        with self.lock:
+            series = sorted(self.series.items())
+        for labels, (counts, count, total) in series:
+            label_text = ','.join(
+                f'{name}="{escape_label(value)}"' for name, value in zip(self.labelnames, labels)
+            ) + extra_labels
+            for bound, bucket_count in zip(self.buckets, counts):
+                lines.append(f'{self.name}_bucket{{{label_text},le="{bound}"}} {bucket_count}')
+            lines.append(f'{self.name}_bucket{{{label_text},le="+Inf"}} {count}')
+            lines.append(f'{self.name}_count{{{label_text}}} {count}')
+            lines.append(f'{self.name}_sum{{{label_text}}} {total}')
+        return lines
+
+
+class Counter:
+    """Prometheus counter with one series per label tuple"""
+    
+    def __init__(self, name, documentation, labelnames):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = labelnames
+        self.series = {}
+        self.lock = threading.Lock()
+    
+    def inc(self, labels, amount=1):
+        with self.lock:
+            self.series[labels] = self.series.get(labels, 0) + amount
+    
+    def expose(self, extra_labels=''):
+        lines = [
+            f'# HELP {self.name} {self.documentation}',
+            f'# TYPE {self.name} counter',
+        ]
+        with self.lock:
+            series = sorted(self.series.items())
+        for labels, value in series:
+            label_text = ','.join(
+                f'{name}="{escape_label(value)}"' for name, value in zip(self.labelnames, labels)
+            ) + extra_labels
+            lines.append(f'{self.name}{{{label_text}}} {value}')
+        return lines
+
+
+def escape_label(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+LABELS = ('endpoint', 'method', 'status')
+REQUEST_SECONDS = Histogram(
+    'http_request_duration_seconds', 'Time to produce the response.', LATENCY_BUCKETS, LABELS
+)
+DB_QUERIES = Histogram(
+    'http_request_db_queries', 'Database queries run by the request.', QUERY_BUCKETS, LABELS
+)
+DB_SECONDS = Histogram(
+    'http_request_db_seconds', 'Time spent in database queries.', LATENCY_BUCKETS, LABELS
+)
+SERIALIZE_SECONDS = Histogram(
+    'http_response_serialize_seconds', 'Time spent encoding the response body.', LATENCY_BUCKETS, LABELS
+)
+RESPONSE_BYTES = Histogram(
+    'http_response_size_bytes', 'Size of the response body.', SIZE_BUCKETS, LABELS
+)
+HISTOGRAMS = (REQUEST_SECONDS, DB_QUERIES, DB_SECONDS, SERIALIZE_SECONDS, RESPONSE_BYTES)
+# result: hit (answered 304), miss (If-None-Match was stale) or unconditional
+CONDITIONAL_REQUESTS = Counter(
+    'http_conditional_requests_total', 'Requests to ETag-enabled endpoints by outcome.', ('endpoint', 'result')
+)
+COUNTERS = (CONDITIONAL_REQUESTS,)
+
+
+class RequestMetrics:
+    """Counters for one request, fed by the connection execute wrappers"""
+    
+    def __init__(self):
+        self.queries = 0
+        self.db_seconds = 0.0
+        self.serialize_seconds = 0.0
+        self.endpoint = None
+    
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.queries += 1
+            self.db_seconds += time.perf_counter() - start
+
+
+def endpoint_label(view_func, method):
+    """``ViewSet.action`` for DRF viewsets, ``module.view`` for everything else"""
+    view_class = getattr(view_func, 'cls', None)
+    if view_class is None:
+        return f'{view_func.__module__}.{view_func.__name__}'
+    action = (getattr(view_func, 'actions', None) or {}).get(method.lower())
+    return f'{view_class.__name__}.{action}' if action else view_class.__name__
+
+
+def check_query_budget(endpoint, queries):
+    budget = settings.QUERY_BUDGETS.get(endpoint, settings.QUERY_BUDGET_DEFAULT)
+    if budget is None or queries <= budget:
+        return
+    message = f'{endpoint} ran {queries} queries, over its budget of {budget}'
+    if settings.QUERY_BUDGET_RAISE:
+        raise QueryBudgetExceeded(message)
+    logger.warning(message)
+
+
+class RequestMetricsMiddleware:
+    """Record the metrics of every request routed to a view"""
+    
+    def __init__(self, get_response):
+        self.get_response = get_response
+    
+    def __call__(self, request):
+        metrics = RequestMetrics()
+        token = current_request_metrics.set(metrics)
+        start = time.perf_counter()
+        try:
+            with ExitStack() as stack:
+                for connection in connections.all():
+                    stack.enter_context(connection.execute_wrapper(metrics))
+                response = self.get_response(request)
+        finally:
+            current_request_metrics.reset(token)
+        elapsed = time.perf_counter() - start
+        
+        if metrics.endpoint is not None:
+            labels = (metrics.endpoint, request.method, str(response.status_code))
+            size = len(response.content) if not response.streaming else 0
+            REQUEST_SECONDS.observe(labels, elapsed)
+            DB_QUERIES.observe(labels, metrics.queries)
+            DB_SECONDS.observe(labels, metrics.db_seconds)
+            SERIALIZE_SECONDS.observe(labels, metrics.serialize_seconds)
+            RESPONSE_BYTES.observe(labels, size)
+            check_query_budget(metrics.endpoint, metrics.queries)
+        return response
+    
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        metrics = current_request_metrics.get()
+        if metrics is not None and not getattr(view_func, 'exclude_from_metrics', False):
+            metrics.endpoint = endpoint_label(view_func, request.method)
+
+
+class InstrumentedJSONRenderer(FastJSONRenderer):
+    """``FastJSONRenderer`` that adds its encoding time to the current request's metrics"""
+    
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        start = time.perf_counter()
+        try:
+            return super().render(data, accepted_media_type, renderer_context)
+        finally:
+            metrics = current_request_metrics.get()
+            if metrics is not None:
+                metrics.serialize_seconds += time.perf_counter() - start
+
+
+def render_metrics():
+    extra_labels = f',pid="{os.getpid()}"'
+    lines = []
+    for metric in HISTOGRAMS + COUNTERS:
+        lines.extend(metric.expose(extra_labels))
+    return '\n'.join(lines) + '\n'
+
+
+def metrics_view(request):
+    """Prometheus text exposition; requires ``METRICS_TOKEN`` as a bearer token when it is set"""
+    if settings.METRICS_TOKEN:
+        if request.headers.get('Authorization') != f'Bearer {settings.METRICS_TOKEN}':
+            return HttpResponseForbidden()
+    return HttpResponse(render_metrics(), content_type='text/plain; version=0.0.4; charset=utf-8')
+
+
+metrics_view.exclude_from_metrics = True
@@ -0,0 +1,48 @@
+"""
+Fast JSON output for the hot list endpoints.
+
+``FastJSONRenderer`` writes the same bytes as DRF's ``JSONRenderer`` with
+the project's settings (compact, ``UNICODE_JSON``, U+2028/U+2029 escaped),
+using orjson. Values orjson does not know natively (datetimes, decimals,
+lazy strings, querysets) still go through DRF's ``JSONEncoder``. Anything
+orjson refuses, such as integers wider than 64 bits or non-string keys,
+and indented output fall back to the stock renderer. Floats in exponent
+notation are written without padding (``1e-7``, not ``1e-07``); no
+endpoint returns floats.
+
+List endpoints build their rows with plain dicts from ``values_list``
+queries instead of serializer instances; ``format_datetime`` gives those
+rows the exact string a ``DateTimeField`` would.
+"""
+import orjson
+from django.utils import timezone
+from rest_framework.renderers import JSONRenderer
+from rest_framework.utils.encoders import JSONEncoder
+
+
+def format_datetime(value):
+    """``value`` as DRF's ``DateTimeField`` renders it: ISO 8601 in the current time zone, UTC as ``Z``"""
+    if value is None:
+        return None
+    value = timezone.localtime(value).isoformat()
+    return value[:-6] + 'Z' if value.endswith('+00:00') else value
+
+
+class FastJSONRenderer(JSONRenderer):
+    """``JSONRenderer`` producing identical output with orjson"""
+    default = JSONEncoder().default
+    
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b''
+        if (
+            self.ensure_ascii or not self.compact or self.encoder_class is not JSONEncoder or
+            self.get_indent(accepted_media_type, renderer_context or {})
+        ):
+            return super().render(data, accepted_media_type, renderer_context)
+        try:
+            ret = orjson.dumps(data, default=self.default, option=orjson.OPT_PASSTHROUGH_DATETIME)
+        except TypeError:
+            return super().render(data, accepted_media_type, renderer_context)
+        # Same escaping as JSONRenderer, for embedding in JavaScript
+        return ret.replace(b'\xe2\x80\xa8', b'\\u2028').replace(b'\xe2\x80\xa9', b'\\u2029')
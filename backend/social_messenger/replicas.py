@@ -0,0 +1,215 @@
+"""
+Read replicas with read-your-writes stickiness.
+
+``DB_REPLICAS`` adds ``replica_1``, ``replica_2``... to ``DATABASES``
+(``DATABASE_REPLICAS`` lists them). ``ReplicaRouter`` then sends the reads
+of safe HTTP requests (GET, HEAD, OPTIONS) to one healthy replica, chosen
+at random once per request; everything else uses the primary:
+
+- writes, and reads inside a transaction, since they may need to see
+  what it wrote or lock rows;
+- every query of unsafe requests, Celery tasks, WebSocket consumers and
+  management commands, which often read what was just written;
+- requests of a user who wrote less than ``REPLICA_STICKY_SECONDS`` ago.
+  ``ReplicaRoutingMiddleware`` marks the user in the shared cache after
+  any request that wrote, so they read their own writes on every node
+  until the replicas have caught up. Only users authenticated by DRF are
+  known in time; session users are not pinned.
+
+Each process checks the replicas' lag every ``REPLICA_CHECK_INTERVAL``
+seconds, in a thread started by the first request that finds the check
+due, and leaves out those lagging more than ``REPLICA_MAX_LAG`` seconds or
+not answering. A streaming PostgreSQL standby reports its replay lag.
+Any other database (a second local database standing in for a replica)
+is as far behind as the oldest message the primary has and it lacks.
+Without a healthy replica, reads use the primary.
+"""
+import contextvars
+import logging
+import random
+import threading
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import DEFAULT_DB_ALIAS, DatabaseError, connections
+from django.utils import timezone
+from django.utils.functional import SimpleLazyObject
+
+logger = logging.getLogger(__name__)
+
+SAFE_METHODS = ('GET', 'HEAD', 'OPTIONS')
+
+POSTGRES_LAG_QUERY = """
+    SELECT pg_is_in_recovery(),
+           CASE WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0
+                ELSE EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp())
+           END
+"""
+
+# The routing of the request being served; None outside requests
+current_routing = contextvars.ContextVar('current_routing', default=None)
+
+
+def pin_key(user_id):
+    return f'db:primary:{user_id}'
+
+
+def request_user_id(request):
+    """The id of the user DRF authenticated, without triggering authentication"""
+    user = request.__dict__.get('user')
+    if user is None or isinstance(user, SimpleLazyObject) or not user.is_authenticated:
+        return None
+    return user.pk
+
+
+def replica_lag(alias):
+    """Seconds the database ``alias`` is behind the primary"""
+    from messaging.models import Message
+    
+    connection = connections[alias]
+    if connection.vendor == 'postgresql':
+        with connection.cursor() as cursor:
+            cursor.execute(POSTGRES_LAG_QUERY)
+            in_recovery, lag = cursor.fetchone()
+        if in_recovery:
+            return float(lag or 0)
+    
+    latest = Message.objects.using(alias).order_by('-id').values_list('id', flat=True).first() or 0
+    missing = Message.objects.using(DEFAULT_DB_ALIAS).filter(id__gt=latest).order_by('id').values_list(
+        'created_at', flat=True
+    ).first()
+    if missing is None:
+        return 0.0
+    return max(0.0, (timezone.now() - missing).total_seconds())
+
+
+class ReplicaHealth:
+    """Per-process list of replicas in rotation, refreshed every REPLICA_CHECK_INTERVAL"""
+    
+    def __init__(self):
+        self.healthy = None
+        self.lags = {}
+        self.checked_at = 0.0
+        self.lock = threading.Lock()
+        self.checking = None
+    
+    def get(self, now=None):
+        """The replicas in rotation; starts a check in the background when one is due"""
+        now = time.monotonic() if now is None else now
+        with self.lock:
+            due = self.healthy is None or now - self.checked_at >= settings.REPLICA_CHECK_INTERVAL
+            if self.checking is None and due:
+                self.checked_at = now
+                self.checking = threading.Thread(target=self.check_in_background, daemon=True)
+                self.checking.start()
+            checking = self.checking
+        if self.healthy is None:
+            # Only the first check is waited for; later requests use the last result meanwhile
+            checking.join()
+        return self.healthy or []
+    
+    def check_in_background(self):
+        try:
+            self.check()
+        except Exception:
+            logger.exception('Replica check failed')
+        finally:
+            with self.lock:
+                self.checking = None
+            # Not a request, so nothing else closes this thread's connections
+            connections.close_all()
+    
+    def check(self):
+        """Measure every replica's lag and update the rotation"""
+        healthy = []
+        for alias in settings.DATABASE_REPLICAS:
+            try:
+                lag = replica_lag(alias)
+            except DatabaseError:
+                logger.warning('Replica %s is not answering', alias, exc_info=True)
+                lag = None
+            self.lags[alias] = lag
+            if lag is not None and lag <= settings.REPLICA_MAX_LAG:
+                healthy.append(alias)
+            elif lag is not None:
+                logger.warning('Replica %s is %.1f s behind the primary', alias, lag)
+        if self.healthy is not None and set(healthy) != set(self.healthy):
+            logger.warning('Replicas in rotation: %s', ', '.join(healthy) or 'none')
+        self.healthy = healthy
+
+
+health = ReplicaHealth()
+
+
+class RequestRouting:
+    """Where the reads of one request go"""
+    
+    def __init__(self, request):
+        self.request = request
+        self.primary = request.method not in SAFE_METHODS
+        self.wrote = False
+        self.replica = None
+        self.pin_checked = False
+    
+    def db_for_read(self):
+        if self.primary:
+            return DEFAULT_DB_ALIAS
+        if not self.pin_checked:
+            user_id = request_user_id(self.request)
+            if user_id is not None:
+                self.pin_checked = True
+                if cache.get(pin_key(user_id)) is not None:
+                    self.primary = True
+                    return DEFAULT_DB_ALIAS
+        if self.replica is None:
+            healthy = health.get()
+            self.replica = random.choice(healthy) if healthy else DEFAULT_DB_ALIAS
+        return self.replica
+
+
+class ReplicaRouter:
+    def db_for_read(self, model, **hints):
+        routing = current_routing.get()
+        if routing is None or connections[DEFAULT_DB_ALIAS].in_atomic_block:
+            return DEFAULT_DB_ALIAS
+        instance = hints.get('instance')
+        # Related objects come from the database their parent did
+        if instance is not None and instance._state.db:
+            return instance._state.db
+        return routing.db_for_read()
+    
+    def db_for_write(self, model, **hints):
+        routing = current_routing.get()
+        if routing is not None:
+            routing.wrote = True
+        return DEFAULT_DB_ALIAS
+    
+    def allow_relation(self, obj1, obj2, **hints):
+        return True
+    
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        # Replicas get their schema through replication
+        return False if db in settings.DATABASE_REPLICAS else None
+
+
+class ReplicaRoutingMiddleware:
+    """Routes the request's reads and pins users who wrote to the primary"""
+    
+    def __init__(self, get_response):
+        self.get_response = get_response
+    
+    def __call__(self, request):
+        if not settings.DATABASE_REPLICAS:
+            return self.get_response(request)
+        routing = RequestRouting(request)
+        token = current_routing.set(routing)
+        try:
+            response = self.get_response(request)
+        finally:
+            current_routing.reset(token)
+        wrote = routing.wrote or (request.method not in SAFE_METHODS and response.status_code < 400)
+        user_id = request_user_id(request)
+        if wrote and user_id is not None:
+            cache.set(pin_key(user_id), 1, settings.REPLICA_STICKY_SECONDS)
+        return response
@@ -4,7 +4,8 @@ Django settings for social_messenger project.
 
 import os
 from pathlib import Path
-from decouple import config
+from corsheaders.defaults import default_headers
+from decouple import Csv, config
 from datetime import timedelta
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -20,12 +21,14 @@ ALLOWED_HOSTS = ['localhost', '127.0.0.1', '0.0.0.0', '192.168.1.3', '192.168.1.
 
 # Application definition
 INSTALLED_APPS = [
+    'daphne',
     'django.contrib.admin',
     'django.contrib.auth',
     'django.contrib.contenttypes',
     'django.contrib.sessions',
     'django.contrib.messages',
     'django.contrib.staticfiles',
+    'channels',
     'rest_framework',
     'rest_framework_simplejwt',
     'corsheaders',
@@ -33,9 +36,13 @@ INSTALLED_APPS = [
     'accounts',
     'friends',
     'messaging',
+    'notifications',
+    'benchmarks',
 ]
 
 MIDDLEWARE = [
+    'social_messenger.metrics.RequestMetricsMiddleware',
+    'social_messenger.replicas.ReplicaRoutingMiddleware',
     'corsheaders.middleware.CorsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'whitenoise.middleware.WhiteNoiseMiddleware',
@@ -66,17 +73,186 @@ TEMPLATES = [
 ]
 
 WSGI_APPLICATION = 'social_messenger.wsgi.application'
+ASGI_APPLICATION = 'social_messenger.asgi.application'
 
 # Database
-DATABASES = {
-    'default': {
-        'ENGINE': 'django.db.backends.postgresql',
-        'NAME': config('DB_NAME', default='social_messenger'),
-        'USER': config('DB_USER', default='postgres'),
-        'PASSWORD': config('DB_PASSWORD', default='postgres'),
-        'HOST': config('DB_HOST', default='db'),
-        'PORT': config('DB_PORT', default='5432'),
+DB_ENGINE = config('DB_ENGINE', default='postgresql')
+if DB_ENGINE == 'sqlite':
+    # Local runs and benchmarks without a PostgreSQL server
+    DATABASES = {
+        'default': {
+            'ENGINE': 'django.db.backends.sqlite3',
+            'NAME': config('DB_NAME', default=str(BASE_DIR / 'db.sqlite3')),
+        }
+    }
+else:
+    DATABASES = {
+        'default': {
+            'ENGINE': 'django.db.backends.postgresql',
+            'NAME': config('DB_NAME', default='social_messenger'),
+            'USER': config('DB_USER', default='postgres'),
+            'PASSWORD': config('DB_PASSWORD', default='postgres'),
+            'HOST': config('DB_HOST', default='db'),
+            'PORT': config('DB_PORT', default='5432'),
+        }
+    }
+
+# Read replicas (see social_messenger.replicas): SQLite files with
+# DB_ENGINE=sqlite, otherwise "host[:port][/name]" of PostgreSQL servers
+# with the primary's credentials
+DATABASE_REPLICAS = []
+for number, location in enumerate(config('DB_REPLICAS', default='', cast=Csv()), 1):
+    replica = {**DATABASES['default'], 'TEST': {'MIRROR': 'default'}}
+    if DB_ENGINE == 'sqlite':
+        replica['NAME'] = location
+    else:
+        address, _, name = location.partition('/')
+        host, _, port = address.partition(':')
+        replica.update(HOST=host, PORT=port or replica['PORT'], NAME=name or replica['NAME'])
+    DATABASES[f'replica_{number}'] = replica
+    DATABASE_REPLICAS.append(f'replica_{number}')
+DATABASE_ROUTERS = ['social_messenger.replicas.ReplicaRouter']
+# Seconds a user who wrote reads from the primary, longest replica lag
+# before a replica leaves rotation, and seconds between lag checks
+REPLICA_STICKY_SECONDS = config('REPLICA_STICKY_SECONDS', default=10, cast=int)
+REPLICA_MAX_LAG = config('REPLICA_MAX_LAG', default=5, cast=float)
+REPLICA_CHECK_INTERVAL = config('REPLICA_CHECK_INTERVAL', default=5, cast=float)
+
+# Redis
+REDIS_URL = config('REDIS_URL', default='')
+
+# Channels (WebSocket push)
+if REDIS_URL:
+    CHANNEL_LAYERS = {
+        'default': {
+            'BACKEND': 'channels_redis.core.RedisChannelLayer',
+            'CONFIG': {
+                'hosts': [REDIS_URL],
+            },
+        },
+    }
+else:
+    # Single-process fallback for local development without Redis
+    CHANNEL_LAYERS = {
+        'default': {
+            'BACKEND': 'channels.layers.InMemoryChannelLayer',
+        },
+    }
+
+# Cache (shared by every process when Redis is configured)
+if REDIS_URL:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': REDIS_URL,
+        },
+        'presence': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': REDIS_URL,
+        },
     }
+else:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        },
+        # Presence is then only visible within one process
+        'presence': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+            'LOCATION': 'presence',
+            'OPTIONS': {'MAX_ENTRIES': 100000},
+        },
+    }
+
+# Authenticated user caching (see accounts.authentication)
+AUTH_USER_CACHE_TIMEOUT = config('AUTH_USER_CACHE_TIMEOUT', default=300, cast=int)
+# Per-process copies; their timeout bounds how stale another process can be
+AUTH_USER_CACHE_LOCAL_TIMEOUT = config('AUTH_USER_CACHE_LOCAL_TIMEOUT', default=5, cast=int)
+AUTH_USER_CACHE_LOCAL_SIZE = config('AUTH_USER_CACHE_LOCAL_SIZE', default=10000, cast=int)
+# Serve opted-in read-only actions with a user built from the token claims
+AUTH_CLAIMS_USER_READS = config('AUTH_CLAIMS_USER_READS', default=False, cast=bool)
+
+# Version-based ETags (see social_messenger.etags); the counters need a shared cache
+ETAGS_ENABLED = config('ETAGS_ENABLED', default=bool(REDIS_URL), cast=bool)
+ETAG_VERSION_TIMEOUT = config('ETAG_VERSION_TIMEOUT', default=7 * 24 * 3600, cast=int)
+
+# Monthly partitions of the messages table on PostgreSQL (see messaging.partitions)
+MESSAGE_PARTITIONS_AHEAD = config('MESSAGE_PARTITIONS_AHEAD', default=3, cast=int)
+# Months of messages kept attached; older partitions are detached (0 keeps everything)
+MESSAGE_RETENTION_MONTHS = config('MESSAGE_RETENTION_MONTHS', default=0, cast=int)
+
+# Cold message archive (see messaging.archive); 0 disables archiving
+MESSAGE_ARCHIVE_AFTER_DAYS = config('MESSAGE_ARCHIVE_AFTER_DAYS', default=0, cast=int)
+MESSAGE_ARCHIVE_CHUNK_SIZE = config('MESSAGE_ARCHIVE_CHUNK_SIZE', default=500, cast=int)
+MESSAGE_ARCHIVE_BUCKET = config('MESSAGE_ARCHIVE_BUCKET', default='')
+
+# Resumable attachment uploads (see messaging.uploads); the staging
+# directory must be shared by every web process and the Celery worker
+ATTACHMENT_UPLOAD_DIR = config('ATTACHMENT_UPLOAD_DIR', default=os.path.join(BASE_DIR, 'uploads'))
+ATTACHMENT_MAX_SIZE = config('ATTACHMENT_MAX_SIZE', default=100 * 1024 * 1024, cast=int)
+# Largest chunk per request; below FILE_UPLOAD_MAX_MEMORY_SIZE so ASGI spools it in memory
+ATTACHMENT_CHUNK_SIZE = config('ATTACHMENT_CHUNK_SIZE', default=4 * 1024 * 1024, cast=int)
+ATTACHMENT_UPLOAD_EXPIRY_HOURS = config('ATTACHMENT_UPLOAD_EXPIRY_HOURS', default=24, cast=int)
+# Unreferenced blobs deleted per transaction (see messaging.attachments)
+ATTACHMENT_GC_BATCH_SIZE = config('ATTACHMENT_GC_BATCH_SIZE', default=100, cast=int)
+ATTACHMENT_BUCKET = config('ATTACHMENT_BUCKET', default='')
+
+# Presence and typing indicators (see messaging.presence); clients should
+# heartbeat more often than PRESENCE_TTL minus PRESENCE_WRITE_INTERVAL
+PRESENCE_TTL = config('PRESENCE_TTL', default=60, cast=int)
+PRESENCE_WRITE_INTERVAL = config('PRESENCE_WRITE_INTERVAL', default=15, cast=int)
+PRESENCE_LAST_SEEN_TTL = config('PRESENCE_LAST_SEEN_TTL', default=30 * 24 * 3600, cast=int)
+TYPING_TTL = config('TYPING_TTL', default=6, cast=int)
+
+# Delivery and read receipts (see messaging.receipts): seconds receipts are
+# merged in memory before being written (0 writes each at once), and the
+# most conversations one request may acknowledge
+RECEIPT_FLUSH_WINDOW = config('RECEIPT_FLUSH_WINDOW', default=2.0, cast=float)
+RECEIPT_BATCH_SIZE = config('RECEIPT_BATCH_SIZE', default=100, cast=int)
+
+# Group conversations (see messaging.groups)
+GROUP_MAX_MEMBERS = config('GROUP_MAX_MEMBERS', default=10000, cast=int)
+
+# Push notifications (see notifications.pipeline); events for one user are
+# gathered for one to two NOTIFICATION_COALESCE_SECONDS, a user gets at most
+# NOTIFICATION_RATE notifications ("<count>/<second|minute|hour|day>"), and
+# each provider call carries up to NOTIFICATION_BATCH_SIZE of them
+NOTIFICATIONS_ENABLED = config('NOTIFICATIONS_ENABLED', default=True, cast=bool)
+NOTIFICATION_PROVIDER = config('NOTIFICATION_PROVIDER', default='notifications.providers.LocalProvider')
+NOTIFICATION_WEBHOOK_URL = config('NOTIFICATION_WEBHOOK_URL', default='')
+NOTIFICATION_COALESCE_SECONDS = config('NOTIFICATION_COALESCE_SECONDS', default=5, cast=int)
+NOTIFICATION_RATE = config('NOTIFICATION_RATE', default='20/hour')
+NOTIFICATION_BATCH_SIZE = config('NOTIFICATION_BATCH_SIZE', default=500, cast=int)
+
+# Celery (background tasks)
+CELERY_BROKER_URL = config('CELERY_BROKER_URL', default=REDIS_URL or 'memory://')
+CELERY_RESULT_BACKEND = None
+CELERY_TASK_IGNORE_RESULT = True
+# Without a broker, run tasks inline so local development needs no worker
+CELERY_TASK_ALWAYS_EAGER = config('CELERY_TASK_ALWAYS_EAGER', default=not REDIS_URL, cast=bool)
+CELERY_TIMEZONE = 'UTC'
+CELERY_BEAT_SCHEDULE = {
+    'rebuild-friend-suggestions': {
+        'task': 'friends.tasks.rebuild_all_suggestions',
+        'schedule': timedelta(hours=24),
+    },
+    'manage-message-partitions': {
+        'task': 'messaging.tasks.manage_message_partitions',
+        'schedule': timedelta(hours=24),
+    },
+    'archive-cold-messages': {
+        'task': 'messaging.tasks.archive_cold_messages',
+        'schedule': timedelta(hours=24),
+    },
+    'expire-attachment-uploads': {
+        'task': 'messaging.tasks.expire_attachment_uploads',
+        'schedule': timedelta(hours=1),
+    },
+    # Deletions queue a collection; this catches any that were lost
+    'collect-attachment-garbage': {
+        'task': 'messaging.tasks.collect_attachment_garbage',
+        'schedule': timedelta(hours=24),
+    },
 }
 
 # Password validation
@@ -108,6 +284,58 @@ STATIC_ROOT = os.path.join(BASE_DIR, 'staticfiles')
 # Media files
 MEDIA_URL = '/media/'
 MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
+# How media responses hand off files (see social_messenger.media): '' sends
+# them from Django (os.sendfile under gunicorn), 'x-accel-redirect' through
+# nginx's internal MEDIA_ACCEL_PREFIX location, 'x-sendfile' through Apache
+# or lighttpd
+MEDIA_SENDFILE = config('MEDIA_SENDFILE', default='')
+MEDIA_ACCEL_PREFIX = config('MEDIA_ACCEL_PREFIX', default='/protected-media/')
+# Browser cache lifetime of media other than attachments, which never change
+MEDIA_CACHE_SECONDS = config('MEDIA_CACHE_SECONDS', default=3600, cast=int)
+
+STORAGES = {
+    'default': {
+        'BACKEND': 'django.core.files.storage.FileSystemStorage',
+    },
+    'staticfiles': {
+        'BACKEND': 'django.contrib.staticfiles.storage.StaticFilesStorage',
+    },
+    # Archived message chunks: local files, or any S3-compatible store
+    # when a bucket is set (needs django-storages[s3])
+    'message_archive': {
+        'BACKEND': 'storages.backends.s3.S3Storage',
+        'OPTIONS': {
+            'bucket_name': MESSAGE_ARCHIVE_BUCKET,
+            'endpoint_url': config('MESSAGE_ARCHIVE_ENDPOINT_URL', default=None),
+            'location': 'message-archive',
+            'default_acl': 'private',
+            'file_overwrite': False,
+        },
+    } if MESSAGE_ARCHIVE_BUCKET else {
+        'BACKEND': 'django.core.files.storage.FileSystemStorage',
+        'OPTIONS': {
+            'location': config('MESSAGE_ARCHIVE_DIR', default=os.path.join(BASE_DIR, 'archive')),
+        },
+    },
+    # Message attachments: under MEDIA_ROOT, or an S3-compatible bucket
+    # with signed URLs when a bucket is set
+    'attachments': {
+        'BACKEND': 'storages.backends.s3.S3Storage',
+        'OPTIONS': {
+            'bucket_name': ATTACHMENT_BUCKET,
+            'endpoint_url': config('ATTACHMENT_ENDPOINT_URL', default=None),
+            'location': 'attachments',
+            'default_acl': 'private',
+            'file_overwrite': False,
+        },
+    } if ATTACHMENT_BUCKET else {
+        'BACKEND': 'django.core.files.storage.FileSystemStorage',
+        'OPTIONS': {
+            'location': os.path.join(MEDIA_ROOT, 'attachments'),
+            'base_url': config('ATTACHMENT_URL', default=MEDIA_URL + 'attachments/'),
+        },
+    },
+}
 
 # Default primary key field type
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
@@ -115,7 +343,7 @@ DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 # Django REST Framework
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': (
-        'rest_framework_simplejwt.authentication.JWTAuthentication',
+        'accounts.authentication.CachedJWTAuthentication',
     ),
     'DEFAULT_PERMISSION_CLASSES': [
         'rest_framework.permissions.IsAuthenticated',
@@ -128,20 +356,27 @@ REST_FRAMEWORK = {
         'rest_framework.filters.OrderingFilter',
     ],
     'DEFAULT_RENDERER_CLASSES': [
-        'rest_framework.renderers.JSONRenderer',
+        'social_messenger.metrics.InstrumentedJSONRenderer',
     ],
     'DEFAULT_PARSER_CLASSES': [
         'rest_framework.parsers.JSONParser',
         'rest_framework.parsers.MultiPartParser',
         'rest_framework.parsers.FormParser',
     ],
+    # Token buckets in Redis (see social_messenger.throttling)
     'DEFAULT_THROTTLE_CLASSES': [
-        'rest_framework.throttling.AnonRateThrottle',
-        'rest_framework.throttling.UserRateThrottle'
-    ],
+        'social_messenger.throttling.AnonThrottle',
+        'social_messenger.throttling.UserThrottle',
+        'social_messenger.throttling.ScopedThrottle',
+    ] if config('THROTTLE_ENABLED', default=True, cast=bool) else [],
     'DEFAULT_THROTTLE_RATES': {
-        'anon': '100/hour',
-        'user': '1000/hour'
+        'anon': config('THROTTLE_ANON_RATE', default='100/hour'),
+        'user': config('THROTTLE_USER_RATE', default='1000/hour'),
+        # Scopes of single actions, on top of the user's overall rate
+        'send_message': config('THROTTLE_SEND_MESSAGE_RATE', default='60/minute'),
+        'friend_request': config('THROTTLE_FRIEND_REQUEST_RATE', default='30/hour'),
+        'login': config('THROTTLE_LOGIN_RATE', default='10/minute'),
+        'search': config('THROTTLE_SEARCH_RATE', default='60/minute'),
     },
     'EXCEPTION_HANDLER': 'rest_framework.views.exception_handler',
 }
@@ -173,6 +408,32 @@ SIMPLE_JWT = {
     'SLIDING_TOKEN_REFRESH_LIFETIME': timedelta(days=1),
 }
 
+# Request metrics (see social_messenger.metrics)
+# Bearer token required to read /metrics; leave empty to serve it openly
+METRICS_TOKEN = config('METRICS_TOKEN', default='')
+# Queries allowed per request, by endpoint ("ViewSet.action"); None disables the check
+QUERY_BUDGET_DEFAULT = config('QUERY_BUDGET_DEFAULT', default=20, cast=int)
+QUERY_BUDGETS = {
+    'MessageViewSet.messages_between_users': 6,
+    'MessageViewSet.inbox': 4,
+    'MessageViewSet.unread_counts': 5,
+    # Long-polling checks for changes once a second for up to 30 seconds
+    'MessageViewSet.sync_changes': 40,
+    'MessageViewSet.search': 4,
+    'UserViewSet.search': 6,
+    'UserViewSet.suggestions': 4,
+    'GroupViewSet.list': 3,
+    'GroupViewSet.messages': 6,
+    'GroupViewSet.mark_read': 3,
+    # The last chunk runs the processing task inline when Celery is eager
+    'AttachmentUploadViewSet.partial_update': 30,
+    # Sends deliver their push notification inline when Celery is eager
+    'MessageViewSet.create': 30,
+    'FriendRequestViewSet.create': 30,
+}
+# Raise QueryBudgetExceeded instead of logging a warning (for test runs)
+QUERY_BUDGET_RAISE = config('QUERY_BUDGET_RAISE', default=False, cast=bool)
+
 # CORS settings
 CORS_ALLOWED_ORIGINS = [
     "http://localhost:3000",
@@ -191,6 +452,9 @@ CORS_ALLOWED_ORIGINS = [
 ]
 
 CORS_ALLOW_CREDENTIALS = True
+# Resumable uploads send and read the chunk offset in a header
+CORS_ALLOW_HEADERS = (*default_headers, 'upload-offset')
+CORS_EXPOSE_HEADERS = ['Upload-Offset']
 
 # Custom User Model
 AUTH_USER_MODEL = 'accounts.User'
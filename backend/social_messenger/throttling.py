@@ -0,0 +1,186 @@
+"""
+Request throttling with token buckets shared by every process.
+
+A rate ``"<count>/<period>"`` (``DEFAULT_THROTTLE_RATES``) is a bucket of
+``count`` tokens refilled evenly over the period: a client may burst up
+to ``count`` requests, then gets one more every ``period / count``
+seconds. Each request takes a token; one that finds the bucket empty is
+refused with 429 and a ``Retry-After`` of the seconds until the next
+token, so a client that waits that long gets through.
+
+With Redis as the default cache, a check is one ``EVALSHA`` of a Lua
+script that refills, takes and stores the bucket atomically on the Redis
+clock, so every worker and node draws from the same bucket in a single
+round trip, whatever the rate. Otherwise buckets live in process memory
+(``LocalBuckets``), which suits tests and single-process development. If
+Redis fails, requests are let through and a warning is logged: throttling
+protects the service and must not take it down.
+
+``AnonThrottle`` and ``UserThrottle`` are the overall limits per client
+address and per user (scopes ``anon`` and ``user``). ``ScopedThrottle``
+adds a bucket per user for the actions a view names in
+``throttle_scopes`` (``{action: scope}``, or ``{'action:METHOD': scope}``
+for one method only) or, for plain views, ``throttle_scope``.
+"""
+import logging
+import threading
+import time
+from collections import OrderedDict
+
+from django.core.cache import caches
+from django.core.cache.backends.redis import RedisCache
+from rest_framework.settings import api_settings
+from rest_framework.throttling import BaseThrottle
+
+logger = logging.getLogger(__name__)
+
+# Buckets each process keeps without Redis; an evicted bucket starts full
+LOCAL_BUCKETS_SIZE = 100000
+PERIODS = {'s': 1, 'm': 60, 'h': 3600, 'd': 86400}
+
+# KEYS[1]: bucket; ARGV: capacity, seconds per token. Returns the seconds
+# to wait as a string (Lua numbers become integers in replies), 0 when a
+# token was taken.
+TOKEN_BUCKET_SCRIPT = """
+local capacity = tonumber(ARGV[1])
+local interval = tonumber(ARGV[2])
+local clock = redis.call('TIME')
+local now = tonumber(clock[1]) + tonumber(clock[2]) / 1000000
+local state = redis.call('HMGET', KEYS[1], 'tokens', 'at')
+local tokens = capacity
+if state[1] then
+    tokens = math.min(capacity, tonumber(state[1]) + math.max(0, now - tonumber(state[2])) / interval)
+end
+local wait = 0
+if tokens >= 1 then
+    tokens = tokens - 1
+else
+    wait = (1 - tokens) * interval
+end
+redis.call('HSET', KEYS[1], 'tokens', tostring(tokens), 'at', tostring(now))
+redis.call('EXPIRE', KEYS[1], math.ceil(capacity * interval) + 1)
+return tostring(wait)
+"""
+
+
+def parse_rate(rate):
+    """``'<count>/<period>'`` as (capacity, seconds per token), periods as in DRF"""
+    count, period = rate.split('/')
+    return int(count), PERIODS[period[0]] / int(count)
+
+
+class LocalBuckets:
+    """Thread-safe, bounded token buckets in process memory"""
+    
+    def __init__(self, max_size):
+        self.max_size = max_size
+        self.buckets = OrderedDict()
+        self.lock = threading.Lock()
+    
+    def take(self, key, capacity, interval, now=None):
+        """Take a token from ``key``; returns 0, or the seconds until one is available"""
+        now = time.monotonic() if now is None else now
+        with self.lock:
+            tokens, at = self.buckets.get(key, (capacity, now))
+            tokens = min(capacity, tokens + max(0, now - at) / interval)
+            wait = 0.0
+            if tokens >= 1:
+                tokens -= 1
+            else:
+                wait = (1 - tokens) * interval
+            self.buckets[key] = (tokens, now)
+            self.buckets.move_to_end(key)
+            while len(self.buckets) > self.max_size:
+                self.buckets.popitem(last=False)
+            return wait
+    
+    def clear(self):
+        with self.lock:
+            self.buckets.clear()
+
+
+local_buckets = LocalBuckets(LOCAL_BUCKETS_SIZE)
+token_bucket_script = None
+
+
+def take_token(key, capacity, interval):
+    """Take a token from bucket ``key``; returns 0, or the seconds until one is available"""
+    global token_bucket_script
+    cache = caches['default']
+    if not isinstance(cache, RedisCache):
+        return local_buckets.take(key, capacity, interval)
+    
+    from redis.exceptions import RedisError
+    try:
+        client = cache._cache.get_client(key, write=True)
+        if token_bucket_script is None:
+            token_bucket_script = client.register_script(TOKEN_BUCKET_SCRIPT)
+        return float(token_bucket_script(keys=[cache.make_key(key)], args=[capacity, interval], client=client))
+    except RedisError:
+        logger.warning('Throttle check failed, letting the request through', exc_info=True)
+        return 0.0
+
+
+class TokenBucketThrottle(BaseThrottle):
+    """A token bucket per ``get_cache_key``, at the rate of its scope"""
+    
+    scope = None
+    cache_format = 'throttle_%(scope)s_%(ident)s'
+    
+    def get_scope(self, request, view):
+        return self.scope
+    
+    def get_cache_key(self, request, view, scope):
+        """The bucket of this request, or ``None`` to let it through"""
+        raise NotImplementedError
+    
+    def allow_request(self, request, view):
+        self.delay = 0.0
+        scope = self.get_scope(request, view)
+        rate = api_settings.DEFAULT_THROTTLE_RATES.get(scope) if scope else None
+        if rate is None:
+            return True
+        key = self.get_cache_key(request, view, scope)
+        if key is None:
+            return True
+        self.delay = take_token(key, *parse_rate(rate))
+        return self.delay == 0
+    
+    def wait(self):
+        # DRF sends math.ceil of this as Retry-After
+        return self.delay
+
+
+class AnonThrottle(TokenBucketThrottle):
+    """Requests of anonymous clients, per address"""
+    
+    scope = 'anon'
+    
+    def get_cache_key(self, request, view, scope):
+        if request.user and request.user.is_authenticated:
+            return None
+        return self.cache_format % {'scope': scope, 'ident': self.get_ident(request)}
+
+
+class UserThrottle(TokenBucketThrottle):
+    """Requests per user, or per address for anonymous clients"""
+    
+    scope = 'user'
+    
+    def get_cache_key(self, request, view, scope):
+        if request.user and request.user.is_authenticated:
+            ident = request.user.pk
+        else:
+            ident = self.get_ident(request)
+        return self.cache_format % {'scope': scope, 'ident': ident}
+
+
+class ScopedThrottle(UserThrottle):
+    """A separate bucket for the actions a view gives a scope"""
+    
+    def get_scope(self, request, view):
+        scopes = getattr(view, 'throttle_scopes', None)
+        action = getattr(view, 'action', None)
+        if scopes and action:
+            return scopes.get(f'{action}:{request.method}', scopes.get(action))
+        return getattr(view, 'throttle_scope', None)
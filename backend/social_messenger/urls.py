@@ -1,18 +1,21 @@
 """
 URL configuration for social_messenger project.
 """
+import re
+
 from django.contrib import admin
-from django.urls import path, include
+from django.urls import path, include, re_path
 from django.conf import settings
-from django.conf.urls.static import static
+
+from .media import serve_media
+from .metrics import metrics_view
 
 urlpatterns = [
     path('admin/', admin.site.urls),
     path('api/v1/users/', include('accounts.urls')),
     path('api/v1/friends/', include('friends.urls')),
     path('api/v1/messages/', include('messaging.urls')),
+    path('metrics', metrics_view, name='metrics'),
+    # Media need a signed-in user, and attachments a participant (see media.py)
+    re_path(r'^%s(?P<path>.+)$' % re.escape(settings.MEDIA_URL.lstrip('/')), serve_media, name='media'),
 ]
-
-# Serve media files in development
-if settings.DEBUG:
-    urlpatterns += static(settings.MEDIA_URL, document_root=settings.MEDIA_ROOT)
@@ -64,7 +64,11 @@ export const useFriendRequests = (userId: number, options?: UseApiOptions) => {
 export const useMessages = (senderId: number, recipientId: number, options?: UseApiOptions) => {
   return useQuery({
     queryKey: queryKeys.messages(senderId, recipientId),
-    queryFn: () => apiClient.get(`/messages/messages/${senderId}/${recipientId}/`),
+    queryFn: async () => {
+      // Latest page of the conversation; older pages are loaded with `before=<olderCursor>`
+      const page = await apiClient.get<{ messages: any[] }>(`/messages/messages/${senderId}/${recipientId}/`);
+      return page.messages;
+    },
     enabled: options?.enabled ?? true,
     retry: options?.retry ?? 3,
     staleTime: options?.staleTime ?? 30 * 1000, // 30 seconds
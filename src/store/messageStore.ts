@@ -35,7 +35,7 @@ export const useMessageStore = create<MessageStore>((set, get) => ({
     set({ isLoading: true, error: null });
     
     try {
-      const messages: Message[] = await apiClient.get(
+      const { messages } = await apiClient.get<{ messages: Message[] }>(
         `/messages/messages/${senderId}/${recipientId}/`
       );
       